@@ -8,7 +8,7 @@ from typing import final
 from lightllm.common.basemodel.layer_weights.hf_load_utils import load_hf_weights
 from lightllm.common.basemodel.infer_struct import InferStateInfo
 from lightllm.common.mem_manager import MemoryManager
-from lightllm.common.req_manager import ReqManager
+from lightllm.common.req_manager import ReqManager, ReqSamplingParamsManager
 from lightllm.common.infer_utils import init_req_to_token_indexes
 from lightllm.common.build_utils import repair_config
 from lightllm.common.basemodel.triton_kernel.copy_kv_index_to_req import copy_kv_index_to_req
@@ -71,6 +71,8 @@ class TpPartBaseModel:
         self._verify_must()
         self._verify_params()
         self._init_quant()
+        # penalty 使用的 token 计数表需要在根据剩余显存确定 kv cache 大小之前申请
+        self._init_req_sampling_params_manager()
 
         # 更连续的显存分配可以有更好的性能
         if self.max_total_token_num is None:
@@ -171,7 +173,13 @@ class TpPartBaseModel:
         if self.max_seq_length is not None:
             create_max_seq_len = max(create_max_seq_len, self.max_seq_length)
 
-        self.req_manager = ReqManager(self.max_req_num, create_max_seq_len, self.mem_manager)
+        self.req_manager = ReqManager(
+            self.max_req_num, create_max_seq_len, self.mem_manager, self.req_sampling_params_manager
+        )
+        return
+
+    def _init_req_sampling_params_manager(self):
+        self.req_sampling_params_manager = ReqSamplingParamsManager(self.max_req_num, self.config["vocab_size"])
         return
 
     def _init_infer_layer(self):
@@ -0,0 +1,72 @@
+import torch
+
+import triton
+import triton.language as tl
+
+
+@triton.jit
+def _fwd_kernel_apply_penalty_by_counter(
+    Logits,
+    b_req_idx,
+    presence_penalty,
+    freqency_penalty,
+    repetition_penalty,
+    req_to_out_token_id_counter,
+    stride_logit_b,
+    stride_counter_b,
+    vocab_size,
+    BLOCK: tl.constexpr,
+):
+    cur_batch = tl.program_id(0)
+    block_index = tl.program_id(1)
+    cur_freqency = tl.load(freqency_penalty + cur_batch)
+    cur_presence = tl.load(presence_penalty + cur_batch)
+    cur_repetition = tl.load(repetition_penalty + cur_batch)
+    # 没有开启任何 penalty 的请求，其计数表中的数据是无效的，不需要读取
+    has_penalty = (cur_freqency != 0.0) | (cur_presence != 0.0) | (cur_repetition != 1.0)
+    cur_req_idx = tl.load(b_req_idx + cur_batch)
+
+    offs = block_index * BLOCK + tl.arange(0, BLOCK)
+    mask = (offs < vocab_size) & has_penalty
+    counts = tl.load(req_to_out_token_id_counter + cur_req_idx * stride_counter_b + offs, mask=mask, other=0)
+    mask = mask & (counts > 0)
+    cur_logits = tl.load(Logits + cur_batch * stride_logit_b + offs, mask=mask, other=0.0)
+    rep_logits = tl.where(cur_logits > 0, cur_logits / cur_repetition, cur_logits * cur_repetition)
+    freq_logits = rep_logits - counts * cur_freqency
+    pre_logits = freq_logits - cur_presence
+    tl.store(Logits + cur_batch * stride_logit_b + offs, pre_logits, mask=mask)
+    return
+
+
+@torch.no_grad()
+def apply_penalty_by_counter(
+    Logits: torch.Tensor,
+    b_req_idx: torch.Tensor,
+    presence_penalty: torch.Tensor,
+    freqency_penalty: torch.Tensor,
+    repetition_penalty: torch.Tensor,
+    req_to_out_token_id_counter: torch.Tensor,
+):
+    """
+    与 apply_penalty 的计算相同，区别是每个请求已经输出的 token 的计数从以 req_idx 为下标的常驻计数表
+    req_to_out_token_id_counter (shape [max_req_num + 1, vocab_size]) 中读取，不需要每一步在 cpu 上构建。
+    """
+    assert Logits.is_contiguous()
+    batch_size = Logits.shape[0]
+    vocab_size = min(Logits.shape[1], req_to_out_token_id_counter.shape[1])
+    BLOCK = 4096
+    grid = (batch_size, triton.cdiv(vocab_size, BLOCK))
+    _fwd_kernel_apply_penalty_by_counter[grid](
+        Logits,
+        b_req_idx,
+        presence_penalty,
+        freqency_penalty,
+        repetition_penalty,
+        req_to_out_token_id_counter,
+        Logits.stride(0),
+        req_to_out_token_id_counter.stride(0),
+        vocab_size,
+        BLOCK=BLOCK,
+        num_warps=8,
+    )
+    return
@@ -0,0 +1,146 @@
+import torch
+from dataclasses import dataclass
+from typing import List, Tuple
+
+# 采样策略，按照请求的 top_k / top_p 参数将 batch 中的请求分组，每组只做该策略需要的计算
+GREEDY = "greedy"  # top_k == 1，直接 argmax
+TOP_K = "top_k"  # 1 < top_k <= TOP_P_CANDIDATE_NUM，在 torch.topk 得到的前 k 个候选上做 top_p / top_k 截断
+TOP_P = "top_p"  # 只有 top_p 限制，在前 TOP_P_CANDIDATE_NUM 个候选上做 top_p 截断，候选覆盖不了的请求回退到全量排序
+FULL = "full"  # 没有 top_p / top_k 限制，直接在全词表的概率上采样，不需要排序
+SORT = "sort"  # 其他情况 (如很大的 top_k)，对全词表排序后截断
+
+# TOP_P 分组中候选 token 的数量
+TOP_P_CANDIDATE_NUM = 1024
+
+
+@dataclass
+class SampleGroup:
+    strategy: str
+    index: torch.Tensor  # 该分组中的请求在 batch 中的下标
+    max_top_k: int = 0  # TOP_K 分组中最大的 top_k
+
+
+def build_sample_groups(top_ps: List[float], top_ks: List[int], vocab_size: int, device="cuda") -> List[SampleGroup]:
+    """
+    在 cpu 上根据请求的采样参数完成分组，避免在 gpu 上判断分组带来的同步。
+    top_k 为 -1 或者不小于 vocab_size 时表示没有 top_k 限制。
+    """
+    group_to_index = {}
+    group_to_max_top_k = {}
+    for i, (top_p, top_k) in enumerate(zip(top_ps, top_ks)):
+        no_top_k_limit = top_k == -1 or top_k >= vocab_size
+        if top_k == 1:
+            strategy = GREEDY
+        elif not no_top_k_limit and top_k <= TOP_P_CANDIDATE_NUM:
+            strategy = TOP_K
+            group_to_max_top_k[TOP_K] = max(group_to_max_top_k.get(TOP_K, 0), top_k)
+        elif top_p < 1.0:
+            strategy = TOP_P
+        elif no_top_k_limit:
+            strategy = FULL
+        else:
+            strategy = SORT
+        group_to_index.setdefault(strategy, []).append(i)
+
+    pin_memory = torch.device(device).type == "cuda"
+    groups = []
+    for strategy, index in group_to_index.items():
+        index_cpu = torch.tensor(index, dtype=torch.int64, device="cpu", pin_memory=pin_memory)
+        groups.append(
+            SampleGroup(
+                strategy=strategy,
+                index=index_cpu.to(device, non_blocking=True),
+                max_top_k=group_to_max_top_k.get(strategy, 0),
+            )
+        )
+    return groups
+
+
+def grouped_sample(
+    probs: torch.Tensor, top_ps: torch.Tensor, top_ks: torch.Tensor, groups: List[SampleGroup]
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    按照分组采样，返回 (采样得到的 token id, 对应 token 在全词表 softmax 中的概率)。
+    只有一个分组时 (比如全部是 greedy 的请求) 不需要额外的 index_select 和 scatter。
+    """
+    if len(groups) == 1:
+        return _SAMPLE_FUNCS[groups[0].strategy](probs, top_ps, top_ks, groups[0])
+
+    batch_next_token_ids = torch.empty((probs.shape[0],), dtype=torch.int64, device=probs.device)
+    batch_next_token_probs = torch.empty((probs.shape[0],), dtype=probs.dtype, device=probs.device)
+    for group in groups:
+        next_token_ids, next_token_probs = _SAMPLE_FUNCS[group.strategy](
+            probs.index_select(0, group.index), top_ps[group.index], top_ks[group.index], group
+        )
+        batch_next_token_ids[group.index] = next_token_ids
+        batch_next_token_probs[group.index] = next_token_probs
+    return batch_next_token_ids, batch_next_token_probs
+
+
+def _greedy_sample(probs: torch.Tensor, top_ps: torch.Tensor, top_ks: torch.Tensor, group: SampleGroup):
+    next_token_probs, next_token_ids = torch.max(probs, dim=-1)
+    return next_token_ids, next_token_probs
+
+
+def _top_k_sample(probs: torch.Tensor, top_ps: torch.Tensor, top_ks: torch.Tensor, group: SampleGroup):
+    probs_sort, probs_idx = torch.topk(probs, k=min(group.max_top_k, probs.shape[-1]), dim=-1, sorted=True)
+    _mask_top_p_top_k(probs_sort, top_ps, top_ks)
+    return _multinomial_from_sorted(probs_sort, probs_idx)
+
+
+def _top_p_sample(probs: torch.Tensor, top_ps: torch.Tensor, top_ks: torch.Tensor, group: SampleGroup):
+    probs_sort, probs_idx = torch.topk(probs, k=min(TOP_P_CANDIDATE_NUM, probs.shape[-1]), dim=-1, sorted=True)
+    # 候选 token 的概率和大于 top_p 时，候选之外的 token 一定会被 top_p 截断，与全量排序的结果一致
+    covered = probs_sort.sum(dim=-1) > top_ps
+    _mask_top_p_top_k(probs_sort, top_ps, top_ks)
+    next_token_ids, next_token_probs = _multinomial_from_sorted(probs_sort, probs_idx)
+    if not bool(covered.all()):
+        uncovered_index = torch.nonzero(~covered).view(-1)
+        fallback_ids, fallback_probs = _sort_sample(
+            probs.index_select(0, uncovered_index), top_ps[uncovered_index], top_ks[uncovered_index], group
+        )
+        next_token_ids[uncovered_index] = fallback_ids
+        next_token_probs[uncovered_index] = fallback_probs
+    return next_token_ids, next_token_probs
+
+
+def _full_sample(probs: torch.Tensor, top_ps: torch.Tensor, top_ks: torch.Tensor, group: SampleGroup):
+    sampled_index = torch.multinomial(probs, num_samples=1, replacement=True)
+    next_token_probs = torch.gather(probs, dim=1, index=sampled_index)
+    return sampled_index.view(-1), next_token_probs.view(-1)
+
+
+def _sort_sample(probs: torch.Tensor, top_ps: torch.Tensor, top_ks: torch.Tensor, group: SampleGroup):
+    probs_sort, probs_idx = _top_p_top_k(probs, top_ps, top_ks)
+    return _multinomial_from_sorted(probs_sort, probs_idx)
+
+
+def _multinomial_from_sorted(probs_sort: torch.Tensor, probs_idx: torch.Tensor):
+    sampled_index = torch.multinomial(probs_sort, num_samples=1, replacement=True)
+    next_token_ids = torch.gather(probs_idx, dim=1, index=sampled_index)
+    next_token_probs = torch.gather(probs_sort, dim=1, index=sampled_index)
+    return next_token_ids.view(-1), next_token_probs.view(-1)
+
+
+def _top_p_top_k(probs: torch.Tensor, top_ps: torch.Tensor, top_ks: torch.Tensor):
+    probs_sort, probs_idx = probs.sort(dim=-1, descending=True)
+    _mask_top_p_top_k(probs_sort, top_ps, top_ks)
+    return probs_sort, probs_idx
+
+
+def _mask_top_p_top_k(probs_sort: torch.Tensor, top_ps: torch.Tensor, top_ks: torch.Tensor):
+    # probs_sort 为降序排列的 (部分) 概率，原地将 top_p 与 top_k 之外的概率置 0
+    probs_sum = torch.cumsum(probs_sort, dim=-1)
+    probs_sort[(probs_sum - probs_sort) > top_ps.view(-1, 1)] = 0.0
+    col_index = torch.arange(0, probs_sort.shape[-1], device=probs_sort.device).view(1, -1)
+    probs_sort[col_index >= top_ks.view(-1, 1)] = 0.0
+    return
+
+
+_SAMPLE_FUNCS = {
+    GREEDY: _greedy_sample,
+    TOP_K: _top_k_sample,
+    TOP_P: _top_p_sample,
+    FULL: _full_sample,
+    SORT: _sort_sample,
+}
@@ -0,0 +1,137 @@
+import itertools
+import torch
+import numpy as np
+from typing import Dict, List, Tuple, Union
+
+
+class FreeListTokenAllocator:
+    """
+    以连续空闲段 (run) 为单位管理 kv cache token 的分配器，支持任意顺序的释放。
+    run_by_start / run_by_end 分别以空闲段的起始和结束位置为 key，释放时以 O(1) 的代价与相邻的空闲段合并；
+    buckets 是按照长度分级的空闲链表 (segregated free list)，第 k 级保存长度在 [2^k, 2^(k+1)) 内的空闲段。
+    分配时优先从能够容纳需求的较小的空闲段中切分出一段连续的 token，
+    不存在这样的空闲段时，再从最大的空闲段开始依次拼凑，使返回的 token 尽量的连续。
+    """
+
+    # 在与需求同级的链表中查找能容纳需求的空闲段时，最多检查的空闲段数量
+    SAME_BUCKET_SCAN_NUM = 16
+
+    def __init__(self, size: int):
+        self.size = size
+        self.free_all()
+
+    def free_all(self):
+        self.run_by_start: Dict[int, int] = {}
+        self.run_by_end: Dict[int, int] = {}
+        # 使用 dict 作为有序集合，key 为空闲段的起始位置
+        self.buckets: List[Dict[int, None]] = [{} for _ in range(max(1, self.size.bit_length()))]
+        # 每个 token 是否空闲，用于检查重复释放
+        self.is_free = np.ones((self.size,), dtype=np.bool_)
+        self.can_use_size = 0
+        if self.size > 0:
+            self._add_run(0, self.size)
+        return
+
+    def _add_run(self, start: int, length: int):
+        self.run_by_start[start] = length
+        self.run_by_end[start + length] = start
+        self.buckets[length.bit_length() - 1][start] = None
+        self.can_use_size += length
+        return
+
+    def _remove_run(self, start: int, length: int):
+        del self.run_by_start[start]
+        del self.run_by_end[start + length]
+        del self.buckets[length.bit_length() - 1][start]
+        self.can_use_size -= length
+        return
+
+    def _find_fit_run(self, need_size: int) -> int:
+        level = need_size.bit_length() - 1
+        for start in itertools.islice(self.buckets[level], self.SAME_BUCKET_SCAN_NUM):
+            if self.run_by_start[start] >= need_size:
+                return start
+        for bucket in self.buckets[level + 1 :]:
+            if bucket:
+                return next(iter(bucket))
+        return None
+
+    def _largest_run_start(self) -> int:
+        for bucket in reversed(self.buckets):
+            if bucket:
+                return max(bucket, key=self.run_by_start.__getitem__)
+        return None
+
+    def _take_run(self, start: int, take_len: int):
+        length = self.run_by_start[start]
+        self._remove_run(start, length)
+        if length > take_len:
+            self._add_run(start + take_len, length - take_len)
+        self.is_free[start : start + take_len] = False
+        return
+
+    def alloc(self, need_size: int) -> torch.Tensor:
+        assert need_size <= self.can_use_size, f"no enough cache need_size {need_size} left_size {self.can_use_size}"
+        if need_size == 0:
+            return torch.empty((0,), dtype=torch.int32)
+
+        start = self._find_fit_run(need_size)
+        if start is not None:
+            self._take_run(start, need_size)
+            return torch.arange(start, start + need_size, dtype=torch.int32)
+
+        # 没有足够大的连续空闲段，从最大的空闲段开始拼凑
+        parts = []
+        left_size = need_size
+        while left_size > 0:
+            start = self._largest_run_start()
+            use_len = min(self.run_by_start[start], left_size)
+            self._take_run(start, use_len)
+            parts.append(np.arange(start, start + use_len, dtype=np.int32))
+            left_size -= use_len
+        return torch.from_numpy(np.concatenate(parts))
+
+    def free(self, free_index: Union[torch.Tensor, List[int], np.ndarray]):
+        if isinstance(free_index, torch.Tensor):
+            # 从 gpu 到 cpu 的拷贝操作是流内阻塞操作
+            free_index = free_index.cpu().numpy()
+        free_index = np.sort(np.asarray(free_index, dtype=np.int64))
+        if len(free_index) == 0:
+            return
+        assert free_index[0] >= 0 and free_index[-1] < self.size, "error free index"
+        assert not self.is_free[free_index].any(), "double free token index"
+        assert np.all(free_index[1:] != free_index[:-1]), "double free token index"
+        self.is_free[free_index] = True
+
+        # 与相邻的空闲段合并，释放的 token 较为分散时空闲段数量很多，这里展开了 _add_run / _remove_run 的调用
+        run_by_start, run_by_end, buckets = self.run_by_start, self.run_by_end, self.buckets
+        for start, length in self._to_runs(free_index):
+            end = start + length
+            left_start = run_by_end.pop(start, None)
+            if left_start is not None:
+                left_len = run_by_start.pop(left_start)
+                del buckets[left_len.bit_length() - 1][left_start]
+                start, length = left_start, left_len + length
+            right_len = run_by_start.pop(end, None)
+            if right_len is not None:
+                del run_by_end[end + right_len]
+                del buckets[right_len.bit_length() - 1][end]
+                length += right_len
+            run_by_start[start] = length
+            run_by_end[start + length] = start
+            buckets[length.bit_length() - 1][start] = None
+        self.can_use_size += len(free_index)
+        return
+
+    def _to_runs(self, sorted_index: np.ndarray) -> List[Tuple[int, int]]:
+        breaks = np.flatnonzero(np.diff(sorted_index) != 1) + 1
+        starts = np.concatenate(([0], breaks))
+        ends = np.concatenate((breaks, [len(sorted_index)]))
+        return list(zip(sorted_index[starts].tolist(), (ends - starts).tolist()))
+
+    def get_largest_free_run(self) -> int:
+        start = self._largest_run_start()
+        return 0 if start is None else self.run_by_start[start]
+
+    def get_free_run_num(self) -> int:
+        return len(self.run_by_start)
@@ -8,6 +8,7 @@ from lightllm.utils.log_utils import init_logger
 from lightllm.server.router.dynamic_prompt.shared_arr import SharedInt
 from lightllm.utils.profile_max_tokens import get_available_gpu_memory, get_total_gpu_memory
 from lightllm.common.kv_trans_kernel.kv_trans import kv_trans
+from lightllm.common.mem_allocator import FreeListTokenAllocator
 from lightllm.utils.dist_utils import get_current_rank_in_node
 from lightllm.utils.envs_utils import get_unique_server_name, get_env_start_args
 from lightllm.distributed.pynccl import PyNcclCommunicator
@@ -44,6 +45,12 @@ class MemoryManager:
         )
 
         self.shared_can_use_token_num.set_value(self.can_use_mem_size)
+        # 空闲 token 的碎片化统计信息，只有 free_list 分配器会更新，stack 分配器下为 -1
+        self.shared_largest_free_run = SharedInt(
+            f"{get_unique_server_name()}_mem_manger_largest_free_run_{rank_in_node}"
+        )
+        self.shared_free_run_num = SharedInt(f"{get_unique_server_name()}_mem_manger_free_run_num_{rank_in_node}")
+        self._init_token_allocator(get_env_start_args().kv_token_allocator)
         self._init_buffers(
             self.size,
             dtype,
@@ -238,7 +245,33 @@ class MemoryManager:
     def _free_buffers(self):
         self.kv_buffer = None
 
+    def _init_token_allocator(self, allocator_name: str):
+        """
+        stack : mem_state 作为栈使用，只能按照后进先出的顺序高效的复用 token
+        free_list : 以连续空闲段为单位管理 token，分配时尽量返回连续的 token，并统计碎片化信息
+        """
+        assert allocator_name in ["stack", "free_list"], f"unknown kv token allocator {allocator_name}"
+        self.token_allocator = FreeListTokenAllocator(self.size) if allocator_name == "free_list" else None
+        self._update_free_run_stats()
+        return
+
+    def _update_free_run_stats(self):
+        if self.token_allocator is None:
+            self.shared_largest_free_run.set_value(-1)
+            self.shared_free_run_num.set_value(-1)
+        else:
+            self.shared_largest_free_run.set_value(self.token_allocator.get_largest_free_run())
+            self.shared_free_run_num.set_value(self.token_allocator.get_free_run_num())
+        return
+
     def alloc(self, need_size) -> torch.Tensor:
+        if self.token_allocator is not None:
+            ans = self.token_allocator.alloc(need_size)
+            self.can_use_mem_size -= need_size
+            self.shared_can_use_token_num.set_value(self.can_use_mem_size)
+            self._update_free_run_stats()
+            return ans
+
         if need_size > self.mark_end - self.mark_start:
             logger.error(f"warn no enough cache need_size {need_size} left_size {self.can_use_mem_size}")
             assert False, "error alloc state"
@@ -258,6 +291,12 @@ class MemoryManager:
         Args:
             free_index (torch.Tensor): _description_
         """
+        if self.token_allocator is not None:
+            self.token_allocator.free(free_index)
+            self.can_use_mem_size += len(free_index)
+            self.shared_can_use_token_num.set_value(self.can_use_mem_size)
+            self._update_free_run_stats()
+            return
 
         end = self.mark_start
         start = self.mark_start - len(free_index)
@@ -284,6 +323,9 @@ class MemoryManager:
         self.mem_state.numpy()[:] = list(range(0, len(self.mem_state)))
         self.mark_start = 0
         self.mark_end = len(self.mem_state)
+        if self.token_allocator is not None:
+            self.token_allocator.free_all()
+            self._update_free_run_stats()
 
     def resize_mem(self, new_size):
         """
@@ -303,6 +345,9 @@ class MemoryManager:
         self.mark_end = self.size
         self.can_use_mem_size = self.size
         self.shared_can_use_token_num.set_value(self.can_use_mem_size)
+        if self.token_allocator is not None:
+            self.token_allocator = FreeListTokenAllocator(self.size)
+            self._update_free_run_stats()
         self._free_buffers()
         self._init_buffers(size, dtype, head_num, head_dim, layer_num)
         return
@@ -311,7 +356,7 @@ class MemoryManager:
         return {"kv_buffer": self.kv_buffer[:, index]}
 
     def load_index_kv_buffer(self, index, load_tensor_dict):
-        self.kv_buffer[:, index].copy_(load_tensor_dict["kv_buffer"])
+        self.kv_buffer[:, index] = load_tensor_dict["kv_buffer"].to(self.kv_buffer.device, non_blocking=True)
 
 
 class ReadOnlyStaticsMemoryManager:
@@ -330,8 +375,31 @@ class ReadOnlyStaticsMemoryManager:
             SharedInt(f"{get_unique_server_name()}_mem_manger_can_use_token_num_{rank_in_node}")
             for rank_in_node in range(0, self.node_world_size, self.dp_world_size)
         ]
+        self.shared_largest_free_runs = [
+            SharedInt(f"{get_unique_server_name()}_mem_manger_largest_free_run_{rank_in_node}")
+            for rank_in_node in range(0, self.node_world_size, self.dp_world_size)
+        ]
+        self.shared_free_run_nums = [
+            SharedInt(f"{get_unique_server_name()}_mem_manger_free_run_num_{rank_in_node}")
+            for rank_in_node in range(0, self.node_world_size, self.dp_world_size)
+        ]
 
     def get_unrefed_token_num(self, dp_rank_in_node: int):
         if self.is_multinode_tp:
             return self.shared_tp_infos[0].get_value()
         return self.shared_tp_infos[dp_rank_in_node].get_value()
+
+    def get_free_run_stats(self, dp_rank_in_node: int):
+        """
+        返回 (最大连续空闲段的长度, 空闲段数量, 碎片率)，碎片率为 1 - 最大连续空闲段长度 / 空闲 token 数量，
+        只有使用 free_list 分配器时才有统计信息，否则返回 None
+        """
+        if self.is_multinode_tp:
+            dp_rank_in_node = 0
+        largest_free_run = self.shared_largest_free_runs[dp_rank_in_node].get_value()
+        if largest_free_run < 0:
+            return None
+        free_run_num = self.shared_free_run_nums[dp_rank_in_node].get_value()
+        free_token_num = self.shared_tp_infos[dp_rank_in_node].get_value()
+        fragmentation = 1.0 - largest_free_run / free_token_num if free_token_num > 0 else 0.0
+        return largest_free_run, free_run_num, fragmentation
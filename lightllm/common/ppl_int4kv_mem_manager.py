@@ -32,5 +32,5 @@ class PPLINT4KVMemoryManager(MemoryManager):
         return {"kv_buffer": self.kv_buffer[:, index], "scale_buffer": self.scale_buffer[:, index]}
 
     def load_index_kv_buffer(self, index, load_tensor_dict):
-        self.kv_buffer[:, index].copy_(load_tensor_dict["kv_buffer"])
-        self.scale_buffer[:, index].copy_(load_tensor_dict["scale_buffer"])
+        self.kv_buffer[:, index] = load_tensor_dict["kv_buffer"].to(self.kv_buffer.device, non_blocking=True)
+        self.scale_buffer[:, index] = load_tensor_dict["scale_buffer"].to(self.scale_buffer.device, non_blocking=True)
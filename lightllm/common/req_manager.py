@@ -1,7 +1,8 @@
 import torch
+import numpy as np
 from lightllm.utils.log_utils import init_logger
 from .mem_manager import MemoryManager
-from typing import List
+from typing import List, Tuple
 
 logger = init_logger(__name__)
 
@@ -48,7 +49,13 @@ class _ReqLinkedList:
 
 
 class ReqManager:
-    def __init__(self, max_request_num, max_sequence_length, mem_manager: MemoryManager):
+    def __init__(
+        self,
+        max_request_num,
+        max_sequence_length,
+        mem_manager: MemoryManager,
+        req_sampling_params_manager: "ReqSamplingParamsManager" = None,
+    ):
         # 这里对最大请求数量的管理在默认上多申请了一个，主要是 index 为 max_request_num 代表
         # 的这个请求管理 id， 主要是为了兼容 DP 运行模式下，让各个 DP 能 padding 到 DP 中最大
         # 的那个batch size 进行运行，所有 padding 的请求都会使用预留的这个请求管理 id 进行处理
@@ -60,6 +67,8 @@ class ReqManager:
         self.mem_manager = mem_manager
         self.max_request_num = max_request_num
         self.HOLD_REQUEST_ID = max_request_num
+        # 采样参数管理对象需要在 kv cache 根据剩余显存确定大小之前创建，由模型初始化时传入
+        self.req_sampling_params_manager = req_sampling_params_manager
 
     def alloc(self):
         return self.req_list.alloc()
@@ -85,3 +94,100 @@ class ReqManager:
     def free_all(self):
         self.req_list = _ReqLinkedList(self.max_request_num)
         return
+
+
+class ReqSamplingParamsManager:
+    """
+    以 req_idx 为下标、常驻在 gpu 上的请求采样参数表和输出 token 计数表。
+    请求初始化时写入一次采样参数，每一步只需要传入 batch 中请求的 req_idx 和已输出长度，
+    penalty 需要的 token 计数在每一步确定输出后在 gpu 上增量更新，不需要在 cpu 上遍历每个请求的计数。
+    token 计数表的大小为 (max_request_num + 1) * vocab_size，需要在 kv cache 根据剩余显存确定大小之前申请，
+    否则运行中才申请的计数表会挤占已经分配给 kv cache 的显存预算。
+    """
+
+    # req_to_params 中各列对应的参数
+    PRESENCE_PENALTY = 0
+    FREQUENCY_PENALTY = 1
+    REPETITION_PENALTY = 2
+    EXP_DECAY_START = 3
+    EXP_DECAY_FACTOR = 4
+    TEMPERATURE = 5
+    TOP_P = 6
+    TOP_K = 7
+    MIN_NEW_TOKENS = 8
+    PARAM_NUM = 9
+
+    def __init__(self, max_request_num: int, vocab_size: int, device="cuda"):
+        self.device = device
+        self.pin_memory = torch.device(device).type == "cuda"
+        self.req_to_params = torch.zeros((max_request_num + 1, self.PARAM_NUM), dtype=torch.float32, device=device)
+        self.req_to_out_token_id_counter = torch.zeros(
+            (max_request_num + 1, vocab_size), dtype=torch.int32, device=device
+        )
+        logger.info(f"alloc req out token id counter with shape {tuple(self.req_to_out_token_id_counter.shape)}")
+        # 每个 req_idx 对应的请求是否开启了 penalty，在 cpu 上判断，避免更新计数时读取 gpu 上的数据
+        self.req_has_penalty = np.zeros((max_request_num + 1,), dtype=np.bool_)
+
+    def init_req_sampling_params(self, req_idx: int, shm_param, prompt_ids: np.ndarray):
+        exponential_decay_length_penalty = shm_param.exponential_decay_length_penalty.to_tuple()
+        params = [0.0] * self.PARAM_NUM
+        params[self.PRESENCE_PENALTY] = shm_param.presence_penalty
+        params[self.FREQUENCY_PENALTY] = shm_param.frequency_penalty
+        params[self.REPETITION_PENALTY] = shm_param.repetition_penalty
+        params[self.EXP_DECAY_START] = exponential_decay_length_penalty[0]
+        params[self.EXP_DECAY_FACTOR] = exponential_decay_length_penalty[1]
+        params[self.TEMPERATURE] = shm_param.temperature
+        params[self.TOP_P] = shm_param.top_p
+        params[self.TOP_K] = shm_param.top_k
+        params[self.MIN_NEW_TOKENS] = shm_param.min_new_tokens
+        params_cpu = torch.tensor(params, dtype=torch.float32, device="cpu", pin_memory=self.pin_memory)
+        self.req_to_params[req_idx].copy_(params_cpu, non_blocking=True)
+
+        has_penalty = (
+            shm_param.presence_penalty != 0.0
+            or shm_param.frequency_penalty != 0.0
+            or shm_param.repetition_penalty != 1.0
+        )
+        self.req_has_penalty[req_idx] = has_penalty
+        if has_penalty:
+            counter = self.req_to_out_token_id_counter
+            counter[req_idx].fill_(0)
+            if shm_param.input_penalty and len(prompt_ids) > 0:
+                prompt_ids_cpu = torch.tensor(prompt_ids, dtype=torch.int64, device="cpu", pin_memory=self.pin_memory)
+                prompt_ids = prompt_ids_cpu.to(self.device, non_blocking=True)
+                counter[req_idx].index_add_(0, prompt_ids, torch.ones_like(prompt_ids, dtype=torch.int32))
+        return
+
+    def has_penalty(self, req_idxs: List[int]) -> bool:
+        return bool(self.req_has_penalty[req_idxs].any())
+
+    def update_out_token_id_counter(self, req_idxs: List[int], token_ids: List[int]):
+        """
+        将每个请求本步确定输出的 token 累加到计数表中，只处理开启了 penalty 的请求。
+        """
+        if len(req_idxs) == 0:
+            return
+        req_idxs = np.asarray(req_idxs, dtype=np.int64)
+        mask = self.req_has_penalty[req_idxs]
+        if not mask.any():
+            return
+        update_cpu = torch.from_numpy(np.stack([req_idxs[mask], np.asarray(token_ids, dtype=np.int64)[mask]]))
+        if self.pin_memory:
+            update_cpu = update_cpu.pin_memory()
+        update = update_cpu.to(self.device, non_blocking=True)
+        self.req_to_out_token_id_counter.index_put_(
+            (update[0], update[1]),
+            torch.ones((update.shape[1],), dtype=torch.int32, device=self.device),
+            accumulate=True,
+        )
+        return
+
+    def get_sampling_params(self, b_req_idx: torch.Tensor) -> Tuple[torch.Tensor, ...]:
+        """
+        返回 batch 中各个请求的 (presence_penalties, frequency_penalties, repetition_penalties,
+        exp_decay_starts, exp_decay_factors, temperatures, top_ps, top_ks, min_new_tokens)。
+        """
+        params = self.req_to_params.index_select(0, b_req_idx)
+        ans = [params[:, i].contiguous() for i in range(self.PARAM_NUM)]
+        ans[self.TOP_K] = ans[self.TOP_K].to(torch.int32)
+        return tuple(ans)
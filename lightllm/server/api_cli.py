@@ -14,6 +14,28 @@ def make_argument_parser() -> argparse.ArgumentParser:
     parser.add_argument("--host", type=str, default="127.0.0.1")
     parser.add_argument("--port", type=int, default=8000)
     parser.add_argument("--httpserver_workers", type=int, default=1)
+    parser.add_argument(
+        "--detokenization_workers",
+        type=int,
+        default=1,
+        help="""the num of detokenization processes, requests are sharded across them by request id,
+        more workers can reduce the inter token latency when there are a large number of concurrent streams""",
+    )
+    parser.add_argument(
+        "--tokenize_workers",
+        type=int,
+        default=2,
+        help="""the num of workers used by each httpserver process to run chat template and tokenize,
+        so that long prompts do not block the event loop, 0 means run them in the event loop directly""",
+    )
+    parser.add_argument(
+        "--tokenize_pool_mode",
+        type=str,
+        choices=["thread", "process"],
+        default="thread",
+        help="""run tokenize in a thread pool or a process pool, the process pool loads a tokenizer in each worker
+        and avoids contending for the GIL with the event loop, multimodal encode always runs in the thread pool""",
+    )
     parser.add_argument(
         "--zmq_mode",
         type=str,
@@ -39,6 +61,42 @@ def make_argument_parser() -> argparse.ArgumentParser:
         default=42000,
         help="p d mode, decode node used for kv move manager rpyc server port",
     )
+    parser.add_argument(
+        "--pd_selector",
+        type=str,
+        choices=["random", "load_aware"],
+        default="random",
+        help="""pd_master mode, how to select the prefill and decode node for a request. load_aware selects the
+        prefill node with the lowest expected first token latency by its queued tokens, kv usage and the prompt
+        prefix it may have cached, and selects the decode node with the most kv headroom""",
+    )
+    parser.add_argument(
+        "--pd_node_status_interval_ms",
+        type=int,
+        default=200,
+        help="p d mode, the interval that prefill and decode nodes push their load to pd_master, 0 disables it",
+    )
+    parser.add_argument(
+        "--pd_master_replicas",
+        type=str,
+        default=None,
+        help="""comma separated ip:port of all the pd_master replicas, such as 10.0.0.1:1212,10.0.0.2:1212.
+        prefill and decode nodes connect to every replica and send the tokens of a request to the replica that
+        created it. when it is set, it overrides pd_master_ip and pd_master_port""",
+    )
+    parser.add_argument(
+        "--pd_master_replica_id",
+        type=int,
+        default=0,
+        help="pd_master mode, the index of this replica in --pd_master_replicas",
+    )
+    parser.add_argument(
+        "--pd_master_store",
+        type=str,
+        default="memory",
+        help="""pd_master mode, where the replicas share the load reported by the nodes. memory keeps it in
+        the process, or set a dir that all the replicas can access""",
+    )
 
     parser.add_argument(
         "--model_name",
@@ -81,6 +139,16 @@ def make_argument_parser() -> argparse.ArgumentParser:
         help="""Memory usage ratio, default is 0.9, you can specify a smaller value if OOM occurs at runtime.
         If max_total_token_num is not specified, it will be calculated automatically based on this value.""",
     )
+    parser.add_argument(
+        "--kv_token_allocator",
+        type=str,
+        choices=["stack", "free_list"],
+        default="stack",
+        help="""the allocator of kv cache token indexes.
+        stack : the free token indexes are used as a stack, frees are cheap but the allocated indexes are scattered
+        free_list : free token runs are kept in a sorted free list and merged on free, allocations prefer
+        contiguous runs, the fragmentation statistics are reported to the router""",
+    )
     parser.add_argument(
         "--batch_max_tokens",
         type=int,
@@ -116,6 +184,22 @@ def make_argument_parser() -> argparse.ArgumentParser:
                         using the deepseekv2 model, set dp to be equal to the tp parameter. In other cases, please
                         do not set it and keep the default value as 1.""",
     )
+    parser.add_argument(
+        "--dp_balancer",
+        type=str,
+        choices=["round_robin", "prefix_affinity"],
+        default="round_robin",
+        help="""the policy used by the router to place requests without a suggested dp index on dp ranks.
+                        prefix_affinity places a request on the dp rank which most likely caches its longest prompt
+                        prefix, weighted by the token load of each rank, it works with --use_dynamic_prompt_cache""",
+    )
+    parser.add_argument(
+        "--dp_balancer_load_weight",
+        type=float,
+        default=1.0,
+        help="""the weight of the token load ratio against the prefix hit ratio when --dp_balancer is prefix_affinity,
+                        a larger value prefers load balance""",
+    )
     parser.add_argument(
         "--max_req_total_len", type=int, default=16384, help="the max value for req_input_len + req_output_len"
     )
@@ -156,6 +240,23 @@ def make_argument_parser() -> argparse.ArgumentParser:
     parser.add_argument(
         "--router_max_new_token_len", type=int, default=1024, help="the request max new token len for router"
     )
+    parser.add_argument(
+        "--output_len_estimator",
+        type=str,
+        choices=["fixed", "histogram"],
+        default="fixed",
+        help="""the way the router estimates the output len of a request when computing its future token usage.
+        fixed uses --router_max_new_token_len, histogram learns online the conditional output len distribution of
+        finished requests, grouped by prompt len and the optional output_len_hint sampling param""",
+    )
+    parser.add_argument(
+        "--output_len_estimator_quantile",
+        type=float,
+        default=0.5,
+        help="""the quantile of the conditional output len distribution used as the estimate of a request when
+        --output_len_estimator is histogram, the estimates of all requests are summed up, so a high quantile is
+        very conservative""",
+    )
 
     parser.add_argument(
         "--router_max_wait_tokens",
@@ -171,6 +272,91 @@ def make_argument_parser() -> argparse.ArgumentParser:
     )
 
     parser.add_argument("--use_dynamic_prompt_cache", action="store_true", help="use_dynamic_prompt_cache test")
+    parser.add_argument(
+        "--prompt_cache_mode",
+        type=str,
+        choices=["radix", "array_radix", "block"],
+        default="radix",
+        help="""the prompt cache implementation used when use_dynamic_prompt_cache is set.
+        radix : token level radix tree stored in torch tensors
+        array_radix : token level radix tree stored in numpy arenas with vectorized prefix matching
+        block : fixed size token blocks indexed by a chained hash dict, only whole blocks can be matched""",
+    )
+    parser.add_argument(
+        "--waiting_queue_policy",
+        type=str,
+        choices=["fcfs", "cache_aware"],
+        default="fcfs",
+        help="""the order in which the router admits waiting requests.
+        fcfs : first come first served
+        cache_aware : requests with a longer estimated prompt cache hit and a shorter remaining prefill are admitted
+        first, the hit is estimated by a read-only prefix index shared from the inference process, it works with
+        --use_dynamic_prompt_cache""",
+    )
+    parser.add_argument(
+        "--waiting_queue_max_skip",
+        type=int,
+        default=16,
+        help="""when --waiting_queue_policy is cache_aware, a waiting request which has been overtaken by later
+        requests this many times is admitted in fcfs order, to bound its starvation""",
+    )
+    parser.add_argument(
+        "--kv_swap_host_mem_gb",
+        type=float,
+        default=0,
+        help="""the size of the pinned host memory pool (GB per rank) used to swap out the kv of paused requests.
+        a paused request whose kv is swapped out is resumed by loading its kv back instead of recomputing it,
+        0 disables swapping and paused requests are always recomputed""",
+    )
+    parser.add_argument(
+        "--kv_swap_min_len",
+        type=int,
+        default=256,
+        help="""when --kv_swap_host_mem_gb > 0, paused requests with fewer kv tokens than this are recomputed
+        instead of swapped, recomputing a short kv is cheaper than the two copies over pcie""",
+    )
+    parser.add_argument(
+        "--enable_priority_schedule",
+        action="store_true",
+        help="""schedule requests by the priority sampling param (smaller value is more important). waiting requests
+        are admitted by priority class, and when the kv cache runs out the lowest priority running requests whose
+        kv is the cheapest to recompute are paused first""",
+    )
+    parser.add_argument(
+        "--priority_preempt_wait_ms",
+        type=int,
+        default=500,
+        help="""when --enable_priority_schedule is set, a waiting request which can not be admitted for this many
+        milliseconds preempts running requests of lower priority to get the kv cache it needs, -1 disables it""",
+    )
+    parser.add_argument(
+        "--prompt_cache_block_size",
+        type=int,
+        default=32,
+        help="the token num of one block when prompt_cache_mode is block",
+    )
+    parser.add_argument(
+        "--prompt_cache_host_mem_gb",
+        type=float,
+        default=0,
+        help="""the size (GB) of pinned host memory used as the second level of the prompt cache, the kv of
+        evicted prompt cache nodes is offloaded to it and loaded back to gpu when a later request hits it,
+        0 means disable""",
+    )
+    parser.add_argument(
+        "--prompt_cache_snapshot_dir",
+        type=str,
+        default=None,
+        help="""the dir to save the prompt cache snapshot on shutdown or by the /admin/save_prompt_cache_snapshot
+        api, the snapshot in this dir is loaded on startup while the server begins serving. the api can only write to
+        this dir and is rejected when it is not set""",
+    )
+    parser.add_argument(
+        "--prompt_cache_snapshot_tokens",
+        type=int,
+        default=100000,
+        help="the max token num of the hottest prompt cache nodes saved in the snapshot",
+    )
 
     parser.add_argument("--chunked_prefill_size", type=int, default=8192, help="chunked prefill size")
     parser.add_argument("--disable_chunked_prefill", action="store_true", help="whether to disable chunked prefill")
@@ -234,6 +420,14 @@ def make_argument_parser() -> argparse.ArgumentParser:
     parser.add_argument(
         "--cache_reserved_ratio", type=float, default=0.5, help="cache server reserved capacity ratio after clear"
     )
+    parser.add_argument(
+        "--cache_embed_arena_gb",
+        type=float,
+        default=0,
+        help="""the size of the shared memory arena that the cache server manages for the image embeddings. the
+        visual server writes the embeddings into it as raw tensors and the llm maps them without any copy or
+        deserialization. 0 stores every embedding in its own shared memory""",
+    )
     parser.add_argument(
         "--data_type",
         type=str,
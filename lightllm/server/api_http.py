@@ -24,7 +24,6 @@ import requests
 import base64
 import os
 from io import BytesIO
-import pickle
 from .build_prompt import build_prompt, init_tokenizer
 
 asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
@@ -42,6 +41,7 @@ from lightllm.server.core.objs.sampling_params import SamplingParams
 from .multimodal_params import MultimodalParams
 from .httpserver.manager import HttpServerManager
 from .httpserver_for_pd_master.manager import HttpServerManagerForPDMaster
+from .pd_io_frame import decode_pd_frame
 from .api_lightllm import lightllm_get_score, lightllm_pd_generate_stream
 from lightllm.utils.envs_utils import get_env_start_args
 from lightllm.utils.image_utils import image2base64, fetch_image
@@ -94,7 +94,6 @@ class G_Objs:
                 metric_port=args.metric_port,
             )
         else:
-            init_tokenizer(args)  # for openai api
             SamplingParams.load_generation_cfg(args.model_dir)
             self.metric_client = MetricClient(args.metric_port)
             self.httpserver_manager = HttpServerManager(
@@ -106,6 +105,7 @@ class G_Objs:
                 enable_multimodal=args.enable_multimodal,
                 metric_port=args.metric_port,
             )
+            init_tokenizer(args, self.httpserver_manager.tokenize_pool)  # for openai api
             dp_size_in_node = max(1, args.dp // args.nnodes)  # 兼容多机纯tp的运行模式，这时候 1 // 2 == 0, 需要兼容
             self.shared_token_load = TokenLoad(f"{get_unique_server_name()}_shared_token_load", dp_size_in_node)
 
@@ -278,6 +278,8 @@ async def chat_completions(request: ChatCompletionRequest, raw_request: Request)
         "best_of": request.n,
         "add_special_tokens": False,
     }
+    if request.priority is not None:
+        sampling_params_dict["priority"] = request.priority
     sampling_params = SamplingParams()
     sampling_params.init(tokenizer=g_objs.httpserver_manager.tokenizer, **sampling_params_dict)
 
@@ -371,7 +373,7 @@ async def tokens(request: Request):
         await multimodal_params.verify_and_preload(request)
         return JSONResponse(
             {
-                "ntokens": g_objs.httpserver_manager.tokens(
+                "ntokens": await g_objs.httpserver_manager.tokens(
                     prompt, multimodal_params, sampling_params, sample_params_dict
                 )
             },
@@ -381,6 +383,23 @@ async def tokens(request: Request):
         return create_error_response(HTTPStatus.EXPECTATION_FAILED, f"error: {str(e)}")
 
 
+@app.post("/admin/save_prompt_cache_snapshot")
+async def save_prompt_cache_snapshot(request: Request) -> Response:
+    args = g_objs.args
+    if args.run_mode == "pd_master" or not args.use_dynamic_prompt_cache or args.nnodes != 1:
+        return create_error_response(HTTPStatus.BAD_REQUEST, "prompt cache snapshot is not supported")
+    # 接口没有鉴权，只能写入启动参数指定的目录，客户端只能设置保存的 token 数量
+    snapshot_dir = args.prompt_cache_snapshot_dir
+    if not snapshot_dir:
+        return create_error_response(HTTPStatus.BAD_REQUEST, "--prompt_cache_snapshot_dir is not set")
+    request_dict = await request.json() if await request.body() else {}
+    max_tokens = request_dict.get("max_tokens", args.prompt_cache_snapshot_tokens)
+    if not isinstance(max_tokens, int) or isinstance(max_tokens, bool) or max_tokens <= 0:
+        return create_error_response(HTTPStatus.BAD_REQUEST, "max_tokens must be a positive int")
+    is_ok = await g_objs.httpserver_manager.save_prompt_cache_snapshot(snapshot_dir, max_tokens)
+    return JSONResponse({"success": is_ok, "snapshot_dir": snapshot_dir, "max_tokens": max_tokens})
+
+
 @app.get("/metrics")
 async def metrics() -> Response:
     data = await g_objs.metric_client.generate_latest()
@@ -402,7 +421,7 @@ async def register_and_keep_alive(websocket: WebSocket):
         while True:
             # 等待接收消息，设置超时为10秒
             data = await websocket.receive_bytes()
-            obj = pickle.loads(data)
+            obj = decode_pd_frame(data)
             await g_objs.httpserver_manager.put_to_handle_queue(obj)
 
     except (WebSocketDisconnect, Exception, RuntimeError) as e:
@@ -437,6 +456,21 @@ async def kv_move_status(websocket: WebSocket):
 @app.on_event("shutdown")
 async def shutdown():
     logger.info("Received signal to shutdown. Performing graceful shutdown...")
+    args = g_objs.args
+    if (
+        args is not None
+        and args.run_mode != "pd_master"
+        and args.use_dynamic_prompt_cache
+        and args.prompt_cache_snapshot_dir
+        and args.nnodes == 1
+    ):
+        try:
+            is_ok = await g_objs.httpserver_manager.save_prompt_cache_snapshot(
+                args.prompt_cache_snapshot_dir, args.prompt_cache_snapshot_tokens, timeout=120
+            )
+            logger.info(f"save prompt cache snapshot on shutdown, success {is_ok}")
+        except Exception as e:
+            logger.exception(f"save prompt cache snapshot on shutdown error {str(e)}")
     await asyncio.sleep(3)
 
     # 杀掉所有子进程
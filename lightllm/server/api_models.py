@@ -42,6 +42,8 @@ class ChatCompletionRequest(BaseModel):
     ignore_eos: Optional[bool] = False
     role_settings: Optional[Dict[str, str]] = None
     character_settings: Optional[List[Dict[str, str]]] = None
+    # 请求的优先级，数值越小优先级越高，在开启 --enable_priority_schedule 时生效
+    priority: Optional[int] = None
 
 
 class UsageInfo(BaseModel):
@@ -172,13 +172,22 @@ def normal_or_p_d_start(args):
     ports_locker.lock_port()
 
     node_world_size = args.tp // args.nnodes
+    assert args.detokenization_workers >= 1
+    extra_detokenization_num = args.detokenization_workers - 1
     can_use_ports = alloc_can_use_network_port(
-        num=6 + node_world_size + args.visual_dp * args.visual_tp, used_nccl_ports=already_uesd_ports
+        num=6 + node_world_size + args.visual_dp * args.visual_tp + 2 * extra_detokenization_num,
+        used_nccl_ports=already_uesd_ports,
     )
     logger.info(f"alloced ports: {can_use_ports}")
     router_port, detokenization_port, detokenization_pub_port, visual_port, cache_port, metric_port = can_use_ports[0:6]
     can_use_ports = can_use_ports[6:]
 
+    # 多个 detokenization 进程时，每个进程使用单独的接收端口和发布端口
+    detokenization_ports = [detokenization_port] + can_use_ports[0:extra_detokenization_num]
+    can_use_ports = can_use_ports[extra_detokenization_num:]
+    detokenization_pub_ports = [detokenization_pub_port] + can_use_ports[0:extra_detokenization_num]
+    can_use_ports = can_use_ports[extra_detokenization_num:]
+
     visual_model_tp_ports = []
     for _ in range(args.visual_dp):
         tp_ports_for_dp = can_use_ports[0 : args.visual_tp]
@@ -189,6 +198,8 @@ def normal_or_p_d_start(args):
     args.router_port = router_port
     args.detokenization_port = detokenization_port
     args.detokenization_pub_port = detokenization_pub_port
+    args.detokenization_ports = detokenization_ports
+    args.detokenization_pub_ports = detokenization_pub_ports
     args.visual_port = visual_port
     args.cache_port = cache_port
     args.metric_port = metric_port
@@ -235,10 +246,11 @@ def normal_or_p_d_start(args):
     )
 
     process_manager.start_submodule_processes(
-        start_funcs=[start_router_process, start_detokenization_process],
-        start_args=[
-            (args, router_port, detokenization_port, metric_port),
-            (args, detokenization_port, detokenization_pub_port),
+        start_funcs=[start_router_process] + [start_detokenization_process] * args.detokenization_workers,
+        start_args=[(args, router_port, detokenization_port, metric_port)]
+        + [
+            (args, detok_port, detok_pub_port)
+            for detok_port, detok_pub_port in zip(detokenization_ports, detokenization_pub_ports)
         ],
     )
 
@@ -284,6 +296,12 @@ def pd_master_start(args):
     if args.run_mode != "pd_master":
         return
 
+    from .pd_io_struct import get_pd_master_addrs
+
+    assert (
+        0 <= args.pd_master_replica_id < len(get_pd_master_addrs(args))
+    ), "pd_master_replica_id must be the index of this replica in pd_master_replicas"
+
     logger.info(f"use tgi api: {args.use_tgi_api}")
     logger.info(f"all start args:{args}")
 
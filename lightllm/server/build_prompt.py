@@ -1,20 +1,25 @@
 tokenizer = None
+tokenize_pool = None
 
 
-def init_tokenizer(args):
-    global tokenizer
+def init_tokenizer(args, pool=None):
+    global tokenizer, tokenize_pool
     from lightllm.server.tokenizer import get_tokenizer
 
     tokenizer = get_tokenizer(args.model_dir, args.tokenizer_mode, trust_remote_code=args.trust_remote_code)
+    tokenize_pool = pool
 
 
 async def build_prompt(request) -> str:
-    global tokenizer
+    global tokenizer, tokenize_pool
     messages = request.messages
     kwargs = {"conversation": messages}
     if request.character_settings:
         kwargs["character_settings"] = request.character_settings
     if request.role_settings:
         kwargs["role_setting"] = request.role_settings
+    if tokenize_pool is not None:
+        # 在 tokenize pool 中渲染 chat template，避免长对话阻塞事件循环
+        return await tokenize_pool.apply_chat_template(**kwargs, tokenize=False, add_generation_prompt=True)
     input_str = tokenizer.apply_chat_template(**kwargs, tokenize=False, add_generation_prompt=True)
     return input_str
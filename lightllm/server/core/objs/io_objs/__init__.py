@@ -1 +1,2 @@
 from .group_req import GroupReqIndexes, GroupReqObjs
+from .prompt_cache_snapshot import PromptCacheSnapshotCmd, PromptCacheSnapshotStatus
@@ -0,0 +1,42 @@
+import numpy as np
+from dataclasses import dataclass
+from lightllm.server.router.dynamic_prompt.shared_arr import SharedArray, SharedInt
+from lightllm.utils.envs_utils import get_unique_server_name
+
+
+@dataclass
+class PromptCacheSnapshotCmd:
+    snapshot_dir: str
+    max_tokens: int
+
+
+class PromptCacheSnapshotStatus:
+    """
+    prompt cache 快照在 httpserver, router 和推理进程之间共享的状态。
+    states 记录每个推理进程启动时加载快照的状态，version 在每次保存快照完成后加一。
+    """
+
+    NONE = 0
+    LOADING = 1
+    READY = 2
+    FAILED = 3
+
+    def __init__(self, node_world_size: int):
+        name = get_unique_server_name()
+        self.states = SharedArray(f"{name}_prompt_cache_snapshot_states", (node_world_size,), dtype=np.int64)
+        self.version = SharedInt(f"{name}_prompt_cache_snapshot_version")
+
+    def set_state(self, rank_in_node: int, state: int):
+        self.states.arr[rank_in_node] = state
+
+    def is_loading(self) -> bool:
+        return bool(np.any(self.states.arr == self.LOADING))
+
+    def has_pending_load(self) -> bool:
+        return bool(np.any(self.states.arr != self.NONE))
+
+    def all_ready(self) -> bool:
+        return bool(np.all(self.states.arr == self.READY))
+
+    def reset(self):
+        self.states.arr[:] = self.NONE
@@ -6,6 +6,7 @@ import os
 from typing import List, Optional, Union, Tuple
 from transformers import GenerationConfig
 from lightllm.server.req_id_generator import MAX_BEST_OF
+from lightllm.server.core.objs.sampling_params import PRIORITY_CLASS_NUM, DEFAULT_PRIORITY
 
 
 _SAMPLING_EPS = 1e-5
@@ -60,6 +61,10 @@ class SamplingParams:
         move_kv_to_decode_node: Optional[dict] = None,
         # suggest dp index, deepseekv2 dp mode, use to suggest used dp_index
         suggested_dp_index: Optional[int] = None,
+        # client supplied bucket of the expected output len, used by router to estimate the output len, -1 is for none
+        output_len_hint: int = -1,
+        # priority class of the request, smaller value is more important, used by router priority schedule
+        priority: int = DEFAULT_PRIORITY,
     ) -> None:
         self.best_of = best_of
         self.n = n
@@ -91,6 +96,8 @@ class SamplingParams:
         self.group_request_id = group_request_id
         self.move_kv_to_decode_node = move_kv_to_decode_node
         self.suggested_dp_index = suggested_dp_index
+        self.output_len_hint = output_len_hint
+        self.priority = priority
         if self.do_sample is False:
             self.temperature = 1.0
             self.top_p = 1.0
@@ -193,6 +200,12 @@ class SamplingParams:
         if not (self.suggested_dp_index is None or isinstance(self.suggested_dp_index, int)):
             raise ValueError(f"suggested_dp_index must be None or int, but get {self.suggested_dp_index}")
 
+        if not isinstance(self.output_len_hint, int) or self.output_len_hint < -1:
+            raise ValueError(f"output_len_hint must be -1 (disable) or int >= 0, but get {self.output_len_hint}")
+
+        if not isinstance(self.priority, int) or not (0 <= self.priority < PRIORITY_CLASS_NUM):
+            raise ValueError(f"priority must be int in [0, {PRIORITY_CLASS_NUM}), but get {self.priority}")
+
         self._verify_stop_sentences()
 
         self._verify_allowed_token_ids()
@@ -268,6 +281,8 @@ class SamplingParams:
         ret["guided_json"] = self.guided_json
         ret["allowed_token_ids"] = self.allowed_token_ids
         ret["move_kv_to_decode_node"] = self.move_kv_to_decode_node
+        ret["output_len_hint"] = self.output_len_hint
+        ret["priority"] = self.priority
         return ret
 
     def to_origin_dict(self):
@@ -5,6 +5,7 @@ import numpy as np
 from .sampling_params import SamplingParams
 from .out_token_circlequeue import CircularQueue
 from .shm_array import ShmArray
+from .req_shm_arena import get_req_shm_arena
 from lightllm.server.req_id_generator import convert_sub_id_to_group_id
 from lightllm.utils.envs_utils import get_unique_server_name
 from lightllm.utils.envs_utils import get_env_start_args
@@ -153,6 +154,9 @@ class Req(ctypes.Structure):
         pass
 
     def create_prompt_ids_shm_array(self):
+        self.shm_prompt_ids = self._get_arena_slot("prompts")
+        if self.shm_prompt_ids is not None:
+            return
         service_uni_name = get_unique_server_name()
         name = f"{service_uni_name}_shm_prompts_{self.index_in_shm_mem}"
         self.shm_prompt_ids = ShmArray(name, (self.alloc_shm_numpy_len,), dtype=np.int64)
@@ -160,6 +164,9 @@ class Req(ctypes.Structure):
         return
 
     def link_prompt_ids_shm_array(self):
+        self.shm_prompt_ids = self._get_arena_slot("prompts")
+        if self.shm_prompt_ids is not None:
+            return
         service_uni_name = get_unique_server_name()
         name = f"{service_uni_name}_shm_prompts_{self.index_in_shm_mem}"
         self.shm_prompt_ids = ShmArray(name, (self.alloc_shm_numpy_len,), dtype=np.int64)
@@ -167,6 +174,9 @@ class Req(ctypes.Structure):
         return
 
     def create_logprobs_shm_array(self):
+        self.shm_logprobs = self._get_arena_slot("logprobs")
+        if self.shm_logprobs is not None:
+            return
         service_uni_name = get_unique_server_name()
         name = f"{service_uni_name}_shm_logprobs_{self.index_in_shm_mem}"
         self.shm_logprobs = ShmArray(name, (self.alloc_shm_numpy_len,), dtype=np.float32)
@@ -174,12 +184,23 @@ class Req(ctypes.Structure):
         return
 
     def link_logprobs_shm_array(self):
+        self.shm_logprobs = self._get_arena_slot("logprobs")
+        if self.shm_logprobs is not None:
+            return
         service_uni_name = get_unique_server_name()
         name = f"{service_uni_name}_shm_logprobs_{self.index_in_shm_mem}"
         self.shm_logprobs = ShmArray(name, (self.alloc_shm_numpy_len,), dtype=np.float32)
         self.shm_logprobs.link_shm()
         return
 
+    def _get_arena_slot(self, kind: str):
+        # 优先使用预先分配好的 arena 中的槽位，超出槽位长度的请求回退到单独创建的共享内存段，
+        # 判断只依赖 index_in_shm_mem 和 alloc_shm_numpy_len，所以各个进程的选择一定是一致的
+        arena = get_req_shm_arena(kind)
+        if arena is None or not arena.can_hold(self.index_in_shm_mem, self.alloc_shm_numpy_len):
+            return None
+        return arena.get_slot(self.index_in_shm_mem, self.alloc_shm_numpy_len)
+
     def get_prompt_ids(self):
         return self.shm_prompt_ids.arr[: self.input_len].tolist()
 
@@ -253,7 +274,7 @@ class NormalReq(Req):
             cur_max_new_token_len = self.sample_params.max_new_tokens
         else:
             # 用当前输出长度的 1.1 倍作为预估输出长度的另一个参考量，用于更新估计的最大输出长度量
-            # 后续会更新为更合理的统计条件概率估计方式 to do
+            # router_max_new_token_len 由 router 的输出长度估计器给出，见 --output_len_estimator
             cur_max_new_token_len = min(
                 self.sample_params.max_new_tokens, max(int(1.1 * has_out_len), router_max_new_token_len)
             )
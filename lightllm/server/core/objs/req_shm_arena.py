@@ -0,0 +1,66 @@
+import os
+import numpy as np
+from functools import lru_cache
+from .shm_array import ShmArray
+from lightllm.utils.envs_utils import get_unique_server_name, get_env_start_args
+from lightllm.utils.log_utils import init_logger
+
+logger = init_logger(__name__)
+
+# 与 Req.init 中 alloc_shm_numpy_len 的计算方式保持一致
+REQ_SHM_SAFE_EXTRA_LEN = 1024
+
+
+class ReqShmArenaSlot:
+    """
+    arena 中一个请求对应的缓冲区，与 ShmArray 一样通过 arr 属性读写数据。
+    """
+
+    def __init__(self, arr: np.ndarray):
+        self.arr = arr
+
+    def close_shm(self):
+        # 所在的共享内存由 arena 持有，请求结束时不需要释放
+        self.arr = None
+
+
+class ReqShmArena:
+    """
+    按照 index_in_shm_mem 预先划分好的共享内存，第 i 行为占用 shm req 管理器中第 i 个槽位的请求使用。
+    每个进程只需要 create 或者 link 一次，之后请求的 prompt ids 和 logprobs 缓冲区都是这块内存上的
+    切片视图，避免每个请求都创建和映射新的共享内存段。tmpfs 上的内存页在第一次写入时才会真正分配，
+    所以未被使用的部分不会占用实际的内存。
+    """
+
+    def __init__(self, name: str, max_req_num: int, slot_len: int, dtype):
+        self.max_req_num = max_req_num
+        self.slot_len = slot_len
+        self.shm_array = ShmArray(name, (max_req_num, slot_len), dtype=dtype)
+        # 所有进程都使用 create_shm，先到的进程负责创建，其他进程直接 link
+        self.shm_array.create_shm()
+        logger.info(f"req shm arena {name} shape {(max_req_num, slot_len)} dtype {np.dtype(dtype).name}")
+
+    def can_hold(self, index_in_shm_mem: int, alloc_len: int) -> bool:
+        return 0 <= index_in_shm_mem < self.max_req_num and alloc_len <= self.slot_len
+
+    def get_slot(self, index_in_shm_mem: int, alloc_len: int) -> ReqShmArenaSlot:
+        return ReqShmArenaSlot(self.shm_array.arr[index_in_shm_mem, 0:alloc_len])
+
+
+@lru_cache(maxsize=None)
+def get_req_shm_arena(kind: str):
+    """
+    kind 为 "prompts" 或者 "logprobs"，分别返回保存 prompt ids (int64) 与 logprobs (float32) 的 arena。
+    没有启动参数时 (比如单独构造 Req 对象的场景) 返回 None，调用方回退到每个请求单独的共享内存段。
+    """
+    if "LIGHTLLM_START_ARGS" not in os.environ:
+        return None
+    args = get_env_start_args()
+    max_req_num = args.get("running_max_req_size", None)
+    max_req_total_len = args.get("max_req_total_len", None)
+    if not max_req_num or not max_req_total_len:
+        return None
+
+    dtype = {"prompts": np.int64, "logprobs": np.float32}[kind]
+    name = f"{get_unique_server_name()}_req_arena_{kind}"
+    return ReqShmArena(name, max_req_num, max_req_total_len + REQ_SHM_SAFE_EXTRA_LEN, dtype)
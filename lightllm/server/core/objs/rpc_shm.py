@@ -1,5 +1,8 @@
 import os
+import time
 import pickle
+import struct
+import asyncio
 import numpy as np
 from multiprocessing import shared_memory
 from typing import List
@@ -10,6 +13,90 @@ logger = init_logger(__name__)
 
 LIGHTLLM_RPC_BYTE_SIZE = int(os.getenv("LIGHTLLM_RPC_BYTE_SIZE", 1024 * 1024 * 16))  # 默认16M buf
 LIGHTLLM_RPC_RESULT_BYTE_SIZE = int(os.getenv("LIGHTLLM_RPC_RESULT_BYTE_SIZE", 1024 * 1024))  # 默认1M buf
+# 等待 rpc 命令或者结果时，先忙等 LIGHTLLM_RPC_SPIN_US，之后以指数退避的方式 sleep，单次 sleep 不超过 LIGHTLLM_RPC_MAX_SLEEP_US
+LIGHTLLM_RPC_SPIN_US = int(os.getenv("LIGHTLLM_RPC_SPIN_US", 100))
+LIGHTLLM_RPC_MAX_SLEEP_US = int(os.getenv("LIGHTLLM_RPC_MAX_SLEEP_US", 200))
+
+# 高频调用的 prefill/decode/pause_reqs 使用紧凑的二进制编码，其他调用和带有图片等多模态参数的 prefill 使用 pickle。
+# 编码格式为 [flag: u8][func_code: u8][n: u32][int64 * ...]，flag 为 0 时后面直接是 pickle 的数据。
+_PICKLE_FLAG = 0
+_BINARY_FLAG = 1
+_BINARY_FUNC_NAMES = ["prefill", "decode", "pause_reqs"]
+_BINARY_FUNC_CODES = {name: code for code, name in enumerate(_BINARY_FUNC_NAMES)}
+_BINARY_HEADER = struct.Struct("<BBI")
+# prefill 的每个请求编码为 (request_id, index_in_shm_mem, 多模态参数标记, suggested_dp_index)
+_PREFILL_REQ_FIELD_NUM = 4
+_MM_NONE = 0
+_MM_EMPTY = 1
+
+
+def _is_empty_multimodal_params(multimodal_params) -> bool:
+    # 不直接引用 MultimodalParams，避免 router 等进程导入图片处理相关的依赖
+    return type(multimodal_params).__name__ == "MultimodalParams" and len(multimodal_params.images) == 0
+
+
+def encode_func_params(func_name, args) -> bytes:
+    if func_name == "prefill":
+        reqs = args[0]
+        if all(r[2] is None or _is_empty_multimodal_params(r[2]) for r in reqs):
+            values = []
+            for request_id, index, multimodal_params, dp_index in reqs:
+                values.extend((request_id, index, _MM_NONE if multimodal_params is None else _MM_EMPTY, dp_index))
+            return _BINARY_HEADER.pack(_BINARY_FLAG, _BINARY_FUNC_CODES[func_name], len(reqs)) + struct.pack(
+                f"<{len(values)}q", *values
+            )
+    elif func_name == "decode" and len(args) == 0:
+        return _BINARY_HEADER.pack(_BINARY_FLAG, _BINARY_FUNC_CODES[func_name], 0)
+    elif func_name == "pause_reqs":
+        req_ids = args[0]
+        return _BINARY_HEADER.pack(_BINARY_FLAG, _BINARY_FUNC_CODES[func_name], len(req_ids)) + struct.pack(
+            f"<{len(req_ids)}q", *req_ids
+        )
+    return bytes([_PICKLE_FLAG]) + pickle.dumps((func_name, args))
+
+
+def decode_func_params(buf):
+    if buf[0] == _PICKLE_FLAG:
+        return pickle.loads(buf[1:])
+
+    _, func_code, n = _BINARY_HEADER.unpack_from(buf, 0)
+    func_name = _BINARY_FUNC_NAMES[func_code]
+    offset = _BINARY_HEADER.size
+    if func_name == "prefill":
+        values = struct.unpack_from(f"<{n * _PREFILL_REQ_FIELD_NUM}q", buf, offset)
+        reqs = []
+        for i in range(0, len(values), _PREFILL_REQ_FIELD_NUM):
+            request_id, index, mm_flag, dp_index = values[i : i + _PREFILL_REQ_FIELD_NUM]
+            multimodal_params = None
+            if mm_flag == _MM_EMPTY:
+                from lightllm.server.multimodal_params import MultimodalParams
+
+                multimodal_params = MultimodalParams()
+            reqs.append((request_id, index, multimodal_params, dp_index))
+        return func_name, (reqs,)
+    elif func_name == "decode":
+        return func_name, ()
+    else:
+        return func_name, (list(struct.unpack_from(f"<{n}q", buf, offset)),)
+
+
+def spin_then_sleep_wait(cond, spin_us: int = LIGHTLLM_RPC_SPIN_US, max_sleep_us: int = LIGHTLLM_RPC_MAX_SLEEP_US):
+    """
+    等待 cond() 为 True，短时间内忙等以降低延迟，超时后改为指数退避的 sleep，避免长时间占满一个 cpu 核。
+    """
+    if cond():
+        return
+    start_time = time.perf_counter()
+    spin_time = spin_us / 1e6
+    while time.perf_counter() - start_time < spin_time:
+        if cond():
+            return
+    sleep_time = min(10, max_sleep_us) / 1e6
+    max_sleep_time = max_sleep_us / 1e6
+    while not cond():
+        time.sleep(sleep_time)
+        sleep_time = min(sleep_time * 2, max_sleep_time)
+    return
 
 
 class RpcShmParams:
@@ -38,14 +125,14 @@ class RpcShmParams:
         return
 
     def write_func_params(self, func_name, args):
-        objs_bytes = pickle.dumps((func_name, args))
+        objs_bytes = encode_func_params(func_name, args)
         self.shm.buf.cast("i")[0] = len(objs_bytes)
         self.shm.buf[4 : 4 + len(objs_bytes)] = objs_bytes
         return
 
     def read_func_params(self):
         bytes_len = self.shm.buf.cast("i")[0]
-        func_name, args = pickle.loads(self.shm.buf[4 : 4 + bytes_len])
+        func_name, args = decode_func_params(self.shm.buf[4 : 4 + bytes_len])
         return func_name, args
 
 
@@ -86,13 +173,19 @@ class RpcShmResults:
 
 
 class ShmSyncStatusArray:
+    """
+    rpc 客户端和各个 rank 之间的同步状态，arr[0] 为客户端下发的命令序号，arr[1 + rank] 为各个 rank 已经完成的命令序号。
+    客户端写入参数后递增命令序号，各个 rank 执行完成后写入自己完成的序号，所有 rank 的完成序号都等于命令序号时调用结束。
+    rank 之间不再需要互相等待，等待的一方使用先忙等后 sleep 的方式，不会持续占满 cpu。
+    """
+
     def __init__(self, world_size):
         self.shm = None
         self.arr = None
         self.name = f"{get_unique_server_name()}_rpc_result_state"
         self.dtype_byte_num = np.array([1], dtype=np.int64).dtype.itemsize
-        self.dest_size = np.prod((world_size * 2,)) * self.dtype_byte_num
-        self.shape = (world_size * 2,)
+        self.dest_size = np.prod((world_size + 1,)) * self.dtype_byte_num
+        self.shape = (world_size + 1,)
         self.dtype = np.int64
         self.world_size = world_size
 
@@ -116,20 +209,40 @@ class ShmSyncStatusArray:
         self.shm = shm
         self.arr = np.ndarray(self.shape, dtype=self.dtype, buffer=self.shm.buf)
         self.arr[:] = 0
-        self.arr0 = self.arr[0 : self.world_size]
-        self.arr1 = self.arr[self.world_size : 2 * self.world_size]
+        self.done_arr = self.arr[1:]
         return
 
-    def add_mark(self, tp_rank: int):
-        self.arr0[tp_rank] += 1
-        return
+    def send_cmd(self) -> int:
+        # 客户端调用，需要在参数写入完成后调用
+        cmd_seq = int(self.arr[0]) + 1
+        self.arr[0] = cmd_seq
+        return cmd_seq
+
+    def wait_cmd(self, last_cmd_seq: int) -> int:
+        # rank 调用，等待序号大于 last_cmd_seq 的新命令
+        spin_then_sleep_wait(lambda: self.arr[0] != last_cmd_seq)
+        return int(self.arr[0])
 
-    def add_mark1(self, tp_rank: int):
-        self.arr1[tp_rank] += 1
+    def mark_done(self, tp_rank: int, cmd_seq: int):
+        self.done_arr[tp_rank] = cmd_seq
         return
 
-    def run_finished(self):
-        return len(np.unique(self.arr0)) == 1
+    def all_done(self, cmd_seq: int) -> bool:
+        return bool((self.done_arr == cmd_seq).all())
 
-    def run_finished1(self):
-        return len(np.unique(self.arr1)) == 1
+    def wait_all_done(self, cmd_seq: int, spin_us: int = LIGHTLLM_RPC_SPIN_US):
+        spin_then_sleep_wait(lambda: self.all_done(cmd_seq), spin_us=spin_us)
+        return
+
+    async def async_wait_all_done(self, cmd_seq: int):
+        # 先在事件循环中让出执行权的同时忙等，短调用不需要切换线程，超时后转到线程中 sleep 等待
+        start_time = time.perf_counter()
+        spin_time = LIGHTLLM_RPC_SPIN_US / 1e6
+        while time.perf_counter() - start_time < spin_time:
+            if self.all_done(cmd_seq):
+                return
+            await asyncio.sleep(0)
+        if not self.all_done(cmd_seq):
+            # 线程中不再忙等，忙等的线程会长时间持有 GIL，阻塞事件循环
+            await asyncio.to_thread(self.wait_all_done, cmd_seq, 0)
+        return
@@ -16,6 +16,10 @@ REGULAR_CONSTRAINT_MAX_LENGTH = int(os.getenv("LIGHTLLM_REGULAR_CONSTRAINT_MAX_L
 GRAMMAR_CONSTRAINT_MAX_LENGTH = int(os.getenv("LIGHTLLM_GRAMMAR_CONSTRAINT_MAX_LENGTH", 2048))
 JSON_SCHEMA_MAX_LENGTH = int(os.getenv("LIGHTLLM_JSON_SCHEMA_MAX_LENGTH", 2048))
 
+# 请求的优先级分级数量，数值越小优先级越高，未指定时使用默认优先级
+PRIORITY_CLASS_NUM = 8
+DEFAULT_PRIORITY = int(os.getenv("LIGHTLLM_DEFAULT_PRIORITY", 0))
+
 
 class StopSequence(ctypes.Structure):
     _pack_ = 4
@@ -274,6 +278,10 @@ class SamplingParams(ctypes.Structure):
             ctypes.c_bool,
         ),  # whether to add spaces between special tokens when decoding
         ("print_eos_token", ctypes.c_bool),  # eos_id will be always ignored except the value is set to True
+        # client supplied bucket of the expected output len, used by router to estimate the output len, -1 is for none
+        ("output_len_hint", ctypes.c_int),
+        # priority class of the request, smaller value is more important, used by router priority schedule
+        ("priority", ctypes.c_int),
     ]
 
     _do_sample: bool = False
@@ -308,6 +316,8 @@ class SamplingParams(ctypes.Structure):
         self.add_special_tokens = kwargs.get("add_special_tokens", True)
         self.add_spaces_between_special_tokens = kwargs.get("add_spaces_between_special_tokens", True)
         self.print_eos_token = kwargs.get("print_eos_token", False)
+        self.output_len_hint = kwargs.get("output_len_hint", -1)
+        self.priority = kwargs.get("priority", DEFAULT_PRIORITY)
 
         self.exponential_decay_length_penalty = ExponentialDecayLengthPenalty()
         self.exponential_decay_length_penalty.initialize(kwargs.get("exponential_decay_length_penalty", (1, 1.0)))
@@ -393,6 +403,10 @@ class SamplingParams(ctypes.Structure):
             raise ValueError(
                 f"min_new_tokens must <= max_new_tokens, but got min {self.min_new_tokens}, max {self.max_new_tokens}."
             )
+        if self.output_len_hint < -1:
+            raise ValueError(f"output_len_hint must be -1 (disable), or at least 0, got {self.output_len_hint}.")
+        if not (0 <= self.priority < PRIORITY_CLASS_NUM):
+            raise ValueError(f"priority must be in [0, {PRIORITY_CLASS_NUM}), got {self.priority}.")
 
         self._verify_allowed_token_ids()
         self._verify_grammar_constraint()
@@ -444,6 +458,8 @@ class SamplingParams(ctypes.Structure):
             "add_special_tokens": self.add_special_tokens,
             "add_spaces_between_special_tokens": self.add_spaces_between_special_tokens,
             "print_eos_token": self.print_eos_token,
+            "output_len_hint": self.output_len_hint,
+            "priority": self.priority,
         }
 
     def to_origin_dict(self):
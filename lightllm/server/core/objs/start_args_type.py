@@ -9,6 +9,9 @@ class StartArgs:
     run_mode: str = field(default="normal", metadata={"choices": ["normal", "prefill", "decode", "pd_master"]})
     host: str = field(default="127.0.0.1")
     port: int = field(default=8000)
+    detokenization_workers: int = field(default=1)
+    tokenize_workers: int = field(default=2)
+    tokenize_pool_mode: str = field(default="thread", metadata={"choices": ["thread", "process"]})
     zmq_mode: str = field(
         default="ipc:///tmp/",
         metadata={"help": "use socket mode or ipc mode, only can be set in ['tcp://', 'ipc:///tmp/']"},
@@ -16,17 +19,25 @@ class StartArgs:
     pd_master_ip: str = field(default="127.0.0.1")
     pd_master_port: int = field(default=1212)
     pd_decode_rpyc_port: int = field(default=42000)
+    pd_selector: str = field(default="random", metadata={"choices": ["random", "load_aware"]})
+    pd_node_status_interval_ms: int = field(default=200)
+    pd_master_replicas: Optional[str] = field(default=None)
+    pd_master_replica_id: int = field(default=0)
+    pd_master_store: str = field(default="memory")
     model_name: str = field(default="default_model_name")
     model_dir: Optional[str] = field(default=None)
     tokenizer_mode: str = field(default="slow")
     load_way: str = field(default="HF")
     max_total_token_num: Optional[int] = field(default=None)
     mem_fraction: float = field(default=0.9)
+    kv_token_allocator: str = field(default="stack", metadata={"choices": ["stack", "free_list"]})
     batch_max_tokens: Optional[int] = field(default=None)
     eos_id: List[int] = field(default_factory=list)
     running_max_req_size: int = field(default=1000)
     tp: int = field(default=1)
     dp: int = field(default=1)
+    dp_balancer: str = field(default="round_robin", metadata={"choices": ["round_robin", "prefix_affinity"]})
+    dp_balancer_load_weight: float = field(default=1.0)
     max_req_total_len: int = field(default=2048 + 1024)
     nccl_port: int = field(default=28765)
     mode: List[str] = field(default_factory=list)
@@ -35,9 +46,22 @@ class StartArgs:
     log_stats_interval: int = field(default=10)
     router_token_ratio: float = field(default=0.0)
     router_max_new_token_len: int = field(default=1024)
+    output_len_estimator: str = field(default="fixed", metadata={"choices": ["fixed", "histogram"]})
+    output_len_estimator_quantile: float = field(default=0.5)
     router_max_wait_tokens: int = field(default=6)
     disable_aggressive_schedule: bool = field(default=False)
     use_dynamic_prompt_cache: bool = field(default=False)
+    prompt_cache_mode: str = field(default="radix", metadata={"choices": ["radix", "array_radix", "block"]})
+    prompt_cache_block_size: int = field(default=32)
+    prompt_cache_host_mem_gb: float = field(default=0)
+    waiting_queue_policy: str = field(default="fcfs", metadata={"choices": ["fcfs", "cache_aware"]})
+    waiting_queue_max_skip: int = field(default=16)
+    kv_swap_host_mem_gb: float = field(default=0)
+    kv_swap_min_len: int = field(default=256)
+    enable_priority_schedule: bool = field(default=False)
+    priority_preempt_wait_ms: int = field(default=500)
+    prompt_cache_snapshot_dir: Optional[str] = field(default=None)
+    prompt_cache_snapshot_tokens: int = field(default=100000)
     chunked_prefill_size: int = field(default=8192)
     disable_chunked_prefill: bool = field(default=False)
     diverse_mode: bool = field(default=False)
@@ -50,6 +74,7 @@ class StartArgs:
     enable_prefill_microbatch_overlap: bool = field(default=False)
     cache_capacity: int = field(default=200)
     cache_reserved_ratio: float = field(default=0.5)
+    cache_embed_arena_gb: float = field(default=0)
     data_type: Optional[str] = field(
         default=None, metadata={"choices": ["fp16", "float16", "bf16", "bfloat16", "fp32", "float32"]}
     )
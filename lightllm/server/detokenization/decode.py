@@ -1,4 +1,5 @@
-from typing import Union, List
+from functools import lru_cache
+from typing import Union, List, Tuple, Dict, Set
 
 from transformers import PreTrainedTokenizer, PreTrainedTokenizerFast
 from .decode_req import DecodeReq
@@ -10,32 +11,72 @@ def decode_token(
     new_token_id: int,
     eos_id: List[int],
 ) -> str:
+    """
+    增量的 detokenize，返回加入 new_token_id 后新产生的文本。每次只对 output_tokens[prefix_offset:]
+    这个尾部的小窗口调用 convert_tokens_to_string，所以每个 token 的解码代价与已经输出的长度无关。
+    窗口解码的结果以 \ufffd 结尾时，说明最后的 token 只包含了一个字符的部分 utf-8 字节，暂时不输出，
+    等后续的 token 补全这个字符后再一起输出。
+    added token 会把输出切分为多段，与 transformers 的 decode 行为一致，每段单独解码，段与段之间
+    在 add_spaces_between_special_tokens 为 True 时使用空格连接。
+    """
     new_token = tokenizer.convert_ids_to_tokens(
         new_token_id, skip_special_tokens=decode_req.req.sample_params.skip_special_tokens
     )
-    decode_req.output_tokens.append(new_token)
 
     is_eos_id = new_token_id in eos_id
     if is_eos_id and not decode_req.req.sample_params.print_eos_token:
-        return decode_req.output_str
-
-    if decode_req.req.sample_params.skip_special_tokens and new_token_id in tokenizer.all_special_ids and not is_eos_id:
-        return decode_req.output_str
+        return ""
 
-    if not getattr(tokenizer, "added_tokens_encoder", {}):
-        output_text = tokenizer.convert_tokens_to_string(decode_req.output_tokens)
-        return output_text
+    all_special_ids, added_tokens_encoder = _get_special_tokens_info(tokenizer)
+    if decode_req.req.sample_params.skip_special_tokens and new_token_id in all_special_ids and not is_eos_id:
+        return ""
 
     sep = " " if decode_req.req.sample_params.add_spaces_between_special_tokens else ""
 
-    if new_token in tokenizer.added_tokens_encoder:
-        if decode_req.current_sub_text:
-            sub_text = tokenizer.convert_tokens_to_string(decode_req.current_sub_text)
-            decode_req.sub_texts.append(sub_text)
-            decode_req.current_sub_text = []
-        decode_req.sub_texts.append(new_token)
-        return sep.join(decode_req.sub_texts)
-    else:
-        decode_req.current_sub_text.append(new_token)
-        new_sub_text = tokenizer.convert_tokens_to_string(decode_req.current_sub_text)
-        return sep.join(decode_req.sub_texts + [new_sub_text])
+    if new_token in added_tokens_encoder:
+        new_text = ""
+        if decode_req.output_tokens:
+            # 结束当前的段，段中还没有输出的文本 (可能包含不完整的字符) 在这里全部输出
+            _, rest_text = _decode_window(tokenizer, decode_req)
+            new_text = _segment_sep(decode_req, sep) + rest_text
+            decode_req.sub_text_num += 1
+        # added token 单独作为一段输出
+        new_text += (sep if decode_req.sub_text_num > 0 else "") + new_token
+        decode_req.sub_text_num += 1
+        decode_req.start_new_segment()
+        return new_text
+
+    decode_req.output_tokens.append(new_token)
+    _, new_text = _decode_window(tokenizer, decode_req)
+    if len(new_text) == 0 or new_text.endswith("\ufffd"):
+        return ""
+    decode_req.prefix_offset = decode_req.read_offset
+    decode_req.read_offset = len(decode_req.output_tokens)
+    return _segment_sep(decode_req, sep) + new_text
+
+
+@lru_cache(maxsize=None)
+def _get_special_tokens_info(tokenizer) -> Tuple[Set[int], Dict[str, int]]:
+    # transformers 中的 all_special_ids 和 added_tokens_encoder 每次访问都会重新构建，缓存起来避免每个 token 的重复开销
+    return set(tokenizer.all_special_ids), dict(getattr(tokenizer, "added_tokens_encoder", {}))
+
+
+def _decode_window(tokenizer, decode_req: DecodeReq) -> Tuple[str, str]:
+    """
+    返回 (已经输出过的窗口前缀文本, 窗口中新产生的文本)。窗口从 prefix_offset 开始而不是从 read_offset 开始，
+    是因为部分 tokenizer (如 sentencepiece) 解码时的结果依赖于前面的 token，比如会去掉首个 token 的前导空格。
+    """
+    tokens = decode_req.output_tokens
+    prefix_text = tokenizer.convert_tokens_to_string(tokens[decode_req.prefix_offset : decode_req.read_offset])
+    window_text = tokenizer.convert_tokens_to_string(tokens[decode_req.prefix_offset :])
+    if len(window_text) <= len(prefix_text):
+        return prefix_text, ""
+    return prefix_text, window_text[len(prefix_text) :]
+
+
+def _segment_sep(decode_req: DecodeReq, sep: str) -> str:
+    # 每一段第一次输出文本时，需要先输出与前一段之间的分隔符
+    if decode_req.segment_has_output:
+        return ""
+    decode_req.segment_has_output = True
+    return sep if decode_req.sub_text_num > 0 else ""
@@ -13,16 +13,12 @@ logger = init_logger(__name__)
 def decode_mode_fix(req_out: DecodeReq, tokenizer, eos_id):
     new_token_id = req_out.prompt_ids[-1]
 
-    out_text = decode_token(
+    # 该 token 的文本已经由 prefill 节点输出，这里只需要更新增量 detokenize 的状态
+    decode_token(
         tokenizer,
         req_out,
         new_token_id,
         eos_id,
     )
 
-    if out_text.endswith("\ufffd"):
-        pass
-    else:
-        req_out.output_str = out_text
-
     return req_out
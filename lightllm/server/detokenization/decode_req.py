@@ -11,10 +11,13 @@ class DecodeReq:
         self.group_req_id = req.group_req_id
         self.prompt_ids = req.shm_prompt_ids.arr[0 : req.input_len].tolist()
         self.output_ids = []
+        # 增量 detokenize 的状态，output_tokens 只保存当前段 (以 added token 分隔) 的 token，
+        # [prefix_offset, read_offset) 是已经输出过文本的窗口前缀，read_offset 之后是还没有输出文本的 token
         self.output_tokens = []
-        self.output_str = ""
-        self.sub_texts = []
-        self.current_sub_text = []
+        self.prefix_offset = 0
+        self.read_offset = 0
+        self.sub_text_num = 0
+        self.segment_has_output = False
         self.req = req
         self.input_len = self.req.input_len
         self.prefix_str = ""
@@ -27,6 +30,13 @@ class DecodeReq:
             self.prefix_str = ""
         return
 
+    def start_new_segment(self):
+        self.output_tokens = []
+        self.prefix_offset = 0
+        self.read_offset = 0
+        self.segment_has_output = False
+        return
+
     def need_detoken(self):
         if (not self.req.is_aborted) and len(self.output_ids) < self.req.candetoken_out_len:
             return True
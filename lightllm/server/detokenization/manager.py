@@ -110,7 +110,7 @@ class DeTokenizationManager:
 
     def gen_token_out(self):
         exist_need_detoken = False
-        exist_decode = False
+        touched_group_req_ids = set()
         for decode_req in self.req_id_to_out.values():
             if decode_req.need_detoken() and not decode_req.out_queue_is_full():
                 new_token_id, src_index = decode_req.get_next_token_id_and_index()
@@ -118,46 +118,44 @@ class DeTokenizationManager:
                 special = new_token_id in self.all_special_ids
                 count_output_tokens = len(decode_req.output_ids)
 
-                exist_decode = True
-                out_text = decode_token(
+                touched_group_req_ids.add(decode_req.group_req_id)
+                new_text = decode_token(
                     self.tokenizer,
                     decode_req,
                     int(new_token_id),
                     self.eos_id,
                 )
-                if out_text.endswith("\ufffd"):
-                    new_text = ""
-                else:
-                    new_text = out_text[len(decode_req.output_str) :]
-                    decode_req.output_str = out_text
-
-                    # 对应 token_healing 的特殊处理
-                    if self.args.token_healing_mode:
-                        if new_text.startswith(decode_req.prefix_str):
-                            new_text = new_text[len(decode_req.prefix_str) :]
-                            decode_req.prefix_str = ""
-                        elif decode_req.prefix_str.startswith(new_text):
-                            decode_req.prefix_str = decode_req.prefix_str[len(new_text) :]
-                            new_text = ""
-                        else:
-                            logger.error(
-                                f"error token healing state, prefix_str {decode_req.prefix_str} new_text {new_text}"
-                            )
+
+                # 对应 token_healing 的特殊处理
+                if self.args.token_healing_mode and new_text:
+                    if new_text.startswith(decode_req.prefix_str):
+                        new_text = new_text[len(decode_req.prefix_str) :]
+                        decode_req.prefix_str = ""
+                    elif decode_req.prefix_str.startswith(new_text):
+                        decode_req.prefix_str = decode_req.prefix_str[len(new_text) :]
+                        new_text = ""
+                    else:
+                        logger.error(
+                            f"error token healing state, prefix_str {decode_req.prefix_str} new_text {new_text}"
+                        )
 
                 decode_req.req.out_tokens_queue.push(new_text, src_index, special, count_output_tokens)
 
             if decode_req.need_detoken():
                 exist_need_detoken = True
 
-        # 通知 httpserver 进程
-        if exist_decode:
-            self.pub_to_httpserver.send_pyobj(None, protocol=pickle.HIGHEST_PROTOCOL)
+        # 通知 httpserver 进程，发布 (有新 token 输出的 group_req_id 列表, 可以被释放的 group_req_id 列表)，
+        # httpserver 只需要处理这些发生了变化的请求，而不用遍历所有的请求
+        if touched_group_req_ids:
+            self.pub_to_httpserver.send_pyobj((list(touched_group_req_ids), []), protocol=pickle.HIGHEST_PROTOCOL)
 
-        self.remove_finished_reqs()
+        released_group_req_ids = self.remove_finished_reqs()
+        if released_group_req_ids:
+            self.pub_to_httpserver.send_pyobj(([], released_group_req_ids), protocol=pickle.HIGHEST_PROTOCOL)
 
         return exist_need_detoken
 
-    def remove_finished_reqs(self):
+    def remove_finished_reqs(self) -> List[int]:
         finished_reqs: List[DecodeReq] = []
         for decode_req in self.req_id_to_out.values():
             if decode_req.can_set_release_mark():
@@ -168,7 +166,7 @@ class DeTokenizationManager:
             logger.info(f"detoken release req id {decode_req.req.request_id}")
             self.shm_req_manager.put_back_req_obj(decode_req.req)
             self.req_id_to_out.pop(decode_req.request_id, None)
-        return
+        return list(set(decode_req.group_req_id for decode_req in finished_reqs))
 
 
 def start_detokenization_process(args, detokenization_port, detokenization_pub_port, pipe_writer):
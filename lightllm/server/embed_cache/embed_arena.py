@@ -0,0 +1,213 @@
+import struct
+import torch
+import numpy as np
+import multiprocessing.shared_memory as shm
+from typing import List, Optional, Tuple
+from lightllm.utils.envs_utils import get_unique_server_name
+from lightllm.utils.log_utils import init_logger
+
+logger = init_logger(__name__)
+
+# 图片 embedding 使用的原始 tensor 格式：定长的 header 之后直接是连续存放的 tensor 数据，
+# header 为 [magic: u32][dtype: u8][ndim: u8][pad: u16][shape: i64 * 4]，数据从 RAW_TENSOR_HEADER_SIZE 处开始。
+# 读取时使用 torch.frombuffer 直接映射到 shm 上，不需要反序列化和额外的拷贝。
+_RAW_TENSOR_MAGIC = 0x4C454D42
+_RAW_TENSOR_MAX_NDIM = 4
+_RAW_TENSOR_HEADER = struct.Struct("<IBBxx4q")
+RAW_TENSOR_HEADER_SIZE = 64
+_RAW_TENSOR_DTYPES = [
+    torch.float16,
+    torch.bfloat16,
+    torch.float32,
+    torch.float64,
+    torch.int32,
+    torch.int64,
+    torch.uint8,
+]
+_RAW_TENSOR_DTYPE_CODES = {dtype: code for code, dtype in enumerate(_RAW_TENSOR_DTYPES)}
+
+# arena 的 header 为 [magic: u64][capacity: u64][data_offset: u64]，之后是 capacity 个 slot 的 (offset, nbytes)
+_ARENA_MAGIC = 0x4C4C4D4152454E41
+_ARENA_ALIGN = 64
+
+
+def get_raw_tensor_nbytes(tensor: torch.Tensor) -> int:
+    return RAW_TENSOR_HEADER_SIZE + tensor.numel() * tensor.element_size()
+
+
+def write_raw_tensor(buf: memoryview, tensor: torch.Tensor):
+    """
+    将 tensor 写入 buf，tensor 可以在 gpu 上，此时直接从显存拷贝到 shm 中。
+    """
+    assert tensor.dim() <= _RAW_TENSOR_MAX_NDIM
+    shape = list(tensor.shape) + [0] * (_RAW_TENSOR_MAX_NDIM - tensor.dim())
+    _RAW_TENSOR_HEADER.pack_into(buf, 0, _RAW_TENSOR_MAGIC, _RAW_TENSOR_DTYPE_CODES[tensor.dtype], tensor.dim(), *shape)
+    if tensor.numel() != 0:
+        dst = torch.frombuffer(buf, dtype=tensor.dtype, count=tensor.numel(), offset=RAW_TENSOR_HEADER_SIZE)
+        dst.copy_(tensor.reshape(-1))
+    return
+
+
+def read_raw_tensor(buf: memoryview) -> torch.Tensor:
+    """
+    返回直接映射在 buf 上的 tensor，buf 需要在 tensor 使用期间保持有效。
+    """
+    magic, dtype_code, ndim, *shape = _RAW_TENSOR_HEADER.unpack_from(buf, 0)
+    if magic != _RAW_TENSOR_MAGIC:
+        raise ValueError("embed data is not a raw tensor")
+    dtype = _RAW_TENSOR_DTYPES[dtype_code]
+    shape = shape[:ndim]
+    numel = int(np.prod(shape)) if ndim != 0 else 1
+    if numel == 0:
+        return torch.empty(shape, dtype=dtype)
+    return torch.frombuffer(buf, dtype=dtype, count=numel, offset=RAW_TENSOR_HEADER_SIZE).view(shape)
+
+
+class ArenaAllocator:
+    """
+    arena 数据区的 first fit 分配器，释放时合并相邻的空闲块。只在 embed cache 进程中使用。
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        # 按照 offset 排序的空闲块 (offset, nbytes)
+        self.free_blocks: List[Tuple[int, int]] = [(0, size)]
+        self.used_bytes = 0
+
+    def alloc(self, nbytes: int) -> Optional[int]:
+        nbytes = (nbytes + _ARENA_ALIGN - 1) // _ARENA_ALIGN * _ARENA_ALIGN
+        for i, (offset, block_bytes) in enumerate(self.free_blocks):
+            if block_bytes >= nbytes:
+                if block_bytes == nbytes:
+                    self.free_blocks.pop(i)
+                else:
+                    self.free_blocks[i] = (offset + nbytes, block_bytes - nbytes)
+                self.used_bytes += nbytes
+                return offset
+        return None
+
+    def free(self, offset: int, nbytes: int):
+        nbytes = (nbytes + _ARENA_ALIGN - 1) // _ARENA_ALIGN * _ARENA_ALIGN
+        self.used_bytes -= nbytes
+        index = 0
+        while index < len(self.free_blocks) and self.free_blocks[index][0] < offset:
+            index += 1
+        self.free_blocks.insert(index, (offset, nbytes))
+        # 与后一个空闲块合并
+        if index + 1 < len(self.free_blocks) and offset + nbytes == self.free_blocks[index + 1][0]:
+            self.free_blocks[index] = (offset, nbytes + self.free_blocks[index + 1][1])
+            self.free_blocks.pop(index + 1)
+        # 与前一个空闲块合并
+        if index > 0 and self.free_blocks[index - 1][0] + self.free_blocks[index - 1][1] == offset:
+            self.free_blocks[index - 1] = (
+                self.free_blocks[index - 1][0],
+                self.free_blocks[index - 1][1] + self.free_blocks[index][1],
+            )
+            self.free_blocks.pop(index)
+        return
+
+
+class EmbedArena:
+    """
+    由 embed cache 管理的预先分配好大小的 shm，用于存放图片的 embedding。
+    embed cache 为每个图片记录分配一个 slot，并在数据区中为其 embedding 分配空间，将 (offset, nbytes)
+    写入 slot 表中，visual server 按照 slot 找到写入的位置，llm 的推理进程按照 slot 直接映射读取。
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.shm: shm.SharedMemory = None
+        self.capacity = 0
+        self.data_offset = 0
+        self.slots: np.ndarray = None
+
+    def create(self, capacity: int, data_bytes: int):
+        table_bytes = 24 + capacity * 16
+        self.data_offset = (table_bytes + _ARENA_ALIGN - 1) // _ARENA_ALIGN * _ARENA_ALIGN
+        size = self.data_offset + data_bytes
+        try:
+            self.shm = shm.SharedMemory(name=self.name, create=True, size=size)
+        except FileExistsError:
+            logger.warning(f"embed arena {self.name} already exists, recreate it")
+            unlink_embed_arena(self.name)
+            self.shm = shm.SharedMemory(name=self.name, create=True, size=size)
+        struct.pack_into("<QQQ", self.shm.buf, 0, _ARENA_MAGIC, capacity, self.data_offset)
+        self._init_slots(capacity)
+        self.slots.fill(0)
+        return
+
+    def link(self):
+        self.shm = shm.SharedMemory(name=self.name)
+        magic, capacity, self.data_offset = struct.unpack_from("<QQQ", self.shm.buf, 0)
+        assert magic == _ARENA_MAGIC, f"{self.name} is not an embed arena"
+        self._init_slots(capacity)
+        return
+
+    def _init_slots(self, capacity: int):
+        self.capacity = capacity
+        self.slots = np.ndarray((capacity, 2), dtype=np.int64, buffer=self.shm.buf, offset=24)
+        return
+
+    @property
+    def data_bytes(self):
+        return self.shm.size - self.data_offset
+
+    def set_slot(self, slot: int, offset: int, nbytes: int):
+        self.slots[slot] = (offset, nbytes)
+        return
+
+    def get_slot(self, slot: int) -> Tuple[int, int]:
+        offset, nbytes = self.slots[slot]
+        return int(offset), int(nbytes)
+
+    def _slot_buf(self, slot: int) -> Optional[memoryview]:
+        offset, nbytes = self.get_slot(slot)
+        if nbytes == 0:
+            return None
+        start = self.data_offset + offset
+        return self.shm.buf[start : start + nbytes]
+
+    def write(self, slot: int, tensor: torch.Tensor) -> bool:
+        buf = self._slot_buf(slot)
+        if buf is None or len(buf) < get_raw_tensor_nbytes(tensor):
+            return False
+        write_raw_tensor(buf, tensor)
+        return True
+
+    def read(self, slot: int) -> Optional[torch.Tensor]:
+        buf = self._slot_buf(slot)
+        return None if buf is None else read_raw_tensor(buf)
+
+
+def get_embed_arena_name():
+    return f"{get_unique_server_name()}_embed_arena"
+
+
+_linked_arena: Optional[EmbedArena] = None
+_arena_checked = False
+
+
+def get_embed_arena() -> Optional[EmbedArena]:
+    """
+    visual server 和推理进程中使用，没有开启 arena 时返回 None。
+    """
+    global _linked_arena, _arena_checked
+    if not _arena_checked:
+        arena = EmbedArena(get_embed_arena_name())
+        try:
+            arena.link()
+            _linked_arena = arena
+        except FileNotFoundError:
+            _linked_arena = None
+        _arena_checked = True
+    return _linked_arena
+
+
+def unlink_embed_arena(name: str):
+    try:
+        old_shm = shm.SharedMemory(name=name)
+    except FileNotFoundError:
+        return
+    old_shm.close()
+    old_shm.unlink()
+    return
@@ -8,6 +8,7 @@ import time
 from collections import deque
 import multiprocessing.shared_memory as shm
 from ..utils import get_shm_name_data, get_shm_name_embed, free_shm
+from ..embed_arena import ArenaAllocator, EmbedArena, get_embed_arena_name, unlink_embed_arena
 
 
 @dataclasses.dataclass
@@ -21,6 +22,10 @@ class Record(object):
     visittime: float
     token_id: int
     token_num: int
+    # embed arena 中的 slot 和 embedding 所在的区域，embed_nbytes 为 0 时 embedding 在单独的 shm 中
+    embed_slot: int = -1
+    embed_offset: int = 0
+    embed_nbytes: int = 0
 
 @CacheManagerFactory.register("naive")
 class InMemoryCache(CacheManager):
@@ -35,6 +40,19 @@ class InMemoryCache(CacheManager):
         self.expired_secs = 60 * 60
         self.lock = threading.Lock()
 
+        # 开启 embed arena 时，每个记录占用一个 slot，图片的 embedding 写入 arena 中预先分配好的 shm
+        self.arena = None
+        self.arena_allocator = None
+        arena_bytes = int(args.cache_embed_arena_gb * 1024 * 1024 * 1024)
+        if arena_bytes > 0:
+            self.arena = EmbedArena(get_embed_arena_name())
+            self.arena.create(self.capacity, arena_bytes)
+            self.arena_allocator = ArenaAllocator(arena_bytes)
+        else:
+            # 清理之前运行遗留的 arena，防止其他进程链接到过期的 arena
+            unlink_embed_arena(get_embed_arena_name())
+        self.free_slots = deque(range(self.capacity))
+
         from lightllm.server.tokenizer import get_tokenizer
         tokenizer = get_tokenizer(
             args.model_dir, args.tokenizer_mode, trust_remote_code=args.trust_remote_code
@@ -50,8 +68,10 @@ class InMemoryCache(CacheManager):
             if record.ref <= 0 or t - record.visittime >= self.expired_secs:
                 if record.data:
                     free_shm(get_shm_name_data(id))
-                if record.embed:
+                if record.embed and record.embed_nbytes == 0:
                     free_shm(get_shm_name_embed(id))
+                self._free_embed_arena(record)
+                self.free_slots.append(record.embed_slot)
                 del self._md5_to_record[record.md5sum]
                 del self._records[id]
                 self.occupied -= 1
@@ -83,6 +103,7 @@ class InMemoryCache(CacheManager):
                     visittime=t,
                     token_id=self.cur_token_id,
                     token_num=token_num,
+                    embed_slot=self.free_slots.popleft(),
                 )
                 self.cur_token_id += token_num
                 self._records[id] = record
@@ -98,7 +119,8 @@ class InMemoryCache(CacheManager):
             return {
                 "id": record.id,
                 "token_id": record.token_id,
-                "token_num": record.token_num
+                "token_num": record.token_num,
+                "embed_slot": record.embed_slot,
             }
 
     def release(self, id: int) -> None:
@@ -111,6 +133,28 @@ class InMemoryCache(CacheManager):
     def get_item_data(self, id: int) -> bool:
         return self._records[id].data
 
+    def _free_embed_arena(self, record: Record):
+        if record.embed_nbytes > 0:
+            self.arena_allocator.free(record.embed_offset, record.embed_nbytes)
+            self.arena.set_slot(record.embed_slot, 0, 0)
+            record.embed_nbytes = 0
+        return
+
+    def alloc_embed(self, id: int, nbytes: int) -> int:
+        # 在 arena 中为记录的 embedding 分配空间，返回 slot，没有开启 arena 或者空间不足时返回 -1
+        with self.lock:
+            if self.arena is None:
+                return -1
+            record = self._records[id]
+            self._free_embed_arena(record)
+            offset = self.arena_allocator.alloc(nbytes)
+            if offset is None:
+                return -1
+            record.embed_offset = offset
+            record.embed_nbytes = nbytes
+            self.arena.set_slot(record.embed_slot, offset, nbytes)
+            return record.embed_slot
+
     def set_item_embed(self, id: int) -> None:
         self._records[id].embed = True
 
@@ -18,6 +18,9 @@ class CacheManager(object):
     def get_item_data(self, id: int) -> bool:
         pass
 
+    def alloc_embed(self, id: int, nbytes: int) -> int:
+        pass
+
     def set_item_embed(self, id: int) -> None:
         pass
 
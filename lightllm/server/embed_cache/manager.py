@@ -40,6 +40,11 @@ class CacheServer(rpyc.Service):
         id = obtain(id)
         return self._impl.get_item_data(id=id)
 
+    def exposed_alloc_embed(self, id: int, nbytes: int) -> int:
+        id = obtain(id)
+        nbytes = obtain(nbytes)
+        return self._impl.alloc_embed(id=id, nbytes=nbytes)
+
     def exposed_set_item_embed(self, id: int) -> None:
         id = obtain(id)
         return self._impl.set_item_embed(id=id)
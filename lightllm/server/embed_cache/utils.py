@@ -2,6 +2,7 @@ import torch
 import numpy as np
 from io import BytesIO
 import multiprocessing.shared_memory as shm
+from .embed_arena import get_embed_arena, get_raw_tensor_nbytes, read_raw_tensor, write_raw_tensor
 
 
 def tensor2bytes(t):
@@ -40,6 +41,35 @@ def free_shm(name):
     shared_memory.unlink()
 
 
+def create_embed_shm(name, tensor: torch.Tensor):
+    # 没有开启 embed arena 或者 arena 空间不足时，每个图片的 embedding 使用单独的 shm，格式与 arena 中相同
+    try:
+        shared_memory = shm.SharedMemory(name=name, create=True, size=get_raw_tensor_nbytes(tensor))
+    except FileExistsError:
+        print("Warning create shm {} failed because of FileExistsError!".format(name))
+        return
+    write_raw_tensor(shared_memory.buf, tensor)
+    shared_memory.close()
+
+
+def read_embed(img: dict) -> torch.Tensor:
+    """
+    读取图片的 embedding，在 embed arena 中时直接返回映射在 shm 上的 tensor，不进行任何拷贝。
+    """
+    arena = get_embed_arena()
+    embed_slot = img.get("embed_slot", None)
+    if arena is not None and embed_slot is not None and embed_slot >= 0:
+        tensor = arena.read(embed_slot)
+        if tensor is not None:
+            return tensor
+    shared_memory = shm.SharedMemory(name=get_shm_name_embed(img["uuid"]))
+    view = read_raw_tensor(shared_memory.buf)
+    tensor = view.clone()
+    del view
+    shared_memory.close()
+    return tensor
+
+
 def get_shm_name_data(uid):
     return str(uid) + "-data"
 
@@ -17,18 +17,27 @@ import multiprocessing
 asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
 from typing import Union, List, Tuple, Dict, Optional
 from ..tokenizer import get_tokenizer
-from ..pd_io_struct import NodeRole, ObjType
+from ..pd_io_struct import NodeRole, ObjType, get_pd_master_addrs
+from ..pd_io_frame import (
+    LIGHTLLM_PD_FRAME_BATCH_WINDOW_US,
+    LIGHTLLM_PD_FRAME_MAX_TOKENS,
+    decode_pd_frame,
+    encode_node_status,
+    encode_token_packs,
+)
 from ..embed_cache.utils import get_shm_name_data, create_shm
 from ..multimodal_params import MultimodalParams, ImageItem
-from ..req_id_generator import ReqIDGenerator
+from ..req_id_generator import ReqIDGenerator, get_id_shard
 from .async_queue import AsyncQueue
+from .tokenize_pool import TokenizePool
 from lightllm.server.core.objs import Req, FinishStatus
 from lightllm.server.core.objs import SamplingParams
-from lightllm.server.core.objs.io_objs import GroupReqObjs
+from lightllm.server.core.objs.io_objs import GroupReqObjs, PromptCacheSnapshotCmd, PromptCacheSnapshotStatus
 from fastapi import Request
 from lightllm.server.core.objs.shm_req_manager import ShmReqManager
 from lightllm.utils.log_utils import init_logger
-from lightllm.utils.envs_utils import get_env_start_args
+from lightllm.utils.envs_utils import get_env_start_args, get_unique_server_name
+from lightllm.server.router.token_load import TokenLoad
 from lightllm.server.metrics.manager import MetricClient
 from lightllm.utils.statics_utils import MovingAverage
 from lightllm.utils.net_utils import get_hostname_ip
@@ -38,6 +47,9 @@ logger = init_logger(__name__)
 
 
 class HttpServerManager:
+    # 兜底的全量扫描所有请求的时间间隔 (s)
+    FULL_SCAN_INTERVAL = 1.0
+
     def __init__(
         self,
         args,
@@ -88,33 +100,68 @@ class HttpServerManager:
         self.shm_req_manager = ShmReqManager()
 
         self.recv_from_detokenization = context.socket(zmq.SUB)
-        self.recv_from_detokenization.connect(f"{args.zmq_mode}127.0.0.1:{detokenization_pub_port}")
+        # 多个 detokenization 进程时，同时订阅所有进程的发布端口
+        for detok_pub_port in args.detokenization_pub_ports:
+            self.recv_from_detokenization.connect(f"{args.zmq_mode}127.0.0.1:{detok_pub_port}")
         self.recv_from_detokenization.setsockopt(zmq.SUBSCRIBE, b"")
 
         self.tokenizer = get_tokenizer(args.model_dir, args.tokenizer_mode, trust_remote_code=args.trust_remote_code)
+        self.tokenize_pool = TokenizePool(
+            self.tokenizer,
+            worker_num=args.tokenize_workers,
+            mode=args.tokenize_pool_mode,
+            model_dir=args.model_dir,
+            tokenizer_mode=args.tokenizer_mode,
+            trust_remote_code=args.trust_remote_code,
+        )
 
         self.req_id_to_out_inf: Dict[int, ReqStatus] = {}  # value type (out_str, metadata, finished, event)
-        self.forwarding_queue: AsyncQueue = None  # p d 分离模式使用的转发队列, 需要延迟初始化
+        # p d 分离模式使用的转发队列, 每个 pd master 副本一个, 需要延迟初始化
+        self.forwarding_queues: List[AsyncQueue] = None
 
         self.max_req_total_len = args.max_req_total_len
         self.metric_client = MetricClient(metric_port)
 
         self.pd_mode: NodeRole = NodeRole(self.args.run_mode)
         assert self.pd_mode in [NodeRole.P, NodeRole.D, NodeRole.NORMAL]
+        # p d 节点向 pd_master 上报负载时读取 router 写入的负载信息
+        self.dp_size_in_node = max(1, args.dp // args.nnodes)
+        self.shared_token_load = None
+        if self.pd_mode.is_P_or_D():
+            self.shared_token_load = TokenLoad(f"{get_unique_server_name()}_shared_token_load", self.dp_size_in_node)
         self.id_gen = ReqIDGenerator()
         self.first_time_costs = MovingAverage()
         self.per_token_costs = MovingAverage()
         # 有的模型的vocab size 读取tokenizer和config.json中不一致
         self.vocab_size = max(get_vocab_size(args.model_dir), self.tokenizer.vocab_size)
 
+        self.prompt_cache_snapshot_status = PromptCacheSnapshotStatus(args.tp // args.nnodes)
         return
 
+    async def save_prompt_cache_snapshot(self, snapshot_dir: str, max_tokens: int, timeout: float = 600) -> bool:
+        """
+        通知 router 在两次推理之间保存 prompt cache 快照，并等待保存完成。
+        """
+        version = self.prompt_cache_snapshot_status.version
+        old_version = version.get_value()
+        self.send_to_router.send_pyobj(
+            PromptCacheSnapshotCmd(snapshot_dir=snapshot_dir, max_tokens=max_tokens), protocol=pickle.HIGHEST_PROTOCOL
+        )
+        start_time = time.time()
+        while version.get_value() == old_version:
+            if time.time() - start_time > timeout:
+                return False
+            await asyncio.sleep(0.1)
+        return True
+
     # connect cache server, calculate md5, alloc resource, return uuid
     async def _alloc_resource(self, img: ImageItem):
         data = img.read()
         # must after init_imageItem_extral_params
         num_tokens = self.tokenizer.get_image_token_length(img)
-        md5sum = hashlib.md5(data).hexdigest() + "_" + str(hash(frozendict(img.extra_params)))
+        # 图片的 md5 在 preload 时已经在线程池中计算
+        md5 = img.md5 if img.md5 is not None else hashlib.md5(data).hexdigest()
+        md5sum = md5 + "_" + str(hash(frozendict(img.extra_params)))
         wait_time = 1
         while True:
             record = self.cache_client.root.alloc(md5sum, num_tokens)
@@ -139,6 +186,7 @@ class HttpServerManager:
                 img.uuid = record["id"]
                 img.token_id = record["token_id"]
                 img.token_num = record["token_num"]
+                img.embed_slot = record["embed_slot"]
         return
 
     async def _release_multimodal_resources(self, multimodal_params: MultimodalParams):
@@ -152,11 +200,12 @@ class HttpServerManager:
                         img.uuid = None
                         img.token_id = None
                         img.token_num = None
+                        img.embed_slot = None
         return
 
-    def tokens(self, prompt, multimodal_params, samping_params: SamplingParams, kwargs=None):
+    async def tokens(self, prompt, multimodal_params, samping_params: SamplingParams, kwargs=None):
         kwargs = {} if kwargs is None else kwargs
-        prompt_ids = self.tokenizer.encode(prompt, None, **kwargs)
+        prompt_ids = await self.tokenize_pool.call("encode", prompt, None, **kwargs)
         image_tokens = 0
         img_count = 0
         for img in multimodal_params.images:
@@ -281,7 +330,8 @@ class HttpServerManager:
             async for sub_req_id, request_output, metadata, finish_status in results_generator:
                 # p d 模式下，将 token 数据放入到转发队列中
                 if self.pd_mode.is_P_or_D() and sub_req_id >= 0:
-                    await self.forwarding_queue.put((sub_req_id, request_output, metadata, finish_status))
+                    forwarding_queue = self.forwarding_queues[get_id_shard(sub_req_id, len(self.forwarding_queues))]
+                    await forwarding_queue.put((sub_req_id, request_output, metadata, finish_status))
                 else:
                     yield sub_req_id, request_output, metadata, finish_status
 
@@ -317,11 +367,13 @@ class HttpServerManager:
             if self.enable_multimodal:
                 assert len(multimodal_params.images) <= self.args.cache_capacity, "too many images!"
                 await self._alloc_multimodal_resources(multimodal_params, sampling_params)
-                prompt_ids = self.tokenizer.encode(
-                    prompt, multimodal_params, add_special_tokens=sampling_params.add_special_tokens
+                prompt_ids = await self.tokenize_pool.call(
+                    "encode", prompt, multimodal_params, add_special_tokens=sampling_params.add_special_tokens
                 )
             else:
-                prompt_ids = self.tokenizer.encode(prompt, add_special_tokens=sampling_params.add_special_tokens)
+                prompt_ids = await self.tokenize_pool.encode(
+                    prompt, add_special_tokens=sampling_params.add_special_tokens
+                )
             return prompt_ids
 
         # 这里的校验对多模态不是很充分, to do
@@ -528,6 +580,18 @@ class HttpServerManager:
                         self.metric_client.histogram_observe(
                             "lightllm_request_first_token_duration", first_token_cost_ms / 1000.0
                         )
+                        if self.args.enable_priority_schedule:
+                            priority = str(sampling_params.priority)
+                            self.metric_client.histogram_observe(
+                                "lightllm_request_mean_time_per_token_duration_by_priority",
+                                mean_per_token_cost_time_ms / 1000.0,
+                                priority,
+                            )
+                            self.metric_client.histogram_observe(
+                                "lightllm_request_first_token_duration_by_priority",
+                                first_token_cost_ms / 1000.0,
+                                priority,
+                            )
                         self.metric_client.histogram_observe("lightllm_request_generated_tokens", out_token_counter)
                         self.metric_client.counter_inc("lightllm_request_success")
 
@@ -548,6 +612,7 @@ class HttpServerManager:
 
     async def recycle_resource_loop(self):
         pre_time_mark = time.time()
+        pre_full_scan_time_mark = time.time()
 
         while True:
 
@@ -557,14 +622,26 @@ class HttpServerManager:
                 pass
             self.recycle_event.clear()
 
+            # 只检查 detokenization 进程通知的可以释放的请求，同时低频的检查所有的请求，
+            # 防止 pub 消息丢失等情况下有请求一直得不到释放
+            if time.time() - pre_full_scan_time_mark > self.FULL_SCAN_INTERVAL:
+                pre_full_scan_time_mark = time.time()
+                check_group_req_ids = list(self.req_id_to_out_inf.keys())
+            else:
+                check_group_req_ids = list(self.wait_release_group_req_ids)
+
             # 清理已经处理完的可以删除的请求
             release_req_status: List[ReqStatus] = []
-            for req_status in self.req_id_to_out_inf.values():
-                if req_status.can_release():
+            for group_req_id in check_group_req_ids:
+                req_status = self.req_id_to_out_inf.get(group_req_id, None)
+                if req_status is None:
+                    self.wait_release_group_req_ids.discard(group_req_id)
+                elif req_status.can_release():
                     release_req_status.append(req_status)
 
             for req_status in release_req_status:
                 self.req_id_to_out_inf.pop(req_status.group_req_objs.group_req_id, None)
+                self.wait_release_group_req_ids.discard(req_status.group_req_objs.group_req_id)
                 for req in req_status.group_req_objs.shm_req_objs:
                     await self.shm_req_manager.async_put_back_req_obj(req)
                     await self.shm_req_manager.async_release_req_index(req.index_in_shm_mem)
@@ -583,10 +660,12 @@ class HttpServerManager:
 
     async def handle_loop(self):
         self.recycle_event = asyncio.Event()
+        # detokenization 进程通知的已经可以释放，但是还没有被回收的请求
+        self.wait_release_group_req_ids = set()
         asyncio.create_task(self.recycle_resource_loop())
 
         if self.pd_mode.is_P_or_D():
-            self.forwarding_queue = AsyncQueue()
+            self.forwarding_queues = [AsyncQueue() for _ in get_pd_master_addrs(self.args)]
             asyncio.create_task(self.pd_handle_loop())
 
         # 多节点tp模式下的slave节点，需要开启一个协程task用来接收
@@ -594,17 +673,34 @@ class HttpServerManager:
         if self.is_multinode_tp_slave:
             asyncio.create_task(self.loop_for_request())
 
+        pre_full_scan_time_mark = time.time()
         while True:
             try:
-                await asyncio.wait_for(self.recv_from_detokenization.recv_pyobj(), timeout=0.05)
+                touched_group_req_ids, released_group_req_ids = await asyncio.wait_for(
+                    self.recv_from_detokenization.recv_pyobj(), timeout=0.05
+                )
             except asyncio.TimeoutError:
-                pass
+                touched_group_req_ids, released_group_req_ids = [], []
+
+            # 多个 httpserver 进程会收到相同的通知，只处理属于自己的请求
+            self.wait_release_group_req_ids.update(
+                group_req_id for group_req_id in released_group_req_ids if group_req_id in self.req_id_to_out_inf
+            )
 
-            for req_status in self.req_id_to_out_inf.values():
+            # 只处理有新 token 输出的请求，同时低频的检查所有的请求，防止 pub 消息丢失等情况下请求得不到处理
+            if time.time() - pre_full_scan_time_mark > self.FULL_SCAN_INTERVAL:
+                pre_full_scan_time_mark = time.time()
+                touched_group_req_ids = list(self.req_id_to_out_inf.keys())
+
+            for group_req_id in touched_group_req_ids:
+                req_status = self.req_id_to_out_inf.get(group_req_id, None)
+                if req_status is None:
+                    continue
                 token_list = []
                 for req in req_status.group_req_objs.shm_req_objs:
                     req_id = req.request_id
-                    if not req.out_tokens_queue.is_empty():
+                    # 一次取出队列中所有的 token，被访问的请求不依赖于之后的通知
+                    while not req.out_tokens_queue.is_empty():
 
                         text, src_index, special, count_output_tokens = req.out_tokens_queue.peek()
                         req.cumlogprob += float(req.shm_logprobs.arr[src_index])
@@ -645,10 +741,20 @@ class HttpServerManager:
         if self.host_ip is None:
             self.host_ip = self.args.host
 
+        # 连接所有的 pd master 副本，请求的 token 只发送给创建该请求的副本
+        pd_master_addrs = get_pd_master_addrs(self.args)
+        await asyncio.gather(
+            *[self._pd_master_conn_loop(replica_id, ip, port) for replica_id, (ip, port) in enumerate(pd_master_addrs)]
+        )
+        return
+
+    async def _pd_master_conn_loop(self, replica_id: int, pd_master_ip: str, pd_master_port: int):
+        forwarding_queue = self.forwarding_queues[replica_id]
         while True:
             forwarding_tokens_task = None
+            node_status_task = None
             try:
-                uri = f"ws://{self.args.pd_master_ip}:{self.args.pd_master_port}/pd_register"
+                uri = f"ws://{pd_master_ip}:{pd_master_port}/pd_register"
                 async with websockets.connect(uri, max_queue=(2048 * 1024, 2048 * 1023)) as websocket:
                     import socket
 
@@ -673,16 +779,32 @@ class HttpServerManager:
                         while True:
                             handle_list = await forwarding_queue.wait_to_get_all_data()
                             if len(handle_list) != 0:
-                                await websocket.send(pickle.dumps((ObjType.TOKEN_PACKS, handle_list)))
+                                # 等待一个很短的窗口，将其他请求同一轮输出的 token 合并到一个帧中发送
+                                if LIGHTLLM_PD_FRAME_BATCH_WINDOW_US > 0:
+                                    await asyncio.sleep(LIGHTLLM_PD_FRAME_BATCH_WINDOW_US / 1e6)
+                                    handle_list.extend(await forwarding_queue.get_all_data())
+                                for start in range(0, len(handle_list), LIGHTLLM_PD_FRAME_MAX_TOKENS):
+                                    await websocket.send(
+                                        encode_token_packs(handle_list[start : start + LIGHTLLM_PD_FRAME_MAX_TOKENS])
+                                    )
                         return
 
-                    forwarding_tokens_task = asyncio.create_task(
-                        up_tokens_to_pd_master(self.forwarding_queue, websocket)
-                    )
+                    forwarding_tokens_task = asyncio.create_task(up_tokens_to_pd_master(forwarding_queue, websocket))
+
+                    # 周期上报节点负载的task，pd_master 据此选择 p d 节点
+                    async def up_node_status_to_pd_master(websocket):
+                        interval = self.args.pd_node_status_interval_ms / 1000.0
+                        while True:
+                            node_status = self._get_pd_node_status()
+                            await websocket.send(encode_node_status(node_status))
+                            await asyncio.sleep(interval)
+
+                    if self.args.pd_node_status_interval_ms > 0:
+                        node_status_task = asyncio.create_task(up_node_status_to_pd_master(websocket))
 
                     while True:
                         recv_bytes = await websocket.recv()
-                        obj = pickle.loads(recv_bytes)
+                        obj = decode_pd_frame(recv_bytes)
                         if obj[0] == ObjType.REQ:
                             prompt, sampling_params, multimodal_params = obj[1]
 
@@ -707,13 +829,34 @@ class HttpServerManager:
                             logger.error(f"recevie error obj {str(obj)}")
 
             except Exception as e:
-                logger.error("connetion to pd_master has error")
+                logger.error(f"connetion to pd_master {uri} has error")
                 logger.exception(str(e))
                 if forwarding_tokens_task is not None:
                     forwarding_tokens_task.cancel()
+                if node_status_task is not None:
+                    node_status_task.cancel()
                 await asyncio.sleep(10)
-                await self.forwarding_queue.get_all_data()
-                logger.info("reconnection to pd_master")
+                await forwarding_queue.get_all_data()
+                logger.info(f"reconnection to pd_master {uri}")
+
+    def _get_pd_node_status(self) -> dict:
+        pending_prompt_tokens = 0
+        for req_status in self.req_id_to_out_inf.values():
+            req = req_status.group_req_objs.shm_req_objs[0]
+            if req.shm_cur_output_len == 0:
+                pending_prompt_tokens += req.input_len - req.prompt_cache_len
+        return {
+            "client_ip_port": f"{self.host_ip}:{self.args.port}",
+            "running_req_num": len(self.req_id_to_out_inf),
+            "pending_prompt_tokens": pending_prompt_tokens,
+            "current_load": [
+                float(self.shared_token_load.get_current_load(dp_index)) for dp_index in range(self.dp_size_in_node)
+            ],
+            "dynamic_max_load": [
+                float(self.shared_token_load.get_dynamic_max_load(dp_index))
+                for dp_index in range(self.dp_size_in_node)
+            ],
+        }
 
     async def timer_log(self):
         while True:
@@ -0,0 +1,205 @@
+import copy
+import asyncio
+import threading
+import multiprocessing
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple, Union
+from lightllm.utils.log_utils import init_logger
+
+logger = init_logger(__name__)
+
+
+# 工作线程或者工作进程中使用的 tokenizer，线程模式下每个线程持有一份独立的拷贝，
+# 避免多个线程同时使用同一个 rust tokenizer 对象时出现 "Already borrowed" 的异常
+_worker_local = threading.local()
+_worker_tokenizer = None
+
+
+def _init_thread_worker(tokenizer, model_dir: Optional[str], tokenizer_mode: str, trust_remote_code: bool):
+    try:
+        _worker_local.tokenizer = copy.deepcopy(tokenizer)
+    except Exception:
+        # 无法拷贝的 tokenizer 从模型目录重新加载一份，不能多个线程共享同一个对象
+        from lightllm.server.tokenizer import get_tokenizer
+
+        _worker_local.tokenizer = get_tokenizer(model_dir, tokenizer_mode, trust_remote_code=trust_remote_code)
+    return
+
+
+def _init_process_worker(model_dir: str, tokenizer_mode: str, trust_remote_code: bool):
+    global _worker_tokenizer
+    from lightllm.server.tokenizer import get_tokenizer
+
+    _worker_tokenizer = get_tokenizer(model_dir, tokenizer_mode, trust_remote_code=trust_remote_code)
+    return
+
+
+def _get_worker_tokenizer():
+    tokenizer = getattr(_worker_local, "tokenizer", None)
+    return _worker_tokenizer if tokenizer is None else tokenizer
+
+
+def _worker_call(method_name: str, args: Tuple, kwargs: Dict):
+    return getattr(_get_worker_tokenizer(), method_name)(*args, **kwargs)
+
+
+def _worker_encode_batch(prompts: List[str], add_special_tokens: bool) -> List[Union[List[int], Exception]]:
+    # 单个 prompt 的异常作为结果返回，不影响合并在同一个任务中的其他请求
+    tokenizer = _get_worker_tokenizer()
+    ans = []
+    for prompt in prompts:
+        try:
+            ans.append(tokenizer.encode(prompt, add_special_tokens=add_special_tokens))
+        except Exception as e:
+            ans.append(e)
+    return ans
+
+
+class TokenizePool:
+    """
+    在线程池或者进程池中执行 chat template 渲染和 tokenize，事件循环中只等待结果，
+    避免很长的 prompt 的 tokenize 阻塞其他请求的流式输出。
+    同一轮事件循环中到达的短 prompt 的 encode 请求会被合并为一个任务提交，减少任务调度和进程间通信的开销。
+    多模态的 encode 需要修改请求中的图片对象，只在线程池中执行。
+    worker_num 为 0 时在事件循环中直接执行，与不使用 pool 的行为一致。
+    """
+
+    def __init__(
+        self,
+        tokenizer,
+        worker_num: int,
+        mode: str = "thread",
+        model_dir: Optional[str] = None,
+        tokenizer_mode: str = "auto",
+        trust_remote_code: bool = False,
+        max_batch_size: int = 32,
+        small_prompt_len: int = 4096,
+    ):
+        assert mode in ["thread", "process"]
+        self.tokenizer = tokenizer
+        self.worker_num = worker_num
+        self.mode = mode
+        self.max_batch_size = max_batch_size
+        self.small_prompt_len = small_prompt_len
+        # add_special_tokens -> [(prompt, future)]
+        self.pending: Dict[bool, List[Tuple[str, asyncio.Future]]] = {}
+        self.flush_scheduled = False
+
+        self.thread_executor: Optional[Executor] = None
+        self.text_executor: Optional[Executor] = None
+        if worker_num <= 0:
+            return
+        try:
+            copy.deepcopy(tokenizer)
+        except Exception as e:
+            if model_dir is None:
+                raise RuntimeError(
+                    f"tokenizer {type(tokenizer).__name__} can not be copied for tokenize threads, "
+                    "model_dir is needed to load one tokenizer for each thread"
+                ) from e
+            logger.warning(f"tokenizer can not be copied: {str(e)}, each tokenize thread loads it from {model_dir}")
+        self.thread_executor = ThreadPoolExecutor(
+            max_workers=worker_num,
+            thread_name_prefix="lightllm_tokenize",
+            initializer=_init_thread_worker,
+            initargs=(tokenizer, model_dir, tokenizer_mode, trust_remote_code),
+        )
+        if mode == "process":
+            self.text_executor = ProcessPoolExecutor(
+                max_workers=worker_num,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_process_worker,
+                initargs=(model_dir, tokenizer_mode, trust_remote_code),
+            )
+        else:
+            self.text_executor = self.thread_executor
+        logger.info(f"tokenize pool mode {mode} worker_num {worker_num}")
+        return
+
+    async def encode(self, prompt: str, add_special_tokens: bool = True) -> List[int]:
+        if self.text_executor is None:
+            return self.tokenizer.encode(prompt, add_special_tokens=add_special_tokens)
+
+        loop = asyncio.get_running_loop()
+        if len(prompt) > self.small_prompt_len:
+            ans = await loop.run_in_executor(self.text_executor, _worker_encode_batch, [prompt], add_special_tokens)
+            if isinstance(ans[0], Exception):
+                raise ans[0]
+            return ans[0]
+
+        future = loop.create_future()
+        items = self.pending.setdefault(add_special_tokens, [])
+        items.append((prompt, future))
+        if len(items) >= self.max_batch_size:
+            self._submit_batch(add_special_tokens)
+        elif not self.flush_scheduled:
+            # 等到本轮事件循环结束后再提交，使同一时刻到达的请求合并到一个任务中
+            self.flush_scheduled = True
+            loop.call_soon(self._flush)
+        return await future
+
+    async def apply_chat_template(self, **kwargs) -> str:
+        if self.text_executor is None:
+            return self.tokenizer.apply_chat_template(**kwargs)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.text_executor, _worker_call, "apply_chat_template", (), kwargs)
+
+    async def call(self, method_name: str, *args, **kwargs) -> Any:
+        """
+        在线程池中调用 tokenizer 的任意方法，用于参数中包含需要被修改的对象 (如多模态参数) 的调用。
+        """
+        if self.thread_executor is None:
+            return getattr(self.tokenizer, method_name)(*args, **kwargs)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.thread_executor, _worker_call, method_name, args, kwargs)
+
+    def _flush(self):
+        self.flush_scheduled = False
+        for add_special_tokens in list(self.pending.keys()):
+            self._submit_batch(add_special_tokens)
+        return
+
+    def _submit_batch(self, add_special_tokens: bool):
+        items = self.pending.pop(add_special_tokens, None)
+        if not items:
+            return
+        prompts = [prompt for prompt, _ in items]
+        futures = [future for _, future in items]
+        try:
+            task = self.text_executor.submit(_worker_encode_batch, prompts, add_special_tokens)
+        except Exception as e:
+            # 比如 pool 已经被关闭，直接通知等待的请求失败
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        task.add_done_callback(lambda task: self._set_results(futures, task))
+        return
+
+    def _set_results(self, futures: List[asyncio.Future], task):
+        # 在工作线程中被回调，需要回到事件循环所在的线程中设置结果
+        loop = futures[0].get_loop()
+        loop.call_soon_threadsafe(self._set_results_in_loop, futures, task)
+        return
+
+    @staticmethod
+    def _set_results_in_loop(futures: List[asyncio.Future], task):
+        exception = task.exception()
+        results = [None] * len(futures) if exception is not None else task.result()
+        for future, result in zip(futures, results):
+            if future.done():
+                continue
+            if exception is not None:
+                future.set_exception(exception)
+            elif isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+        return
+
+    def shutdown(self):
+        if self.text_executor is not None and self.text_executor is not self.thread_executor:
+            self.text_executor.shutdown(wait=False)
+        if self.thread_executor is not None:
+            self.thread_executor.shutdown(wait=False)
+        return
@@ -9,12 +9,12 @@ import hashlib
 import datetime
 import aiohttp
 import ujson as json
-import pickle
 
 asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
 from typing import Union, List, Tuple, Dict
 from lightllm.server.core.objs import FinishStatus
-from ..pd_io_struct import PD_Client_Obj, UpKVStatus, ObjType
+from ..pd_io_struct import PD_Client_Obj, UpKVStatus, ObjType, get_pd_master_addrs
+from ..pd_io_frame import encode_abort, encode_req
 from lightllm.server.core.objs import SamplingParams
 from ..multimodal_params import MultimodalParams
 from ..tokenizer import get_tokenizer
@@ -24,6 +24,8 @@ from lightllm.utils.log_utils import init_logger
 from lightllm.server.metrics.manager import MetricClient
 from lightllm.utils.statics_utils import MovingAverage
 from lightllm.server.httpserver.manager import AsyncQueue
+from .pd_selector import build_pd_selector
+from .pd_store import build_pd_master_store
 
 logger = init_logger(__name__)
 
@@ -36,10 +38,17 @@ class HttpServerManagerForPDMaster:
     ):
         self.args = args
         self.metric_client = MetricClient(metric_port)
-        self.id_gen = ReqIDGenerator()
+        # 多个 pd master 副本时，每个副本只生成属于自己的请求 id，节点将请求的 token 直接发送给对应的副本
+        self.replica_id = args.pd_master_replica_id
+        self.replica_num = len(get_pd_master_addrs(args))
+        self.id_gen = ReqIDGenerator(shard_id=self.replica_id, shard_num=self.replica_num)
+        self.store = build_pd_master_store(args)
+        # 已经同步到 pd_selector 中的节点负载信息的上报时间
+        self.node_status_update_time: Dict[str, float] = {}
         self.prefill_nodes: List[PD_Client_Obj] = []
         self.decode_nodes: List[PD_Client_Obj] = []
         self.url_to_pd_nodes: Dict[str, PD_Client_Obj] = {}
+        self.pd_selector = build_pd_selector(args)
 
         self.req_id_to_out_inf: Dict[int, ReqStatus] = {}
         self.infos_queues = None  # 这个需要延迟初始化，否则使用的loop不对
@@ -74,6 +83,8 @@ class HttpServerManagerForPDMaster:
             pass
         self.prefill_nodes = [e for e in self.prefill_nodes if e.client_ip_port != pd_client.client_ip_port]
         self.decode_nodes = [e for e in self.decode_nodes if e.client_ip_port != pd_client.client_ip_port]
+        self.pd_selector.remove_node(pd_client.client_ip_port)
+        self.node_status_update_time.pop(pd_client.client_ip_port, None)
         logger.info(f"mode: {pd_client.mode} url: {pd_client.client_ip_port} removed")
         return
 
@@ -94,11 +105,13 @@ class HttpServerManagerForPDMaster:
     async def select_p_d_node(
         self, prompt: Union[str, List[int]], sampling_params: SamplingParams, multimodal_params: MultimodalParams
     ) -> Tuple[PD_Client_Obj, PD_Client_Obj]:
-        import random
-
-        p_node = random.choice(self.prefill_nodes)
-        d_node = random.choice(self.decode_nodes)
-        return p_node, d_node
+        return self.pd_selector.select(
+            sampling_params.group_request_id,
+            prompt,
+            sampling_params.max_new_tokens,
+            self.prefill_nodes,
+            self.decode_nodes,
+        )
 
     async def generate(
         self,
@@ -190,7 +203,7 @@ class HttpServerManagerForPDMaster:
         sampling_params.move_kv_to_decode_node.initialize(decode_node_dict if old_max_new_tokens != 1 else None)
         sampling_params.suggested_dp_index = -1
 
-        await p_node.websocket.send_bytes(pickle.dumps((ObjType.REQ, (prompt, sampling_params, multimodal_params))))
+        await p_node.websocket.send_bytes(encode_req(prompt, sampling_params, multimodal_params))
 
         while True:
             await req_status.wait_to_ready()
@@ -210,6 +223,7 @@ class HttpServerManagerForPDMaster:
                         prompt_ids.append(metadata.get("id"))
                     yield sub_req_id, request_output, metadata, finish_status
                 break
+        self.pd_selector.on_prefill_finished(group_request_id)
 
         # 如果只需要一个输出 token，prefill 完就直接结束掉吧
         if old_max_new_tokens == 1:
@@ -225,7 +239,7 @@ class HttpServerManagerForPDMaster:
         sampling_params.max_new_tokens = old_max_new_tokens - 1
         sampling_params.suggested_dp_index = up_status_event.upkv_status.dp_index
 
-        await d_node.websocket.send_bytes(pickle.dumps((ObjType.REQ, (prompt_ids, sampling_params, multimodal_params))))
+        await d_node.websocket.send_bytes(encode_req(prompt_ids, sampling_params, multimodal_params))
 
         while True:
             await req_status.wait_to_ready()
@@ -310,18 +324,19 @@ class HttpServerManagerForPDMaster:
             pass
 
         try:
-            await req_status.p_node.websocket.send_bytes(pickle.dumps((ObjType.ABORT, group_request_id)))
+            await req_status.p_node.websocket.send_bytes(encode_abort(group_request_id))
         except:
             pass
 
         try:
-            await req_status.d_node.websocket.send_bytes(pickle.dumps((ObjType.ABORT, group_request_id)))
+            await req_status.d_node.websocket.send_bytes(encode_abort(group_request_id))
         except:
             pass
 
         return
 
     async def remove_req(self, group_request_id):
+        self.pd_selector.on_req_finished(group_request_id)
         try:
             del self.req_id_to_out_inf[group_request_id]
         except:
@@ -336,9 +351,34 @@ class HttpServerManagerForPDMaster:
     async def put_to_handle_queue(self, obj):
         await self.infos_queues.put(obj)
 
+    def _update_node_status(self, node_status: dict):
+        client_ip_port = node_status["client_ip_port"]
+        if node_status["update_time"] <= self.node_status_update_time.get(client_ip_port, 0.0):
+            return
+        self.node_status_update_time[client_ip_port] = node_status["update_time"]
+        self.pd_selector.update_node_status(client_ip_port, node_status)
+        return
+
+    async def sync_node_status_loop(self):
+        """
+        节点的负载可能是通过其他副本上报的，定期从 store 中同步已连接节点的最新负载信息。
+        """
+        interval = self.args.pd_node_status_interval_ms / 1000.0
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                all_node_status = await asyncio.to_thread(self.store.get_node_status)
+                for client_ip_port, node_status in all_node_status.items():
+                    if client_ip_port in self.url_to_pd_nodes:
+                        self._update_node_status(node_status)
+            except BaseException as e:
+                logger.exception(str(e))
+
     async def handle_loop(self):
         self.infos_queues = AsyncQueue()
         asyncio.create_task(self.timer_log())
+        if self.replica_num > 1 and self.args.pd_node_status_interval_ms > 0:
+            asyncio.create_task(self.sync_node_status_loop())
 
         while True:
             objs = await self.infos_queues.wait_to_get_all_data()
@@ -356,6 +396,12 @@ class HttpServerManagerForPDMaster:
                                     req_status.event.set()
                             except:
                                 pass
+                    elif obj[0] == ObjType.NODE_STATUS:
+                        # 使用文件 store 时写入是阻塞操作，不能在事件循环中直接执行
+                        node_status = await asyncio.to_thread(
+                            self.store.put_node_status, obj[1]["client_ip_port"], obj[1]
+                        )
+                        self._update_node_status(node_status)
                     else:
                         logger.error(f"recevie error obj {obj}")
             except BaseException as e:
@@ -0,0 +1,269 @@
+import time
+import random
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple, Union
+from ..pd_io_struct import PD_Client_Obj
+from lightllm.utils.log_utils import init_logger
+
+logger = init_logger(__name__)
+
+# 以字符串为 prompt 时，按照字符数估计 token 数量
+CHARS_PER_TOKEN = 4
+# 前缀索引按块记录 prompt 的前缀，一个块约 64 个 token
+PREFIX_BLOCK_TOKENS = 64
+# 节点没有设置 max_total_token_num 时，使用的默认 kv 容量估计
+DEFAULT_NODE_TOKEN_CAPACITY = 200000
+# 超过该时间没有收到节点的状态上报时，忽略节点上报的负载信息 (s)
+NODE_STATUS_EXPIRE_TIME = 5.0
+# kv 使用率超过该值后，prefill 节点的预期首字延迟按照比例放大
+KV_PRESSURE_LOAD = 0.9
+
+
+class PDNodeStatus:
+    """
+    p d 节点通过 /pd_register 的 websocket 周期上报的负载信息。
+    """
+
+    def __init__(self):
+        self.running_req_num = 0
+        # 还没有输出首个 token 的请求的 prompt token 总数
+        self.pending_prompt_tokens = 0
+        # 各个 dp 的 kv 使用率，含义与 /token_load 接口一致
+        self.current_load: List[float] = [0.0]
+        self.dynamic_max_load: List[float] = [0.0]
+        self.update_time = 0.0
+
+    def update(self, status: dict, now: float):
+        self.running_req_num = status["running_req_num"]
+        self.pending_prompt_tokens = status["pending_prompt_tokens"]
+        self.current_load = status["current_load"]
+        self.dynamic_max_load = status["dynamic_max_load"]
+        self.update_time = now
+        return
+
+    def is_valid(self, now: float) -> bool:
+        return now - self.update_time <= NODE_STATUS_EXPIRE_TIME
+
+
+def get_prompt_token_num(prompt: Union[str, List[int]]) -> int:
+    if isinstance(prompt, str):
+        return (len(prompt) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+    return len(prompt)
+
+
+def get_prompt_block_hashes(prompt: Union[str, List[int]]) -> List[int]:
+    """
+    将 prompt 按照固定长度切块，返回每个完整块对应前缀的链式哈希值，前缀相同的 prompt 前面的哈希值也相同。
+    """
+    block_len = PREFIX_BLOCK_TOKENS * CHARS_PER_TOKEN if isinstance(prompt, str) else PREFIX_BLOCK_TOKENS
+    hashes = []
+    prefix_hash = 0
+    for start in range(0, len(prompt) - block_len + 1, block_len):
+        block = prompt[start : start + block_len]
+        prefix_hash = hash((prefix_hash, block if isinstance(block, str) else tuple(block)))
+        hashes.append(prefix_hash)
+    return hashes
+
+
+class PrefixSketch:
+    """
+    近似记录一个 prefill 节点的 prompt cache 中保存了哪些前缀，按照 LRU 淘汰，容量与节点的 kv 容量相当。
+    """
+
+    def __init__(self, capacity_blocks: int):
+        self.capacity_blocks = max(1, capacity_blocks)
+        self.blocks: OrderedDict = OrderedDict()
+
+    def match_len(self, block_hashes: List[int]) -> int:
+        # 返回连续命中的块数
+        match_num = 0
+        for block_hash in block_hashes:
+            if block_hash not in self.blocks:
+                break
+            match_num += 1
+        return match_num
+
+    def insert(self, block_hashes: List[int]):
+        for block_hash in block_hashes:
+            self.blocks[block_hash] = None
+            self.blocks.move_to_end(block_hash)
+        while len(self.blocks) > self.capacity_blocks:
+            self.blocks.popitem(last=False)
+        return
+
+
+class PDSelector:
+    """
+    pd master 为请求选择 prefill 和 decode 节点。
+    """
+
+    def select(
+        self,
+        group_request_id: int,
+        prompt: Union[str, List[int]],
+        max_new_tokens: int,
+        prefill_nodes: List[PD_Client_Obj],
+        decode_nodes: List[PD_Client_Obj],
+    ) -> Tuple[PD_Client_Obj, PD_Client_Obj]:
+        raise NotImplementedError()
+
+    def update_node_status(self, client_ip_port: str, status: dict):
+        return
+
+    def remove_node(self, client_ip_port: str):
+        return
+
+    def on_prefill_finished(self, group_request_id: int):
+        return
+
+    def on_req_finished(self, group_request_id: int):
+        return
+
+
+class RandomPDSelector(PDSelector):
+    def select(self, group_request_id, prompt, max_new_tokens, prefill_nodes, decode_nodes):
+        return random.choice(prefill_nodes), random.choice(decode_nodes)
+
+
+class _ReqRecord:
+    def __init__(self, p_url: str, d_url: str, prompt_tokens: int, uncached_tokens: int):
+        self.p_url = p_url
+        self.d_url = d_url
+        self.prompt_tokens = prompt_tokens
+        self.uncached_tokens = uncached_tokens
+        self.prefill_finished = False
+
+
+class LoadAwarePDSelector(PDSelector):
+    """
+    按照预期的首字延迟选择 prefill 节点，按照 kv 余量选择 decode 节点。
+
+    prefill 节点的预期首字延迟用 token 数衡量：节点上排队等待 prefill 的 token 数加上当前请求没有命中节点
+    prompt cache 的 token 数，kv 使用率超过 KV_PRESSURE_LOAD 后按比例放大。排队的 token 数为 master
+    自己记录的已分发未完成 prefill 的 token 数，加上节点上报的排队 token 数中不是由本 master 分发的部分
+    (多个 master 的情况)。prompt cache 的命中情况由每个 prefill 节点的 PrefixSketch 近似估计。
+    decode 节点的负载为节点上报的 dynamic_max_load，加上上次上报之后新分发的请求预计占用的 token 比例。
+    """
+
+    def __init__(self):
+        self.node_status: Dict[str, PDNodeStatus] = {}
+        self.prefix_sketches: Dict[str, PrefixSketch] = {}
+        # master 本地记录的各个 prefill 节点已分发未完成 prefill 的未命中 prompt cache 的 token 数和 prompt token 数
+        self.pending_prefill_tokens: Dict[str, int] = {}
+        self.pending_prompt_tokens: Dict[str, int] = {}
+        # 节点上报的排队 token 数中由其他 master 分发的部分
+        self.other_pending_tokens: Dict[str, int] = {}
+        # 上次状态上报之后分发到各个 decode 节点的 token 数
+        self.decode_tokens_since_report: Dict[str, int] = {}
+        self.req_records: Dict[int, _ReqRecord] = {}
+
+    def _get_status(self, node: PD_Client_Obj, now: float) -> Optional[PDNodeStatus]:
+        status = self.node_status.get(node.client_ip_port, None)
+        if status is None or not status.is_valid(now):
+            return None
+        return status
+
+    def _get_capacity(self, node: PD_Client_Obj) -> int:
+        capacity = node.start_args.get("max_total_token_num", None)
+        return DEFAULT_NODE_TOKEN_CAPACITY if capacity is None else capacity
+
+    def _get_prefix_sketch(self, node: PD_Client_Obj) -> PrefixSketch:
+        sketch = self.prefix_sketches.get(node.client_ip_port, None)
+        if sketch is None:
+            sketch = PrefixSketch(self._get_capacity(node) // PREFIX_BLOCK_TOKENS)
+            self.prefix_sketches[node.client_ip_port] = sketch
+        return sketch
+
+    def get_prefill_score(self, node: PD_Client_Obj, block_hashes: List[int], prompt_tokens: int, now: float):
+        """
+        返回 (预期首字延迟的 token 数, 未命中 prompt cache 的 token 数)。
+        """
+        match_tokens = self._get_prefix_sketch(node).match_len(block_hashes) * PREFIX_BLOCK_TOKENS
+        uncached_tokens = max(1, prompt_tokens - match_tokens)
+        pending_tokens = self.pending_prefill_tokens.get(node.client_ip_port, 0)
+        status = self._get_status(node, now)
+        kv_pressure = 0.0
+        if status is not None:
+            pending_tokens += self.other_pending_tokens.get(node.client_ip_port, 0)
+            kv_pressure = max(0.0, min(status.current_load) - KV_PRESSURE_LOAD) / (1.0 - KV_PRESSURE_LOAD)
+        return (pending_tokens + uncached_tokens) * (1.0 + kv_pressure), uncached_tokens
+
+    def get_decode_score(self, node: PD_Client_Obj, now: float) -> float:
+        load = 0.0
+        status = self._get_status(node, now)
+        if status is not None:
+            load = min(status.dynamic_max_load)
+        return load + self.decode_tokens_since_report.get(node.client_ip_port, 0) / self._get_capacity(node)
+
+    def _select_min(self, scores: List[float]) -> int:
+        # 分数相同的节点中随机选择，避免负载信息缺失时总是选中同一个节点
+        min_score = min(scores)
+        return random.choice([i for i, score in enumerate(scores) if score == min_score])
+
+    def select(self, group_request_id, prompt, max_new_tokens, prefill_nodes, decode_nodes):
+        now = time.time()
+        prompt_tokens = get_prompt_token_num(prompt)
+        block_hashes = get_prompt_block_hashes(prompt)
+
+        prefill_scores = [self.get_prefill_score(node, block_hashes, prompt_tokens, now) for node in prefill_nodes]
+        p_index = self._select_min([score for score, _ in prefill_scores])
+        p_node = prefill_nodes[p_index]
+        uncached_tokens = prefill_scores[p_index][1]
+        d_node = decode_nodes[self._select_min([self.get_decode_score(node, now) for node in decode_nodes])]
+
+        # 请求的 prompt 会进入 prefill 节点的 prompt cache 中
+        self._get_prefix_sketch(p_node).insert(block_hashes)
+        p_url = p_node.client_ip_port
+        self.pending_prefill_tokens[p_url] = self.pending_prefill_tokens.get(p_url, 0) + uncached_tokens
+        self.pending_prompt_tokens[p_url] = self.pending_prompt_tokens.get(p_url, 0) + prompt_tokens
+        self.decode_tokens_since_report[d_node.client_ip_port] = (
+            self.decode_tokens_since_report.get(d_node.client_ip_port, 0) + prompt_tokens + max_new_tokens
+        )
+        self.req_records[group_request_id] = _ReqRecord(p_url, d_node.client_ip_port, prompt_tokens, uncached_tokens)
+        return p_node, d_node
+
+    def update_node_status(self, client_ip_port: str, status: dict):
+        if client_ip_port not in self.node_status:
+            self.node_status[client_ip_port] = PDNodeStatus()
+        self.node_status[client_ip_port].update(status, time.time())
+        self.other_pending_tokens[client_ip_port] = max(
+            0, status["pending_prompt_tokens"] - self.pending_prompt_tokens.get(client_ip_port, 0)
+        )
+        self.decode_tokens_since_report.pop(client_ip_port, None)
+        return
+
+    def remove_node(self, client_ip_port: str):
+        self.node_status.pop(client_ip_port, None)
+        self.prefix_sketches.pop(client_ip_port, None)
+        self.pending_prefill_tokens.pop(client_ip_port, None)
+        self.pending_prompt_tokens.pop(client_ip_port, None)
+        self.other_pending_tokens.pop(client_ip_port, None)
+        self.decode_tokens_since_report.pop(client_ip_port, None)
+        return
+
+    def on_prefill_finished(self, group_request_id: int):
+        record = self.req_records.get(group_request_id, None)
+        if record is None or record.prefill_finished:
+            return
+        record.prefill_finished = True
+        # 节点在请求运行期间被移除并重新注册时，计数已经被清零
+        if record.p_url in self.pending_prefill_tokens:
+            p_url = record.p_url
+            self.pending_prefill_tokens[p_url] = max(0, self.pending_prefill_tokens[p_url] - record.uncached_tokens)
+            self.pending_prompt_tokens[p_url] = max(0, self.pending_prompt_tokens[p_url] - record.prompt_tokens)
+        return
+
+    def on_req_finished(self, group_request_id: int):
+        # 请求异常结束时 prefill 可能还没有完成
+        self.on_prefill_finished(group_request_id)
+        self.req_records.pop(group_request_id, None)
+        return
+
+
+def build_pd_selector(args) -> PDSelector:
+    if args.pd_selector == "random":
+        return RandomPDSelector()
+    elif args.pd_selector == "load_aware":
+        return LoadAwarePDSelector()
+    else:
+        raise ValueError(f"can not support pd_selector {args.pd_selector}")
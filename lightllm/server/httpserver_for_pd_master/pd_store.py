@@ -0,0 +1,95 @@
+import os
+import json
+import time
+from abc import ABC, abstractmethod
+from typing import Dict
+from lightllm.utils.log_utils import init_logger
+
+logger = init_logger(__name__)
+
+
+class PDMasterStore(ABC):
+    """
+    pd master 的多个副本之间共享的节点负载信息。
+    副本只能通过自己持有的 websocket 向节点下发请求，节点可能只通过其中一个副本上报负载，
+    store 中记录每个节点最近一次上报的负载信息，其他副本定期读取后同步到自己的 pd_selector 中。
+    """
+
+    @abstractmethod
+    def put_node_status(self, client_ip_port: str, status: dict) -> dict:
+        """
+        记录节点上报的负载信息，返回附加了 update_time 的记录。
+        """
+        pass
+
+    @abstractmethod
+    def get_node_status(self) -> Dict[str, dict]:
+        """
+        返回 {client_ip_port: status}。
+        """
+        pass
+
+
+class MemoryPDMasterStore(PDMasterStore):
+    """
+    只在当前进程内记录的 store，只有一个 pd master 副本时使用。
+    """
+
+    def __init__(self):
+        self.node_status: Dict[str, dict] = {}
+
+    def put_node_status(self, client_ip_port: str, status: dict) -> dict:
+        status = dict(status, update_time=time.time())
+        self.node_status[client_ip_port] = status
+        return status
+
+    def get_node_status(self) -> Dict[str, dict]:
+        return dict(self.node_status)
+
+
+class FilePDMasterStore(PDMasterStore):
+    """
+    以目录中的 json 文件记录的 store，同一台机器或者共享文件系统上的多个 pd master 副本可以使用同一个目录，
+    也用于测试。写入时先写临时文件再重命名，读取时不会读到写了一半的内容。
+    读写文件都是阻塞操作，在事件循环中需要通过 asyncio.to_thread 调用。
+    """
+
+    def __init__(self, root_dir: str):
+        self.root_dir = root_dir
+        self.status_dir = os.path.join(root_dir, "status")
+        os.makedirs(self.status_dir, exist_ok=True)
+
+    def _write_json(self, path: str, obj: dict):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(obj, f)
+        os.replace(tmp_path, path)
+        return
+
+    def _read_dir(self, dir_path: str) -> Dict[str, dict]:
+        ans = {}
+        for file_name in os.listdir(dir_path):
+            if not file_name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(dir_path, file_name), "r") as f:
+                    ans[file_name[: -len(".json")]] = json.load(f)
+            except (FileNotFoundError, ValueError):
+                # 读取的同时文件被其他副本替换
+                continue
+        return ans
+
+    def put_node_status(self, client_ip_port: str, status: dict) -> dict:
+        status = dict(status, update_time=time.time())
+        self._write_json(os.path.join(self.status_dir, f"{client_ip_port}.json"), status)
+        return status
+
+    def get_node_status(self) -> Dict[str, dict]:
+        return self._read_dir(self.status_dir)
+
+
+def build_pd_master_store(args) -> PDMasterStore:
+    if args.pd_master_store == "memory":
+        return MemoryPDMasterStore()
+    logger.info(f"pd master share node info by dir {args.pd_master_store}")
+    return FilePDMasterStore(args.pd_master_store)
@@ -26,6 +26,20 @@ MONITOR_INFO = {
     "lightllm_cache_length": "Length of tokens which hit prompt cache",
     "lightllm_cache_ratio": "cache length / input_length",
     "lightllm_batch_current_max_tokens": "dynamic max token used for current batch",
+    "lightllm_request_queue_duration_by_priority": "Queue duration of requests of each priority class",
+    "lightllm_request_first_token_duration_by_priority": "First token time of requests of each priority class",
+    "lightllm_request_mean_time_per_token_duration_by_priority": "Per token time of requests of each priority class",
+    "lightllm_request_pause_count_by_priority": "The number of paused requests of each priority class",
+    "lightllm_kv_swap_out_bytes": "Total bytes of kv swapped out to host memory for paused requests",
+    "lightllm_kv_swap_in_bytes": "Total bytes of kv swapped in from host memory for resumed requests",
+    "lightllm_kv_swap_out_latency": "Mean latency of swapping out the kv of a paused request (s)",
+    "lightllm_kv_swap_in_latency": "Mean latency of swapping in the kv of a resumed request (s)",
+    "lightllm_kv_swap_recompute_count": "The number of paused requests whose kv is recomputed instead of swapped",
+    "lightllm_host_kv_cache_hit_rate": "Request level hit rate of the host kv cache for prompt cache",
+    "lightllm_host_kv_cache_token_hit_rate": "Token level hit rate of the host kv cache for prompt cache",
+    "lightllm_host_kv_cache_used_bytes": "Bytes of host memory used by the host kv cache",
+    "lightllm_host_kv_cache_offload_bytes": "Total bytes of kv offloaded from gpu to the host kv cache",
+    "lightllm_host_kv_cache_load_bytes": "Total bytes of kv loaded from the host kv cache back to gpu",
 }
 
 
@@ -82,12 +96,33 @@ class Monitor:
         self.create_histogram("lightllm_request_first_token_duration", self.duration_buckets)
         self.create_histogram("lightllm_request_queue_duration_bucket", self.duration_buckets)
         self.create_histogram("lightllm_batch_inference_duration_bucket", self.duration_buckets, labelnames=["method"])
+        # 按照请求优先级分类的延迟统计，label 为 priority 的取值
+        self.create_histogram(
+            "lightllm_request_queue_duration_by_priority", self.duration_buckets, labelnames=["priority"]
+        )
+        self.create_histogram(
+            "lightllm_request_first_token_duration_by_priority", self.duration_buckets, labelnames=["priority"]
+        )
+        self.create_histogram(
+            "lightllm_request_mean_time_per_token_duration_by_priority", self.duration_buckets, labelnames=["priority"]
+        )
+        self.create_counter("lightllm_request_pause_count_by_priority", labelnames=["priority"])
         self.gateway_url = args.metric_gateway
 
         self.create_gauge("lightllm_queue_size")
         self.create_gauge("lightllm_batch_current_size")
         self.create_gauge("lightllm_batch_pause_size")
         self.create_gauge("lightllm_batch_current_max_tokens")
+        self.create_gauge("lightllm_kv_swap_out_bytes")
+        self.create_gauge("lightllm_kv_swap_in_bytes")
+        self.create_gauge("lightllm_kv_swap_out_latency")
+        self.create_gauge("lightllm_kv_swap_in_latency")
+        self.create_gauge("lightllm_kv_swap_recompute_count")
+        self.create_gauge("lightllm_host_kv_cache_hit_rate")
+        self.create_gauge("lightllm_host_kv_cache_token_hit_rate")
+        self.create_gauge("lightllm_host_kv_cache_used_bytes")
+        self.create_gauge("lightllm_host_kv_cache_offload_bytes")
+        self.create_gauge("lightllm_host_kv_cache_load_bytes")
         batch_size_buckets = [i + 1 for i in range(0, 128)]
         self.create_histogram("lightllm_batch_next_size", batch_size_buckets)
 
@@ -118,13 +153,14 @@ class Monitor:
         if label is None:
             self.monitor_registry[name].inc()
         else:
-            self.monitor_registry[name].labels(method=label).inc()
+            # 带 label 的指标都只有一个 labelname
+            self.monitor_registry[name].labels(label).inc()
 
     def histogram_observe(self, name, value, label=None):
         if label is None:
             self.monitor_registry[name].observe(value)
         else:
-            self.monitor_registry[name].labels(method=label).observe(value)
+            self.monitor_registry[name].labels(label).observe(value)
 
     def gauge_set(self, name, value):
         self.monitor_registry[name].set(value)
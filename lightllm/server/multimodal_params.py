@@ -1,10 +1,9 @@
 """Multimodal parameters for text generation."""
 from typing import List
 import os
+import asyncio
 import requests
-from io import BytesIO
-from PIL import Image
-from lightllm.utils.image_utils import fetch_image
+from lightllm.utils.image_utils import fetch_and_load_image, load_image
 import base64
 from fastapi import Request
 
@@ -19,10 +18,14 @@ class ImageItem:
         self.token_id = None
         # the image token num
         self.token_num = None
+        # the slot of the image embedding in the embed arena
+        self.embed_slot = None
         self.image_w = 0
         self.image_h = 0
 
         self._preload_data = None
+        # 图片数据的 md5，在 preload 时计算
+        self.md5 = None
         self.extra_params = {}
 
     async def preload(self, request: Request):
@@ -30,9 +33,9 @@ class ImageItem:
             if self._type == "url":
                 timeout = int(os.getenv("REQUEST_TIMEOUT", "5"))
                 proxy = os.getenv("REQUEST_PROXY", None)
-                img_data = await fetch_image(self._data, request, timeout=timeout, proxy=proxy)
+                image = await fetch_and_load_image(self._data, request, timeout=timeout, proxy=proxy)
             elif self._type == "base64":
-                img_data = base64.b64decode(self._data)
+                image = await load_image(base64.b64decode(self._data))
             elif self._type == "image_size":
                 # image_size 代表直接传入图片的 width，height，主要是用于一些场景
                 # 的 token 计数判断, 所以只需要图片长宽信息，不需要具体图片的内容信息
@@ -42,10 +45,9 @@ class ImageItem:
             else:
                 raise ValueError(f"cannot read image which type is {self._type}!")
 
-            # check if valid image bytes
-            image = Image.open(BytesIO(img_data))
-            self.image_w, self.image_h = image.size
-            self._preload_data = img_data
+            self.image_w, self.image_h = image.width, image.height
+            self.md5 = image.md5
+            self._preload_data = image.data
             return
 
         except Exception as e:
@@ -63,6 +65,7 @@ class ImageItem:
         ret["uuid"] = self.uuid
         ret["token_id"] = self.token_id
         ret["token_num"] = self.token_num
+        ret["embed_slot"] = self.embed_slot
         return ret
 
     def to_origin_dict(self):
@@ -84,8 +87,7 @@ class MultimodalParams:
         return
 
     async def verify_and_preload(self, request: Request):
-        for image in self.images:
-            await image.preload(request)
+        await asyncio.gather(*[image.preload(request) for image in self.images])
         return
 
     def to_dict(self):
@@ -0,0 +1,215 @@
+"""
+pd master 与 p d 节点之间 websocket 消息的二进制帧格式。
+
+每个帧以 [magic: u8][version: u8][obj_type: u8] 开头，后面的内容与 obj_type 相关：
+    TOKEN_PACKS: [n: u32] 加上 n 个 token，每个 token 为定长字段 _TOKEN_HEADER 加上变长部分：
+        utf8 编码的文本，flags 中带有 _HAS_PROMPT_IDS 时为 [n: u32][int32 * n] 的 prompt_ids，
+        带有 _HAS_EXTRA 时为 [len: u32] 加上其他 metadata (prompt logprobs, score 等) 的 pickle 数据。
+    REQ: [prompt 类型: u8][len: u32] 加上 utf8 的文本或者 int32 的 token ids，[len: u32] 加上 SamplingParams
+        的内存数据，[多模态参数类型: u8][len: u32] 加上多模态参数的 pickle 数据 (没有图片时不需要)。
+    ABORT: [group_request_id: i64]
+    NODE_STATUS: 节点负载信息的 pickle 数据。
+pickle 数据总是以 0x80 开头，decode_pd_frame 据此兼容旧版本节点发送的 pickle 消息。
+"""
+import os
+import array
+import pickle
+import struct
+from typing import List, Tuple
+from lightllm.server.core.objs import FinishStatus, SamplingParams
+from .pd_io_struct import ObjType
+
+# 节点向 pd master 转发 token 时，等待 LIGHTLLM_PD_FRAME_BATCH_WINDOW_US 将更多请求的 token 合并到一个帧中，
+# 一个帧最多包含 LIGHTLLM_PD_FRAME_MAX_TOKENS 个 token
+LIGHTLLM_PD_FRAME_BATCH_WINDOW_US = int(os.getenv("LIGHTLLM_PD_FRAME_BATCH_WINDOW_US", 500))
+LIGHTLLM_PD_FRAME_MAX_TOKENS = int(os.getenv("LIGHTLLM_PD_FRAME_MAX_TOKENS", 4096))
+
+PD_FRAME_MAGIC = 0x4C
+PD_FRAME_VERSION = 1
+_PICKLE_MAGIC = 0x80
+
+_FRAME_HEADER = struct.Struct("<BBB")
+_U32 = struct.Struct("<I")
+_I64 = struct.Struct("<q")
+_TYPE_AND_LEN = struct.Struct("<BI")
+# (sub_req_id, id, count_output_tokens, prompt_tokens, logprob, cumlogprob, special, finish_status, flags, text_len)
+_TOKEN_HEADER = struct.Struct("<qiiiddBBHI")
+_TOKEN_FIXED_KEYS = ("id", "logprob", "cumlogprob", "special", "count_output_tokens", "prompt_tokens")
+_HAS_PROMPT_IDS = 1
+_HAS_EXTRA = 2
+
+_PROMPT_STR = 0
+_PROMPT_IDS = 1
+_MM_NONE = 0
+_MM_EMPTY = 1
+_MM_PICKLE = 2
+
+
+def _encode_ids(ids) -> bytes:
+    data = array.array("i", ids).tobytes()
+    return _U32.pack(len(ids)) + data
+
+
+def encode_token_packs(handle_list: List[Tuple[int, str, dict, FinishStatus]]) -> bytes:
+    buf = bytearray(_FRAME_HEADER.pack(PD_FRAME_MAGIC, PD_FRAME_VERSION, ObjType.TOKEN_PACKS.value))
+    buf += _U32.pack(len(handle_list))
+    for sub_req_id, text, metadata, finish_status in handle_list:
+        text_bytes = text.encode("utf-8")
+        prompt_ids = metadata.get("prompt_ids", None)
+        flags = 0
+        extra = None
+        if prompt_ids is not None:
+            flags |= _HAS_PROMPT_IDS
+        if len(metadata) > len(_TOKEN_FIXED_KEYS) + (prompt_ids is not None):
+            extra = {k: v for k, v in metadata.items() if k not in _TOKEN_FIXED_KEYS and k != "prompt_ids"}
+            flags |= _HAS_EXTRA
+        buf += _TOKEN_HEADER.pack(
+            sub_req_id,
+            metadata["id"],
+            metadata["count_output_tokens"],
+            metadata["prompt_tokens"],
+            metadata["logprob"],
+            metadata["cumlogprob"],
+            metadata["special"],
+            finish_status.status,
+            flags,
+            len(text_bytes),
+        )
+        buf += text_bytes
+        if prompt_ids is not None:
+            buf += _encode_ids(prompt_ids)
+        if extra is not None:
+            extra_bytes = pickle.dumps(extra, protocol=pickle.HIGHEST_PROTOCOL)
+            buf += _U32.pack(len(extra_bytes))
+            buf += extra_bytes
+    return bytes(buf)
+
+
+def encode_req(prompt, sampling_params: SamplingParams, multimodal_params) -> bytes:
+    buf = bytearray(_FRAME_HEADER.pack(PD_FRAME_MAGIC, PD_FRAME_VERSION, ObjType.REQ.value))
+    if isinstance(prompt, str):
+        prompt_bytes = prompt.encode("utf-8")
+        buf += _TYPE_AND_LEN.pack(_PROMPT_STR, len(prompt_bytes))
+        buf += prompt_bytes
+    else:
+        buf += _TYPE_AND_LEN.pack(_PROMPT_IDS, len(prompt))
+        buf += array.array("i", prompt).tobytes()
+    sampling_params_bytes = memoryview(sampling_params).cast("B")
+    buf += _U32.pack(len(sampling_params_bytes))
+    buf += sampling_params_bytes
+    if multimodal_params is None:
+        buf += _TYPE_AND_LEN.pack(_MM_NONE, 0)
+    elif len(multimodal_params.images) == 0:
+        buf += _TYPE_AND_LEN.pack(_MM_EMPTY, 0)
+    else:
+        mm_bytes = pickle.dumps(multimodal_params, protocol=pickle.HIGHEST_PROTOCOL)
+        buf += _TYPE_AND_LEN.pack(_MM_PICKLE, len(mm_bytes))
+        buf += mm_bytes
+    return bytes(buf)
+
+
+def encode_abort(group_request_id: int) -> bytes:
+    return _FRAME_HEADER.pack(PD_FRAME_MAGIC, PD_FRAME_VERSION, ObjType.ABORT.value) + _I64.pack(group_request_id)
+
+
+def encode_node_status(node_status: dict) -> bytes:
+    header = _FRAME_HEADER.pack(PD_FRAME_MAGIC, PD_FRAME_VERSION, ObjType.NODE_STATUS.value)
+    return header + pickle.dumps(node_status, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _decode_ids(buf: memoryview, offset: int):
+    (n,) = _U32.unpack_from(buf, offset)
+    offset += _U32.size
+    ids = buf[offset : offset + n * 4].cast("i").tolist()
+    return ids, offset + n * 4
+
+
+def _decode_token_packs(buf: memoryview, offset: int):
+    (n,) = _U32.unpack_from(buf, offset)
+    offset += _U32.size
+    unpack_from = _TOKEN_HEADER.unpack_from
+    header_size = _TOKEN_HEADER.size
+    handle_list = []
+    for _ in range(n):
+        (
+            sub_req_id,
+            token_id,
+            count_output_tokens,
+            prompt_tokens,
+            logprob,
+            cumlogprob,
+            special,
+            status,
+            flags,
+            text_len,
+        ) = unpack_from(buf, offset)
+        offset += header_size
+        text = str(buf[offset : offset + text_len], "utf-8")
+        offset += text_len
+        metadata = {
+            "id": token_id,
+            "logprob": logprob,
+            "cumlogprob": cumlogprob,
+            "special": bool(special),
+            "count_output_tokens": count_output_tokens,
+            "prompt_tokens": prompt_tokens,
+        }
+        if flags & _HAS_PROMPT_IDS:
+            metadata["prompt_ids"], offset = _decode_ids(buf, offset)
+        if flags & _HAS_EXTRA:
+            (extra_len,) = _U32.unpack_from(buf, offset)
+            offset += _U32.size
+            metadata.update(pickle.loads(buf[offset : offset + extra_len]))
+            offset += extra_len
+        handle_list.append((sub_req_id, text, metadata, FinishStatus(status)))
+    return handle_list
+
+
+def _decode_req(buf: memoryview, offset: int):
+    prompt_type, prompt_len = _TYPE_AND_LEN.unpack_from(buf, offset)
+    offset += _TYPE_AND_LEN.size
+    if prompt_type == _PROMPT_STR:
+        prompt = str(buf[offset : offset + prompt_len], "utf-8")
+        offset += prompt_len
+    else:
+        prompt = buf[offset : offset + prompt_len * 4].cast("i").tolist()
+        offset += prompt_len * 4
+    (sampling_params_len,) = _U32.unpack_from(buf, offset)
+    offset += _U32.size
+    sampling_params = SamplingParams.from_buffer_copy(buf[offset : offset + sampling_params_len])
+    offset += sampling_params_len
+    mm_type, mm_len = _TYPE_AND_LEN.unpack_from(buf, offset)
+    offset += _TYPE_AND_LEN.size
+    if mm_type == _MM_NONE:
+        multimodal_params = None
+    elif mm_type == _MM_EMPTY:
+        # 只有 p d 节点会收到请求，延迟导入避免 pd master 之外的进程引入图片相关的依赖
+        from .multimodal_params import MultimodalParams
+
+        multimodal_params = MultimodalParams()
+    else:
+        multimodal_params = pickle.loads(buf[offset : offset + mm_len])
+    return prompt, sampling_params, multimodal_params
+
+
+def decode_pd_frame(data: bytes) -> Tuple[ObjType, object]:
+    """
+    解析 encode_* 生成的帧，返回与原来 pickle 消息相同的 (ObjType, payload)。
+    定长字段直接从接收到的数据上解析，不会为每个 token 复制数据。
+    """
+    buf = memoryview(data)
+    if buf[0] == _PICKLE_MAGIC:
+        return pickle.loads(data)
+    magic, version, obj_type = _FRAME_HEADER.unpack_from(buf, 0)
+    if magic != PD_FRAME_MAGIC or version != PD_FRAME_VERSION:
+        raise ValueError(f"unknown pd frame magic {magic} version {version}")
+    obj_type = ObjType(obj_type)
+    offset = _FRAME_HEADER.size
+    if obj_type == ObjType.TOKEN_PACKS:
+        return obj_type, _decode_token_packs(buf, offset)
+    elif obj_type == ObjType.REQ:
+        return obj_type, _decode_req(buf, offset)
+    elif obj_type == ObjType.ABORT:
+        return obj_type, _I64.unpack_from(buf, offset)[0]
+    else:
+        return obj_type, pickle.loads(buf[offset:])
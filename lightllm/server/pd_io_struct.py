@@ -27,6 +27,7 @@ class ObjType(enum.Enum):
     ABORT = 1
     REQ = 2
     TOKEN_PACKS = 3
+    NODE_STATUS = 4
 
 
 @dataclass
@@ -48,6 +49,19 @@ class PD_Client_Obj:
         return f"http://{self.client_ip_port}/pd_generate_stream"
 
 
+def get_pd_master_addrs(args) -> List[Tuple[str, int]]:
+    """
+    返回所有 pd master 副本的 (ip, port)，下标即为副本的 pd_master_replica_id。
+    """
+    if args.pd_master_replicas is None:
+        return [(args.pd_master_ip, args.pd_master_port)]
+    addrs = []
+    for addr in args.pd_master_replicas.split(","):
+        ip, port = addr.strip().rsplit(":", 1)
+        addrs.append((ip, int(port)))
+    return addrs
+
+
 @dataclass
 class UpKVStatus:
     type: str = "kv_move_status"
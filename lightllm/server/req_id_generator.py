@@ -9,22 +9,42 @@ MAX_BEST_OF = 8
 
 
 class ReqIDGenerator:
-    def __init__(self):
+    def __init__(self, shard_id=0, shard_num=1):
+        """
+        多个 pd master 副本各自生成 id 时，每个副本只生成 get_id_shard(id, shard_num) == shard_id 的 id，
+        节点可以据此将请求的 token 直接发送给创建请求的副本。
+        """
         from lightllm.server.core.objs.atomic_lock import AtomicShmLock
         from lightllm.server.core.objs.shm_array import ShmArray
         from lightllm.utils.envs_utils import get_unique_server_name
 
-        self.current_id = ShmArray(f"{get_unique_server_name()}_req_id_gen", (1,), dtype=np.int64)
+        assert 0 <= shard_id < shard_num
+        self.step = MAX_BEST_OF * shard_num
+        # 每个副本的计数器使用独立的共享内存，避免同一台机器上的多个副本链接到同一个计数器
+        name = f"{get_unique_server_name()}_req_id_gen"
+        if shard_num > 1:
+            name = f"{name}_{shard_id}"
+        self.current_id = ShmArray(name, (1,), dtype=np.int64)
         self.current_id.create_shm()
-        self.current_id.arr[0] = 0
-        self.lock = AtomicShmLock(f"{get_unique_server_name()}_req_id_gen_lock")
+        self.current_id.arr[0] = MAX_BEST_OF * shard_id
+        self.lock = AtomicShmLock(f"{name}_lock")
 
     def generate_id(self):
         with self.lock:
             id = self.current_id.arr[0]
-            self.current_id.arr[0] += MAX_BEST_OF
+            self.current_id.arr[0] += self.step
         return id
 
 
 def convert_sub_id_to_group_id(sub_req_id):
     return (sub_req_id // MAX_BEST_OF) * MAX_BEST_OF
+
+
+def get_detokenization_shard_id(req_id, shard_num):
+    # 同一个 group 中的请求分配到同一个 detokenization 进程中
+    return (req_id // MAX_BEST_OF) % shard_num
+
+
+def get_id_shard(req_id, shard_num):
+    # 请求所属的 pd master 副本，与 ReqIDGenerator 的 shard_id 对应
+    return (req_id // MAX_BEST_OF) % shard_num
@@ -1,6 +1,6 @@
 import time
 from dataclasses import dataclass
-from typing import Dict, List, Optional, Tuple, Union
+from typing import Callable, Dict, List, Optional, Tuple, Union
 from lightllm.server.core.objs import ShmReqManager, Req
 from lightllm.utils.log_utils import init_logger
 
@@ -40,7 +40,12 @@ class Batch:
                 req_list.append(req)
         return req_list
 
-    def filter_out_finished_req(self, shm_req_manager: ShmReqManager):
+    def filter_out_finished_req(
+        self, shm_req_manager: ShmReqManager, finished_req_callback: Optional[Callable[[Req], None]] = None
+    ):
+        """
+        finished_req_callback 在正常结束 (非 abort) 的请求被回收之前调用，可以读取请求最终的输出长度等信息。
+        """
         unfinished_req_ids = []
         for req in self.reqs:
             # 更新aborted 标记，可以触发推理进程主动退出aborted的请求。
@@ -49,6 +54,8 @@ class Batch:
 
             if req.shm_infer_released:
                 logger.info(f"router release req id {req.request_id}")
+                if finished_req_callback is not None and not req.is_aborted and req.finish_status.is_finished():
+                    finished_req_callback(req)
                 shm_req_manager.put_back_req_obj(req)
                 req = None
             else:
@@ -0,0 +1,402 @@
+import torch
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+from .radix_cache import RadixCache, time_gen
+from lightllm.common.mem_manager import MemoryManager
+
+
+def _to_array(data, dtype) -> np.ndarray:
+    if isinstance(data, torch.Tensor):
+        data = data.numpy()
+    return np.asarray(data, dtype=dtype)
+
+
+def array_match(key: np.ndarray, seq: np.ndarray) -> int:
+    """
+    向量化计算两个 int 数组的最长公共前缀长度，比较窗口按倍增的方式扩大，
+    这样对于很早就出现分叉的长 key，也不需要比较完整个 key。
+    """
+    n = min(len(key), len(seq))
+    start = 0
+    step = 64
+    while start < n:
+        end = min(n, start + step)
+        diff = np.flatnonzero(key[start:end] != seq[start:end])
+        if len(diff) != 0:
+            return start + int(diff[0])
+        start = end
+        step *= 4
+    return n
+
+
+class TokenArena:
+    """
+    按块管理的连续内存, 树节点的 key (int32) 和 value (int64) 都是块上的 numpy 视图，
+    节点分裂只是切分视图，不会发生拷贝。每个块记录其上存活的 token 数，存活数降为 0
+    的块会被直接丢弃，碎片化比较严重的时候由 ArrayRadixCache 进行整体的压缩。
+    """
+
+    def __init__(self, chunk_size: int = 1 << 16):
+        self.chunk_size = chunk_size
+        # chunk_id -> [capacity, live_token_num]
+        self.chunk_infos: Dict[int, List[int]] = {}
+        self._chunk_id = -1
+        self._next_chunk_id = 0
+        self._key_chunk: np.ndarray = None
+        self._value_chunk: np.ndarray = None
+        self._offset = 0
+        self.alloced_token_num = 0
+
+    def _new_chunk(self, capacity) -> int:
+        chunk_id = self._next_chunk_id
+        self._next_chunk_id += 1
+        self.chunk_infos[chunk_id] = [capacity, 0]
+        self.alloced_token_num += capacity
+        return chunk_id
+
+    def store(self, key: np.ndarray, value: np.ndarray) -> Tuple[int, np.ndarray, np.ndarray]:
+        n = len(key)
+        if n > self.chunk_size:
+            # 超长的 key 单独占用一个块
+            chunk_id = self._new_chunk(n)
+            self.chunk_infos[chunk_id][1] = n
+            return chunk_id, np.array(key, dtype=np.int32), np.array(value, dtype=np.int64)
+
+        if self._key_chunk is None or self._offset + n > self.chunk_size:
+            self._release_current_chunk()
+            self._chunk_id = self._new_chunk(self.chunk_size)
+            self._key_chunk = np.empty((self.chunk_size,), dtype=np.int32)
+            self._value_chunk = np.empty((self.chunk_size,), dtype=np.int64)
+            self._offset = 0
+
+        start, end = self._offset, self._offset + n
+        key_view = self._key_chunk[start:end]
+        value_view = self._value_chunk[start:end]
+        key_view[:] = key
+        value_view[:] = value
+        self._offset = end
+        self.chunk_infos[self._chunk_id][1] += n
+        return self._chunk_id, key_view, value_view
+
+    def release(self, chunk_id: int, token_num: int):
+        info = self.chunk_infos[chunk_id]
+        info[1] -= token_num
+        assert info[1] >= 0
+        if info[1] == 0 and chunk_id != self._chunk_id:
+            self._drop_chunk(chunk_id)
+        return
+
+    def _release_current_chunk(self):
+        if self._chunk_id in self.chunk_infos and self.chunk_infos[self._chunk_id][1] == 0:
+            self._drop_chunk(self._chunk_id)
+        self._chunk_id = -1
+        return
+
+    def _drop_chunk(self, chunk_id: int):
+        capacity, _ = self.chunk_infos.pop(chunk_id)
+        self.alloced_token_num -= capacity
+        return
+
+    def get_live_token_num(self) -> int:
+        return sum(info[1] for info in self.chunk_infos.values())
+
+
+class ArrayTreeNode:
+    def __init__(self):
+        self.children: Dict[int, ArrayTreeNode] = {}  # 这里的键 为 key 的第一个元素
+        self.parent: ArrayTreeNode = None
+        self.key: np.ndarray = None  # int32 token ids, TokenArena 中的视图
+        self.value: np.ndarray = None  # int64 token mem index, TokenArena 中的视图
+        self.chunk_id: int = -1
+        self.ref_counter = 0
+        self.time_id = time_gen.generate_time_id()  # 用于标识时间周期
+
+        self.node_value_len = 0
+        self.node_prefix_total_len = 0
+
+    @property
+    def token_id_key(self) -> torch.Tensor:
+        return torch.from_numpy(self.key)
+
+    @property
+    def token_mem_index_value(self) -> torch.Tensor:
+        return torch.from_numpy(self.value)
+
+    def get_compare_key(self):
+        return (0 if self.ref_counter == 0 else 1, len(self.children), self.time_id)
+
+    def split_node(self, prefix_len):
+        split_parent_node = ArrayTreeNode()
+        split_parent_node.parent = self.parent
+        split_parent_node.parent.children[int(self.key[0])] = split_parent_node
+        split_parent_node.key = self.key[0:prefix_len]
+        split_parent_node.value = self.value[0:prefix_len]
+        split_parent_node.chunk_id = self.chunk_id
+        split_parent_node.children = {}
+        split_parent_node.children[int(self.key[prefix_len])] = self
+        split_parent_node.ref_counter = self.ref_counter
+
+        split_parent_node.node_value_len = prefix_len
+        split_parent_node.node_prefix_total_len = split_parent_node.parent.node_prefix_total_len + prefix_len
+
+        self.key = self.key[prefix_len:]
+        self.value = self.value[prefix_len:]
+        self.parent = split_parent_node
+        self.node_value_len = len(self.value)
+        self.node_prefix_total_len = self.parent.node_prefix_total_len + self.node_value_len
+        return split_parent_node
+
+    def add_and_return_new_child(self, arena: TokenArena, key: np.ndarray, value: np.ndarray):
+        child = ArrayTreeNode()
+        child.chunk_id, child.key, child.value = arena.store(key, value)
+        first_token_key = int(child.key[0])
+        assert first_token_key not in self.children
+        self.children[first_token_key] = child
+        child.parent = self
+
+        child.node_value_len = len(child.value)
+        child.node_prefix_total_len = self.node_prefix_total_len + child.node_value_len
+        return child
+
+    def remove_child(self, child_node: "ArrayTreeNode"):
+        del self.children[int(child_node.key[0])]
+        child_node.parent = None
+        return
+
+    def update_time(self):
+        self.time_id = time_gen.generate_time_id()
+
+    def is_leaf(self):
+        return len(self.children) == 0
+
+
+class ArrayRadixCache(RadixCache):
+    """
+    与 RadixCache 接口一致的实现，节点的 key 和 value 保存在 TokenArena 管理的连续
+    numpy 数组中，前缀匹配使用向量化比较，插入和匹配都是迭代实现，避免了逐元素比较
+    和每跳一次的 tensor.item() 调用开销。
+    """
+
+    def __init__(
+        self,
+        unique_name,
+        total_token_num,
+        rank_in_node,
+        mem_manager: MemoryManager = None,
+        arena_chunk_size: int = 1 << 16,
+    ):
+        self.arena = TokenArena(arena_chunk_size)
+        super().__init__(unique_name, total_token_num, rank_in_node, mem_manager=mem_manager)
+
+    def _create_root_node(self):
+        root_node = ArrayTreeNode()
+        root_node.key = np.zeros((0,), dtype=np.int32)
+        root_node.value = np.zeros((0,), dtype=np.int64)
+        root_node.ref_counter = 1  # 初始化为 1 保证永远不会被 evict 掉
+        return root_node
+
+    def insert(self, key, value=None):
+        if value is None:
+            value = key
+
+        assert len(key) == len(value)
+        if len(key) == 0:
+            return 0
+        key = _to_array(key, np.int32)
+        value = _to_array(value, np.int64)
+        prefix_len = self._insert_helper(self.root_node, key, value)
+        self._publish_inserted_prefix(key, value, prefix_len)
+        return prefix_len
+
+    def _insert_helper(self, node: ArrayTreeNode, key: np.ndarray, value: np.ndarray):
+        visited_nodes: List[ArrayTreeNode] = []
+        prefix_total_len = 0
+        try:
+            while True:
+                if node.is_leaf():
+                    self.evict_tree_set.discard(node)
+                visited_nodes.append(node)
+
+                child: Optional[ArrayTreeNode] = node.children.get(int(key[0]), None)
+                if child is None:
+                    new_node = node.add_and_return_new_child(self.arena, key, value)
+                    self.tree_total_tokens_num.arr[0] += new_node.node_value_len
+                    self.evict_tree_set.add(new_node)
+                    return prefix_total_len
+
+                prefix_len = array_match(key, child.key)
+                if prefix_len == len(key):
+                    if child.is_leaf():
+                        self.evict_tree_set.discard(child)
+                    child.update_time()
+                    if child.is_leaf():
+                        self.evict_tree_set.add(child)
+                    return prefix_total_len + prefix_len
+
+                if prefix_len < child.node_value_len:
+                    if child.is_leaf():
+                        self.evict_tree_set.discard(child)
+
+                    split_parent_node = child.split_node(prefix_len)
+                    new_node = split_parent_node.add_and_return_new_child(
+                        self.arena, key[prefix_len:], value[prefix_len:]
+                    )
+                    self.tree_total_tokens_num.arr[0] += new_node.node_value_len
+                    self.evict_tree_set.add(new_node)
+
+                    if child.is_leaf():
+                        self.evict_tree_set.add(child)
+                    return prefix_total_len + prefix_len
+
+                # 完整匹配了 child 节点，继续向下匹配
+                prefix_total_len += prefix_len
+                key = key[prefix_len:]
+                value = value[prefix_len:]
+                node = child
+        finally:
+            # 与递归实现保持一致，越深的节点越先更新时间
+            for visited_node in reversed(visited_nodes):
+                visited_node.update_time()
+                if visited_node.is_leaf():
+                    self.evict_tree_set.add(visited_node)
+
+    def match_prefix(self, key, update_refs=False):
+        assert len(key) != 0
+        ans_value_list = []
+        tree_node = self._match_prefix_helper(
+            self.root_node, _to_array(key, np.int32), ans_value_list, update_refs=update_refs
+        )
+        if tree_node != self.root_node:
+            if len(ans_value_list) != 0:
+                value = torch.from_numpy(np.concatenate(ans_value_list))
+            else:
+                value = torch.zeros((0,), device="cpu", dtype=self._value_dtype)
+            return tree_node, len(value), value
+        else:
+            if update_refs:
+                self.dec_node_ref_counter(self.root_node)
+            return None, 0, None
+
+    def _match_prefix_helper(
+        self, node: ArrayTreeNode, key: np.ndarray, ans_value_list: list, update_refs=False
+    ) -> ArrayTreeNode:
+        visited_nodes: List[ArrayTreeNode] = []
+        try:
+            while True:
+                if node.is_leaf():
+                    self.evict_tree_set.discard(node)
+                visited_nodes.append(node)
+
+                if update_refs:
+                    node.ref_counter += 1
+                    # from 0 to 1 need update refs token num
+                    if node.ref_counter == 1:
+                        self.refed_tokens_num.arr[0] += node.node_value_len
+
+                if len(key) == 0:
+                    return node
+
+                child: Optional[ArrayTreeNode] = node.children.get(int(key[0]), None)
+                if child is None:
+                    return node
+
+                prefix_len = array_match(key, child.key)
+                if prefix_len == child.node_value_len:
+                    ans_value_list.append(child.value)
+                    key = key[prefix_len:]
+                    node = child
+                    continue
+
+                if child.is_leaf():
+                    self.evict_tree_set.discard(child)
+
+                split_parent_node = child.split_node(prefix_len)
+                ans_value_list.append(split_parent_node.value)
+
+                if update_refs:
+                    split_parent_node.ref_counter += 1
+                    # from 0 to 1 need update refs token num
+                    if split_parent_node.ref_counter == 1:
+                        self.refed_tokens_num.arr[0] += split_parent_node.node_value_len
+
+                if child.is_leaf():
+                    self.evict_tree_set.add(child)
+                return split_parent_node
+        finally:
+            for visited_node in reversed(visited_nodes):
+                visited_node.update_time()
+                if visited_node.is_leaf():
+                    self.evict_tree_set.add(visited_node)
+
+    def evict(self, need_remove_tokens, evict_callback):
+        if self.tree_total_tokens_num.arr[0] - self.refed_tokens_num.arr[0] < need_remove_tokens:
+            assert False, f"""can not free tree tokens {need_remove_tokens},
+                              tree_total_tokens_num {self.tree_total_tokens_num.arr[0]},
+                              refed_tokens_num {self.refed_tokens_num.arr[0]}"""
+        num_evicted = 0
+        evicted_infos = []
+        while num_evicted < need_remove_tokens:
+            node: ArrayTreeNode = self.evict_tree_set.pop(0)
+            assert (
+                node.ref_counter == 0 and len(node.children) == 0 and node != self.root_node
+            ), "error evict tree node state"
+            num_evicted += node.node_value_len
+            self._record_evicted_node(node, evicted_infos)
+            evict_callback(node.token_mem_index_value)
+            # update total token num
+            self.tree_total_tokens_num.arr[0] -= node.node_value_len
+            self.arena.release(node.chunk_id, node.node_value_len)
+            parent_node: ArrayTreeNode = node.parent
+            parent_node.remove_child(node)
+            if parent_node.is_leaf():
+                self.evict_tree_set.add(parent_node)
+
+        self._offload_evicted_nodes(evicted_infos)
+        self._maybe_compact_arena()
+        return
+
+    def _maybe_compact_arena(self):
+        """
+        当 arena 中已分配的容量远大于树中实际存活的 token 数时，将所有节点的
+        key 和 value 重新紧凑的拷贝到新的 arena 中，释放被少量存活节点占据的旧块。
+        """
+        arena = self.arena
+        live_token_num = int(self.tree_total_tokens_num.arr[0])
+        if arena.alloced_token_num <= 2 * live_token_num + 2 * arena.chunk_size:
+            return
+
+        new_arena = TokenArena(arena.chunk_size)
+        stack = list(self.root_node.children.values())
+        while stack:
+            node: ArrayTreeNode = stack.pop()
+            node.chunk_id, node.key, node.value = new_arena.store(node.key, node.value)
+            stack.extend(node.children.values())
+        self.arena = new_arena
+        return
+
+    def clear_tree_nodes(self):
+        """
+        该函数只在测试时调用
+        """
+        super().clear_tree_nodes()
+        self.arena = TokenArena(self.arena.chunk_size)
+        return
+
+    def dec_node_ref_counter(self, node: ArrayTreeNode):
+        if node is None:
+            return
+        # 如果减引用的是叶节点，需要先从 evict_tree_set 中移除
+        old_node = node
+        if old_node.is_leaf():
+            self.evict_tree_set.discard(old_node)
+
+        while node is not None:
+            if node.ref_counter == 1:
+                self.refed_tokens_num.arr[0] -= node.node_value_len
+            node.ref_counter -= 1
+            node = node.parent
+
+        # 加回。
+        if old_node.is_leaf():
+            self.evict_tree_set.add(old_node)
+        return
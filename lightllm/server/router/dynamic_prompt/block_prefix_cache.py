@@ -0,0 +1,272 @@
+import torch
+import numpy as np
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+from .radix_cache import RadixCache, time_gen
+from .array_radix_cache import _to_array
+from lightllm.common.mem_manager import MemoryManager
+from lightllm.utils.log_utils import init_logger
+
+logger = init_logger(__name__)
+
+
+class BlockNode:
+    def __init__(self, node_id: int):
+        self.node_id = node_id
+        self.parent: BlockNode = None
+        self.dict_key: Tuple[int, bytes] = None  # 在 BlockPrefixCache.block_dict 中的键
+        self.key: np.ndarray = None  # int32 token ids, 只读
+        self.value: np.ndarray = None  # int64 token mem index
+        self.ref_counter = 0
+        self.child_num = 0
+        self.time_id = time_gen.generate_time_id()  # 用于快照时估计节点的热度
+        # 不满一个 block 的尾部子节点的长度计数，用于在匹配时只探测存在的长度
+        self.partial_lens: Dict[int, int] = {}
+
+        self.node_value_len = 0
+        self.node_prefix_total_len = 0
+
+    @property
+    def token_id_key(self) -> torch.Tensor:
+        return torch.tensor(self.key, dtype=torch.int64)
+
+    @property
+    def token_mem_index_value(self) -> torch.Tensor:
+        return torch.from_numpy(self.value)
+
+    def is_leaf(self):
+        return self.child_num == 0
+
+
+class BlockPrefixCache(RadixCache):
+    """
+    按固定大小 token block 管理的 prompt cache。每个 block 以 (父节点 id, block 内容)
+    作为键放入一个全局字典中，形成链式的 hash 索引，一次查找只需要 O(block 数) 次字典
+    探测，也永远不需要分裂节点。请求尾部不满一个 block 的 token 也作为一个节点保存，
+    以保持 insert 接口对 [prefix_len:] 部分 token 所有权的约定，这样的节点后续也可以
+    继续挂载完整 block 的子节点，相当于对齐位置发生了偏移。可以被淘汰的叶子节点
+    放在一个 LRU 的 OrderedDict 中，避免了 SortedSet 在每次访问时的重新排序开销。
+    共享内存中的 refed_tokens_num 和 tree_total_tokens_num 与 RadixCache 保持一致，
+    router 端的 RadixCacheReadOnlyClient 不需要任何修改。
+    """
+
+    def __init__(
+        self,
+        unique_name,
+        total_token_num,
+        rank_in_node,
+        mem_manager: MemoryManager = None,
+        block_size: int = 32,
+    ):
+        assert block_size >= 1
+        self.block_size = block_size
+        super().__init__(unique_name, total_token_num, rank_in_node, mem_manager=mem_manager)
+
+    def _init_tree_state(self):
+        self._next_node_id = 0
+        self.root_node = self._create_root_node()
+        self.block_dict: Dict[Tuple[int, bytes], BlockNode] = {}
+        # 可以被淘汰的节点 (ref_counter == 0 且没有子节点)，按照访问时间排序
+        self.evict_lru: "OrderedDict[int, BlockNode]" = OrderedDict()
+
+    def _new_node(self) -> BlockNode:
+        node = BlockNode(self._next_node_id)
+        self._next_node_id += 1
+        return node
+
+    def _create_root_node(self):
+        root_node = self._new_node()
+        root_node.key = np.zeros((0,), dtype=np.int32)
+        root_node.value = np.zeros((0,), dtype=np.int64)
+        root_node.ref_counter = 1  # 初始化为 1 保证永远不会被 evict 掉
+        return root_node
+
+    def _walk(self, key: np.ndarray) -> Tuple[List[BlockNode], int]:
+        """
+        沿着链式索引进行匹配，优先探测完整的 block，探测失败时再尝试不满一个 block 的子节点,
+        返回匹配路径上的节点（不包含 root）和匹配的长度。
+        """
+        path: List[BlockNode] = []
+        node = self.root_node
+        pos = 0
+        block_size = self.block_size
+        key_len = len(key)
+        while pos < key_len:
+            child = None
+            if pos + block_size <= key_len:
+                child = self.block_dict.get((node.node_id, key[pos : pos + block_size].tobytes()), None)
+            if child is None:
+                child = self._match_partial(node, key, pos)
+            if child is None:
+                break
+            path.append(child)
+            node = child
+            pos += child.node_value_len
+        return path, pos
+
+    def _match_partial(self, node: BlockNode, key: np.ndarray, pos: int) -> BlockNode:
+        if not node.partial_lens:
+            return None
+        left_len = len(key) - pos
+        for partial_len in sorted(node.partial_lens.keys(), reverse=True):
+            if partial_len <= left_len:
+                child = self.block_dict.get((node.node_id, key[pos : pos + partial_len].tobytes()), None)
+                if child is not None:
+                    return child
+        return None
+
+    def _add_child(self, parent: BlockNode, key: np.ndarray, value: np.ndarray) -> BlockNode:
+        child = self._new_node()
+        child.parent = parent
+        child.dict_key = (parent.node_id, np.ascontiguousarray(key, dtype=np.int32).tobytes())
+        # key 直接复用字典键中的 bytes, 不额外保存一份
+        child.key = np.frombuffer(child.dict_key[1], dtype=np.int32)
+        child.value = np.array(value, dtype=np.int64)
+        child.node_value_len = len(child.key)
+        child.node_prefix_total_len = parent.node_prefix_total_len + child.node_value_len
+        self.block_dict[child.dict_key] = child
+
+        if parent.child_num == 0:
+            self.evict_lru.pop(parent.node_id, None)
+        parent.child_num += 1
+        if child.node_value_len < self.block_size:
+            parent.partial_lens[child.node_value_len] = parent.partial_lens.get(child.node_value_len, 0) + 1
+
+        self.tree_total_tokens_num.arr[0] += child.node_value_len
+        self.evict_lru[child.node_id] = child
+        return child
+
+    def _update_path_time(self, path: List[BlockNode]):
+        # 逆序更新，保证父节点的 time_id 不小于子节点
+        for path_node in reversed(path):
+            path_node.time_id = time_gen.generate_time_id()
+        return
+
+    def _touch(self, node: BlockNode):
+        if node.node_id in self.evict_lru:
+            self.evict_lru.move_to_end(node.node_id)
+        return
+
+    def insert(self, key, value=None):
+        if value is None:
+            value = key
+
+        assert len(key) == len(value)
+        if len(key) == 0:
+            return 0
+
+        key = _to_array(key, np.int32)
+        value = _to_array(value, np.int64)
+        path, pos = self._walk(key)
+        node = path[-1] if path else self.root_node
+        self._touch(node)
+        self._update_path_time(path)
+
+        prefix_len = pos
+        while pos < len(key):
+            end = min(pos + self.block_size, len(key))
+            node = self._add_child(node, key[pos:end], value[pos:end])
+            pos = end
+        self._publish_inserted_prefix(key, value, prefix_len)
+        return prefix_len
+
+    def match_prefix(self, key, update_refs=False):
+        assert len(key) != 0
+        key = _to_array(key, np.int32)
+        path, _ = self._walk(key)
+        if len(path) == 0:
+            return None, 0, None
+
+        self._update_path_time(path)
+        if update_refs:
+            for path_node in path:
+                path_node.ref_counter += 1
+                # from 0 to 1 need update refs token num
+                if path_node.ref_counter == 1:
+                    self.refed_tokens_num.arr[0] += path_node.node_value_len
+                    self.evict_lru.pop(path_node.node_id, None)
+        else:
+            self._touch(path[-1])
+
+        value = torch.from_numpy(np.concatenate([path_node.value for path_node in path]))
+        return path[-1], len(value), value
+
+    def dec_node_ref_counter(self, node: BlockNode):
+        if node is None:
+            return
+        while node is not None and node is not self.root_node:
+            if node.ref_counter == 1:
+                self.refed_tokens_num.arr[0] -= node.node_value_len
+            node.ref_counter -= 1
+            if node.ref_counter == 0 and node.child_num == 0:
+                self.evict_lru[node.node_id] = node
+            node = node.parent
+        return
+
+    def evict(self, need_remove_tokens, evict_callback):
+        if self.tree_total_tokens_num.arr[0] - self.refed_tokens_num.arr[0] < need_remove_tokens:
+            assert False, f"""can not free tree tokens {need_remove_tokens},
+                              tree_total_tokens_num {self.tree_total_tokens_num.arr[0]},
+                              refed_tokens_num {self.refed_tokens_num.arr[0]}"""
+        num_evicted = 0
+        evicted_infos = []
+        while num_evicted < need_remove_tokens:
+            _, node = self.evict_lru.popitem(last=False)
+            assert node.ref_counter == 0 and node.child_num == 0, "error evict tree node state"
+            num_evicted += node.node_value_len
+            self._record_evicted_node(node, evicted_infos)
+            evict_callback(node.token_mem_index_value)
+            self.tree_total_tokens_num.arr[0] -= node.node_value_len
+            self._remove_node(node)
+
+        self._offload_evicted_nodes(evicted_infos)
+        return
+
+    def _remove_node(self, node: BlockNode):
+        del self.block_dict[node.dict_key]
+        parent = node.parent
+        parent.child_num -= 1
+        if node.node_value_len < self.block_size:
+            parent.partial_lens[node.node_value_len] -= 1
+            if parent.partial_lens[node.node_value_len] == 0:
+                del parent.partial_lens[node.node_value_len]
+        node.parent = None
+        if parent is not self.root_node and parent.child_num == 0 and parent.ref_counter == 0:
+            # 父节点的访问时间早于子节点，放到 LRU 的最前面，使一条链可以被连续的淘汰
+            self.evict_lru[parent.node_id] = parent
+            self.evict_lru.move_to_end(parent.node_id, last=False)
+        return
+
+    def assert_leafs_is_right(self):
+        for node in self.evict_lru.values():
+            a = node.token_mem_index_value.cuda()
+            assert (self.mem_manager.mem_state[a] == 1).sum().item() == len(a)
+
+    def clear_tree_nodes(self):
+        """
+        该函数只在测试时调用
+        """
+        self.block_dict.clear()
+        self.evict_lru.clear()
+        self.root_node.child_num = 0
+        self.root_node.partial_lens = {}
+        self.tree_total_tokens_num.arr[0] = 0
+        self.refed_tokens_num.arr[0] = 0
+        return
+
+    def get_node_num(self):
+        return len(self.block_dict)
+
+    def iter_nodes(self):
+        # 父节点总是先于子节点创建，按照 node_id 排序即可保证父节点在前
+        return iter(sorted(self.block_dict.values(), key=lambda node: node.node_id))
+
+    def print_self(self, indent=0):
+        for node in self.block_dict.values():
+            print(
+                " " * indent,
+                f"id: {node.node_id} parent: {node.parent.node_id} k: {node.key[0:10]} v: {node.value[0:10]} "
+                f"refs: {node.ref_counter} prefix_total_len: {node.node_prefix_total_len} "
+                f"node_value_len: {node.node_value_len}",
+            )
+        return
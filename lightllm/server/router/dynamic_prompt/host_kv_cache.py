@@ -0,0 +1,253 @@
+import time
+import hashlib
+import torch
+import numpy as np
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from lightllm.common.mem_manager import MemoryManager
+from lightllm.utils.log_utils import init_logger
+from .shared_arr import SharedArray
+
+logger = init_logger(__name__)
+
+
+def prefix_digest(tokens: np.ndarray) -> bytes:
+    return hashlib.blake2b(np.ascontiguousarray(tokens, dtype=np.int32).tobytes(), digest_size=16).digest()
+
+
+class HostKvEntry:
+    def __init__(self, entry_id: int, parent_digest: bytes, digest: bytes, tokens: np.ndarray, kv_tensors: Dict):
+        self.entry_id = entry_id
+        self.parent_digest = parent_digest  # 该段 token 之前的完整前缀的摘要
+        self.digest = digest  # 包含该段 token 的完整前缀的摘要，用于链式的继续查找
+        self.tokens = tokens
+        self.kv_tensors: Dict[str, torch.Tensor] = kv_tensors  # 与 get_index_kv_buffer 的返回结构一致
+        self.nbytes = sum(t.numel() * t.element_size() for t in kv_tensors.values())
+
+
+class HostKvCacheStats:
+    """
+    host kv cache 的累计统计信息，推理进程的每个 rank 写入自己的一行，router 读取后通过 MetricClient 上报。
+    name 为 None 时只在进程内使用。
+    """
+
+    FIELDS = [
+        "lookup_num",
+        "hit_num",
+        "lookup_tokens",
+        "hit_tokens",
+        "used_bytes",
+        "offload_bytes",
+        "offload_time_us",
+        "load_bytes",
+        "load_time_us",
+        "dropped_bytes",
+    ]
+
+    def __init__(self, name: Optional[str], rank_num: int = 1, rank: int = 0):
+        self.rank = rank
+        if name is None:
+            self.arr = np.zeros((rank_num, len(self.FIELDS)), dtype=np.int64)
+        else:
+            self.shared_arr = SharedArray(name, (rank_num, len(self.FIELDS)), dtype=np.int64)
+            self.arr = self.shared_arr.arr
+        self.field_index = {field: index for index, field in enumerate(self.FIELDS)}
+
+    def add(self, field: str, value: int):
+        self.arr[self.rank, self.field_index[field]] += value
+        return
+
+    def set(self, field: str, value: int):
+        self.arr[self.rank, self.field_index[field]] = value
+        return
+
+    def get(self, field: str) -> int:
+        # 所有 rank 的累计值之和
+        return int(self.arr[:, self.field_index[field]].sum())
+
+    def get_hit_rate(self) -> float:
+        return self.get("hit_num") / max(1, self.get("lookup_num"))
+
+    def get_token_hit_rate(self) -> float:
+        return self.get("hit_tokens") / max(1, self.get("lookup_tokens"))
+
+    def get_gbps(self, direction: str) -> float:
+        return self.get(f"{direction}_bytes") / max(1, self.get(f"{direction}_time_us")) * 1e6 / 1024**3
+
+
+class HostKvCache:
+    """
+    prompt cache 在 host 内存 (pinned) 上的第二级缓存。radix cache 淘汰节点时，
+    通过 mem_manager.get_index_kv_buffer 批量的将其 kv 拷贝到 host 上保存，
+    后续请求在 gpu 上的前缀匹配结束的位置，如果能够在 host 上继续匹配到，
+    则通过 mem_manager.load_index_kv_buffer 将 kv 重新加载回 gpu。
+    host 上的缓存以字节数作为容量限制，按照 LRU 的方式淘汰。
+    """
+
+    def __init__(self, max_bytes: int, pin_memory: bool = None, stats: HostKvCacheStats = None):
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+        self.pin_memory = torch.cuda.is_available() if pin_memory is None else pin_memory
+        self._next_entry_id = 0
+        self.lru_entries: "OrderedDict[int, HostKvEntry]" = OrderedDict()
+        # parent_digest -> {first token id -> [entry, ...]}
+        self.parent_index: Dict[bytes, Dict[int, List[HostKvEntry]]] = {}
+        # 统计信息
+        self.stats = stats if stats is not None else HostKvCacheStats(None)
+        self.stats.set("used_bytes", 0)
+
+    def _sync(self):
+        if torch.cuda.is_available():
+            torch.cuda.current_stream().synchronize()
+        return
+
+    def _find_entry(self, parent_digest: bytes, tokens: np.ndarray) -> HostKvEntry:
+        for entry in self.parent_index.get(parent_digest, {}).get(int(tokens[0]), []):
+            if len(entry.tokens) == len(tokens) and np.array_equal(entry.tokens, tokens):
+                return entry
+        return None
+
+    def _add_entry(self, entry: HostKvEntry):
+        self.lru_entries[entry.entry_id] = entry
+        self.parent_index.setdefault(entry.parent_digest, {}).setdefault(int(entry.tokens[0]), []).append(entry)
+        self.used_bytes += entry.nbytes
+        self.stats.set("used_bytes", self.used_bytes)
+        return
+
+    def _remove_entry(self, entry: HostKvEntry):
+        del self.lru_entries[entry.entry_id]
+        first_token_dict = self.parent_index[entry.parent_digest]
+        entries = first_token_dict[int(entry.tokens[0])]
+        entries.remove(entry)
+        if len(entries) == 0:
+            del first_token_dict[int(entry.tokens[0])]
+            if len(first_token_dict) == 0:
+                del self.parent_index[entry.parent_digest]
+        self.used_bytes -= entry.nbytes
+        self.stats.set("used_bytes", self.used_bytes)
+        return
+
+    def _make_room(self, nbytes: int):
+        while self.used_bytes + nbytes > self.max_bytes and len(self.lru_entries) != 0:
+            _, entry = next(iter(self.lru_entries.items()))
+            self._remove_entry(entry)
+            self.stats.add("dropped_bytes", entry.nbytes)
+        return
+
+    @torch.no_grad()
+    def offload(self, evicted_infos: List[Tuple[torch.Tensor, torch.Tensor]], mem_manager: MemoryManager):
+        """
+        evicted_infos 中的每一项为 (被淘汰节点从 root 开始的完整前缀 token, 节点的 mem index)，
+        需要在这些 mem index 被 mem_manager 释放之前调用。
+        """
+        new_items = []
+        for prefix_key, mem_index in evicted_infos:
+            prefix_key = np.asarray(prefix_key, dtype=np.int32)
+            node_len = len(mem_index)
+            if node_len == 0:
+                continue
+            parent_digest = prefix_digest(prefix_key[: len(prefix_key) - node_len])
+            tokens = prefix_key[len(prefix_key) - node_len :].copy()
+            exist_entry = self._find_entry(parent_digest, tokens)
+            if exist_entry is not None:
+                self.lru_entries.move_to_end(exist_entry.entry_id)
+                continue
+            new_items.append((parent_digest, prefix_digest(prefix_key), tokens, mem_index))
+
+        if len(new_items) == 0:
+            return
+
+        start_time = time.time()
+        all_mem_index = torch.cat([item[3] for item in new_items]).to(torch.int64)
+        # 一次批量的 gather 所有被淘汰 token 的 kv
+        kv_dict = mem_manager.get_index_kv_buffer(all_mem_index)
+        offload_bytes = 0
+        start = 0
+        for parent_digest, digest, tokens, _ in new_items:
+            end = start + len(tokens)
+            host_tensors = {}
+            for name, tensor in kv_dict.items():
+                part = tensor[:, start:end]
+                host_tensor = torch.empty(part.shape, dtype=part.dtype, device="cpu", pin_memory=self.pin_memory)
+                host_tensor.copy_(part, non_blocking=True)
+                host_tensors[name] = host_tensor
+            start = end
+
+            entry = HostKvEntry(self._next_entry_id, parent_digest, digest, tokens, host_tensors)
+            self._next_entry_id += 1
+            if entry.nbytes > self.max_bytes:
+                self.stats.add("dropped_bytes", entry.nbytes)
+                continue
+            self._make_room(entry.nbytes)
+            self._add_entry(entry)
+            offload_bytes += entry.nbytes
+
+        self._sync()
+        self.stats.add("offload_bytes", offload_bytes)
+        self.stats.add("offload_time_us", int((time.time() - start_time) * 1e6))
+        return
+
+    def match(self, key: np.ndarray, start: int) -> List[Tuple[HostKvEntry, int]]:
+        """
+        从 key[start:] 开始在 host 缓存中进行链式的匹配，返回 [(entry, 使用的 token 数), ...]，
+        只有最后一个 entry 可能只使用其部分 token。
+        """
+        key = np.asarray(key, dtype=np.int32)
+        self.stats.add("lookup_num", 1)
+        self.stats.add("lookup_tokens", len(key) - start)
+        ans = []
+        if start >= len(key) or len(self.lru_entries) == 0:
+            return ans
+
+        parent_digest = prefix_digest(key[:start])
+        pos = start
+        while pos < len(key):
+            best_entry, best_len = None, 0
+            for entry in self.parent_index.get(parent_digest, {}).get(int(key[pos]), []):
+                cmp_len = min(len(entry.tokens), len(key) - pos)
+                diff = np.flatnonzero(entry.tokens[:cmp_len] != key[pos : pos + cmp_len])
+                match_len = cmp_len if len(diff) == 0 else int(diff[0])
+                if match_len > best_len:
+                    best_entry, best_len = entry, match_len
+            if best_entry is None:
+                break
+            self.lru_entries.move_to_end(best_entry.entry_id)
+            ans.append((best_entry, best_len))
+            pos += best_len
+            if best_len != len(best_entry.tokens):
+                break
+            parent_digest = best_entry.digest
+
+        if ans:
+            self.stats.add("hit_num", 1)
+            self.stats.add("hit_tokens", pos - start)
+        return ans
+
+    @torch.no_grad()
+    def load(self, matched: List[Tuple[HostKvEntry, int]], mem_index: torch.Tensor, mem_manager: MemoryManager):
+        start_time = time.time()
+        load_bytes = 0
+        start = 0
+        for entry, use_len in matched:
+            end = start + use_len
+            load_dict = {name: tensor[:, 0:use_len] for name, tensor in entry.kv_tensors.items()}
+            mem_manager.load_index_kv_buffer(mem_index[start:end].to(torch.int64), load_dict)
+            load_bytes += entry.nbytes * use_len // len(entry.tokens)
+            start = end
+        self._sync()
+        self.stats.add("load_bytes", load_bytes)
+        self.stats.add("load_time_us", int((time.time() - start_time) * 1e6))
+        return
+
+    def get_stats(self) -> Dict[str, float]:
+        return {
+            "host_used_bytes": self.used_bytes,
+            "host_entry_num": len(self.lru_entries),
+            "hit_rate": self.stats.get_hit_rate(),
+            "token_hit_rate": self.stats.get_token_hit_rate(),
+            "offload_bytes": self.stats.get("offload_bytes"),
+            "offload_gbps": self.stats.get_gbps("offload"),
+            "load_bytes": self.stats.get("load_bytes"),
+            "load_gbps": self.stats.get_gbps("load"),
+            "dropped_bytes": self.stats.get("dropped_bytes"),
+        }
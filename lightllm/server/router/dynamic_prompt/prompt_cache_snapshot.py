@@ -0,0 +1,282 @@
+import os
+import json
+import threading
+import torch
+import numpy as np
+from typing import Dict, List, Tuple
+from .radix_cache import RadixCache
+from lightllm.utils.log_utils import init_logger
+
+logger = init_logger(__name__)
+
+SNAPSHOT_MAGIC = b"LPCSNAP1"
+_SECTION_ALIGN = 4096
+
+
+def get_snapshot_file_path(snapshot_dir: str, rank: int) -> str:
+    return os.path.join(snapshot_dir, f"prompt_cache_rank_{rank}.snapshot")
+
+
+def _align(offset: int) -> int:
+    return (offset + _SECTION_ALIGN - 1) // _SECTION_ALIGN * _SECTION_ALIGN
+
+
+def _dtype_from_str(dtype_str: str) -> torch.dtype:
+    return getattr(torch, dtype_str.replace("torch.", ""))
+
+
+def select_hot_nodes(radix_cache: RadixCache, max_tokens: int) -> List[Tuple[object, int]]:
+    """
+    选出 prompt cache 中最热的不超过 max_tokens 个 token 所在的节点，返回 [(node, parent 在结果中的位置), ...]，
+    父节点总是排在子节点之前，parent 位置为 -1 表示其父节点为 root。
+    节点的热度为其子树中最大的 time_id，这样父节点的热度总是不低于子节点，保证选出的节点集合是前缀封闭的。
+    """
+    nodes = list(radix_cache.iter_nodes())
+    hot = {id(node): node.time_id for node in nodes}
+    depth = {id(radix_cache.root_node): 0}
+    for node in nodes:
+        depth[id(node)] = depth[id(node.parent)] + 1
+    # iter_nodes 保证父节点在前，逆序遍历即可完成子树热度的汇总
+    for node in reversed(nodes):
+        parent_id = id(node.parent)
+        if parent_id in hot:
+            hot[parent_id] = max(hot[parent_id], hot[id(node)])
+
+    nodes.sort(key=lambda node: (-hot[id(node)], depth[id(node)]))
+    selected_pos = {id(radix_cache.root_node): -1}
+    ans = []
+    token_num = 0
+    for node in nodes:
+        parent_id = id(node.parent)
+        if parent_id not in selected_pos or token_num + node.node_value_len > max_tokens:
+            continue
+        selected_pos[id(node)] = len(ans)
+        ans.append((node, selected_pos[parent_id]))
+        token_num += node.node_value_len
+    return ans
+
+
+@torch.no_grad()
+def save_prompt_cache_snapshot(radix_cache: RadixCache, file_path: str, max_tokens: int, chunk_token_num=4096):
+    """
+    文件格式: magic | header 长度 (uint64) | json header | 对齐后的各个数据段。
+    数据段依次为 parents(int32), node_lens(int32), keys(int32) 以及 get_index_kv_buffer 返回的
+    每一个 kv tensor, kv tensor 按照 (layer_num, token_num, 每层每个 token 的字节数) 的布局保存为 uint8,
+    加载时可以按层连续的读取。先写入临时文件再重命名，避免中途失败时破坏已有的快照。
+    """
+    selected = select_hot_nodes(radix_cache, max_tokens)
+    parents = np.array([parent_pos for _, parent_pos in selected], dtype=np.int32)
+    node_lens = np.array([node.node_value_len for node, _ in selected], dtype=np.int32)
+    token_num = int(node_lens.sum())
+    if token_num == 0:
+        logger.info("prompt cache is empty, skip saving snapshot")
+        return 0
+
+    keys = np.concatenate([np.asarray(node.token_id_key, dtype=np.int32) for node, _ in selected])
+    mem_index = torch.cat([node.token_mem_index_value.to(torch.int64) for node, _ in selected])
+
+    probe = radix_cache.mem_manager.get_index_kv_buffer(mem_index[0:1])
+    kv_infos = {}
+    for name, tensor in probe.items():
+        kv_infos[name] = {
+            "dtype": str(tensor.dtype),
+            "layer_num": tensor.shape[0],
+            "token_shape": list(tensor.shape[2:]),
+            "token_bytes": tensor[0, 0].numel() * tensor.element_size(),
+        }
+
+    header = {
+        "node_num": len(selected),
+        "token_num": token_num,
+        "kv_infos": kv_infos,
+        "sections": {},
+    }
+    offset = _align(len(SNAPSHOT_MAGIC) + 8 + 64 * 1024)  # 预留 header 的空间
+    for name, nbytes in [("parents", parents.nbytes), ("node_lens", node_lens.nbytes), ("keys", keys.nbytes)]:
+        header["sections"][name] = offset
+        offset = _align(offset + nbytes)
+    for name, info in kv_infos.items():
+        header["sections"][f"kv_{name}"] = offset
+        offset = _align(offset + info["layer_num"] * token_num * info["token_bytes"])
+    header_bytes = json.dumps(header).encode("utf-8")
+    assert len(header_bytes) <= 64 * 1024
+
+    os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+    tmp_path = file_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.truncate(offset)
+        f.write(SNAPSHOT_MAGIC)
+        f.write(np.uint64(len(header_bytes)).tobytes())
+        f.write(header_bytes)
+
+    mm = np.memmap(tmp_path, dtype=np.uint8, mode="r+")
+    mm[header["sections"]["parents"] : header["sections"]["parents"] + parents.nbytes] = parents.view(np.uint8)
+    mm[header["sections"]["node_lens"] : header["sections"]["node_lens"] + node_lens.nbytes] = node_lens.view(np.uint8)
+    mm[header["sections"]["keys"] : header["sections"]["keys"] + keys.nbytes] = keys.view(np.uint8)
+    kv_arrs = _kv_section_views(mm, header)
+    for start in range(0, token_num, chunk_token_num):
+        end = min(start + chunk_token_num, token_num)
+        kv_dict = radix_cache.mem_manager.get_index_kv_buffer(mem_index[start:end])
+        for name, tensor in kv_dict.items():
+            layer_num = tensor.shape[0]
+            data = tensor.contiguous().view(torch.uint8).reshape(layer_num, end - start, -1).cpu().numpy()
+            kv_arrs[name][:, start:end] = data
+    mm.flush()
+    del kv_arrs, mm
+    os.replace(tmp_path, file_path)
+    logger.info(f"save prompt cache snapshot to {file_path}, node num {len(selected)}, token num {token_num}")
+    return token_num
+
+
+def _read_header(mm: np.ndarray) -> Dict:
+    assert bytes(mm[0 : len(SNAPSHOT_MAGIC)]) == SNAPSHOT_MAGIC, "not a prompt cache snapshot file"
+    header_len = int(mm[len(SNAPSHOT_MAGIC) : len(SNAPSHOT_MAGIC) + 8].view(np.uint64)[0])
+    start = len(SNAPSHOT_MAGIC) + 8
+    return json.loads(bytes(mm[start : start + header_len]).decode("utf-8"))
+
+
+def _kv_section_views(mm: np.ndarray, header: Dict) -> Dict[str, np.ndarray]:
+    token_num = header["token_num"]
+    ans = {}
+    for name, info in header["kv_infos"].items():
+        start = header["sections"][f"kv_{name}"]
+        nbytes = info["layer_num"] * token_num * info["token_bytes"]
+        ans[name] = mm[start : start + nbytes].reshape(info["layer_num"], token_num, info["token_bytes"])
+    return ans
+
+
+class PromptCacheSnapshotLoader:
+    """
+    启动时加载 prompt cache 快照。start 时先为快照中的 token 申请好显存，然后在后台线程中
+    逐层的把 kv 从内存映射的文件拷贝到 mem_manager 对应的 buffer 中，服务在此期间可以正常的处理请求。
+    所有层都拷贝完成后，由推理线程在一个各个 rank 一致的时机调用 finish，将节点插入到 prompt cache 中。
+    kv 数据是通过 get_index_kv_buffer 返回的 key 名字找到 mem_manager 上同名的 buffer 进行按层写入的。
+    """
+
+    def __init__(self, file_path: str, radix_cache: RadixCache, done_callback=None):
+        self.file_path = file_path
+        self.radix_cache = radix_cache
+        # 后台线程加载结束后调用 done_callback(is_ok)
+        self.done_callback = done_callback
+        self.mem_manager = radix_cache.mem_manager
+        self.mem_index: torch.Tensor = None
+        self.load_thread: threading.Thread = None
+        self.load_error: Exception = None
+
+    def start(self) -> bool:
+        if not os.path.exists(self.file_path):
+            logger.info(f"prompt cache snapshot {self.file_path} not exists")
+            return False
+        # 使用 copy on write 的模式打开，torch.from_numpy 不会因为只读的内存产生警告，也不会改动文件
+        self.mm = np.memmap(self.file_path, dtype=np.uint8, mode="c")
+        self.header = _read_header(self.mm)
+        token_num = self.header["token_num"]
+
+        probe = self.mem_manager.get_index_kv_buffer(torch.tensor([0], dtype=torch.int64))
+        for name, tensor in probe.items():
+            info = self.header["kv_infos"].get(name, None)
+            if (
+                info is None
+                or info["dtype"] != str(tensor.dtype)
+                or info["layer_num"] != tensor.shape[0]
+                or info["token_shape"] != list(tensor.shape[2:])
+            ):
+                logger.warning(f"prompt cache snapshot {self.file_path} kv format not match, skip it")
+                return False
+        if token_num > self.mem_manager.can_use_mem_size:
+            logger.warning(f"prompt cache snapshot token num {token_num} is too large, skip it")
+            return False
+
+        self.mem_index = self.mem_manager.alloc(token_num).clone().to(torch.int64)
+        self.load_thread = threading.Thread(target=self._load_kv, daemon=True)
+        self.load_thread.start()
+        return True
+
+    @torch.no_grad()
+    def _load_kv(self):
+        try:
+            kv_arrs = _kv_section_views(self.mm, self.header)
+            token_num = self.header["token_num"]
+            use_cuda = torch.cuda.is_available() and self.mem_manager.kv_buffer.is_cuda
+            stream = torch.cuda.Stream() if use_cuda else None
+            device_index = self.mem_index.to(self.mem_manager.kv_buffer.device)
+            for layer_index in range(self.header["kv_infos"][next(iter(kv_arrs))]["layer_num"]):
+                for name, arr in kv_arrs.items():
+                    info = self.header["kv_infos"][name]
+                    src = torch.from_numpy(arr[layer_index]).view(_dtype_from_str(info["dtype"]))
+                    src = src.view(token_num, *info["token_shape"])
+                    dest_buffer = getattr(self.mem_manager, name)
+                    if use_cuda:
+                        with torch.cuda.stream(stream):
+                            dest_buffer[layer_index, device_index] = src.pin_memory().to(
+                                dest_buffer.device, non_blocking=True
+                            )
+                        stream.synchronize()
+                    else:
+                        dest_buffer[layer_index, device_index] = src
+        except BaseException as e:
+            logger.exception(str(e))
+            self.load_error = e
+
+        if self.done_callback is not None:
+            self.done_callback(self.load_error is None)
+        return
+
+    def is_loading(self) -> bool:
+        return self.load_thread is not None and self.load_thread.is_alive()
+
+    def is_ready(self) -> bool:
+        return self.load_thread is not None and not self.load_thread.is_alive() and self.load_error is None
+
+    def finish(self, commit: bool) -> int:
+        """
+        commit 为 False 时 (例如某个 rank 加载失败)，放弃加载的数据并释放申请的显存。返回插入的 token 数量。
+        """
+        if self.load_thread is None:
+            return 0
+        self.load_thread.join()
+        self.load_thread = None
+        if not commit or self.load_error is not None:
+            self.mem_manager.free(self.mem_index)
+            self.mem_index = None
+            return 0
+
+        sections = self.header["sections"]
+        node_num, token_num = self.header["node_num"], self.header["token_num"]
+        parents = self.mm[sections["parents"] : sections["parents"] + node_num * 4].view(np.int32)
+        node_lens = self.mm[sections["node_lens"] : sections["node_lens"] + node_num * 4].view(np.int32)
+        keys = self.mm[sections["keys"] : sections["keys"] + token_num * 4].view(np.int32)
+        node_starts = np.zeros(node_num, dtype=np.int64)
+        node_starts[1:] = np.cumsum(node_lens)[:-1]
+
+        # 只需要插入叶子节点所在的完整路径
+        is_leaf = np.ones(node_num, dtype=bool)
+        is_leaf[parents[parents >= 0]] = False
+        path_offsets: List[np.ndarray] = [None] * node_num
+        owned = np.zeros(token_num, dtype=bool)
+        for i in range(node_num):
+            own_offsets = np.arange(node_starts[i], node_starts[i] + node_lens[i], dtype=np.int64)
+            path_offsets[i] = own_offsets if parents[i] < 0 else np.concatenate([path_offsets[parents[i]], own_offsets])
+            if is_leaf[i]:
+                self._insert_path(keys, path_offsets[i], owned)
+
+        # 已经存在于 prompt cache 中的部分不会被树持有，需要释放
+        if not owned.all():
+            self.mem_manager.free(self.mem_index[~torch.from_numpy(owned)])
+        self.mem_index = None
+        inserted = int(owned.sum())
+        logger.info(f"load prompt cache snapshot {self.file_path}, node num {node_num}, insert token num {inserted}")
+        return inserted
+
+    def _insert_path(self, keys: np.ndarray, offsets: np.ndarray, owned: np.ndarray):
+        key = torch.from_numpy(keys[offsets].astype(np.int64))
+        _, kv_len, _ = self.radix_cache.match_prefix(key, update_refs=False)
+        # 树中已有的节点和快照中的节点切分位置不同时 (如 block 模式下服务已经插入了不满一个 block 的节点)，
+        # 同一个 token 的 mem index 可能被再次交给树持有，这种情况下只插入到第一个已经被持有的位置之前
+        dup_pos = np.flatnonzero(owned[offsets[kv_len:]])
+        insert_len = len(offsets) if len(dup_pos) == 0 else kv_len + int(dup_pos[0])
+        if insert_len <= kv_len:
+            return
+        prefix_len = self.radix_cache.insert(key[0:insert_len], self.mem_index[offsets[0:insert_len]])
+        owned[offsets[prefix_len:insert_len]] = True
+        return
@@ -5,6 +5,8 @@ from typing import Tuple, Dict, Set, List
 from sortedcontainers import SortedSet
 from .shared_arr import SharedArray
 from lightllm.common.mem_manager import MemoryManager
+from .host_kv_cache import HostKvCache
+from .shared_prefix_index import SharedPrefixIndex
 
 
 class UniqueTimeIdGenerator:
@@ -100,14 +102,12 @@ class RadixCache:
         self.mem_manager = mem_manager
         self._key_dtype = torch.int64
         self._value_dtype = torch.int64
+        # 可选的 host 内存二级缓存，被淘汰节点的 kv 会被卸载到其中
+        self.host_kv_cache: HostKvCache = None
+        # 可选的共享前缀索引，用于 router 估计等待中的请求的 prompt cache 命中长度
+        self.prefix_index: SharedPrefixIndex = None
 
-        self.root_node = TreeNode()
-        self.root_node.token_id_key = torch.zeros((0,), device="cpu", dtype=self._key_dtype)
-        self.root_node.token_mem_index_value = torch.zeros((0,), device="cpu", dtype=self._value_dtype)
-        self.root_node.ref_counter = 1  # 初始化为 1 保证永远不会被 evict 掉
-
-        self.evict_tree_set: Set[TreeNode] = SortedSet(key=lambda x: x.get_compare_key())  # 自定义比较器
-        self.evict_tree_set.add(self.root_node)
+        self._init_tree_state()
 
         self.refed_tokens_num = SharedArray(f"{unique_name}_refed_tokens_num_{rank_in_node}", (1,), dtype=np.int64)
         self.refed_tokens_num.arr[0] = 0
@@ -116,6 +116,19 @@ class RadixCache:
         )
         self.tree_total_tokens_num.arr[0] = 0
 
+    def _init_tree_state(self):
+        self.root_node = self._create_root_node()
+
+        self.evict_tree_set: Set[TreeNode] = SortedSet(key=lambda x: x.get_compare_key())  # 自定义比较器
+        self.evict_tree_set.add(self.root_node)
+
+    def _create_root_node(self):
+        root_node = TreeNode()
+        root_node.token_id_key = torch.zeros((0,), device="cpu", dtype=self._key_dtype)
+        root_node.token_mem_index_value = torch.zeros((0,), device="cpu", dtype=self._value_dtype)
+        root_node.ref_counter = 1  # 初始化为 1 保证永远不会被 evict 掉
+        return root_node
+
     def insert(self, key, value=None):
         if value is None:
             value = key
@@ -123,7 +136,14 @@ class RadixCache:
         assert len(key) == len(value)  # and len(key) >= 1
         if len(key) == 0:
             return 0
-        return self._insert_helper(self.root_node, key, value)
+        prefix_len = self._insert_helper(self.root_node, key, value)
+        self._publish_inserted_prefix(key, value, prefix_len)
+        return prefix_len
+
+    def _publish_inserted_prefix(self, key, value, prefix_len):
+        if self.prefix_index is not None:
+            self.prefix_index.insert(key, value, prefix_len)
+        return
 
     def _insert_helper(self, node: TreeNode, key, value):
         if node.is_leaf():
@@ -247,12 +267,14 @@ class RadixCache:
                               tree_total_tokens_num {self.tree_total_tokens_num.arr[0]},
                               refed_tokens_num {self.refed_tokens_num.arr[0]}"""
         num_evicted = 0
+        evicted_infos = []
         while num_evicted < need_remove_tokens:
             node: TreeNode = self.evict_tree_set.pop(0)
             assert (
                 node.ref_counter == 0 and len(node.children) == 0 and node != self.root_node
             ), "error evict tree node state"
             num_evicted += len(node.token_mem_index_value)
+            self._record_evicted_node(node, evicted_infos)
             evict_callback(node.token_mem_index_value)
             # update total token num
             self.tree_total_tokens_num.arr[0] -= len(node.token_mem_index_value)
@@ -261,8 +283,30 @@ class RadixCache:
             if parent_node.is_leaf():
                 self.evict_tree_set.add(parent_node)
 
+        self._offload_evicted_nodes(evicted_infos)
+        return
+
+    def _record_evicted_node(self, node, evicted_infos: list):
+        if self.prefix_index is not None:
+            self.prefix_index.remove_by_mem_index(node.token_mem_index_value)
+        # 需要在节点从树上摘除之前记录其完整的前缀
+        if self.host_kv_cache is not None:
+            evicted_infos.append((self.get_node_prefix_key(node), node.token_mem_index_value))
+        return
+
+    def _offload_evicted_nodes(self, evicted_infos: list):
+        # evict_callback 只是收集了需要释放的 mem index, 此时这些 token 的 kv 依然有效
+        if self.host_kv_cache is not None and len(evicted_infos) != 0 and self.mem_manager is not None:
+            self.host_kv_cache.offload(evicted_infos, self.mem_manager)
         return
 
+    def get_node_prefix_key(self, node) -> torch.Tensor:
+        keys = []
+        while node is not None and node is not self.root_node:
+            keys.append(node.token_id_key)
+            node = node.parent
+        return torch.cat(keys[::-1])
+
     def assert_leafs_is_right(self):
         for node in self.evict_tree_set:
             if node.is_leaf() and node.ref_counter == 0:
@@ -306,6 +350,16 @@ class RadixCache:
             self.evict_tree_set.add(old_node)
         return
 
+    def iter_nodes(self):
+        """
+        遍历树中除 root 外的所有节点，父节点总是先于子节点被返回。
+        """
+        stack = list(self.root_node.children.values())
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(node.children.values())
+
     def get_refed_tokens_num(self):
         return self.refed_tokens_num.arr[0]
 
@@ -341,17 +395,52 @@ class RadixCache:
             self.mem_manager.free(mem_index)
         return
 
+    def restore_from_host_kv_cache(self, key) -> int:
+        """
+        在 gpu 上的前缀匹配结束的位置，继续从 host 缓存中匹配，将命中部分的 kv 重新加载回 gpu
+        并插入到树中，之后的 match_prefix 就可以直接命中这些 token。返回恢复的 token 数量。
+        """
+        if self.host_kv_cache is None or len(key) == 0:
+            return 0
+
+        # 增加引用计数，防止为恢复的 token 申请显存时，已经匹配上的部分被淘汰掉
+        share_node, kv_len, value = self.match_prefix(key, update_refs=True)
+        try:
+            matched = self.host_kv_cache.match(np.asarray(key, dtype=np.int32), kv_len)
+            restore_len = sum(use_len for _, use_len in matched)
+            if restore_len == 0:
+                return 0
+            can_use_token_num = self.mem_manager.can_use_mem_size + self.get_tree_total_tokens_num()
+            if restore_len > can_use_token_num - self.get_refed_tokens_num():
+                return 0
+
+            self.free_radix_cache_to_get_enough_token(restore_len)
+            mem_index = self.mem_manager.alloc(restore_len).clone().to(self._value_dtype)
+            self.host_kv_cache.load(matched, mem_index, self.mem_manager)
+            if value is not None:
+                mem_index = torch.cat([value.to(self._value_dtype), mem_index])
+            new_key = torch.as_tensor(np.asarray(key[0 : kv_len + restore_len], dtype=np.int64))
+            prefix_len = self.insert(new_key, mem_index)
+            if prefix_len > kv_len:
+                self.mem_manager.free(mem_index[kv_len:prefix_len])
+            return restore_len
+        finally:
+            self.dec_node_ref_counter(share_node)
+
 
 class _RadixCacheReadOnlyClient:
     """
     router 端只读用的客户端，用于从共享内存中读取树结构中的信息，用于进行prompt cache 的调度估计。
     """
 
-    def __init__(self, unique_name, total_token_num, rank_in_node):
+    def __init__(self, unique_name, total_token_num, rank_in_node, use_prefix_index=False):
         self.refed_tokens_num = SharedArray(f"{unique_name}_refed_tokens_num_{rank_in_node}", (1,), dtype=np.int64)
         self.tree_total_tokens_num = SharedArray(
             f"{unique_name}_tree_total_tokens_num_{rank_in_node}", (1,), dtype=np.int64
         )
+        self.prefix_index: SharedPrefixIndex = None
+        if use_prefix_index:
+            self.prefix_index = SharedPrefixIndex(unique_name, total_token_num, rank_in_node)
 
     def get_refed_tokens_num(self):
         return self.refed_tokens_num.arr[0]
@@ -362,11 +451,14 @@ class _RadixCacheReadOnlyClient:
     def get_unrefed_tokens_num(self):
         return self.tree_total_tokens_num.arr[0] - self.refed_tokens_num.arr[0]
 
+    def get_prefix_match_len(self, block_hashes: np.ndarray):
+        return self.prefix_index.match_len(block_hashes)
+
 
 class RadixCacheReadOnlyClient:
-    def __init__(self, unique_name, total_token_num, node_world_size, dp_world_size):
+    def __init__(self, unique_name, total_token_num, node_world_size, dp_world_size, use_prefix_index=False):
         self.dp_rank_clients: List[_RadixCacheReadOnlyClient] = [
-            _RadixCacheReadOnlyClient(unique_name, total_token_num, rank_in_node)
+            _RadixCacheReadOnlyClient(unique_name, total_token_num, rank_in_node, use_prefix_index=use_prefix_index)
             for rank_in_node in range(0, node_world_size, dp_world_size)
         ]
 
@@ -378,3 +470,10 @@ class RadixCacheReadOnlyClient:
 
     def get_unrefed_tokens_num(self, dp_rank_in_node):
         return self.dp_rank_clients[dp_rank_in_node].get_unrefed_tokens_num()
+
+    def get_prefix_match_len(self, dp_rank_in_node, block_hashes: np.ndarray):
+        """
+        估计按照 get_prefix_block_hashes 切分的 prompt 在该 dp 的 prompt cache 中可以命中的前缀长度，
+        需要推理进程开启了共享前缀索引。
+        """
+        return self.dp_rank_clients[dp_rank_in_node].get_prefix_match_len(block_hashes)
@@ -0,0 +1,110 @@
+import torch
+import hashlib
+import numpy as np
+from .shared_arr import SharedArray
+
+PREFIX_INDEX_BLOCK_SIZE = 64
+
+
+def _to_numpy(data, dtype) -> np.ndarray:
+    if isinstance(data, torch.Tensor):
+        data = data.detach().cpu().numpy()
+    return np.ascontiguousarray(data, dtype=dtype)
+
+
+def get_prefix_block_hashes(
+    token_ids, block_size: int = PREFIX_INDEX_BLOCK_SIZE, start_block: int = 0, prev_hash: int = 0
+) -> np.ndarray:
+    """
+    将 token_ids 按照 block_size 切分，返回每个完整块的链式 hash (包含之前所有块的内容)，
+    不满一个块的尾部不参与计算。hash 需要在推理进程和 router 进程中保持一致，所以不能使用 python 内置的 hash。
+    start_block 大于 0 时，prev_hash 为第 start_block - 1 个块的 hash，从该块之后继续计算，只返回之后的块的 hash。
+    """
+    token_ids = _to_numpy(token_ids, np.int32)
+    block_num = len(token_ids) // block_size
+    hashes = np.zeros((max(0, block_num - start_block),), dtype=np.int64)
+    prev_digest = b"" if start_block == 0 else int(prev_hash).to_bytes(8, "little", signed=True)
+    for i in range(start_block, block_num):
+        digest = hashlib.blake2b(
+            prev_digest + token_ids[i * block_size : (i + 1) * block_size].tobytes(), digest_size=8
+        ).digest()
+        block_hash = int.from_bytes(digest, "little", signed=True)
+        # 0 用于表示空槽位，链式计算使用替换后的值，保证可以从任意一个已经发布的块继续计算
+        block_hash = 1 if block_hash == 0 else block_hash
+        hashes[i - start_block] = block_hash
+        prev_digest = block_hash.to_bytes(8, "little", signed=True)
+    return hashes
+
+
+class SharedPrefixIndex:
+    """
+    推理进程将 prompt cache 中已经缓存的前缀块的 hash 发布到共享内存中的直接映射 hash 表中，
+    router 进程只读的查询一个等待中的请求可能命中的前缀长度，用于调度的估计。
+    hash 冲突时后写入的块会覆盖之前的块，所以查询的结果只是一个近似值。
+    推理进程额外记录每个块最后一个 token 所在的 mem index，当该 token 的 kv 被 evict 时，将对应的块从表中删除。
+    """
+
+    def __init__(self, unique_name, total_token_num, rank_in_node, block_size: int = PREFIX_INDEX_BLOCK_SIZE):
+        self.block_size = block_size
+        slot_num = 1
+        while slot_num < 2 * max(1, total_token_num // block_size):
+            slot_num *= 2
+        self.slot_mask = slot_num - 1
+        self.table = SharedArray(f"{unique_name}_prefix_index_{rank_in_node}", (slot_num,), dtype=np.int64)
+        self.mem_index_to_hash: np.ndarray = None
+
+    def init_writer(self, total_token_num):
+        # 只有推理进程需要调用
+        self.table.arr[:] = 0
+        self.mem_index_to_hash = np.zeros((total_token_num + 1,), dtype=np.int64)
+        return
+
+    def insert(self, key, value, prefix_len: int):
+        """
+        key 的 [prefix_len:] 部分是新插入 prompt cache 的 token，value 为其对应的 mem index。
+        前缀部分的块已经发布过，其 hash 记录在块最后一个 token 的 mem index 上，从最后一个记录的 hash 继续计算，
+        不需要每次都从第一个块开始重新计算整个 key 的 hash。
+        """
+        block_num = len(key) // self.block_size
+        if block_num == 0:
+            return
+        value = _to_numpy(value, np.int64)
+        ends = np.arange(1, block_num + 1) * self.block_size - 1
+        start_block, prev_hash = 0, 0
+        old_block_num = int(np.searchsorted(ends, prefix_len))
+        if old_block_num > 0:
+            # 前缀中与已有节点重复的 token 的 mem index 上没有记录 hash
+            old_hashes = self.mem_index_to_hash[value[ends[:old_block_num]]]
+            published = np.flatnonzero(old_hashes)
+            if len(published) > 0:
+                start_block = int(published[-1]) + 1
+                prev_hash = int(old_hashes[published[-1]])
+        hashes = get_prefix_block_hashes(key, self.block_size, start_block, prev_hash)
+        if len(hashes) == 0:
+            return
+        self.table.arr[hashes & self.slot_mask] = hashes
+        ends = ends[start_block:]
+        new_mask = ends >= prefix_len
+        self.mem_index_to_hash[value[ends[new_mask]]] = hashes[new_mask]
+        return
+
+    def remove_by_mem_index(self, mem_index):
+        mem_index = _to_numpy(mem_index, np.int64)
+        hashes = self.mem_index_to_hash[mem_index]
+        valid = hashes != 0
+        if not valid.any():
+            return
+        hashes = hashes[valid]
+        slots = hashes & self.slot_mask
+        # 槽位可能已经被冲突的其他块覆盖
+        slots = slots[self.table.arr[slots] == hashes]
+        self.table.arr[slots] = 0
+        self.mem_index_to_hash[mem_index[valid]] = 0
+        return
+
+    def match_len(self, block_hashes: np.ndarray) -> int:
+        if len(block_hashes) == 0:
+            return 0
+        hit = self.table.arr[block_hashes & self.slot_mask] == block_hashes
+        matched_block_num = len(hit) if hit.all() else int(np.argmin(hit))
+        return matched_block_num * self.block_size
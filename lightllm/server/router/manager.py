@@ -20,12 +20,15 @@ from typing import Dict, List, Optional
 from .batch import Batch
 from .model_infer.model_rpc import start_model_process, ModelRpcClient
 from .req_queue import build_req_queue
+from .req_queue.output_len_estimator import build_output_len_estimator
 from lightllm.utils.infer_utils import calculate_time
-from lightllm.server.core.objs.io_objs import GroupReqIndexes
+from lightllm.server.core.objs.io_objs import GroupReqIndexes, PromptCacheSnapshotCmd, PromptCacheSnapshotStatus
 from lightllm.server.core.objs import ShmReqManager
 from .dynamic_prompt.radix_cache import RadixCacheReadOnlyClient
 from .stats import Stats
-from .pause_strategy import Fcfs, select_paused_reqs
+from .pause_strategy import Fcfs, PriorityRecoverable, select_paused_reqs, select_preempted_reqs
+from .model_infer.kv_swap_pool import KvSwapStats
+from .dynamic_prompt.host_kv_cache import HostKvCacheStats
 from lightllm.utils.log_utils import init_logger, log_time_ready
 from lightllm.server.router.token_load import TokenLoad
 from lightllm.server.metrics.manager import MetricClient
@@ -34,6 +37,7 @@ from lightllm.common.mem_manager import ReadOnlyStaticsMemoryManager
 from lightllm.utils.graceful_utils import graceful_registry
 from lightllm.utils.process_check import start_parent_check_thread
 from lightllm.utils.envs_utils import get_unique_server_name
+from lightllm.server.req_id_generator import get_detokenization_shard_id
 
 logger = init_logger(__name__)
 
@@ -61,6 +65,8 @@ class RouterManager:
         self.read_only_statics_mem_manager = ReadOnlyStaticsMemoryManager()
         # 初始化 radix_cache_client 用于读取 prompt cache 的管理信息
         self.radix_cache_client = None
+        # 调度时估计请求的输出长度，在请求结束时在线更新
+        self.output_len_estimator = build_output_len_estimator(args)
 
         # 共享变量，用于存储router端调度分析得到的机器负载信息
         self.shared_token_load = TokenLoad(f"{get_unique_server_name()}_shared_token_load", self.dp_size_in_node)
@@ -71,7 +77,30 @@ class RouterManager:
             self.shared_token_load.set_logical_max_load(0.0, dp_index)
             self.shared_token_load.set_dynamic_max_load(0.0, dp_index)
 
+        # 推理进程写入的 kv 交换统计信息，在推理进程启动前清零
+        self.kv_swap_stats = None
+        if args.kv_swap_host_mem_gb > 0:
+            self.kv_swap_stats = KvSwapStats(f"{get_unique_server_name()}_kv_swap_stats", self.node_world_size)
+            self.kv_swap_stats.arr.fill(0)
+        # 推理进程写入的 host kv cache 统计信息，同样在推理进程启动前清零
+        self.host_kv_cache_stats = None
+        if args.use_dynamic_prompt_cache and args.prompt_cache_host_mem_gb > 0:
+            self.host_kv_cache_stats = HostKvCacheStats(
+                f"{get_unique_server_name()}_host_kv_cache_stats", self.node_world_size
+            )
+            self.host_kv_cache_stats.arr.fill(0)
+
         self.pause_strategy = Fcfs()
+        self.enable_priority_schedule = args.enable_priority_schedule
+        if self.enable_priority_schedule:
+            self.pause_strategy = PriorityRecoverable(args.use_dynamic_prompt_cache)
+        # 等待过久的高优先级请求抢占低优先级的运行请求，p d 分离模式下不进行暂停
+        self.enable_priority_preempt = (
+            self.enable_priority_schedule
+            and args.priority_preempt_wait_ms >= 0
+            and args.run_mode not in ["prefill", "decode"]
+        )
+        self.priority_preempt_wait_time = args.priority_preempt_wait_ms / 1000.0
         self.running_batch: Batch = None
         self.eos_id = args.eos_id
         self.has_wait_tokens = 0
@@ -80,8 +109,11 @@ class RouterManager:
         self.recv_from_httpserver = context.socket(zmq.PULL)
         self.recv_from_httpserver.bind(f"{args.zmq_mode}127.0.0.1:{router_port}")
 
-        self.send_to_detokenization = context.socket(zmq.PUSH)
-        self.send_to_detokenization.connect(f"{args.zmq_mode}127.0.0.1:{detokenization_port}")
+        # 请求按照 request id 分片发送到多个 detokenization 进程中
+        self.send_to_detokenizations = []
+        for detok_port in args.detokenization_ports:
+            self.send_to_detokenizations.append(context.socket(zmq.PUSH))
+            self.send_to_detokenizations[-1].connect(f"{args.zmq_mode}127.0.0.1:{detok_port}")
 
         if self.is_multinode_tp:
             self.mulitnode_group = dist.init_process_group(
@@ -108,6 +140,13 @@ class RouterManager:
         self.overlap_thread_pool = concurrent.futures.ThreadPoolExecutor(max_workers=1)
         self.schedule_task = None
         self.overlap_event = threading.Event()
+
+        # prompt cache 快照的保存和加载，只支持单机部署
+        self.enable_prompt_cache_snapshot = args.use_dynamic_prompt_cache and self.nnodes == 1
+        self.prompt_cache_snapshot_status = PromptCacheSnapshotStatus(self.node_world_size)
+        self.prompt_cache_snapshot_status.reset()
+        self.is_prompt_cache_snapshot_loading = False
+        self.prompt_cache_snapshot_cmds: List[PromptCacheSnapshotCmd] = []
         return
 
     async def wait_to_model_ready(self):
@@ -118,8 +157,6 @@ class RouterManager:
         self.mem_queues: List[torch.multiprocessing.Queue] = [
             torch.multiprocessing.Queue() for _ in range(self.world_size)
         ]
-        self.rpc_event = multiprocessing.Event()
-        self.rpc_finished_event = multiprocessing.Event()
 
         assert (self.world_size % self.nnodes) == 0
         node_world_size = self.world_size // self.nnodes
@@ -129,8 +166,6 @@ class RouterManager:
                 rank=rank_id,
                 rank_in_node=rank_id % node_world_size,
                 node_world_size=node_world_size,
-                rpc_event=self.rpc_event,
-                rpc_finished_event=self.rpc_finished_event,
                 info_queue=self.info_queue,
                 mem_queue=self.mem_queues[rank_id],
                 router_lock=self.router_lock,
@@ -140,8 +175,7 @@ class RouterManager:
         self.model_rpc_client = ModelRpcClient(
             model_infer_servers=self.model_rpc_servers,
             world_size=self.world_size,
-            rpc_event=self.rpc_event,
-            rpc_finished_event=self.rpc_finished_event,
+            node_world_size=node_world_size,
         )
 
         kvargs = {
@@ -188,7 +222,9 @@ class RouterManager:
                 self.max_total_token_num,
                 node_world_size=self.node_world_size,
                 dp_world_size=self.world_size // self.dp_size,
+                use_prefix_index=self.args.waiting_queue_policy == "cache_aware",
             )
+        self.is_prompt_cache_snapshot_loading = self.prompt_cache_snapshot_status.has_pending_load()
         self.req_queue = build_req_queue(self.args, self, self.dp_size_in_node)
         logger.info(f"use req queue {self.req_queue.__class__.__name__}")
 
@@ -220,7 +256,8 @@ class RouterManager:
 
             logger.info(f"router recive req id {req.request_id} cost time {time.time() - req.start_time} s")
         self.req_queue.extend(req_group)
-        self.send_to_detokenization.send_pyobj(group_req_indexes, protocol=pickle.HIGHEST_PROTOCOL)
+        shard_id = get_detokenization_shard_id(group_req_indexes.group_req_id, len(self.send_to_detokenizations))
+        self.send_to_detokenizations[shard_id].send_pyobj(group_req_indexes, protocol=pickle.HIGHEST_PROTOCOL)
 
         return
 
@@ -229,6 +266,8 @@ class RouterManager:
     ):
         counter_count = 0
         while True:
+            if self.enable_prompt_cache_snapshot:
+                await self._handle_prompt_cache_snapshot()
             await self._step()
             counter_count += 1
             if self.running_batch is not None:
@@ -250,9 +289,21 @@ class RouterManager:
                             f"dp_i {d_i} token used ratio: {token_ratio1} not contain prompt cache tree unrefed token\n"
                             f"dp_i {d_i} token used ratio: {token_ratio2} contain prompt cache tree unrefed token"
                         )
+                        free_run_stats = self.read_only_statics_mem_manager.get_free_run_stats(d_i)
+                        if free_run_stats is not None:
+                            largest_free_run, free_run_num, fragmentation = free_run_stats
+                            logger.debug(
+                                f"dp_i {d_i} largest free token run: {largest_free_run} \n"
+                                f"dp_i {d_i} free token run num: {free_run_num} \n"
+                                f"dp_i {d_i} free token fragmentation: {fragmentation}"
+                            )
                         self.metric_client.gauge_set(
                             "lightllm_batch_pause_size", self.req_queue.get_paused_req_num(d_i)
                         )
+                    if self.kv_swap_stats is not None:
+                        self._report_kv_swap_stats()
+                    if self.host_kv_cache_stats is not None:
+                        self._report_host_kv_cache_stats()
                 # pd decode mode need to update token_load more frequently
                 self.req_queue.update_token_load(self.running_batch, force_update=self.is_pd_decode_mode)
                 self.stats_tool.print_stats()
@@ -283,6 +334,24 @@ class RouterManager:
             if self.running_batch is None:
                 await asyncio.sleep(0.01)  # 10ms
 
+    async def _handle_prompt_cache_snapshot(self):
+        # 在两次推理之间处理快照相关的操作，保证所有的推理进程在同一个时机修改 prompt cache
+        if self.is_prompt_cache_snapshot_loading and not self.prompt_cache_snapshot_status.is_loading():
+            commit = self.prompt_cache_snapshot_status.all_ready()
+            await self.model_rpc_client.finish_prompt_cache_snapshot_load(commit)
+            logger.info(f"prompt cache snapshot load finished, commit {commit}")
+            self.prompt_cache_snapshot_status.reset()
+            self.is_prompt_cache_snapshot_loading = False
+
+        while self.prompt_cache_snapshot_cmds:
+            cmd = self.prompt_cache_snapshot_cmds.pop(0)
+            start_time = time.time()
+            await self.model_rpc_client.save_prompt_cache_snapshot(cmd.snapshot_dir, cmd.max_tokens)
+            logger.info(f"save prompt cache snapshot to {cmd.snapshot_dir} cost {time.time() - start_time} s")
+            version = self.prompt_cache_snapshot_status.version
+            version.set_value(version.get_value() + 1)
+        return
+
     async def get_schedule_result(self, running_batch: Batch):
         if self.schedule_task is None:
 
@@ -324,6 +393,7 @@ class RouterManager:
                     self.metric_client.histogram_observe(
                         "lightllm_request_queue_duration_bucket", time.time() - req.start_time
                     )
+                self._observe_priority_queue_duration(new_batch)
                 self.stats_tool.count_prompt_tokens(new_batch)
                 self.running_batch = new_batch
                 await self._prefill_batch(self.running_batch)
@@ -353,6 +423,7 @@ class RouterManager:
                     self.has_wait_tokens = self.max_wait_tokens
 
                 self.stats_tool.count_prompt_tokens(new_mini_batch)
+                self._observe_priority_queue_duration(new_mini_batch)
                 await self._prefill_batch(new_mini_batch)
                 if not new_mini_batch.is_clear():
                     self.running_batch.merge(new_mini_batch)
@@ -369,6 +440,27 @@ class RouterManager:
                 logger.debug(f"DP index {dp_index} pasues req num: {self.req_queue.get_paused_req_num(dp_index)}")
                 self.has_wait_tokens = 0
 
+        # 高优先级请求等待过久时，抢占低优先级的运行请求，并尽快进行调度。
+        # 调度线程运行时会修改等待队列，所以只在没有调度任务时进行抢占。
+        if self.enable_priority_preempt and self.schedule_task is None:
+            now = time.time()
+            for dp_index in range(self.dp_size_in_node):
+                preempted_reqs = select_preempted_reqs(
+                    self.running_batch,
+                    self.pause_strategy,
+                    self.req_queue,
+                    dp_index,
+                    now,
+                    self.priority_preempt_wait_time,
+                )
+                if len(preempted_reqs) != 0:
+                    await self._pause_reqs(preempted_reqs)
+                    logger.debug(f"DP index {dp_index} preempts req num: {len(preempted_reqs)}")
+                    self.has_wait_tokens = self.max_wait_tokens
+            self._filter_runing_batch()
+            if self.running_batch is None:
+                return
+
         # Decode
         self.stats_tool.count_output_tokens(self.running_batch)
         await self._decode_batch(self.running_batch)
@@ -376,15 +468,20 @@ class RouterManager:
         self.has_wait_tokens += 1
         return
 
+    def _notify_detokenization(self):
+        for send_to_detokenization in self.send_to_detokenizations:
+            send_to_detokenization.send_pyobj(None, protocol=pickle.HIGHEST_PROTOCOL)
+        return
+
     async def _prefill_batch(self, batch: Batch):
         start_time = time.time()
         self.metric_client.counter_inc("lightllm_batch_inference_count", "prefill")
         reqs = [r.to_router_rpc_obj() for r in batch.reqs]
         self.overlap_event.set()
         await self.model_rpc_client.prefill(reqs)
-        batch.filter_out_finished_req(self.shm_req_manager)
+        batch.filter_out_finished_req(self.shm_req_manager, self.output_len_estimator.observe)
         # 发个None包触发一下detokenization
-        self.send_to_detokenization.send_pyobj(None, protocol=pickle.HIGHEST_PROTOCOL)
+        self._notify_detokenization()
 
         logger.debug(f"Prefill Batch: {batch.simple_log()} \n")
         self.metric_client.histogram_observe(
@@ -399,9 +496,9 @@ class RouterManager:
         await self.model_rpc_client.decode()
         # 在 self.is_multinode_and_multidp 为 True 时，传入的 batch 对象可能为 None。
         if batch is not None:
-            batch.filter_out_finished_req(self.shm_req_manager)
+            batch.filter_out_finished_req(self.shm_req_manager, self.output_len_estimator.observe)
         # 发个None包触发一下detokenization
-        self.send_to_detokenization.send_pyobj(None, protocol=pickle.HIGHEST_PROTOCOL)
+        self._notify_detokenization()
         self.metric_client.histogram_observe(
             "lightllm_batch_inference_duration_bucket", time.time() - start_time, "decode"
         )
@@ -410,6 +507,39 @@ class RouterManager:
     async def _pause_reqs(self, pasue_reqs):
         pasue_req_ids = [r.request_id for r in pasue_reqs]
         await self.model_rpc_client.pause_reqs(pasue_req_ids)
+        if self.enable_priority_schedule:
+            for req in pasue_reqs:
+                self.metric_client.counter_inc(
+                    "lightllm_request_pause_count_by_priority", str(req.sample_params.priority)
+                )
+        return
+
+    def _observe_priority_queue_duration(self, batch: Batch):
+        if not self.enable_priority_schedule:
+            return
+        now = time.time()
+        for req in batch.reqs:
+            self.metric_client.histogram_observe(
+                "lightllm_request_queue_duration_by_priority", now - req.start_time, str(req.sample_params.priority)
+            )
+        return
+
+    def _report_kv_swap_stats(self):
+        stats = self.kv_swap_stats
+        self.metric_client.gauge_set("lightllm_kv_swap_out_bytes", stats.get("swap_out_bytes"))
+        self.metric_client.gauge_set("lightllm_kv_swap_in_bytes", stats.get("swap_in_bytes"))
+        self.metric_client.gauge_set("lightllm_kv_swap_out_latency", stats.get_mean_latency("out"))
+        self.metric_client.gauge_set("lightllm_kv_swap_in_latency", stats.get_mean_latency("in"))
+        self.metric_client.gauge_set("lightllm_kv_swap_recompute_count", stats.get("recompute_num"))
+        return
+
+    def _report_host_kv_cache_stats(self):
+        stats = self.host_kv_cache_stats
+        self.metric_client.gauge_set("lightllm_host_kv_cache_hit_rate", stats.get_hit_rate())
+        self.metric_client.gauge_set("lightllm_host_kv_cache_token_hit_rate", stats.get_token_hit_rate())
+        self.metric_client.gauge_set("lightllm_host_kv_cache_used_bytes", stats.get("used_bytes"))
+        self.metric_client.gauge_set("lightllm_host_kv_cache_offload_bytes", stats.get("offload_bytes"))
+        self.metric_client.gauge_set("lightllm_host_kv_cache_load_bytes", stats.get("load_bytes"))
         return
 
     def _filter_runing_batch(self):
@@ -439,6 +569,11 @@ class RouterManager:
             recv_req: GroupReqIndexes = await self.recv_from_httpserver.recv_pyobj()
             if isinstance(recv_req, GroupReqIndexes):
                 self.add_req(recv_req)
+            elif isinstance(recv_req, PromptCacheSnapshotCmd):
+                if self.enable_prompt_cache_snapshot:
+                    self.prompt_cache_snapshot_cmds.append(recv_req)
+                else:
+                    logger.warning("prompt cache snapshot is not enabled, ignore the save cmd")
             else:
                 assert False, f"Error Req Inf {recv_req}"
 
@@ -4,7 +4,6 @@ import time
 import torch
 import torch.distributed as dist
 import numpy as np
-import collections
 
 from dataclasses import dataclass, field
 from typing import List, Dict, Tuple, Optional, Union, Any
@@ -12,6 +11,7 @@ from lightllm.common.req_manager import ReqManager
 from lightllm.utils.infer_utils import mark_start, mark_end
 from lightllm.server.core.objs import Req, SamplingParams, FinishStatus, ShmReqManager
 from lightllm.server.router.dynamic_prompt.radix_cache import RadixCache, TreeNode
+from lightllm.server.router.model_infer.kv_swap_pool import KvSwapPool
 from lightllm.utils.log_utils import init_logger
 from lightllm.server.req_id_generator import convert_sub_id_to_group_id
 from lightllm.common.basemodel.infer_lock import g_infer_state_lock
@@ -30,6 +30,7 @@ class InferenceContext:
     group_mapping = None  # 只有进行多输出模式下才有真的使用
     infer_req_ids = None
     vocab_size = None
+    kv_swap_pool: KvSwapPool = None  # 暂停请求的 kv 在 host 内存上的交换池，为 None 时暂停的请求重新计算 kv
 
     overlap_stream: torch.cuda.Stream = None  # 一些情况下推理进程进行异步折叠操作的异步流对象。
 
@@ -132,6 +133,8 @@ class InferenceContext:
         free_token_index = []
         for request_id in finished_request_ids:
             req: InferReq = self.requests_mapping.pop(request_id)
+            if req.swapped_kv_len != 0:
+                self._drop_swapped_req_mem(req)
             group_req_id = convert_sub_id_to_group_id(req.shm_req.request_id)
             if group_req_id in self.group_mapping:
                 is_group_finished = self.group_mapping[group_req_id].remove_req(req.shm_req.request_id)
@@ -159,6 +162,8 @@ class InferenceContext:
                 f"mem manager can alloc token num {self.req_manager.mem_manager.can_use_mem_size}\n"
                 f"mem manager total size {self.req_manager.mem_manager.size}"
             )
+            if self.radix_cache.host_kv_cache is not None:
+                logger.debug(f"host kv cache stats: {self.radix_cache.host_kv_cache.get_stats()}")
 
         return
 
@@ -176,6 +181,7 @@ class InferenceContext:
 
             if req.initialized:
                 # 不支持多输出的情况的暂停
+                self._swap_out_req_mem(req)
                 self.free_a_req_mem(free_token_index, req, is_group_finished=True)
                 req.cur_kv_len = 0
                 req.shm_req.shm_cur_kv_len = req.cur_kv_len
@@ -189,6 +195,43 @@ class InferenceContext:
 
         return self
 
+    def _swap_out_req_mem(self, req: "InferReq"):
+        """
+        将暂停请求的全部 kv 交换到 host 上，交换池不接收时恢复时重新计算。
+        交换后请求的 kv 仍然按照结束请求的方式插入 prompt cache 并释放引用，暂停期间不占用不可淘汰的显存，
+        恢复时优先使用 prompt cache 中仍然保留的前缀，只加载被淘汰的部分。
+        """
+        if self.kv_swap_pool is None or req.cur_kv_len == 0:
+            return
+        mem_index = self.req_manager.req_to_token_indexs[req.req_idx][0 : req.cur_kv_len]
+        if self.kv_swap_pool.swap_out(req.req_id, mem_index, self.req_manager.mem_manager):
+            req.swapped_kv_len = req.cur_kv_len
+        return
+
+    def _drop_swapped_req_mem(self, req: "InferReq"):
+        # 请求在暂停期间结束，丢弃交换池中保存的 kv
+        self.kv_swap_pool.drop(req.req_id)
+        req.swapped_kv_len = 0
+        return
+
+    def swap_in_req_mem(self, req: "InferReq"):
+        ready_len = 0
+        if self.radix_cache is not None:
+            # 暂停期间 prompt cache 中的部分 kv 可能已经被淘汰，重新匹配仍然保留的前缀
+            key = torch.tensor(req.get_input_token_ids()[0 : req.swapped_kv_len], dtype=torch.int64, device="cpu")
+            share_node, _, value_tensor = self.radix_cache.match_prefix(key, update_refs=True)
+            if share_node is not None:
+                req.shared_kv_node = share_node
+                ready_len = share_node.node_prefix_total_len
+                self.req_manager.req_to_token_indexs[req.req_idx, 0:ready_len] = value_tensor
+            self.radix_cache.free_radix_cache_to_get_enough_token(req.swapped_kv_len - ready_len)
+        mem_index = self.req_manager.mem_manager.alloc(req.swapped_kv_len - ready_len)
+        self.kv_swap_pool.swap_in(req.req_id, mem_index, self.req_manager.mem_manager, start=ready_len)
+        self.req_manager.req_to_token_indexs[req.req_idx, ready_len : req.swapped_kv_len] = mem_index
+        req.cur_kv_len = req.swapped_kv_len
+        req.swapped_kv_len = 0
+        return
+
 
 g_infer_context = InferenceContext()
 
@@ -257,6 +300,8 @@ class InferReq:
         self.vocab_size = vocab_size
         self.initialized = False
         self.paused = False
+        # 暂停时被交换到 host 上的 kv 长度，为 0 表示没有被交换
+        self.swapped_kv_len = 0
 
     def init_all(self):
         if self.initialized is False:
@@ -264,10 +309,12 @@ class InferReq:
             self.shm_req.link_prompt_ids_shm_array()
             self.shm_req.link_logprobs_shm_array()
             self.sampling_param: InferSamplingParams = InferSamplingParams(self.shm_req, self.vocab_size)
-            if self.sampling_param.shm_param.input_penalty:
-                self.out_token_id_count = collections.Counter(self.shm_req.get_prompt_ids())
-            else:
-                self.out_token_id_count = collections.defaultdict(int)
+            # 采样参数与 penalty 需要的 token 计数常驻在 gpu 上，以 req_idx 为下标，只在这里写入一次
+            g_infer_context.req_manager.req_sampling_params_manager.init_req_sampling_params(
+                self.req_idx,
+                self.sampling_param.shm_param,
+                self.shm_req.shm_prompt_ids.arr[0 : self.shm_req.input_len],
+            )
 
             self.stop_sequences = self.sampling_param.shm_param.stop_sequences.to_list()
             # token healing mode 才被使用的管理对象
@@ -282,11 +329,16 @@ class InferReq:
             self.finish_status = FinishStatus()
 
         if self.paused or not self.initialized:
+            if self.swapped_kv_len != 0:
+                # 暂停时 kv 被交换到了 host 上，直接加载回来，不需要重新计算
+                g_infer_context.swap_in_req_mem(self)
             # 如果是具有 prompt_cache 的使用特性则需要进行提前的填充和恢复操作。
-            if g_infer_context.radix_cache is not None and self.get_cur_total_len() > 1:
+            elif g_infer_context.radix_cache is not None and self.get_cur_total_len() > 1:
                 input_token_ids = self.shm_req.shm_prompt_ids.arr[0 : self.get_cur_total_len()]
                 key = torch.tensor(input_token_ids, dtype=torch.int64, device="cpu")
                 key = key[0 : len(key) - 1]  # 最后一个不需要，因为需要一个额外的token，让其在prefill的时候输出下一个token的值
+                # 开启了 host 内存二级缓存时，先将 host 上命中的部分加载回 gpu 的 prompt cache 中
+                g_infer_context.radix_cache.restore_from_host_kv_cache(key)
                 share_node, kv_len, value_tensor = g_infer_context.radix_cache.match_prefix(key, update_refs=True)
                 if share_node is not None:
                     self.shared_kv_node = share_node
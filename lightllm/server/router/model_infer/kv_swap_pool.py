@@ -0,0 +1,164 @@
+import time
+import torch
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+from lightllm.common.mem_manager import MemoryManager
+from lightllm.common.mem_allocator import FreeListTokenAllocator
+from lightllm.server.router.dynamic_prompt.shared_arr import SharedArray
+from lightllm.utils.log_utils import init_logger
+
+logger = init_logger(__name__)
+
+
+class KvSwapStats:
+    """
+    kv 交换的累计统计信息，推理进程的每个 rank 写入自己的一行，router 读取后通过 MetricClient 上报。
+    name 为 None 时只在进程内使用。
+    """
+
+    FIELDS = [
+        "swap_out_num",
+        "swap_out_bytes",
+        "swap_out_time_us",
+        "swap_in_num",
+        "swap_in_bytes",
+        "swap_in_time_us",
+        "recompute_num",
+        "pool_full_num",
+    ]
+
+    def __init__(self, name: Optional[str], rank_num: int = 1, rank: int = 0):
+        self.rank = rank
+        if name is None:
+            self.arr = np.zeros((rank_num, len(self.FIELDS)), dtype=np.int64)
+        else:
+            self.shared_arr = SharedArray(name, (rank_num, len(self.FIELDS)), dtype=np.int64)
+            self.arr = self.shared_arr.arr
+        self.field_index = {field: index for index, field in enumerate(self.FIELDS)}
+
+    def add(self, field: str, value: int):
+        self.arr[self.rank, self.field_index[field]] += value
+        return
+
+    def get(self, field: str) -> int:
+        # 所有 rank 的累计值之和
+        return int(self.arr[:, self.field_index[field]].sum())
+
+    def get_mean_latency(self, direction: str) -> float:
+        num = self.get(f"swap_{direction}_num")
+        return self.get(f"swap_{direction}_time_us") / 1e6 / max(1, num)
+
+
+class KvSwapPool:
+    """
+    被暂停请求的 kv 在 host 内存 (pinned) 上的交换池。请求被暂停时，将其 kv 拷贝到交换池中，恢复时拷贝回 gpu，
+    避免重新 prefill 已经计算过的 prompt 和输出的 token。交换池按照 token 为单位预先分配，
+    使用 FreeListTokenAllocator 管理其中的 token slot，尽量让一个请求的 slot 连续，每个连续段只需要一次拷贝。
+    kv 长度小于 min_swap_len 的请求重新计算的代价很小，不进行交换，交换池空间不足时同样退化为重新计算。
+    """
+
+    def __init__(
+        self,
+        max_bytes: int,
+        min_swap_len: int,
+        mem_manager: MemoryManager,
+        stats: KvSwapStats = None,
+        pin_memory: bool = None,
+    ):
+        self.min_swap_len = max(1, min_swap_len)
+        self.stats = stats if stats is not None else KvSwapStats(None)
+        pin_memory = torch.cuda.is_available() if pin_memory is None else pin_memory
+
+        # 按照 get_index_kv_buffer 的返回结构分配 host 上的 buffer，形状为 (layer_num, token_num, ...)
+        probe_dict = mem_manager.get_index_kv_buffer(torch.tensor([0], dtype=torch.int64))
+        self.token_bytes = sum(t.numel() * t.element_size() for t in probe_dict.values())
+        self.size = max_bytes // self.token_bytes
+        self.host_buffers: Dict[str, torch.Tensor] = {}
+        for name, tensor in probe_dict.items():
+            shape = (tensor.shape[0], self.size) + tuple(tensor.shape[2:])
+            self.host_buffers[name] = torch.empty(shape, dtype=tensor.dtype, device="cpu", pin_memory=pin_memory)
+        self.slot_allocator = FreeListTokenAllocator(self.size)
+        # request_id -> 保存其 kv 的 slot
+        self.swapped_slots: Dict[int, np.ndarray] = {}
+        logger.info(f"kv swap pool token num {self.size}, token bytes {self.token_bytes}, pin memory {pin_memory}")
+
+    def _sync(self):
+        if torch.cuda.is_available():
+            torch.cuda.current_stream().synchronize()
+        return
+
+    def _to_runs(self, slots: np.ndarray) -> List[Tuple[int, int, int]]:
+        """
+        将 slot 划分为连续段，返回 [(slot 起始位置, 在请求 kv 中的偏移, 长度), ...]。
+        """
+        breaks = np.flatnonzero(np.diff(slots) != 1) + 1
+        starts = np.concatenate(([0], breaks))
+        ends = np.concatenate((breaks, [len(slots)]))
+        return [(int(slots[s]), int(s), int(e - s)) for s, e in zip(starts, ends)]
+
+    def has_swapped(self, request_id: int) -> bool:
+        return request_id in self.swapped_slots
+
+    @torch.no_grad()
+    def swap_out(self, request_id: int, mem_index: torch.Tensor, mem_manager: MemoryManager) -> bool:
+        """
+        将 mem_index 对应的 kv 拷贝到交换池中，返回 False 表示选择重新计算，需要在 mem_index 被释放之前调用。
+        """
+        swap_len = len(mem_index)
+        if swap_len < self.min_swap_len:
+            self.stats.add("recompute_num", 1)
+            return False
+        if swap_len > self.slot_allocator.can_use_size:
+            self.stats.add("recompute_num", 1)
+            self.stats.add("pool_full_num", 1)
+            return False
+
+        start_time = time.time()
+        slots = self.slot_allocator.alloc(swap_len).numpy().astype(np.int64)
+        # 一次 gather 出请求所有 token 的 kv，再按照 slot 的连续段拷贝到 host 上
+        kv_dict = mem_manager.get_index_kv_buffer(mem_index.to(torch.int64))
+        for slot_start, offset, length in self._to_runs(slots):
+            for name, tensor in kv_dict.items():
+                self.host_buffers[name][:, slot_start : slot_start + length].copy_(
+                    tensor[:, offset : offset + length], non_blocking=True
+                )
+        self._sync()
+        self.swapped_slots[request_id] = slots
+
+        self.stats.add("swap_out_num", 1)
+        self.stats.add("swap_out_bytes", swap_len * self.token_bytes)
+        self.stats.add("swap_out_time_us", int((time.time() - start_time) * 1e6))
+        return True
+
+    @torch.no_grad()
+    def swap_in(self, request_id: int, mem_index: torch.Tensor, mem_manager: MemoryManager, start: int = 0):
+        """
+        将请求保存在交换池中的 kv 的 [start:] 部分加载到新申请的 mem_index 中，并释放其占用的所有 slot。
+        [0:start] 部分的 kv 可以直接从 prompt cache 中获取，不需要加载。
+        """
+        slots = self.swapped_slots.pop(request_id)
+        assert len(slots) - start == len(mem_index), f"swap in len {len(mem_index)} != {len(slots)} - {start}"
+
+        start_time = time.time()
+        if len(mem_index) != 0:
+            mem_index = mem_index.to(torch.int64)
+            for slot_start, offset, length in self._to_runs(slots[start:]):
+                load_dict = {
+                    name: buffer[:, slot_start : slot_start + length] for name, buffer in self.host_buffers.items()
+                }
+                mem_manager.load_index_kv_buffer(mem_index[offset : offset + length], load_dict)
+            # 拷贝完成之前 slot 不能被复用
+            self._sync()
+        self.slot_allocator.free(slots)
+
+        self.stats.add("swap_in_num", 1)
+        self.stats.add("swap_in_bytes", len(mem_index) * self.token_bytes)
+        self.stats.add("swap_in_time_us", int((time.time() - start_time) * 1e6))
+        return
+
+    def drop(self, request_id: int):
+        # 请求在暂停期间结束，直接丢弃保存的 kv
+        slots = self.swapped_slots.pop(request_id, None)
+        if slots is not None:
+            self.slot_allocator.free(slots)
+        return
@@ -45,9 +45,20 @@ from lightllm.utils.infer_utils import set_random_seed
 from lightllm.utils.infer_utils import calculate_time, mark_start, mark_end
 from lightllm.utils.log_utils import init_logger
 from lightllm.server.router.dynamic_prompt.radix_cache import RadixCache
+from lightllm.server.router.dynamic_prompt.array_radix_cache import ArrayRadixCache
+from lightllm.server.router.dynamic_prompt.block_prefix_cache import BlockPrefixCache
+from lightllm.server.router.dynamic_prompt.shared_prefix_index import SharedPrefixIndex
+from lightllm.server.router.dynamic_prompt.host_kv_cache import HostKvCache, HostKvCacheStats
+from lightllm.server.router.dynamic_prompt.prompt_cache_snapshot import (
+    PromptCacheSnapshotLoader,
+    get_snapshot_file_path,
+    save_prompt_cache_snapshot,
+)
+from lightllm.server.core.objs.io_objs import PromptCacheSnapshotStatus
 from lightllm.server.router.model_infer.infer_batch import InferReq, InferSamplingParams
+from lightllm.server.router.model_infer.kv_swap_pool import KvSwapPool, KvSwapStats
 from lightllm.server.router.token_load import TokenLoad
-from lightllm.common.basemodel.infer_lock import g_infer_state_lock, InferStateLock
+from lightllm.common.basemodel.infer_lock import g_infer_state_lock, g_router_lock, InferStateLock
 from lightllm.utils.dist_utils import init_distributed_env
 from lightllm.utils.envs_utils import get_unique_server_name
 from lightllm.server.core.objs import ShmReqManager
@@ -227,16 +238,7 @@ class ModeBackend:
             raise e
 
         set_random_seed(2147483647)
-        self.radix_cache = (
-            RadixCache(
-                get_unique_server_name(),
-                self.model.mem_manager.size,
-                self.rank_in_node,
-                mem_manager=self.model.mem_manager,
-            )
-            if self.use_dynamic_prompt_cache
-            else None
-        )
+        self.radix_cache = self._create_prompt_cache() if self.use_dynamic_prompt_cache else None
 
         if "prompt_cache_kv_buffer" in model_cfg:
             assert self.use_dynamic_prompt_cache
@@ -250,13 +252,113 @@ class ModeBackend:
             shm_req_manager=self.shm_req_manager,
             vocab_size=self.model.vocab_size,
         )
+        if self.args.kv_swap_host_mem_gb > 0:
+            g_infer_context.kv_swap_pool = KvSwapPool(
+                int(self.args.kv_swap_host_mem_gb * 1024 ** 3),
+                self.args.kv_swap_min_len,
+                self.model.mem_manager,
+                KvSwapStats(f"{get_unique_server_name()}_kv_swap_stats", self.node_world_size, self.rank_in_node),
+            )
+
+        self.prompt_cache_snapshot_loader: PromptCacheSnapshotLoader = None
+        if self.radix_cache is not None and self.args.prompt_cache_snapshot_dir and self.nnodes == 1:
+            self._start_load_prompt_cache_snapshot()
 
         self.init_custom()
         return
 
+    def _start_load_prompt_cache_snapshot(self):
+        status = PromptCacheSnapshotStatus(self.node_world_size)
+
+        def done_callback(is_ok):
+            status.set_state(self.rank_in_node, status.READY if is_ok else status.FAILED)
+
+        file_path = get_snapshot_file_path(self.args.prompt_cache_snapshot_dir, self.tp_rank)
+        loader = PromptCacheSnapshotLoader(file_path, self.radix_cache, done_callback=done_callback)
+        # 需要在启动加载线程之前设置，防止加载线程先完成后状态被覆盖
+        status.set_state(self.rank_in_node, status.LOADING)
+        if loader.start():
+            self.prompt_cache_snapshot_loader = loader
+            # 加载期间预留的 kv 空间对 router 不可见，需要作为 frozen token 计入，防止 router 超量调度
+            self._add_frozened_token_count(loader.header["token_num"])
+        else:
+            status.set_state(self.rank_in_node, status.NONE)
+        return
+
+    def finish_prompt_cache_snapshot_load(self, commit: bool):
+        """
+        由 router 在所有 rank 都加载完成 (或者失败) 后统一调用，保证各个 rank 在同一个时机修改 prompt cache。
+        """
+        if self.prompt_cache_snapshot_loader is None:
+            return
+        g_infer_state_lock.acquire()
+        self.prompt_cache_snapshot_loader.finish(commit)
+        g_infer_state_lock.release()
+        # finish 之后预留的 kv 已经插入到 radix cache 中或者被释放，router 可以直接感知
+        self._add_frozened_token_count(-self.prompt_cache_snapshot_loader.header["token_num"])
+        self.prompt_cache_snapshot_loader = None
+        return
+
+    def _add_frozened_token_count(self, token_num: int):
+        # 注意兼容纯tp 和 tp dp 混合模式的逻辑
+        if self.is_master_in_dp:
+            g_router_lock.acquire()
+            self.shared_token_load.add_frozened_token_count(token_num, self.dp_rank_in_node)
+            g_router_lock.release()
+        return
+
+    def save_prompt_cache_snapshot(self, snapshot_dir: str, max_tokens: int):
+        if self.radix_cache is None:
+            return
+        g_infer_state_lock.acquire()
+        try:
+            file_path = get_snapshot_file_path(snapshot_dir, self.tp_rank)
+            save_prompt_cache_snapshot(self.radix_cache, file_path, max_tokens)
+        except BaseException as e:
+            self.logger.exception(f"save prompt cache snapshot error: {str(e)}")
+        finally:
+            g_infer_state_lock.release()
+        return
+
     def init_custom(self):
         pass
 
+    def _create_prompt_cache(self):
+        prompt_cache_mode = self.args.prompt_cache_mode
+        extra_kwargs = {}
+        if prompt_cache_mode == "radix":
+            radix_cache_class = RadixCache
+        elif prompt_cache_mode == "array_radix":
+            radix_cache_class = ArrayRadixCache
+        elif prompt_cache_mode == "block":
+            radix_cache_class = BlockPrefixCache
+            extra_kwargs["block_size"] = self.args.prompt_cache_block_size
+        else:
+            raise ValueError(f"can not support prompt_cache_mode {prompt_cache_mode}")
+        self.logger.info(f"use prompt cache class {radix_cache_class.__name__}")
+        prompt_cache = radix_cache_class(
+            get_unique_server_name(),
+            self.model.mem_manager.size,
+            self.rank_in_node,
+            mem_manager=self.model.mem_manager,
+            **extra_kwargs,
+        )
+        if self.args.prompt_cache_host_mem_gb > 0:
+            host_mem_bytes = int(self.args.prompt_cache_host_mem_gb * 1024 ** 3)
+            prompt_cache.host_kv_cache = HostKvCache(
+                host_mem_bytes,
+                stats=HostKvCacheStats(
+                    f"{get_unique_server_name()}_host_kv_cache_stats", self.node_world_size, self.rank_in_node
+                ),
+            )
+            self.logger.info(f"use host kv cache for prompt cache, max bytes {host_mem_bytes}")
+        if self.args.waiting_queue_policy == "cache_aware":
+            prompt_cache.prefix_index = SharedPrefixIndex(
+                get_unique_server_name(), self.model.mem_manager.size, self.rank_in_node
+            )
+            prompt_cache.prefix_index.init_writer(self.model.mem_manager.size)
+        return prompt_cache
+
     def get_max_total_token_num(self):
         return self.model.mem_manager.size
 
@@ -358,6 +460,9 @@ class ModeBackend:
         约束输出等模式，设置自己请求内部的状态机的状态，并添加额外的停止判定条件等。
         """
         finished_req_ids = []
+        # 本步确定输出的 (req_idx, token_id)，用于增量更新 gpu 上 penalty 使用的 token 计数
+        out_req_idxs = []
+        out_token_ids = []
 
         for req_obj, next_token_id, next_token_logprob in zip(run_reqs, next_token_ids, next_token_logprobs):
             req_obj: InferReq = req_obj
@@ -384,7 +489,8 @@ class ModeBackend:
             req_obj.set_next_gen_token_id(next_token_id, next_token_logprob)
             req_obj.cur_output_len += 1
 
-            req_obj.out_token_id_count[next_token_id] += 1
+            out_req_idxs.append(req_obj.req_idx)
+            out_token_ids.append(next_token_id)
             req_obj.update_finish_status(self.eos_id)
 
             if extra_post_req_handle_func is not None:
@@ -406,6 +512,7 @@ class ModeBackend:
 
                 req_obj.shm_req.candetoken_out_len = req_obj.cur_output_len
 
+        g_infer_context.req_manager.req_sampling_params_manager.update_out_token_id_counter(out_req_idxs, out_token_ids)
         if do_filter_finished_reqs:
             g_infer_context.filter(finished_req_ids)
         return finished_req_ids
@@ -34,6 +34,8 @@ class ReturnPromptLogProbBackend(ContinuesBatchBackend):
         b_seq_len = b_seq_len.cpu().numpy()
 
         finished_req_ids = []
+        out_req_idxs = []
+        out_token_ids = []
         for req_obj, next_token_id, next_token_logprob, start_loc, seq_len in zip(
             run_reqs, next_token_ids, next_token_logprobs, b_start_loc, b_seq_len
         ):
@@ -53,7 +55,8 @@ class ReturnPromptLogProbBackend(ContinuesBatchBackend):
             for i in range(req_obj.shm_req.input_len - 1):
                 req_obj.shm_req.shm_logprobs.arr[i + 1] = cur_logprobs[i]
 
-            req_obj.out_token_id_count[next_token_id] += 1
+            out_req_idxs.append(req_obj.req_idx)
+            out_token_ids.append(next_token_id)
             req_obj.update_finish_status(self.eos_id)
 
             if req_obj.finish_status.is_finished() or req_obj.shm_req.router_aborted:
@@ -72,5 +75,6 @@ class ReturnPromptLogProbBackend(ContinuesBatchBackend):
 
                 req_obj.shm_req.candetoken_out_len = req_obj.cur_output_len
 
+        g_infer_context.req_manager.req_sampling_params_manager.update_out_token_id_counter(out_req_idxs, out_token_ids)
         g_infer_context.filter(finished_request_ids=finished_req_ids)
         return
@@ -7,7 +7,8 @@ import inspect
 
 from typing import List
 from dataclasses import asdict
-from lightllm.server.pd_io_struct import UpKVStatus
+from lightllm.server.pd_io_struct import UpKVStatus, get_pd_master_addrs
+from lightllm.server.req_id_generator import get_id_shard
 from lightllm.utils.log_utils import init_logger
 from lightllm.utils.graceful_utils import graceful_registry
 import torch.multiprocessing as mp
@@ -27,9 +28,28 @@ class UpStatusManager:
         asyncio.run(self.loop())
 
     async def loop(self):
+        # 每个 pd master 副本一个连接，kv 传输的状态发送给创建请求的副本
+        pd_master_addrs = get_pd_master_addrs(self.args)
+        replica_queues = [asyncio.Queue() for _ in pd_master_addrs]
+        await asyncio.gather(
+            self.dispatch_loop(replica_queues),
+            *[
+                self.replica_loop(ip, port, replica_queue)
+                for (ip, port), replica_queue in zip(pd_master_addrs, replica_queues)
+            ],
+        )
+
+    async def dispatch_loop(self, replica_queues: List[asyncio.Queue]):
+        loop = asyncio.get_event_loop()
+        while True:
+            upkv_status: UpKVStatus = await loop.run_in_executor(None, self.task_queue.get)
+            replica_id = get_id_shard(upkv_status.group_request_id, len(replica_queues))
+            await replica_queues[replica_id].put(upkv_status)
+
+    async def replica_loop(self, pd_master_ip: str, pd_master_port: int, replica_queue: asyncio.Queue):
         while True:
             try:
-                uri = f"ws://{self.args.pd_master_ip}:{self.args.pd_master_port}/kv_move_status"
+                uri = f"ws://{pd_master_ip}:{pd_master_port}/kv_move_status"
                 async with websockets.connect(uri) as websocket:
                     import socket
 
@@ -38,8 +58,7 @@ class UpStatusManager:
 
                     while True:
                         try:
-                            loop = asyncio.get_event_loop()
-                            upkv_status: UpKVStatus = await loop.run_in_executor(None, self.task_queue.get)
+                            upkv_status: UpKVStatus = await replica_queue.get()
                             await websocket.send(json.dumps(asdict(upkv_status)))
                             logger.info(f"up status: {upkv_status}")
                             # self.task_out_queue.put("ok")
@@ -49,10 +68,10 @@ class UpStatusManager:
                             raise e
 
             except Exception as e:
-                logger.error(f"connetion to pd_master has error: {str(e)}")
+                logger.error(f"connetion to pd_master {uri} has error: {str(e)}")
                 logger.exception(str(e))
                 await asyncio.sleep(10)
-                logger.info("reconnection to pd_master")
+                logger.info(f"reconnection to pd_master {uri}")
 
 
 def _init_env(args, task_in_queue: mp.Queue, task_out_queue: mp.Queue):
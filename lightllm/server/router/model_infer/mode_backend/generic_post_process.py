@@ -1,132 +1,68 @@
 import torch
 from typing import List
-from lightllm.common.basemodel.triton_kernel.apply_penalty import apply_penalty
-from dataclasses import dataclass
+from lightllm.common.basemodel.triton_kernel.apply_penalty_by_counter import apply_penalty_by_counter
+from lightllm.common.req_manager import ReqSamplingParamsManager
 from lightllm.server.router.model_infer.infer_batch import InferReq, g_infer_context
+from lightllm.common.grouped_sampling import build_sample_groups, grouped_sample
 
 
 def sample(logits, reqs, eos_id: List[int] = [2]):
+    params_manager: ReqSamplingParamsManager = g_infer_context.req_manager.req_sampling_params_manager
+    b_req_idx, b_out_len, sample_groups = _get_post_sample_tensors(reqs, vocab_size=logits.shape[-1])
     (
         presence_penalties,
         frequency_penalties,
         repetition_penalties,
+        exponential_decay_starts,
         exponential_decay_length_penalties,
         temperatures,
         top_ps,
         top_ks,
-        p_token_ids,
-        p_token_counts,
-        p_cumsum_seq_len,
-        p_max_len_in_batch,
-        length_penalty_idx,
-        mask_eos_reqs,
-    ) = _get_post_sample_tensors(reqs)
+        min_new_tokens,
+    ) = params_manager.get_sampling_params(b_req_idx)
 
     logits = logits.contiguous()
 
-    apply_penalty(
-        logits,
-        presence_penalties,
-        frequency_penalties,
-        repetition_penalties,
-        p_token_ids,
-        p_token_counts,
-        p_cumsum_seq_len,
-        p_max_len_in_batch,
-    )
+    if params_manager.has_penalty([req_obj.req_idx for req_obj in reqs]):
+        apply_penalty_by_counter(
+            logits,
+            b_req_idx,
+            presence_penalties,
+            frequency_penalties,
+            repetition_penalties,
+            params_manager.req_to_out_token_id_counter,
+        )
+    length_penalty_idx = torch.clamp(b_out_len - exponential_decay_starts, min=0)
     logits[:, eos_id] = logits[:, eos_id] + torch.abs(logits[:, eos_id]) * (
         torch.pow(exponential_decay_length_penalties, length_penalty_idx).view((-1, 1)) - 1
     )
-    if mask_eos_reqs.any():
-        logits[mask_eos_reqs, eos_id] = -1000000.0
+    # 使用 where 而不是先判断是否存在需要屏蔽 eos 的请求，避免 gpu 同步
+    mask_eos_reqs = b_out_len < (min_new_tokens - 1)
+    logits[:, eos_id] = torch.where(mask_eos_reqs.view((-1, 1)), -1000000.0, logits[:, eos_id])
     logits.div_(temperatures.view((-1, 1)))
     probs = torch.softmax(logits, dim=-1)
-    probs_sort, probs_idx = _top_p_top_k(probs, top_ps, top_ks)
-    sampled_index = torch.multinomial(probs_sort, num_samples=1, replacement=True)
-
-    batch_next_token_ids = torch.gather(probs_idx, dim=1, index=sampled_index)
-    batch_next_token_probs = torch.gather(probs_sort, dim=1, index=sampled_index)
+    # 按照采样策略分组，greedy 和小 top_k 的请求不需要对全词表排序
+    batch_next_token_ids, batch_next_token_probs = grouped_sample(probs, top_ps, top_ks, sample_groups)
 
     return batch_next_token_ids.view(-1), batch_next_token_probs.view(-1)
 
 
-def _top_p_top_k(probs: torch.Tensor, top_ps: torch.Tensor, top_ks: torch.Tensor):
-    probs_sort, probs_idx = probs.sort(dim=-1, descending=True)
-
-    probs_sum = torch.cumsum(probs_sort, dim=-1)
-    probs_sort[(probs_sum - probs_sort) > top_ps.view(-1, 1)] = 0.0
-
-    probs_sort[torch.arange(0, probs.shape[-1], device="cuda").view(1, -1) >= top_ks.view(-1, 1)] = 0.0
-
-    return probs_sort, probs_idx
-
-
-def _get_post_sample_tensors(reqs: List[InferReq]):
-    presence_penalties: List[float] = []
-    frequency_penalties: List[float] = []
-    repetition_penalties: List[float] = []
-    exponential_decay_length_penalties: List[float] = []
-    temperatures: List[float] = []
+def _get_post_sample_tensors(reqs: List[InferReq], vocab_size: int):
+    # 采样参数在请求初始化时已经写入了 gpu 上的参数表，这里每个请求只需要收集 req_idx 和已输出的长度，
+    # top_p 与 top_k 在 cpu 上用于采样策略的分组
+    b_req_idx: List[int] = []
+    b_out_len: List[int] = []
     top_ps: List[float] = []
     top_ks: List[int] = []
-    p_token_ids: List[int] = []
-    p_token_counts: List[int] = []
-    p_seq_len: List[int] = [
-        0,
-    ]
-    p_max_len_in_batch: int = 0
-    length_penalty_idx: List[int] = []
-    mask_eos_reqs: List[bool] = []
-    for i, req_obj in enumerate(reqs):
-        id_to_count = req_obj.out_token_id_count
-        sample_param = req_obj.sampling_param
-        presence_penalties.append(sample_param.shm_param.presence_penalty)
-        frequency_penalties.append(sample_param.shm_param.frequency_penalty)
-        repetition_penalties.append(sample_param.shm_param.repetition_penalty)
-        exponential_decay_length_penalty = sample_param.shm_param.exponential_decay_length_penalty.to_tuple()
-        exponential_decay_length_penalties.append(exponential_decay_length_penalty[1])
-        out_token_len = req_obj.get_cur_total_len() - req_obj.shm_req.input_len
-        length_penalty_idx.append(max(out_token_len - exponential_decay_length_penalty[0], 0))
-        mask_eos_reqs.append(out_token_len < sample_param.shm_param.min_new_tokens - 1)
-
-        temperatures.append(sample_param.shm_param.temperature)
-        top_ps.append(sample_param.shm_param.top_p)
-        top_ks.append(sample_param.shm_param.top_k)
-
-        for token_id, count in id_to_count.items():
-            p_token_ids.append(token_id)
-            p_token_counts.append(count)
-        p_seq_len.append(len(id_to_count))
-        p_max_len_in_batch = max(p_max_len_in_batch, len(id_to_count))
-
-    presence_penalties_cpu = torch.tensor(presence_penalties, dtype=torch.float, device="cpu", pin_memory=True)
-    frequency_penalties_cpu = torch.tensor(frequency_penalties, dtype=torch.float, device="cpu", pin_memory=True)
-    repetition_penalties_cpu = torch.tensor(repetition_penalties, dtype=torch.float, device="cpu", pin_memory=True)
-    exponential_decay_length_penalties_cpu = torch.tensor(
-        exponential_decay_length_penalties, dtype=torch.float, device="cpu", pin_memory=True
-    )
-    temperatures_cpu = torch.tensor(temperatures, dtype=torch.float, device="cpu", pin_memory=True)
-    top_ps_cpu = torch.tensor(top_ps, dtype=torch.float, device="cpu", pin_memory=True)
-    top_ks_cpu = torch.tensor(top_ks, dtype=torch.int32, device="cpu", pin_memory=True)
-    p_token_ids_cpu = torch.tensor(p_token_ids, dtype=torch.int32, device="cpu", pin_memory=True)
-    p_token_counts_cpu = torch.tensor(p_token_counts, dtype=torch.int32, device="cpu", pin_memory=True)
-    p_seq_len_cpu = torch.tensor(p_seq_len, dtype=torch.int32, device="cpu", pin_memory=True)
-    length_penalty_idx_cpu = torch.tensor(length_penalty_idx, dtype=torch.int32, device="cpu", pin_memory=True)
-    mask_eos_reqs_cpu = torch.tensor(mask_eos_reqs, dtype=torch.bool, device="cpu", pin_memory=True)
-    p_cumsum_seq_len_cpu = torch.cumsum(p_seq_len_cpu, dim=0, dtype=torch.int32).pin_memory()
-
-    return (
-        presence_penalties_cpu.cuda(non_blocking=True),
-        frequency_penalties_cpu.cuda(non_blocking=True),
-        repetition_penalties_cpu.cuda(non_blocking=True),
-        exponential_decay_length_penalties_cpu.cuda(non_blocking=True),
-        temperatures_cpu.cuda(non_blocking=True),
-        top_ps_cpu.cuda(non_blocking=True),
-        top_ks_cpu.cuda(non_blocking=True),
-        p_token_ids_cpu.cuda(non_blocking=True),
-        p_token_counts_cpu.cuda(non_blocking=True),
-        p_cumsum_seq_len_cpu.cuda(non_blocking=True),
-        p_max_len_in_batch,
-        length_penalty_idx_cpu.cuda(non_blocking=True),
-        mask_eos_reqs_cpu.cuda(non_blocking=True),
-    )
+    for req_obj in reqs:
+        shm_param = req_obj.sampling_param.shm_param
+        b_req_idx.append(req_obj.req_idx)
+        b_out_len.append(req_obj.cur_output_len)
+        top_ps.append(shm_param.top_p)
+        top_ks.append(shm_param.top_k)
+
+    # 合并为一次 cpu 到 gpu 的拷贝
+    req_info_cpu = torch.tensor(b_req_idx + b_out_len, dtype=torch.int32, device="cpu", pin_memory=True)
+    req_info_gpu = req_info_cpu.cuda(non_blocking=True).view(2, -1)
+    sample_groups = build_sample_groups(top_ps, top_ks, vocab_size, device="cuda")
+    return req_info_gpu[0], req_info_gpu[1], sample_groups
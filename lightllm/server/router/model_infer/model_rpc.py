@@ -1,7 +1,6 @@
 import os
 import asyncio
 import torch.multiprocessing as mp
-import multiprocessing
 import threading
 import inspect
 from datetime import timedelta
@@ -37,8 +36,6 @@ class ModelRpcServer:
         rank: int,
         rank_in_node: int,
         node_world_size: int,
-        rpc_event: multiprocessing.Event,
-        rpc_finished_event: multiprocessing.Event,
         info_queue: mp.Queue,
         mem_queue: mp.Queue,
     ):
@@ -47,8 +44,6 @@ class ModelRpcServer:
         self.node_world_size = node_world_size
         self.info_queue = info_queue
         self.mem_queue = mem_queue
-        self.rpc_event = rpc_event
-        self.rpc_finished_event = rpc_finished_event
 
         self.rpc_shm_params = RpcShmParams()
         self.rpc_shm_params.create_or_link_shm()
@@ -69,28 +64,19 @@ class ModelRpcServer:
 
     def rpc_loop(self):
         error_count = 0
+        last_cmd_seq = 0
         while True:
             try:
-                self.rpc_event.wait()
+                cmd_seq = self.rpc_shm_sync_status.wait_cmd(last_cmd_seq)
                 func_name, args = self.rpc_shm_params.read_func_params()
 
                 ans = getattr(self, func_name)(*args)
                 if ans is not None and self.rank_in_node == 0:
                     self.rpc_shm_results.write_func_result(func_name=func_name, ret=ans)
 
-                # 下面得执行顺序不可随意交换, 否则容易出现同步或者死锁问题。
-                self.rpc_shm_sync_status.add_mark(self.rank_in_node)
-                while not self.rpc_shm_sync_status.run_finished():
-                    pass
-
-                self.rpc_event.clear()
-
-                self.rpc_shm_sync_status.add_mark1(self.rank_in_node)
-                while not self.rpc_shm_sync_status.run_finished1():
-                    pass
-
-                if self.rank_in_node == 0:
-                    self.rpc_finished_event.set()
+                # 结果写入完成后才能标记完成，客户端在所有 rank 完成后才会写入下一个命令的参数。
+                self.rpc_shm_sync_status.mark_done(self.rank_in_node, cmd_seq)
+                last_cmd_seq = cmd_seq
 
             except BaseException as e:
                 logger.exception(str(e))
@@ -184,9 +170,15 @@ class ModelRpcServer:
     def get_max_total_token_num(self):
         return self.backend.get_max_total_token_num()
 
+    def save_prompt_cache_snapshot(self, snapshot_dir, max_tokens):
+        return self.backend.save_prompt_cache_snapshot(snapshot_dir, max_tokens)
+
+    def finish_prompt_cache_snapshot_load(self, commit):
+        return self.backend.finish_prompt_cache_snapshot_load(commit)
+
 
 class ModelRpcClient:
-    def __init__(self, model_infer_servers: List[ModelRpcServer], world_size, rpc_event, rpc_finished_event):
+    def __init__(self, model_infer_servers: List[ModelRpcServer], world_size, node_world_size):
         # model_infer_servers 是传入的推理服务对象，但是在重构后，
         # 单卡不使用rpc 通信的时候，里面才有真实对象，当多卡使用rpc
         # 以后，model_infer_servers 传入的是 None 数组
@@ -201,18 +193,20 @@ class ModelRpcClient:
         self.rpc_shm_params.create_or_link_shm()
         self.rpc_shm_results = RpcShmResults()
         self.rpc_shm_results.create_or_link_shm()
+        self.rpc_shm_sync_status = ShmSyncStatusArray(node_world_size)
+        if self.use_rpc:
+            self.rpc_shm_sync_status.create_or_link_shm()
+        return
 
-        self.rpc_event = rpc_event
-        self.rpc_finished_event = rpc_finished_event
+    async def _rpc_call(self, func_name, args):
+        self.rpc_shm_params.write_func_params(func_name, args)
+        cmd_seq = self.rpc_shm_sync_status.send_cmd()
+        await self.rpc_shm_sync_status.async_wait_all_done(cmd_seq)
         return
 
     async def init_model(self, kvargs):
         if self.use_rpc:
-            self.rpc_shm_params.write_func_params("init_model", (kvargs,))
-            self.rpc_event.set()
-
-            self.rpc_finished_event.wait()
-            self.rpc_finished_event.clear()
+            await self._rpc_call("init_model", (kvargs,))
             return
         else:
             self.model_infer_server.init_model(kvargs)
@@ -220,11 +214,7 @@ class ModelRpcClient:
 
     async def prefill(self, reqs):
         if self.use_rpc:
-            self.rpc_shm_params.write_func_params("prefill", (reqs,))
-            self.rpc_event.set()
-
-            await asyncio.to_thread(self.rpc_finished_event.wait)
-            self.rpc_finished_event.clear()
+            await self._rpc_call("prefill", (reqs,))
             return
         else:
             self.model_infer_server.prefill(reqs)
@@ -232,11 +222,7 @@ class ModelRpcClient:
 
     async def decode(self):
         if self.use_rpc:
-            self.rpc_shm_params.write_func_params("decode", ())
-            self.rpc_event.set()
-
-            await asyncio.to_thread(self.rpc_finished_event.wait)
-            self.rpc_finished_event.clear()
+            await self._rpc_call("decode", ())
             return
         else:
             self.model_infer_server.decode()
@@ -244,23 +230,31 @@ class ModelRpcClient:
 
     async def pause_reqs(self, req_ids):
         if self.use_rpc:
-            self.rpc_shm_params.write_func_params("pause_reqs", (req_ids,))
-            self.rpc_event.set()
-
-            self.rpc_finished_event.wait()
-            self.rpc_finished_event.clear()
+            await self._rpc_call("pause_reqs", (req_ids,))
             return
         else:
             self.model_infer_server.pause_reqs(req_ids)
             return
 
-    async def get_max_total_token_num(self):
+    async def save_prompt_cache_snapshot(self, snapshot_dir, max_tokens):
         if self.use_rpc:
-            self.rpc_shm_params.write_func_params("get_max_total_token_num", ())
-            self.rpc_event.set()
+            await self._rpc_call("save_prompt_cache_snapshot", (snapshot_dir, max_tokens))
+            return
+        else:
+            self.model_infer_server.save_prompt_cache_snapshot(snapshot_dir, max_tokens)
+            return
 
-            self.rpc_finished_event.wait()
-            self.rpc_finished_event.clear()
+    async def finish_prompt_cache_snapshot_load(self, commit):
+        if self.use_rpc:
+            await self._rpc_call("finish_prompt_cache_snapshot_load", (commit,))
+            return
+        else:
+            self.model_infer_server.finish_prompt_cache_snapshot_load(commit)
+            return
+
+    async def get_max_total_token_num(self):
+        if self.use_rpc:
+            await self._rpc_call("get_max_total_token_num", ())
             func_name, ret = self.rpc_shm_results.read_func_result()
             assert func_name == "get_max_total_token_num"
             return ret
@@ -276,8 +270,6 @@ def _init_env(
     info_queue,
     mem_queue,
     router_lock,
-    rpc_event: mp.Event,
-    rpc_finished_event: mp.Event,
     success_event: mp.Event,
 ):
     import lightllm.utils.rpyc_fix_utils as _
@@ -291,9 +283,7 @@ def _init_env(
 
     g_router_lock.obj = router_lock
 
-    model_rpc_server = ModelRpcServer(
-        args, rank, rank_in_node, node_world_size, rpc_event, rpc_finished_event, info_queue, mem_queue
-    )
+    model_rpc_server = ModelRpcServer(args, rank, rank_in_node, node_world_size, info_queue, mem_queue)
     success_event.set()
 
     model_rpc_server.loop_thread.join()
@@ -305,8 +295,6 @@ async def start_model_process(
     rank,
     rank_in_node,
     node_world_size,
-    rpc_event,
-    rpc_finished_event,
     info_queue: mp.Queue,
     mem_queue: mp.Queue,
     router_lock: mp.Queue,
@@ -320,8 +308,6 @@ async def start_model_process(
             rank,
             rank_in_node,
             node_world_size,
-            rpc_event,
-            rpc_finished_event,
             info_queue,
             mem_queue,
         )
@@ -337,8 +323,6 @@ async def start_model_process(
             info_queue,
             mem_queue,
             router_lock,
-            rpc_event,
-            rpc_finished_event,
             success_event,
         ),
     )
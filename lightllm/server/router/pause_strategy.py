@@ -19,6 +19,39 @@ class Fcfs(Strategy):
         return reqs[::-1]
 
 
+class PriorityRecoverable(Strategy):
+    """
+    优先暂停优先级最低的请求组，同一优先级中优先暂停恢复代价最小的请求组，代价相同时优先暂停最晚加入的请求组。
+    请求被暂停后占用的 kv 会被释放，恢复时需要重新 prefill。开启 prompt cache 时，请求命中的 prompt cache 前缀
+    通常还被其他请求引用，会保留在 radix cache 中，恢复代价只计算请求自己计算出来的部分 shm_cur_kv_len - prompt_cache_len。
+    同一个组的请求在返回的顺序中是连续的。
+    """
+
+    def __init__(self, use_prompt_cache: bool) -> None:
+        super().__init__()
+        self.use_prompt_cache = use_prompt_cache
+
+    def get_recompute_len(self, req: Req) -> int:
+        kv_len = max(0, req.shm_cur_kv_len)
+        if self.use_prompt_cache:
+            kv_len -= min(kv_len, req.prompt_cache_len)
+        return kv_len
+
+    def ordering_reqs(self, reqs: List):
+        groups = {}
+        for index, req in enumerate(reqs):
+            if req.group_req_id not in groups:
+                groups[req.group_req_id] = [0, 0, []]
+            group = groups[req.group_req_id]
+            group[0] = index
+            group[1] += self.get_recompute_len(req)
+            group[2].append(req)
+        sorted_groups = sorted(
+            groups.values(), key=lambda group: (-group[2][0].sample_params.priority, group[1], -group[0])
+        )
+        return [req for group in sorted_groups for req in group[2]]
+
+
 def select_paused_reqs(
     batch: Batch, strategy: Strategy, req_queue: BaseQueue, max_total_token_num: int, dp_index: int
 ) -> List[Req]:
@@ -45,3 +78,41 @@ def select_paused_reqs(
     req_queue.back_to_wait_list(pause_reqs)
 
     return pause_reqs
+
+
+def select_preempted_reqs(
+    batch: Batch, strategy: Strategy, req_queue: BaseQueue, dp_index: int, now: float, wait_threshold: float
+) -> List[Req]:
+    """
+    等待队列头部的请求等待超过 wait_threshold 秒时，按照 strategy 的顺序暂停优先级比它低的运行请求，
+    直到它可以被调度器加入运行。暂停这些请求也无法让它加入运行时不做抢占。
+    """
+    if isinstance(req_queue, DpQueue):
+        req_queue = req_queue.get_dp_queue(dp_index)
+    waiting_req = req_queue.get_preempting_req(now, wait_threshold)
+    if waiting_req is None:
+        return []
+
+    running_reqs = batch.get_req_list_for_dp(dp_index)
+    victim_groups: List[List[Req]] = []
+    for req in strategy.ordering_reqs(running_reqs):
+        if req.sample_params.priority <= waiting_req.sample_params.priority:
+            continue
+        if len(victim_groups) != 0 and victim_groups[-1][0].group_req_id == req.group_req_id:
+            victim_groups[-1].append(req)
+        else:
+            victim_groups.append([req])
+    if len(victim_groups) == 0:
+        return []
+
+    group_num = req_queue.calcu_preempt_group_num(running_reqs, victim_groups, waiting_req)
+    if group_num <= 0:
+        return []
+
+    pause_reqs = [req for group in victim_groups[0:group_num] for req in group]
+    for req in pause_reqs:
+        batch.pop_req(req.request_id)
+        req.is_paused = True
+
+    req_queue.back_to_wait_list(pause_reqs)
+    return pause_reqs
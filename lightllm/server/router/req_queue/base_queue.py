@@ -1,9 +1,18 @@
-from typing import List, Dict
+from typing import List, Dict, TYPE_CHECKING
 from lightllm.utils.infer_utils import calculate_time
 from ..batch import Batch, Req
 from lightllm.server.core.objs import FinishStatus
 from lightllm.common.basemodel.infer_lock import g_router_lock
 from lightllm.utils.config_utils import get_fixed_kv_len
+from .cache_aware_order import CacheAwareWaitingOrder
+from .peak_token_tree import PeakTokenTree
+
+if TYPE_CHECKING:
+    from lightllm.server.router.manager import RouterManager
+
+
+def get_req_priority(req: Req) -> int:
+    return req.sample_params.priority
 
 
 class BaseQueue:
@@ -11,9 +20,8 @@ class BaseQueue:
         self.args = args
         self.dp_index = dp_index
         self.dp_size_in_node = dp_size_in_node
-        from lightllm.server.router.manager import RouterManager
-
-        self.router: RouterManager = router
+        # 只在类型检查时引入 RouterManager，使队列可以脱离推理后端单独构建 (如离线的调度模拟)
+        self.router: "RouterManager" = router
         # max_total_token_num - get_fixed_kv_len() 是为了减去被特定
         # 推理模式预先占用了部分token kv 资源，这会导致整体可用的kv 资源
         # 在极端情况下减少，在非特定模式下，get_fixed_kv_len() 返回的都是
@@ -26,16 +34,43 @@ class BaseQueue:
         self.router_token_ratio = args.router_token_ratio  # ratio to determine whether the router is busy
         self.router_max_new_token_len = args.router_max_new_token_len
         self.pause_req_dict: Dict[int, Req] = {}  # List of paused requests
+        # 按照预计的 prompt cache 命中情况对等待队列排序，需要开启 prompt cache
+        self.cache_aware_order: CacheAwareWaitingOrder = None
+        if args.waiting_queue_policy == "cache_aware" and args.use_dynamic_prompt_cache:
+            self.cache_aware_order = CacheAwareWaitingOrder(
+                args.waiting_queue_max_skip, enable_priority_schedule=args.enable_priority_schedule
+            )
+        # 开启优先级调度时，等待队列按照优先级分级，优先级高 (priority 数值小) 的级别整体排在前面，
+        # 每个级别内部保持原有的顺序，所有按照等待队列前缀进行调度的逻辑都不需要改变。
+        self.enable_priority_schedule = args.enable_priority_schedule
 
     def append(self, req: Req):
         req.sample_params.suggested_dp_index = self.dp_index
         self.waiting_req_list.append(req)
+        self._keep_priority_order(1)
         return
 
     def extend(self, req_group: List[Req]):
         for req in req_group:
             req.sample_params.suggested_dp_index = self.dp_index
         self.waiting_req_list.extend(req_group)
+        self._keep_priority_order(len(req_group))
+        return
+
+    def _keep_priority_order(self, new_req_num: int):
+        """
+        新加入队列尾部的请求插入到同优先级请求的末尾，只有新请求的优先级高于队尾请求时才需要排序，
+        稳定排序对于一个有序序列加上一小段新请求的情况是线性复杂度的。
+        """
+        if not self.enable_priority_schedule or new_req_num == 0:
+            return
+        old_req_num = len(self.waiting_req_list) - new_req_num
+        if old_req_num == 0:
+            new_reqs = self.waiting_req_list
+        else:
+            new_reqs = self.waiting_req_list[old_req_num - 1 :]
+        if any(get_req_priority(new_reqs[i]) > get_req_priority(new_reqs[i + 1]) for i in range(len(new_reqs) - 1)):
+            self.waiting_req_list.sort(key=get_req_priority)
         return
 
     def get_paused_req_num(self, fake_dp_index: int = 0):
@@ -50,11 +85,114 @@ class BaseQueue:
             if req.is_paused:
                 self.pause_req_dict[req.request_id] = req
         self.waiting_req_list = req_list + self.waiting_req_list
+        if self.enable_priority_schedule:
+            # 被暂停的请求排在各自优先级的最前面
+            self.waiting_req_list.sort(key=get_req_priority)
+        return
+
+    def get_preempting_req(self, now: float, wait_threshold: float):
+        """
+        返回等待时间超过 wait_threshold 秒，需要抢占低优先级运行请求的等待队列头部请求，没有时返回 None。
+        """
+        for req in self.waiting_req_list:
+            if req.is_aborted and not req.is_paused:
+                continue
+            if now - req.start_time >= wait_threshold:
+                return req
+            return None
+        return None
+
+    def calcu_preempt_group_num(self, running_reqs: List[Req], victim_groups: List[List[Req]], new_req: Req) -> int:
+        """
+        计算需要按顺序暂停 victim_groups 中的前多少组请求，new_req 才能在调度器的 token 峰值估计下被加入运行，
+        已经可以加入时返回 0，暂停所有的候选请求也无法加入时返回 -1。暂停后下一次调度看到的是释放了被暂停请求的 kv
+        之后的繁忙状态，所以按照暂停之后的状态估计。暂停的请求越多峰值越小，所以可以二分查找。
+        """
+        if len(running_reqs) + len(self.pause_req_dict) >= self.running_max_req_size:
+            # 暂停请求不会减少请求数量的占用，抢占没有意义
+            return -1
+        frozen_token_num = self.router.shared_token_load.get_frozened_token_count(self.dp_index)
+        victim_ids = [set(req.request_id for req in group) for group in victim_groups]
+        released_token_nums = [0]
+        for group in victim_groups:
+            released_token_nums.append(released_token_nums[-1] + sum(req.get_used_tokens() for req in group))
+
+        def can_add(group_num: int):
+            is_busy = self.is_busy(released_token_nums[group_num])
+            paused_ids = set().union(*victim_ids[0:group_num])
+            items = [
+                self._get_req_tuple_tokens(req, is_busy) for req in running_reqs if req.request_id not in paused_ids
+            ]
+            items.append(self._get_new_req_tuple_tokens(new_req, is_busy))
+            return PeakTokenTree(items).get_peak() + frozen_token_num < self.max_total_tokens
+
+        if can_add(0):
+            return 0
+        if not can_add(len(victim_groups)):
+            return -1
+        low, high = 0, len(victim_groups)
+        while high - low > 1:
+            mid = (low + high) // 2
+            if can_add(mid):
+                high = mid
+            else:
+                low = mid
+        return high
+
+    def get_waiting_queue(self, limit_router_queue_length: int = None) -> List[Req]:
+        """
+        返回本次调度按顺序尝试加入 batch 的等待请求
+        """
+        if limit_router_queue_length is None:
+            waiting_queue = self.waiting_req_list
+        else:
+            waiting_queue = self.waiting_req_list[:limit_router_queue_length]
+        if self.cache_aware_order is not None and len(waiting_queue) > 1:
+            radix_cache_client = self.router.radix_cache_client
+            # 开启优先级调度时只在同一个优先级的内部按照 prompt cache 的命中情况排序
+            waiting_queue = self.cache_aware_order.order(
+                waiting_queue, lambda block_hashes: radix_cache_client.get_prefix_match_len(self.dp_index, block_hashes)
+            )
+        return waiting_queue
+
+    def remove_scheduled_reqs(self, can_run_list: List[Req], abort_req_list: List[Req]):
+        if self.cache_aware_order is None:
+            # fcfs 的顺序下，被调度和被丢弃的请求一定是等待队列的前缀
+            self.waiting_req_list = self.waiting_req_list[len(can_run_list) + len(abort_req_list) :]
+        else:
+            self.waiting_req_list = self.cache_aware_order.remove_scheduled(
+                self.waiting_req_list, can_run_list, abort_req_list
+            )
+        return
+
+    def _get_req_tuple_tokens(self, req: Req, is_busy):
+        # 由 router 上的输出长度估计器代替固定的 router_max_new_token_len 估计请求的输出长度
+        return req.get_tuple_tokens(is_busy, self.router.output_len_estimator.estimate(req))
+
+    def _get_new_req_tuple_tokens(self, req: Req, is_busy):
+        return self._get_req_tuple_tokens(req, is_busy)
+
+    def _init_peak_token_tree(self, waiting_queue: List[Req], is_busy, max_new_req_num: int):
+        # 预先放入可能被调度的请求的 left_out_len 作为 key，避免加入请求时重建
+        candidate_left_out_lens = [
+            self._get_new_req_tuple_tokens(req, is_busy)[1] for req in waiting_queue[0:max_new_req_num]
+        ]
+        self.peak_token_tree = PeakTokenTree(self.cache_len_list, candidate_left_out_lens)
         return
 
-    def is_busy(self):
+    def _add_req_and_get_peak_token_num(self, req: Req, is_busy):
+        """
+        将 req 加入到 cache_len_list 中，返回加入后运行过程中 token 占用的峰值。
+        """
+        req_tuple = self._get_new_req_tuple_tokens(req, is_busy)
+        self.cache_len_list.append(req_tuple)
+        self.peak_token_tree.add(*req_tuple)
+        return self.peak_token_tree.get_peak()
+
+    def is_busy(self, released_token_num: int = 0):
         # 计算当前所有的token使用量, 如果使用了dynamic prompt cache, 使用的token量中不包含，cache tree 中未被引用的数据。
-        cur_all_used_tokens = self.router.get_used_tokens(self.dp_index)
+        # released_token_num 用于估计释放部分请求的 kv 之后的状态
+        cur_all_used_tokens = self.router.get_used_tokens(self.dp_index) - released_token_num
         # 判断当前服务是否处于token使用率过高的状态，过高的情况下，调度要偏向保守
         cur_token_ratio = (
             cur_all_used_tokens + self.router.shared_token_load.get_frozened_token_count(self.dp_index)
@@ -0,0 +1,69 @@
+import numpy as np
+from typing import Callable, Dict, List
+from ..batch import Req
+from lightllm.server.router.dynamic_prompt.shared_prefix_index import get_prefix_block_hashes
+
+
+class CacheAwareWaitingOrder:
+    """
+    对等待队列前 max_scan_num 个请求重新排序，预计 prompt cache 命中长度越长、剩余需要 prefill 的 token
+    越少的请求越先被调度 (最长前缀匹配优先)，命中长度通过推理进程共享的只读前缀索引估计。
+    被暂停的请求已经占用了资源，以及被后到达的请求超越了 max_skip_times 次的请求，保持 fcfs 的顺序
+    排在最前面，避免请求被无限期的饿死。
+    开启优先级调度时，以上的排序只在同一个优先级的内部进行，优先级高 (priority 数值小) 的请求总是排在前面。
+    """
+
+    def __init__(self, max_skip_times: int, max_scan_num: int = 256, enable_priority_schedule: bool = False):
+        self.max_skip_times = max_skip_times
+        self.max_scan_num = max_scan_num
+        self.enable_priority_schedule = enable_priority_schedule
+        self.skip_times: Dict[int, int] = {}
+        self.block_hashes: Dict[int, np.ndarray] = {}
+
+    def _get_block_hashes(self, req: Req) -> np.ndarray:
+        hashes = self.block_hashes.get(req.request_id, None)
+        if hashes is None:
+            req.link_prompt_ids_shm_array()
+            hashes = get_prefix_block_hashes(req.shm_prompt_ids.arr[0 : req.input_len])
+            self.block_hashes[req.request_id] = hashes
+        return hashes
+
+    def order(self, waiting_reqs: List[Req], get_match_len: Callable[[np.ndarray], int]) -> List[Req]:
+        head_reqs = waiting_reqs[0 : self.max_scan_num]
+        first_reqs = []
+        sort_items = []
+        for fcfs_index, req in enumerate(head_reqs):
+            if req.is_paused or req.is_aborted or self.skip_times.get(req.request_id, 0) >= self.max_skip_times:
+                first_reqs.append(req)
+                continue
+            match_len = min(get_match_len(self._get_block_hashes(req)), req.input_len)
+            priority = req.sample_params.priority if self.enable_priority_schedule else 0
+            sort_items.append((priority, -match_len, req.input_len - match_len, fcfs_index, req))
+        sort_items.sort(key=lambda x: x[0:4])
+        head_reqs = first_reqs + [item[4] for item in sort_items]
+        if self.enable_priority_schedule:
+            # 稳定排序，每个优先级内部暂停和等待过久的请求仍然排在最前面
+            head_reqs.sort(key=lambda req: req.sample_params.priority)
+        return head_reqs + waiting_reqs[self.max_scan_num :]
+
+    def remove_scheduled(self, waiting_reqs: List[Req], can_run_list: List[Req], abort_req_list: List[Req]):
+        """
+        从 fcfs 顺序的等待队列中移除本次被调度和被丢弃的请求，并为被后到达的请求超越的请求增加计数。
+        """
+        scheduled_ids = set(req.request_id for req in can_run_list)
+        removed_ids = scheduled_ids | set(req.request_id for req in abort_req_list)
+        last_scheduled_index = -1
+        for index, req in enumerate(waiting_reqs):
+            if req.request_id in scheduled_ids:
+                last_scheduled_index = index
+
+        left_reqs = []
+        for index, req in enumerate(waiting_reqs):
+            if req.request_id in removed_ids:
+                self.skip_times.pop(req.request_id, None)
+                self.block_hashes.pop(req.request_id, None)
+                continue
+            if index < last_scheduled_index:
+                self.skip_times[req.request_id] = self.skip_times.get(req.request_id, 0) + 1
+            left_reqs.append(req)
+        return left_reqs
@@ -11,7 +11,7 @@ class ChunkedPrefillQueue(BaseQueue):
     def _init_cache_list(self, current_batch: Batch, is_busy):
         if current_batch is not None:
             self.cache_len_list = [
-                req.get_tuple_tokens(is_busy, self.router_max_new_token_len)
+                self._get_req_tuple_tokens(req, is_busy)
                 for req in current_batch.reqs
                 if req.sample_params.suggested_dp_index == self.dp_index
             ]
@@ -21,16 +21,7 @@ class ChunkedPrefillQueue(BaseQueue):
 
     # @calculate_time(show=True, min_cost_ms=0.1)
     def _can_add_new_req(self, req: Req, is_busy, new_batch_first_router_need_tokens):
-        self.cache_len_list.append(req.get_tuple_tokens(is_busy, self.router_max_new_token_len))  # hard to analysis
-        self.cache_len_list.sort(key=lambda x: -x[1])
-
-        left_out_len_array = np.array([e[1] for e in self.cache_len_list])
-        # assert left_out_len_array.min() >= 0
-        has_run_len_array = np.array([e[0] for e in self.cache_len_list])
-        cum_run_len_array = np.cumsum(has_run_len_array)
-        size_array = np.arange(1, len(self.cache_len_list) + 1, 1)
-
-        need_max_token_num = (left_out_len_array * size_array + cum_run_len_array).max()
+        need_max_token_num = self._add_req_and_get_peak_token_num(req, is_busy)
         ok_token_num = (
             need_max_token_num + self.router.shared_token_load.get_frozened_token_count(self.dp_index)
             < self.max_total_tokens
@@ -73,18 +64,16 @@ class ChunkedPrefillQueue(BaseQueue):
         self._init_cache_list(current_batch, is_busy)
         can_run_list = []
         abort_req_list = []
-        aborted_count = 0
 
-        if limit_router_queue_length is None:
-            waiting_queue = self.waiting_req_list
-        else:
-            waiting_queue = self.waiting_req_list[:limit_router_queue_length]
+        waiting_queue = self.get_waiting_queue(limit_router_queue_length)
+        self._init_peak_token_tree(
+            waiting_queue, is_busy, max_new_req_num=self.running_max_req_size - exist_req_num + len(self.pause_req_dict)
+        )
 
         for req in waiting_queue:
             if req.is_aborted and not req.is_paused:
                 # 由于管理的复杂性，只有没有被调度运行过的请求可以因为abort直接在队列中忽略掉.
                 # 暂停的请求需要恢复后，由 router manager 部分来过滤。暂时保持这种处理方法, 否则会导致管理token的泄漏
-                aborted_count += 1
                 abort_req_list.append(req)
                 continue
             ok_insert, new_batch_first_router_need_tokens = self._can_add_new_req(
@@ -102,7 +91,7 @@ class ChunkedPrefillQueue(BaseQueue):
             new_batch = Batch(uuid.uuid4().int, can_run_list, dp_size_in_node=self.dp_size_in_node)
             for req in abort_req_list:
                 self.router.shm_req_manager.put_back_req_obj(req)
-            self.waiting_req_list = self.waiting_req_list[len(can_run_list) + aborted_count :]
+            self.remove_scheduled_reqs(can_run_list, abort_req_list)
             return new_batch
         else:
             return None
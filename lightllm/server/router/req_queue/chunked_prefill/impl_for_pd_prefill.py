@@ -20,17 +20,12 @@ class QueueForPDChunkedPrefill(BaseQueue):
             self.cache_len_list = []
         return
 
+    def _get_new_req_tuple_tokens(self, req: Req, is_busy):
+        return (req.input_len, 1)  # hard to analysis
+
     # @calculate_time(show=True, min_cost_ms=0.1)
     def _can_add_new_req(self, req: Req, is_busy, new_batch_first_router_need_tokens):
-        self.cache_len_list.append((req.input_len, 1))  # hard to analysis
-        self.cache_len_list.sort(key=lambda x: -x[1])
-
-        left_out_len_array = np.array([e[1] for e in self.cache_len_list])
-        has_run_len_array = np.array([e[0] for e in self.cache_len_list])
-        cum_run_len_array = np.cumsum(has_run_len_array)
-        size_array = np.arange(1, len(self.cache_len_list) + 1, 1)
-
-        need_max_token_num = (left_out_len_array * size_array + cum_run_len_array).max()
+        need_max_token_num = self._add_req_and_get_peak_token_num(req, is_busy)
 
         with g_router_lock.obj:
             ok_token_num = (
@@ -75,18 +70,16 @@ class QueueForPDChunkedPrefill(BaseQueue):
         self._init_cache_list(current_batch, is_busy)
         can_run_list = []
         abort_req_list = []
-        aborted_count = 0
 
-        if limit_router_queue_length is None:
-            waiting_queue = self.waiting_req_list
-        else:
-            waiting_queue = self.waiting_req_list[:limit_router_queue_length]
+        waiting_queue = self.get_waiting_queue(limit_router_queue_length)
+        self._init_peak_token_tree(
+            waiting_queue, is_busy, max_new_req_num=self.running_max_req_size - exist_req_num + len(self.pause_req_dict)
+        )
 
         for req in waiting_queue:
             if req.is_aborted and not req.is_paused:
                 # 由于管理的复杂性，只有没有被调度运行过的请求可以因为abort直接在队列中忽略掉.
                 # 暂停的请求需要恢复后，由 router manager 部分来过滤。暂时保持这种处理方法, 否则会导致管理token的泄漏
-                aborted_count += 1
                 abort_req_list.append(req)
                 continue
             ok_insert, new_batch_first_router_need_tokens = self._can_add_new_req(
@@ -104,7 +97,7 @@ class QueueForPDChunkedPrefill(BaseQueue):
             new_batch = Batch(uuid.uuid4().int, can_run_list, dp_size_in_node=self.dp_size_in_node)
             for req in abort_req_list:
                 self.router.shm_req_manager.put_back_req_obj(req)
-            self.waiting_req_list = self.waiting_req_list[len(can_run_list) + aborted_count :]
+            self.remove_scheduled_reqs(can_run_list, abort_req_list)
             return new_batch
         else:
             return None
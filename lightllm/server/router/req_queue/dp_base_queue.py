@@ -1,10 +1,14 @@
 import random
-from typing import List
+from typing import List, TYPE_CHECKING
 from ..batch import Batch, Req
 from lightllm.server.router.req_queue.base_queue import BaseQueue
+from lightllm.server.router.req_queue.dp_prefix_affinity import PrefixAffinityIndex
 from lightllm.common.basemodel.infer_lock import g_router_lock
 from lightllm.utils.log_utils import init_logger
 
+if TYPE_CHECKING:
+    from lightllm.server.router.manager import RouterManager
+
 logger = init_logger(__name__)
 
 
@@ -13,13 +17,20 @@ class DpQueue:
         self.dp_size_in_node = dp_size_in_node
         self.base_queue_class = base_queue_class
         self.round_robin_dp_id = 0
-        from lightllm.server.router.manager import RouterManager
-
-        self.router: RouterManager = router
+        self.router: "RouterManager" = router
         self.inner_queues: List[BaseQueue] = [
             base_queue_class(args, router, dp_index, dp_size_in_node) for dp_index in range(self.dp_size_in_node)
         ]
 
+        self.prefix_affinity_index: PrefixAffinityIndex = None
+        if args.dp_balancer == "prefix_affinity":
+            if not args.use_dynamic_prompt_cache:
+                logger.warning("dp_balancer prefix_affinity works with use_dynamic_prompt_cache, it is not enabled")
+            self.prefix_affinity_index = PrefixAffinityIndex(
+                dp_size=self.dp_size_in_node, load_weight=args.dp_balancer_load_weight
+            )
+        # 各个 dp 上等待队列中的 token 数量，在 update_token_load 时刷新，放置请求时累加
+        self.waiting_token_nums = [0 for _ in range(self.dp_size_in_node)]
         return
 
     def get_dp_queue(self, dp_index: int):
@@ -49,33 +60,45 @@ class DpQueue:
         return merged_batch
 
     def append(self, req: Req):
-        suggested_dp_index = req.sample_params.suggested_dp_index
-        if suggested_dp_index >= self.dp_size_in_node or suggested_dp_index < 0:
-            logger.error(f"input req {req.request_id} dp index {suggested_dp_index} has error")
-            suggested_dp_index = self.round_robin_dp_id
-            self.round_robin_dp_id = (self.round_robin_dp_id + 1) % self.dp_size_in_node
-            req.sample_params.suggested_dp_index = suggested_dp_index
-            self.inner_queues[suggested_dp_index].append(req)
-        else:
-            self.inner_queues[suggested_dp_index].append(req)
+        self.extend([req])
         return
 
     def extend(self, req_group: List[Req]):
         # 同一个组的，要分配在同一个 dp 上，效率最高
-        index = self.round_robin_dp_id
-        self.round_robin_dp_id = (self.round_robin_dp_id + 1) % self.dp_size_in_node
+        index = None
         for req in req_group:
             suggested_dp_index = req.sample_params.suggested_dp_index
             if suggested_dp_index >= self.dp_size_in_node or suggested_dp_index < 0:
-                logger.error(f"input req {req.request_id} dp index {suggested_dp_index} has error")
-
-                req.sample_params.suggested_dp_index = index
-                self.inner_queues[index].append(req)
-            else:
-                self.inner_queues[suggested_dp_index].append(req)
+                if self.prefix_affinity_index is None:
+                    logger.error(f"input req {req.request_id} dp index {suggested_dp_index} has error")
+                if index is None:
+                    index = self._select_dp_index(req)
+                suggested_dp_index = index
+                req.sample_params.suggested_dp_index = suggested_dp_index
+            self.inner_queues[suggested_dp_index].append(req)
+            self.waiting_token_nums[suggested_dp_index] += req.input_len
 
         return
 
+    def _select_dp_index(self, req: Req) -> int:
+        index = self.round_robin_dp_id
+        self.round_robin_dp_id = (self.round_robin_dp_id + 1) % self.dp_size_in_node
+        if self.prefix_affinity_index is None:
+            return index
+
+        # req 对象会被复用，每次都需要重新 link 当前请求的 prompt ids
+        req.link_prompt_ids_shm_array()
+        dp_loads = [
+            self.router.shared_token_load.get_current_load(dp_index)
+            + self.waiting_token_nums[dp_index] / self.router.max_total_token_num
+            for dp_index in range(self.dp_size_in_node)
+        ]
+        index, matched_len = self.prefix_affinity_index.select_dp(
+            req.shm_prompt_ids.arr[0 : req.input_len], dp_loads, default_dp_index=index
+        )
+        logger.debug(f"req {req.request_id} placed on dp {index}, expected prefix hit len {matched_len}")
+        return index
+
     def back_to_wait_list(self, req_list: List[Req]):
         raise NotImplementedError("not supported feature")
 
@@ -93,4 +116,7 @@ class DpQueue:
                     self.router.shared_token_load.set_current_load(token_ratio1, dp_index)
                     self.router.shared_token_load.set_estimated_peak_token_count(estimated_peak_token_count, dp_index)
                     self.router.shared_token_load.set_dynamic_max_load(dynamic_max_load, dp_index)
+                self.waiting_token_nums[dp_index] = sum(
+                    req.input_len for req in self.inner_queues[dp_index].waiting_req_list
+                )
         return
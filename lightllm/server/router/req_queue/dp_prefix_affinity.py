@@ -0,0 +1,83 @@
+import numpy as np
+from collections import OrderedDict
+from typing import List, Tuple
+
+
+class PrefixAffinityIndex:
+    """
+    router 中记录 prompt 前缀被分配到了哪些 dp 上的轻量索引，用于在 dp 模式下将请求分配到
+    已经缓存了其最长前缀的 dp 上，提升各个 dp 上 radix cache 的命中率。
+    prompt 按照 block_size 个 token 切分为块，每个块使用包含了之前所有块内容的链式 hash 作为 key，
+    value 为已经被分配过该前缀的 dp 的位掩码。索引只是对各个 dp 上 radix cache 内容的近似估计，
+    使用 LRU 的方式淘汰，最多保存 max_block_num 个块。
+    """
+
+    def __init__(self, dp_size: int, block_size: int = 64, max_block_num: int = 1000000, load_weight: float = 1.0):
+        self.dp_size = dp_size
+        self.block_size = block_size
+        self.max_block_num = max_block_num
+        # 前缀命中率 (0 ~ 1) 与 dp 负载 (0 ~ 1) 之间的权衡系数，越大越偏向负载均衡
+        self.load_weight = load_weight
+        self.block_to_dp_mask: "OrderedDict[int, int]" = OrderedDict()
+
+    def get_block_hashes(self, token_ids: np.ndarray) -> List[int]:
+        token_ids = np.ascontiguousarray(token_ids, dtype=np.int64)
+        block_num = len(token_ids) // self.block_size
+        hashes = []
+        prev_hash = 0
+        for i in range(block_num):
+            prev_hash = hash((prev_hash, token_ids[i * self.block_size : (i + 1) * self.block_size].tobytes()))
+            hashes.append(prev_hash)
+        return hashes
+
+    def match(self, block_hashes: List[int]) -> List[int]:
+        """
+        返回每个 dp 上可能命中的前缀长度 (token 数量)。
+        """
+        matched_lens = [0] * self.dp_size
+        alive_mask = (1 << self.dp_size) - 1
+        depth = 0
+        for block_hash in block_hashes:
+            dp_mask = self.block_to_dp_mask.get(block_hash, 0) & alive_mask
+            if dp_mask != alive_mask:
+                self._set_matched_len(matched_lens, alive_mask & ~dp_mask, depth)
+                alive_mask = dp_mask
+            if alive_mask == 0:
+                break
+            self.block_to_dp_mask.move_to_end(block_hash)
+            depth += 1
+        self._set_matched_len(matched_lens, alive_mask, depth)
+        return matched_lens
+
+    def _set_matched_len(self, matched_lens: List[int], dp_mask: int, depth: int):
+        dp_index = 0
+        while dp_mask:
+            if dp_mask & 1:
+                matched_lens[dp_index] = depth * self.block_size
+            dp_mask >>= 1
+            dp_index += 1
+        return
+
+    def insert(self, block_hashes: List[int], dp_index: int):
+        dp_bit = 1 << dp_index
+        for block_hash in block_hashes:
+            self.block_to_dp_mask[block_hash] = self.block_to_dp_mask.get(block_hash, 0) | dp_bit
+            self.block_to_dp_mask.move_to_end(block_hash)
+        while len(self.block_to_dp_mask) > self.max_block_num:
+            self.block_to_dp_mask.popitem(last=False)
+        return
+
+    def select_dp(self, token_ids: np.ndarray, dp_loads: List[float], default_dp_index: int) -> Tuple[int, int]:
+        """
+        选择 前缀命中比例 - load_weight * 负载 最大的 dp，分数相同时优先选择 default_dp_index，
+        并将该请求的前缀记录到选中的 dp 上。返回 (dp_index, 预计命中的前缀长度)。
+        """
+        block_hashes = self.get_block_hashes(token_ids)
+        matched_lens = self.match(block_hashes)
+        prompt_len = max(1, len(token_ids))
+        best_dp_index = max(
+            range(self.dp_size),
+            key=lambda i: (matched_lens[i] / prompt_len - self.load_weight * dp_loads[i], i == default_dp_index),
+        )
+        self.insert(block_hashes, best_dp_index)
+        return best_dp_index, matched_lens[best_dp_index]
@@ -0,0 +1,136 @@
+import bisect
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+from ..batch import Req
+
+
+class OutputLenEstimator:
+    """
+    估计请求最终的输出长度，调度器用其代替固定的 router_max_new_token_len 来估计请求未来的 token 占用量，
+    估计值在 get_tuple_tokens 中还会被 max_new_tokens 截断。
+    """
+
+    def estimate(self, req: Req) -> int:
+        raise NotImplementedError()
+
+    def observe(self, req: Req):
+        """
+        请求正常结束时调用，用于在线更新统计信息。
+        """
+        return
+
+
+class FixedOutputLenEstimator(OutputLenEstimator):
+    def __init__(self, router_max_new_token_len: int):
+        self.router_max_new_token_len = router_max_new_token_len
+
+    def estimate(self, req: Req) -> int:
+        return self.router_max_new_token_len
+
+
+class _OutputLenHistogram:
+    def __init__(self, bin_edges: np.ndarray):
+        self.bin_edges = bin_edges
+        self.counts = np.zeros((len(bin_edges) - 1,), dtype=np.float64)
+        self.total = 0.0
+        self.dirty_num = 0
+        # estimates[i] 为已经输出的长度落在第 i 个桶中时，输出长度的条件分位数
+        self.estimates: List[int] = None
+
+    def add(self, bin_index: int, max_sample_num: int):
+        self.counts[bin_index] += 1
+        self.total += 1
+        self.dirty_num += 1
+        if self.total > max_sample_num:
+            # 指数遗忘旧的样本，使统计结果可以跟随负载的变化
+            self.counts *= 0.5
+            self.total *= 0.5
+        return
+
+    def build_estimates(self, quantile: float):
+        suffix_counts = np.concatenate([np.cumsum(self.counts[::-1])[::-1], [0.0]])
+        # 对每个起始桶 i，找到第一个满足 suffix_counts[k] <= (1 - quantile) * suffix_counts[i] 的 k，
+        # 此时 [i, k) 内的样本数量达到了条件分布的 quantile 分位，取第 k - 1 个桶的上边界作为估计值
+        thresholds = (1.0 - quantile) * suffix_counts[:-1]
+        ks = np.searchsorted(-suffix_counts, -thresholds, side="left")
+        ks = np.maximum(ks, np.arange(1, len(ks) + 1))
+        estimates = self.bin_edges[ks]
+        # 没有任何样本超过当前输出长度时无法估计
+        estimates[suffix_counts[:-1] == 0] = -1
+        self.estimates = estimates.tolist()
+        self.dirty_num = 0
+        return
+
+
+class HistogramOutputLenEstimator(OutputLenEstimator):
+    """
+    按照 (客户端提供的 output_len_hint, prompt 长度的 log2 分桶) 在线统计已结束请求的输出长度直方图，
+    估计值为在已经输出 has_out_len 个 token 的条件下，输出长度的 quantile 分位数。
+    样本数量不足 min_sample_num 时依次退化为只按照 output_len_hint 统计、全局统计，以及固定的 fallback_len。
+    """
+
+    def __init__(
+        self,
+        fallback_len: int,
+        max_output_len: int,
+        quantile: float = 0.5,
+        min_sample_num: int = 32,
+        max_sample_num: int = 4096,
+        refresh_interval: int = 16,
+    ):
+        assert 0.0 < quantile < 1.0
+        self.fallback_len = fallback_len
+        self.quantile = quantile
+        self.min_sample_num = min_sample_num
+        self.max_sample_num = max_sample_num
+        self.refresh_interval = refresh_interval
+        edges = np.unique(np.round(np.geomspace(1, max(2, max_output_len + 1), 64)).astype(np.int64))
+        self.bin_edges = np.concatenate([[0], edges])
+        self.bin_lower_edges: List[int] = self.bin_edges[:-1].tolist()
+        self.histograms: Dict[Tuple[int, int], _OutputLenHistogram] = {}
+
+    def _get_group_keys(self, req: Req) -> List[Tuple[Optional[int], Optional[int]]]:
+        hint = req.sample_params.output_len_hint
+        prompt_bucket = int(req.input_len).bit_length()
+        return [(hint, prompt_bucket), (hint, None), (None, None)]
+
+    def _get_bin_index(self, out_len: int) -> int:
+        return min(bisect.bisect_right(self.bin_lower_edges, out_len) - 1, len(self.bin_lower_edges) - 1)
+
+    def observe(self, req: Req):
+        bin_index = self._get_bin_index(req.shm_cur_output_len)
+        for key in self._get_group_keys(req):
+            histogram = self.histograms.get(key, None)
+            if histogram is None:
+                histogram = _OutputLenHistogram(self.bin_edges)
+                self.histograms[key] = histogram
+            histogram.add(bin_index, self.max_sample_num)
+        return
+
+    def estimate(self, req: Req) -> int:
+        has_out_len = req.shm_cur_output_len
+        for key in self._get_group_keys(req):
+            histogram = self.histograms.get(key, None)
+            if histogram is None or histogram.total < self.min_sample_num:
+                continue
+            if histogram.estimates is None or histogram.dirty_num >= self.refresh_interval:
+                histogram.build_estimates(self.quantile)
+            estimate = histogram.estimates[self._get_bin_index(has_out_len)]
+            if estimate >= 0:
+                return estimate
+            # 当前请求已经比所有统计过的请求都长
+            return max(self.fallback_len, has_out_len + 1)
+        return self.fallback_len
+
+
+def build_output_len_estimator(args) -> OutputLenEstimator:
+    if args.output_len_estimator == "fixed":
+        return FixedOutputLenEstimator(args.router_max_new_token_len)
+    elif args.output_len_estimator == "histogram":
+        return HistogramOutputLenEstimator(
+            fallback_len=args.router_max_new_token_len,
+            max_output_len=args.max_req_total_len,
+            quantile=args.output_len_estimator_quantile,
+        )
+    else:
+        raise ValueError(f"can not support output_len_estimator {args.output_len_estimator}")
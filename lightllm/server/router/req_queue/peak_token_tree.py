@@ -0,0 +1,117 @@
+import numpy as np
+from typing import Iterable, List, Tuple
+
+_INF = float("inf")
+
+
+class PeakTokenTree:
+    """
+    增量的计算一组请求在未来运行过程中的 token 占用峰值，与调度器中原有的计算方式等价：
+    将 (has_run_len, left_out_len) 按照 left_out_len 从大到小排序后，
+    need_max_token_num = max_k(left_out_len_k * k + sum_{i<=k} has_run_len_i)。
+    换一种角度，在未来第 t 步时，所有 left_out_len >= t 的请求各占用 has_run_len + t 个 token，
+    记 f(t) = sum_{left_out_len_i >= t} (has_run_len_i + t)，峰值为 max_t f(t)，且只会在某个请求的 left_out_len 处取到。
+    新加入一个请求 (a, b) 等价于对所有 t <= b 的 f(t) 加上 t + a，是一个斜率为正的前缀区间一次函数加，
+    使用以 left_out_len 为 key 的 kinetic segment tree 维护 f 的最大值，每次加入请求的均摊复杂度为 O(log^2 n)。
+    树中的 key 在构建时确定，可以通过 extra_left_out_lens 预先放入将要加入的请求的 left_out_len，
+    加入的请求的 left_out_len 不在 key 中时会重新构建整棵树。
+    """
+
+    def __init__(self, items: Iterable[Tuple[int, int]], extra_left_out_lens: Iterable[int] = ()):
+        self.items: List[Tuple[int, int]] = list(items)
+        self._build(extra_left_out_lens)
+
+    def _build(self, extra_left_out_lens: Iterable[int]):
+        keys = sorted(set(item[1] for item in self.items) | set(extra_left_out_lens))
+        if len(keys) == 0:
+            keys = [0]
+        self.key_to_index = {key: index for index, key in enumerate(keys)}
+        key_num = len(keys)
+        self.size = 1
+        while self.size < key_num:
+            self.size *= 2
+
+        # 初始的 f(key) = key * count(left_out_len >= key) + sum(has_run_len of left_out_len >= key)
+        keys_array = np.array(keys, dtype=np.int64)
+        values = np.zeros((key_num,), dtype=np.int64)
+        if len(self.items) != 0:
+            items_array = np.array(self.items, dtype=np.int64).reshape(-1, 2)
+            order = np.argsort(items_array[:, 1], kind="stable")
+            sorted_left_out = items_array[order, 1]
+            suffix_run_len = np.concatenate([np.cumsum(items_array[order, 0][::-1])[::-1], [0]])
+            start = np.searchsorted(sorted_left_out, keys_array, side="left")
+            values = keys_array * (len(self.items) - start) + suffix_run_len[start]
+
+        # 节点中保存子树内取最大值的 key (即一次函数的斜率) 和最大值，melt 表示子树内的最大值位置
+        # 在再加多少次斜率之后可能会发生变化，lazy 中保存还未下发给子节点的 (斜率的次数, 常数)
+        size = self.size
+        self.best_slope = [0] * (2 * size)
+        self.best_value = [-_INF] * (2 * size)
+        self.melt = [_INF] * (2 * size)
+        self.lazy_heat = [0] * (2 * size)
+        self.lazy_add = [0] * (2 * size)
+        self.best_slope[size : size + key_num] = keys
+        self.best_value[size : size + key_num] = values.tolist()
+        for node in range(size - 1, 0, -1):
+            self._pull(node)
+        return
+
+    def _pull(self, node: int):
+        left, right = 2 * node, 2 * node + 1
+        best_slope, best_value = self.best_slope, self.best_value
+        if best_value[left] > best_value[right] or (
+            best_value[left] == best_value[right] and best_slope[left] >= best_slope[right]
+        ):
+            win, lose = left, right
+        else:
+            win, lose = right, left
+        best_slope[node] = best_slope[win]
+        best_value[node] = best_value[win]
+        melt = min(self.melt[left], self.melt[right])
+        if best_slope[lose] > best_slope[win] and best_value[lose] != -_INF:
+            melt = min(melt, (best_value[win] - best_value[lose]) / (best_slope[lose] - best_slope[win]))
+        self.melt[node] = melt
+        return
+
+    def _apply(self, node: int, heat: int, add: int):
+        self.best_value[node] += self.best_slope[node] * heat + add
+        self.melt[node] -= heat
+        if node < self.size:
+            self.lazy_heat[node] += heat
+            self.lazy_add[node] += add
+        return
+
+    def _push(self, node: int):
+        heat, add = self.lazy_heat[node], self.lazy_add[node]
+        if heat != 0 or add != 0:
+            self._apply(2 * node, heat, add)
+            self._apply(2 * node + 1, heat, add)
+            self.lazy_heat[node] = 0
+            self.lazy_add[node] = 0
+        return
+
+    def _update(self, node: int, node_left: int, node_right: int, right: int, heat: int, add: int):
+        # 对 key 下标在 [0, right] 内的 f 加上 key * heat + add
+        if node_left > right:
+            return
+        if node_right <= right and heat <= self.melt[node]:
+            self._apply(node, heat, add)
+            return
+        self._push(node)
+        mid = (node_left + node_right) // 2
+        self._update(2 * node, node_left, mid, right, heat, add)
+        self._update(2 * node + 1, mid + 1, node_right, right, heat, add)
+        self._pull(node)
+        return
+
+    def add(self, has_run_len: int, left_out_len: int):
+        self.items.append((has_run_len, left_out_len))
+        index = self.key_to_index.get(left_out_len, None)
+        if index is None:
+            self._build(())
+            return
+        self._update(1, 0, self.size - 1, index, 1, has_run_len)
+        return
+
+    def get_peak(self) -> int:
+        return max(0, int(self.best_value[1]))
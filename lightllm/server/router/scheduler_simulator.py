@@ -0,0 +1,488 @@
+"""
+离线的离散事件调度模拟器，不需要 gpu 和推理后端，使用真实的 req_queue、Batch、select_paused_reqs 和 TokenLoad，
+按照请求 trace 回放 router 的调度过程，用于在 cpu 上快速评估调度参数和调度策略对吞吐、延迟和暂停的影响。
+推理过程被简化为：每一步中每个请求处理 prefill 的一个 chunk 或者 decode 一个 token，每一步的耗时由 StepCostModel 估计，
+显存由 _SimMemoryManager 按照 token 数量管理，被暂停的请求释放其全部的 kv，恢复后重新 prefill。
+与 RouterManager 不同，模拟器中的调度是同步完成的，没有模拟调度和推理之间的 overlap。
+"""
+import os
+import json
+import random
+import tempfile
+import threading
+import numpy as np
+from dataclasses import dataclass, asdict, fields
+from typing import Dict, List, Optional
+from lightllm.server.core.objs import FinishStatus
+from lightllm.server.core.objs.req import Req, NormalReq, ChunkedPrefillReq
+from lightllm.server.core.objs.start_args_type import StartArgs
+from lightllm.server.req_id_generator import MAX_BEST_OF
+from lightllm.common.basemodel.infer_lock import g_router_lock
+from lightllm.utils.envs_utils import get_env_start_args, get_unique_server_name, set_env_start_args
+from .batch import Batch
+from .token_load import TokenLoad
+from .pause_strategy import Fcfs, PriorityRecoverable, select_paused_reqs, select_preempted_reqs
+from .req_queue import build_req_queue
+from .req_queue.output_len_estimator import build_output_len_estimator
+
+
+@dataclass
+class SimReqSpec:
+    # trace 中的一个请求，jsonl 中每一行为一个请求，除了 input_len 和 output_len 之外的字段都可以省略
+    input_len: int
+    output_len: int
+    arrival_time: float = 0.0
+    max_new_tokens: int = -1
+    output_len_hint: int = -1
+    priority: int = 0
+
+
+# 兼容其他常见 trace 格式中的字段名
+_TRACE_FIELD_ALIASES = {
+    "timestamp": "arrival_time",
+    "prompt_len": "input_len",
+    "input_tokens": "input_len",
+    "prompt_tokens": "input_len",
+    "output_tokens": "output_len",
+    "completion_tokens": "output_len",
+}
+
+
+def load_trace(trace_path: str) -> List[SimReqSpec]:
+    names = set(field.name for field in fields(SimReqSpec))
+    specs = []
+    with open(trace_path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if len(line) == 0:
+                continue
+            item = {_TRACE_FIELD_ALIASES.get(key, key): value for key, value in json.loads(line).items()}
+            if "input_len" not in item or "output_len" not in item:
+                raise ValueError(f"trace line need input_len and output_len, but get {line}")
+            specs.append(SimReqSpec(**{key: value for key, value in item.items() if key in names}))
+    specs.sort(key=lambda x: x.arrival_time)
+    return specs
+
+
+def dump_trace(specs: List[SimReqSpec], trace_path: str):
+    with open(trace_path, "w") as f:
+        for spec in specs:
+            f.write(json.dumps(asdict(spec)) + "\n")
+    return
+
+
+def gen_bimodal_trace(
+    num_reqs: int, qps: float, short_ratio: float = 0.8, max_new_tokens: int = 2048, seed: int = 0
+) -> List[SimReqSpec]:
+    """
+    生成泊松到达的合成 trace，输出长度为短输出和长输出的混合，output_len_hint 为 0 表示短输出，1 表示长输出。
+    """
+    rng = random.Random(seed)
+    specs = []
+    arrival_time = 0.0
+    for _ in range(num_reqs):
+        arrival_time += rng.expovariate(qps)
+        is_short = rng.random() < short_ratio
+        if is_short:
+            output_len = int(rng.lognormvariate(4.5, 0.5))
+        else:
+            output_len = int(rng.lognormvariate(7.0, 0.3))
+        specs.append(
+            SimReqSpec(
+                input_len=rng.randint(128, 1024),
+                output_len=max(1, min(output_len, max_new_tokens)),
+                arrival_time=arrival_time,
+                max_new_tokens=max_new_tokens,
+                output_len_hint=0 if is_short else 1,
+            )
+        )
+    return specs
+
+
+def build_sim_start_args(**kwargs) -> StartArgs:
+    """
+    构建模拟使用的启动参数，与 api_start 中相同的方式补全 batch_max_tokens。
+    """
+    args = StartArgs(**kwargs)
+    assert args.max_total_token_num is not None, "simulator need max_total_token_num"
+    if args.batch_max_tokens is None:
+        if args.disable_chunked_prefill:
+            args.batch_max_tokens = args.max_req_total_len
+        else:
+            args.batch_max_tokens = min(args.max_req_total_len, 2 * args.chunked_prefill_size)
+    return args
+
+
+def init_sim_env(args: StartArgs):
+    """
+    设置队列依赖的进程级环境，需要在构建 SchedulerSimulator 之前调用，一个进程中同时只能模拟一组启动参数。
+    """
+    if args.model_dir is None:
+        # get_fixed_kv_len 需要读取模型的 config.json
+        args.model_dir = tempfile.mkdtemp(prefix="lightllm_sim_")
+        with open(os.path.join(args.model_dir, "config.json"), "w") as f:
+            f.write("{}")
+    if get_unique_server_name() is None:
+        os.environ["LIGHTLLM_UNIQUE_SERVICE_NAME_ID"] = f"lightllm_sim_{os.getpid()}"
+    set_env_start_args(args)
+    get_env_start_args.cache_clear()
+    if g_router_lock.obj is None:
+        g_router_lock.obj = threading.Lock()
+    return
+
+
+@dataclass
+class StepCostModel:
+    """
+    一次推理的耗时 (秒) = base_time + prefill_token_time * prefill 的 token 数量
+    + decode_req_time * decode 的请求数量 + kv_token_time * decode 请求的 kv 长度之和。
+    默认值大致对应单卡上 7B 模型的量级，需要按照实际的 profile 结果设置。
+    """
+
+    base_time: float = 0.008
+    prefill_token_time: float = 0.00007
+    decode_req_time: float = 0.0001
+    kv_token_time: float = 0.0000002
+
+    def get_step_time(self, prefill_token_num: int, decode_req_num: int, decode_kv_token_num: int) -> float:
+        return (
+            self.base_time
+            + self.prefill_token_time * prefill_token_num
+            + self.decode_req_time * decode_req_num
+            + self.kv_token_time * decode_kv_token_num
+        )
+
+
+class _SimMemoryManager:
+    """
+    按照 token 数量模拟各个 dp 上 kv 显存的占用，提供与 ReadOnlyStaticsMemoryManager 相同的查询接口。
+    """
+
+    def __init__(self, max_total_token_num: int, dp_size_in_node: int):
+        self.max_total_token_num = max_total_token_num
+        self.used_token_nums = [0 for _ in range(dp_size_in_node)]
+        self.max_used_token_nums = [0 for _ in range(dp_size_in_node)]
+        # 推理时申请的 token 超过了显存容量的次数，真实系统中会导致推理失败
+        self.oom_num = 0
+
+    def alloc(self, dp_index: int, token_num: int):
+        self.used_token_nums[dp_index] += token_num
+        if self.used_token_nums[dp_index] > self.max_total_token_num:
+            self.oom_num += 1
+        self.max_used_token_nums[dp_index] = max(self.max_used_token_nums[dp_index], self.used_token_nums[dp_index])
+        return
+
+    def free(self, dp_index: int, token_num: int):
+        self.used_token_nums[dp_index] -= token_num
+        assert self.used_token_nums[dp_index] >= 0
+        return
+
+    def get_unrefed_token_num(self, dp_index: int):
+        return self.max_total_token_num - self.used_token_nums[dp_index]
+
+
+class _SimRouter:
+    """
+    提供队列在调度时需要访问的 RouterManager 的属性和方法。
+    """
+
+    def __init__(self, args: StartArgs, dp_size_in_node: int):
+        self.args = args
+        self.max_total_token_num = args.max_total_token_num
+        self.radix_cache_client = None
+        self.shm_req_manager = self
+        self.output_len_estimator = build_output_len_estimator(args)
+        self.read_only_statics_mem_manager = _SimMemoryManager(self.max_total_token_num, dp_size_in_node)
+        self.shared_token_load = TokenLoad(f"{get_unique_server_name()}_shared_token_load", dp_size_in_node)
+        for dp_index in range(dp_size_in_node):
+            self.shared_token_load.set_estimated_peak_token_count(0, dp_index)
+            self.shared_token_load.set_frozened_token_count(0, dp_index)
+            self.shared_token_load.set_current_load(0.0, dp_index)
+            self.shared_token_load.set_dynamic_max_load(0.0, dp_index)
+
+    def get_used_tokens(self, dp_index):
+        return self.max_total_token_num - self.read_only_statics_mem_manager.get_unrefed_token_num(dp_index)
+
+    def put_back_req_obj(self, req: Req):
+        return
+
+    def close(self):
+        for shared_array in [self.shared_token_load.shared_token_load, self.shared_token_load.shared_token_infos]:
+            shared_array.shm.close()
+            shared_array.shm.unlink()
+        return
+
+
+class _SimReqState:
+    def __init__(self, spec: SimReqSpec):
+        self.spec = spec
+        self.first_token_time: float = None
+        self.last_token_time: float = None
+
+
+def _percentiles(values: List[float], prefix: str) -> dict:
+    ans = {}
+    for p in [50, 90, 99]:
+        ans[f"{prefix}_p{p}"] = float(np.percentile(values, p)) if len(values) != 0 else float("nan")
+    return ans
+
+
+class SchedulerSimulator:
+    def __init__(self, args: StartArgs, specs: List[SimReqSpec], cost_model: Optional[StepCostModel] = None):
+        """
+        args 需要已经通过 init_sim_env 设置到环境中，specs 需要按照 arrival_time 排序。
+        """
+        assert args.max_total_token_num is not None
+        self.args = args
+        self.specs = specs
+        self.cost_model = cost_model if cost_model is not None else StepCostModel()
+        self.dp_size_in_node = args.dp
+        self.is_safe_schedule = args.router_token_ratio == 0.0
+        self.max_wait_tokens = args.router_max_wait_tokens
+        self.is_chunked_prefill = not args.disable_chunked_prefill
+        self.req_class = NormalReq if args.disable_chunked_prefill else ChunkedPrefillReq
+        self.router = _SimRouter(args, self.dp_size_in_node)
+        self.mem_manager = self.router.read_only_statics_mem_manager
+        self.req_queue = build_req_queue(args, self.router, self.dp_size_in_node)
+        self.pause_strategy = Fcfs()
+        if args.enable_priority_schedule:
+            self.pause_strategy = PriorityRecoverable(args.use_dynamic_prompt_cache)
+        self.enable_priority_preempt = args.enable_priority_schedule and args.priority_preempt_wait_ms >= 0
+        self.priority_preempt_wait_time = args.priority_preempt_wait_ms / 1000.0
+        self.req_states: Dict[int, _SimReqState] = {}
+
+    def _create_req(self, index: int, spec: SimReqSpec) -> Req:
+        req = self.req_class()
+        req.index_in_shm_mem = index
+        req.request_id = index * MAX_BEST_OF
+        req.group_req_id = req.request_id
+        req.is_paused = False
+        req.finish_status = FinishStatus()
+        req.is_aborted = False
+        req.router_aborted = False
+        req.shm_infer_released = False
+        req.shm_cur_kv_len = 0
+        req.shm_cur_output_len = 0
+        req.input_len = spec.input_len
+        req.chunked_prefill_size = self.args.chunked_prefill_size
+        max_new_tokens = spec.max_new_tokens
+        if max_new_tokens <= 0:
+            max_new_tokens = max(1, self.args.max_req_total_len - spec.input_len)
+        req.sample_params.init(
+            tokenizer=None,
+            max_new_tokens=max_new_tokens,
+            output_len_hint=spec.output_len_hint,
+            priority=spec.priority,
+        )
+        # 与 RouterManager 中相同，记录请求到达 router 的时间，使用模拟的时钟
+        req.start_time = spec.arrival_time
+        self.req_states[req.request_id] = _SimReqState(spec)
+        return req
+
+    def _forward(self, batch: Batch, decode_batch_size: int = 0):
+        """
+        模拟一次推理，decode_batch_size 不为 0 时记录为一次 decode 步骤的 batch 大小。
+        """
+        forward_lens = []
+        prefill_token_num = 0
+        decode_req_num = 0
+        decode_kv_token_num = 0
+        for req in batch.reqs:
+            forward_len = req.input_len + req.shm_cur_output_len - req.shm_cur_kv_len
+            if self.is_chunked_prefill:
+                forward_len = min(forward_len, req.chunked_prefill_size)
+            if req.shm_cur_output_len > 0 and forward_len == 1:
+                decode_req_num += 1
+                decode_kv_token_num += req.shm_cur_kv_len + 1
+            else:
+                prefill_token_num += forward_len
+            forward_lens.append(forward_len)
+
+        self.now += self.cost_model.get_step_time(prefill_token_num, decode_req_num, decode_kv_token_num)
+        stats = self.stats
+        stats["step_num"] += 1
+        stats["prefill_token_num"] += prefill_token_num
+        if decode_batch_size != 0:
+            stats["decode_step_num"] += 1
+            stats["decode_batch_size_sum"] += decode_batch_size
+            stats["max_batch_size"] = max(stats["max_batch_size"], decode_batch_size)
+
+        for req, forward_len in zip(batch.reqs, forward_lens):
+            dp_index = req.sample_params.suggested_dp_index
+            self.mem_manager.alloc(dp_index, forward_len)
+            req.shm_cur_kv_len += forward_len
+            if req.shm_cur_kv_len < req.input_len + req.shm_cur_output_len:
+                continue
+            req.shm_cur_output_len += 1
+            stats["output_token_num"] += 1
+            state = self.req_states[req.request_id]
+            if state.first_token_time is None:
+                state.first_token_time = self.now
+                self.ttfts.append(self.now - state.spec.arrival_time)
+                self.priority_ttfts.setdefault(state.spec.priority, []).append(self.now - state.spec.arrival_time)
+            else:
+                self.itls.append(self.now - state.last_token_time)
+            state.last_token_time = self.now
+
+            if req.shm_cur_output_len >= state.spec.output_len:
+                req.finish_status.set_status(FinishStatus.FINISHED_STOP)
+            elif req.shm_cur_output_len >= req.sample_params.max_new_tokens:
+                req.finish_status.set_status(FinishStatus.FINISHED_LENGTH)
+            if req.finish_status.is_finished():
+                self.e2e_latencys.append(self.now - state.spec.arrival_time)
+                self.mem_manager.free(dp_index, req.shm_cur_kv_len)
+                req.shm_infer_released = True
+                stats["finished_req_num"] += 1
+        batch.filter_out_finished_req(self.router, self.router.output_len_estimator.observe)
+        return
+
+    def _can_decode(self, dp_index: int):
+        if self.is_safe_schedule:
+            return True
+        return (
+            self.running_batch.get_batch_decode_need_tokens()[dp_index] + self.router.get_used_tokens(dp_index)
+            <= self.router.max_total_token_num
+        )
+
+    def _pause_reqs(self, dp_index: int, paused_reqs: List[Req], is_preempt: bool = False):
+        lost_kv_len = 0
+        for req in paused_reqs:
+            # 被暂停的请求释放所有的 kv，恢复时需要重新计算
+            lost_kv_len += req.shm_cur_kv_len
+            self.mem_manager.free(dp_index, req.shm_cur_kv_len)
+            req.shm_cur_kv_len = 0
+        self.stats["paused_req_num"] += len(paused_reqs)
+        self.stats["recompute_tokens"] += lost_kv_len
+        self.pause_events.append(
+            {
+                "time": self.now,
+                "dp_index": dp_index,
+                "request_ids": [req.request_id for req in paused_reqs],
+                "lost_kv_len": lost_kv_len,
+                "is_preempt": is_preempt,
+            }
+        )
+        return
+
+    def _filter_running_batch(self):
+        if self.running_batch is not None and self.running_batch.is_clear():
+            self.running_batch = None
+        return
+
+    def _step(self):
+        """
+        与 RouterManager._step 的处理流程一致，返回是否进行了推理。
+        """
+        if self.running_batch is None:
+            new_batch = self.req_queue.generate_new_batch(None)
+            if new_batch is None:
+                return False
+            self.running_batch = new_batch
+            self._forward(self.running_batch)
+            self._filter_running_batch()
+            if not self.args.disable_aggressive_schedule:
+                self.has_wait_tokens = self.max_wait_tokens
+            return True
+
+        if self.has_wait_tokens >= self.max_wait_tokens:
+            new_mini_batch = self.req_queue.generate_new_batch(self.running_batch)
+            self.has_wait_tokens = 0
+            if new_mini_batch is not None:
+                if not self.args.disable_aggressive_schedule:
+                    self.has_wait_tokens = self.max_wait_tokens
+                self._forward(new_mini_batch)
+                if not new_mini_batch.is_clear():
+                    self.running_batch.merge(new_mini_batch)
+                return True
+
+        for dp_index in range(self.dp_size_in_node):
+            while not self._can_decode(dp_index):
+                paused_reqs = select_paused_reqs(
+                    self.running_batch, self.pause_strategy, self.req_queue, self.router.max_total_token_num, dp_index
+                )
+                self._pause_reqs(dp_index, paused_reqs)
+                self.has_wait_tokens = 0
+
+        if self.enable_priority_preempt:
+            for dp_index in range(self.dp_size_in_node):
+                preempted_reqs = select_preempted_reqs(
+                    self.running_batch,
+                    self.pause_strategy,
+                    self.req_queue,
+                    dp_index,
+                    self.now,
+                    self.priority_preempt_wait_time,
+                )
+                if len(preempted_reqs) != 0:
+                    self._pause_reqs(dp_index, preempted_reqs, is_preempt=True)
+                    self.has_wait_tokens = self.max_wait_tokens
+            self._filter_running_batch()
+            if self.running_batch is None:
+                return True
+
+        self._forward(self.running_batch, decode_batch_size=len(self.running_batch.reqs))
+        self._filter_running_batch()
+        self.has_wait_tokens += 1
+        return True
+
+    def run(self, max_step_num: Optional[int] = None) -> dict:
+        self.now = 0.0
+        self.running_batch: Batch = None
+        self.has_wait_tokens = 0
+        self.ttfts: List[float] = []
+        self.priority_ttfts: Dict[int, List[float]] = {}
+        self.itls: List[float] = []
+        self.e2e_latencys: List[float] = []
+        self.pause_events: List[dict] = []
+        self.stats = {
+            "finished_req_num": 0,
+            "step_num": 0,
+            "decode_step_num": 0,
+            "decode_batch_size_sum": 0,
+            "max_batch_size": 0,
+            "prefill_token_num": 0,
+            "output_token_num": 0,
+            "paused_req_num": 0,
+            "recompute_tokens": 0,
+        }
+        next_index = 0
+        while next_index < len(self.specs) or self.running_batch is not None or self.req_queue.get_wait_req_num() > 0:
+            if max_step_num is not None and self.stats["step_num"] >= max_step_num:
+                break
+            while next_index < len(self.specs) and self.specs[next_index].arrival_time <= self.now:
+                self.req_queue.extend([self._create_req(next_index, self.specs[next_index])])
+                next_index += 1
+
+            has_run = self._step()
+            self.req_queue.update_token_load(self.running_batch, force_update=True)
+            if not has_run:
+                if next_index >= len(self.specs):
+                    # 等待队列中的请求无法被调度
+                    break
+                self.now = max(self.now, self.specs[next_index].arrival_time)
+        return self._get_result()
+
+    def _get_result(self) -> dict:
+        ans = dict(self.stats)
+        ans["sim_time"] = self.now
+        ans["unfinished_req_num"] = len(self.specs) - ans["finished_req_num"]
+        ans["pause_event_num"] = len(self.pause_events)
+        ans["oom_num"] = self.mem_manager.oom_num
+        ans["mean_decode_batch_size"] = ans["decode_batch_size_sum"] / max(1, ans["decode_step_num"])
+        ans["max_used_token_ratio"] = max(self.mem_manager.max_used_token_nums) / self.router.max_total_token_num
+        ans["req_throughput"] = ans["finished_req_num"] / max(self.now, 1e-6)
+        ans["output_token_throughput"] = ans["output_token_num"] / max(self.now, 1e-6)
+        ans.update(_percentiles(self.ttfts, "ttft"))
+        ans.update(_percentiles(self.itls, "itl"))
+        ans.update(_percentiles(self.e2e_latencys, "e2e"))
+        ans["ttft_by_priority"] = {
+            priority: _percentiles(ttfts, "ttft") for priority, ttfts in sorted(self.priority_ttfts.items())
+        }
+        return ans
+
+    def get_pause_events(self) -> List[dict]:
+        return self.pause_events
+
+    def close(self):
+        self.router.close()
+        return
@@ -16,7 +16,8 @@ from lightllm.server.multimodal_params import MultimodalParams, ImageItem
 from lightllm.models.qwen2_vl.qwen2_visual import Qwen2VisionTransformerPretrainedModel
 from lightllm.models.qwen2_5_vl.qwen2_5_visual import Qwen2_5_VisionTransformerPretrainedModel
 from lightllm.models.tarsier2.tarsier2_visual import TarsierVisionTransformerPretrainedModel
-from lightllm.server.embed_cache.utils import tensor2bytes, read_shm, create_shm, get_shm_name_data, get_shm_name_embed
+from lightllm.server.embed_cache.utils import create_embed_shm, get_shm_name_embed
+from lightllm.server.embed_cache.embed_arena import get_embed_arena, get_raw_tensor_nbytes
 from lightllm.utils.infer_utils import set_random_seed
 from lightllm.utils.infer_utils import calculate_time, mark_start, mark_end
 from lightllm.utils.dist_utils import init_vision_distributed_env
@@ -89,15 +90,20 @@ class VisualModelRpcServer(rpyc.Service):
     def exposed_encode(self, images: List[ImageItem]):
         images = obtain(images)
         all_img_embeds, uuids, valid_ids = self.forward(images)
-        all_img_embeds = all_img_embeds.to(torch.device("cpu"))
         if self.tp_rank_id == 0:
+            # embedding 以原始 tensor 的格式直接从显存拷贝到 embed arena 中，arena 空间不足时使用单独的 shm
+            arena = get_embed_arena()
             for i in range(len(uuids)):
                 uid = uuids[i]
                 if not self.cache_client.root.get_item_embed(uid):
                     start, end = valid_ids[i]
-                    cur_embed_bytes = tensor2bytes(all_img_embeds[start:end])
-                    create_shm(get_shm_name_embed(uuids[i]), cur_embed_bytes)
-                    self.cache_client.root.set_item_embed(uuids[i])
+                    cur_embed = all_img_embeds[start:end]
+                    embed_slot = -1
+                    if arena is not None:
+                        embed_slot = self.cache_client.root.alloc_embed(uid, get_raw_tensor_nbytes(cur_embed))
+                    if embed_slot < 0 or not arena.write(embed_slot, cur_embed):
+                        create_embed_shm(get_shm_name_embed(uid), cur_embed.cpu())
+                    self.cache_client.root.set_item_embed(uid)
         return
 
 
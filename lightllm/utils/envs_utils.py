@@ -10,7 +10,11 @@ logger = init_logger(__name__)
 
 
 def set_unique_server_name(args):
-    os.environ["LIGHTLLM_UNIQUE_SERVICE_NAME_ID"] = str(args.nccl_port) + "_" + str(args.node_rank)
+    unique_name = str(args.nccl_port) + "_" + str(args.node_rank)
+    # 同一台机器上的多个 pd master 副本可能使用相同的 nccl_port，需要加上副本的编号区分共享内存的名称
+    if args.run_mode == "pd_master" and args.pd_master_replicas:
+        unique_name += f"_pd_master_{args.pd_master_replica_id}"
+    os.environ["LIGHTLLM_UNIQUE_SERVICE_NAME_ID"] = unique_name
     return
 
 
@@ -1,14 +1,34 @@
+import os
 import time
 import base64
+import asyncio
+import hashlib
 import httpx
 import logging
 from PIL import Image
 from io import BytesIO
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlsplit
 from fastapi import Request
 from lightllm.utils.log_utils import init_logger
 
 logger = init_logger(__name__)
 
+# 下载图片使用共享的连接池，总连接数不超过 LIGHTLLM_IMAGE_FETCH_MAX_CONNECTIONS，
+# 同一个 host 同时进行的下载不超过 LIGHTLLM_IMAGE_FETCH_MAX_PER_HOST
+LIGHTLLM_IMAGE_FETCH_MAX_CONNECTIONS = int(os.getenv("LIGHTLLM_IMAGE_FETCH_MAX_CONNECTIONS", 256))
+LIGHTLLM_IMAGE_FETCH_MAX_PER_HOST = int(os.getenv("LIGHTLLM_IMAGE_FETCH_MAX_PER_HOST", 32))
+# 图片的解码校验和 md5 计算在线程池中执行
+LIGHTLLM_IMAGE_WORKERS = int(os.getenv("LIGHTLLM_IMAGE_WORKERS", 4))
+# 缓存 url 下载得到的图片及其校验结果，缓存总大小 (MB) 为 0 时不使用缓存
+LIGHTLLM_IMAGE_CACHE_MB = int(os.getenv("LIGHTLLM_IMAGE_CACHE_MB", 256))
+LIGHTLLM_IMAGE_CACHE_TTL_S = float(os.getenv("LIGHTLLM_IMAGE_CACHE_TTL_S", 300))
+
+# 单张图片的数据不能大于128M
+_MAX_IMAGE_BYTES = 128 * 1024 * 1024
+
 
 def image2base64(img_str: str):
     image_obj = Image.open(img_str)
@@ -19,20 +39,107 @@ def image2base64(img_str: str):
     return base64.b64encode(buffer.getvalue()).decode("utf-8")
 
 
+class LoadedImage:
+    def __init__(self, data: bytes, width: int, height: int, md5: str):
+        self.data = data
+        self.width = width
+        self.height = height
+        self.md5 = md5
+
+
+class ImageCache:
+    """
+    以 url 为 key 的 LRU 缓存，按照图片数据的总字节数淘汰，超过 ttl 的缓存项视为失效。
+    """
+
+    def __init__(self, capacity_bytes: int, ttl: float):
+        self.capacity_bytes = capacity_bytes
+        self.ttl = ttl
+        self.used_bytes = 0
+        self.items: "OrderedDict[str, Tuple[float, LoadedImage]]" = OrderedDict()
+        self.hit_count = 0
+        self.miss_count = 0
+
+    def get(self, key: str) -> Optional[LoadedImage]:
+        item = self.items.get(key, None)
+        if item is None or time.time() - item[0] > self.ttl:
+            if item is not None:
+                self._pop(key)
+            self.miss_count += 1
+            return None
+        self.items.move_to_end(key)
+        self.hit_count += 1
+        return item[1]
+
+    def put(self, key: str, image: LoadedImage):
+        if len(image.data) > self.capacity_bytes:
+            return
+        if key in self.items:
+            self._pop(key)
+        self.items[key] = (time.time(), image)
+        self.used_bytes += len(image.data)
+        while self.used_bytes > self.capacity_bytes:
+            self._pop(next(iter(self.items)))
+        return
+
+    def _pop(self, key: str):
+        _, image = self.items.pop(key)
+        self.used_bytes -= len(image.data)
+        return
+
+
+_image_executor: Optional[ThreadPoolExecutor] = None
+_image_cache = ImageCache(LIGHTLLM_IMAGE_CACHE_MB * 1024 * 1024, LIGHTLLM_IMAGE_CACHE_TTL_S)
+# 连接池和 host 的并发限制与创建它们的事件循环绑定
+_http_clients: Dict[Tuple[int, Optional[str]], httpx.AsyncClient] = {}
+_host_semaphores: Dict[Tuple[int, str], asyncio.Semaphore] = {}
+
+
+def _get_image_executor() -> ThreadPoolExecutor:
+    global _image_executor
+    if _image_executor is None:
+        _image_executor = ThreadPoolExecutor(max_workers=LIGHTLLM_IMAGE_WORKERS, thread_name_prefix="image_worker")
+    return _image_executor
+
+
+def _get_http_client(proxy: Optional[str]) -> httpx.AsyncClient:
+    key = (id(asyncio.get_running_loop()), proxy)
+    client = _http_clients.get(key, None)
+    if client is None or client.is_closed:
+        limits = httpx.Limits(
+            max_connections=LIGHTLLM_IMAGE_FETCH_MAX_CONNECTIONS,
+            max_keepalive_connections=LIGHTLLM_IMAGE_FETCH_MAX_CONNECTIONS,
+        )
+        client = httpx.AsyncClient(proxy=proxy, limits=limits)
+        _http_clients[key] = client
+    return client
+
+
+def _get_host_semaphore(url: str) -> asyncio.Semaphore:
+    key = (id(asyncio.get_running_loop()), urlsplit(url).netloc)
+    semaphore = _host_semaphores.get(key, None)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(LIGHTLLM_IMAGE_FETCH_MAX_PER_HOST)
+        _host_semaphores[key] = semaphore
+    return semaphore
+
+
 async def fetch_image(url, request: Request, timeout, proxy=None):
     logger.info(f"Begin to download image from url: {url}")
     start_time = time.time()
-    async with httpx.AsyncClient(proxy=proxy) as client:
+    client = _get_http_client(proxy)
+    async with _get_host_semaphore(url):
         async with client.stream("GET", url, timeout=timeout) as response:
             response.raise_for_status()
             ans_bytes = []
+            total_len = 0
             async for chunk in response.aiter_bytes(chunk_size=1024 * 1024):
                 if request is not None and await request.is_disconnected():
                     await response.aclose()
                     raise Exception("Request disconnected. User cancelled download.")
                 ans_bytes.append(chunk)
-                # 接收的数据不能大于128M
-                if len(ans_bytes) > 128:
+                total_len += len(chunk)
+                if total_len > _MAX_IMAGE_BYTES:
                     raise Exception(f"url {url} Image data is too big")
 
             content = b"".join(ans_bytes)
@@ -40,3 +147,32 @@ async def fetch_image(url, request: Request, timeout, proxy=None):
     cost_time = end_time - start_time
     logger.info(f"Download url {url} image cost time: {cost_time} seconds")
     return content
+
+
+def _load_image_sync(data: bytes) -> LoadedImage:
+    # check if valid image bytes
+    image = Image.open(BytesIO(data))
+    width, height = image.size
+    return LoadedImage(data, width, height, hashlib.md5(data).hexdigest())
+
+
+async def load_image(data: bytes) -> LoadedImage:
+    """
+    在线程池中校验图片数据，得到图片的宽高和 md5，避免大图片阻塞事件循环。
+    """
+    return await asyncio.get_running_loop().run_in_executor(_get_image_executor(), _load_image_sync, data)
+
+
+async def fetch_and_load_image(url, request: Request, timeout, proxy=None) -> LoadedImage:
+    """
+    下载并校验 url 对应的图片，重复的 url 直接使用缓存的结果，不需要重新下载和计算 md5。
+    """
+    use_cache = LIGHTLLM_IMAGE_CACHE_MB > 0
+    if use_cache:
+        image = _image_cache.get(url)
+        if image is not None:
+            return image
+    image = await load_image(await fetch_image(url, request, timeout=timeout, proxy=proxy))
+    if use_cache:
+        _image_cache.put(url, image)
+    return image
@@ -0,0 +1,77 @@
+"""
+对比调度器在一次 generate_new_batch 中对等待请求逐个进行 token 峰值检查的耗时：
+sort 为原有的每加入一个请求都对整个列表重新排序并计算 cumsum/max 的方式，
+tree 为使用 PeakTokenTree 增量维护峰值的方式 (包含每次调度时构建树的耗时)。
+max_total_token_num 足够大时所有等待请求都会被检查，可以通过调小该值观察提前停止的情况。
+
+例子：
+    python benchmark_admission_check.py --running_num 2000 --waiting_num 2000
+"""
+import time
+import random
+import argparse
+import numpy as np
+from lightllm.server.router.req_queue.peak_token_tree import PeakTokenTree
+
+
+def admit_by_sort(running_items, waiting_items, max_total_token_num):
+    cache_len_list = list(running_items)
+    admit_num = 0
+    for item in waiting_items:
+        cache_len_list.append(item)
+        cache_len_list.sort(key=lambda x: -x[1])
+        left_out_len_array = np.array([e[1] for e in cache_len_list])
+        has_run_len_array = np.array([e[0] for e in cache_len_list])
+        cum_run_len_array = np.cumsum(has_run_len_array)
+        size_array = np.arange(1, len(cache_len_list) + 1, 1)
+        need_max_token_num = (left_out_len_array * size_array + cum_run_len_array).max()
+        if need_max_token_num >= max_total_token_num:
+            break
+        admit_num += 1
+    return admit_num
+
+
+def admit_by_tree(running_items, waiting_items, max_total_token_num):
+    tree = PeakTokenTree(running_items, [e[1] for e in waiting_items])
+    admit_num = 0
+    for item in waiting_items:
+        tree.add(*item)
+        if tree.get_peak() >= max_total_token_num:
+            break
+        admit_num += 1
+    return admit_num
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--running_num", type=int, default=2000)
+    parser.add_argument("--waiting_num", type=int, default=2000)
+    parser.add_argument("--max_new_tokens", type=int, default=2048)
+    parser.add_argument("--max_input_len", type=int, default=4096)
+    parser.add_argument("--max_total_token_num", type=int, default=10**12)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    random.seed(0)
+    running_items = [
+        (random.randint(1, args.max_input_len), random.randint(0, args.max_new_tokens)) for _ in range(args.running_num)
+    ]
+    # 新请求的剩余输出长度为其 max_new_tokens，取值的种类较少
+    waiting_items = [
+        (random.randint(1, args.max_input_len), random.choice([128, 256, 512, 1024, args.max_new_tokens]))
+        for _ in range(args.waiting_num)
+    ]
+
+    print(f"running {args.running_num} reqs, waiting {args.waiting_num} reqs")
+    print(f"{'method':>8} {'admit num':>10} {'ms/schedule':>12}")
+    for name, func in [("sort", admit_by_sort), ("tree", admit_by_tree)]:
+        costs = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            admit_num = func(running_items, waiting_items, args.max_total_token_num)
+            costs.append(time.perf_counter() - start)
+        print(f"{name:>8} {admit_num:>10} {min(costs) * 1000:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+detokenize 的 cpu 微基准测试，比较每个 token 都对完整输出重新解码的实现与增量解码的实现
+在不同输出长度下每个 token 的平均耗时。增量解码的耗时应该不随输出长度增长。
+
+例子：
+    python benchmark_detokenization.py --tokenizer_dir /path/to/model --output_lens 256,1024,4096,8192
+"""
+import argparse
+import random
+import time
+from types import SimpleNamespace
+from transformers import AutoTokenizer
+from lightllm.server.detokenization.decode import decode_token
+from lightllm.server.detokenization.decode_req import DecodeReq
+
+
+def create_decode_req(sample_params):
+    decode_req = DecodeReq.__new__(DecodeReq)
+    decode_req.req = SimpleNamespace(sample_params=sample_params)
+    decode_req.output_ids = []
+    decode_req.sub_text_num = 0
+    decode_req.start_new_segment()
+    return decode_req
+
+
+def full_decode(tokenizer, token_ids):
+    # 每个 token 都对完整的输出调用 convert_tokens_to_string
+    output_tokens, output_str = [], ""
+    for token_id in token_ids:
+        output_tokens.append(tokenizer.convert_ids_to_tokens(token_id))
+        out_text = tokenizer.convert_tokens_to_string(output_tokens)
+        if not out_text.endswith("\ufffd"):
+            output_str = out_text
+    return output_str
+
+
+def incremental_decode(tokenizer, token_ids, sample_params):
+    decode_req = create_decode_req(sample_params)
+    return "".join(decode_token(tokenizer, decode_req, token_id, []) for token_id in token_ids)
+
+
+def gen_token_ids(tokenizer, output_len, seed):
+    rng = random.Random(seed)
+    vocab_size = len(tokenizer)
+    special_ids = set(tokenizer.all_special_ids) | set(tokenizer.added_tokens_encoder.values())
+    token_ids = []
+    while len(token_ids) < output_len:
+        token_id = rng.randrange(vocab_size)
+        if token_id not in special_ids:
+            token_ids.append(token_id)
+    return token_ids
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tokenizer_dir", type=str, required=True)
+    parser.add_argument("--output_lens", type=str, default="256,1024,4096,8192")
+    parser.add_argument("--skip_full_decode_above", type=int, default=8192)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    tokenizer = AutoTokenizer.from_pretrained(args.tokenizer_dir, trust_remote_code=True)
+    sample_params = SimpleNamespace(
+        skip_special_tokens=True, print_eos_token=False, add_spaces_between_special_tokens=True
+    )
+    print(f"{'output len':>10} {'full us/token':>14} {'incremental us/token':>21}")
+    for output_len in [int(e) for e in args.output_lens.split(",")]:
+        token_ids = gen_token_ids(tokenizer, output_len, args.seed)
+
+        start = time.perf_counter()
+        incremental_text = incremental_decode(tokenizer, token_ids, sample_params)
+        incremental_cost = (time.perf_counter() - start) / output_len * 1e6
+
+        full_cost = float("nan")
+        if output_len <= args.skip_full_decode_above:
+            start = time.perf_counter()
+            full_text = full_decode(tokenizer, token_ids)
+            full_cost = (time.perf_counter() - start) / output_len * 1e6
+            if full_text != incremental_text:
+                print(f"warning: output len {output_len} incremental text differs from full decode text")
+        print(f"{output_len:>10} {full_cost:>14.2f} {incremental_cost:>21.2f}")
+
+
+if __name__ == "__main__":
+    main()
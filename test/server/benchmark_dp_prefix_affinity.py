@@ -0,0 +1,131 @@
+"""
+离线回放请求 trace，对比 dp 模式下 round_robin 与 prefix_affinity 两种请求放置策略的前缀缓存命中率与各个 dp 之间的负载均衡情况。
+每个 dp 的 radix cache 使用按块 LRU 淘汰的缓存近似模拟，请求结束后 prompt 与输出的 token 都会进入缓存；
+dp 的负载使用未完成的计算量 (未命中的 prefill token + 输出 token) 近似，每个请求到达时各个 dp 消耗 drain_tokens 的计算量。
+trace 文件为 jsonl 格式，每行包含 prompt_ids 与 output_ids 两个字段；不指定 trace 时生成多轮对话的合成 trace，
+每个会话共享 sys_prompt_num 个系统提示词之一，并在后续轮次中携带之前的对话历史。
+
+例子：
+    python benchmark_dp_prefix_affinity.py --dp 8 --session_num 512 --turn_num 4 --cache_tokens 200000
+    python benchmark_dp_prefix_affinity.py --dp 8 --trace trace.jsonl
+"""
+import json
+import random
+import argparse
+import numpy as np
+from collections import OrderedDict
+from lightllm.server.router.req_queue.dp_prefix_affinity import PrefixAffinityIndex
+
+
+def gen_synthetic_trace(args):
+    rng = np.random.default_rng(args.seed)
+    sys_prompts = [rng.integers(0, args.vocab_size, args.sys_len) for _ in range(args.sys_prompt_num)]
+    histories = [sys_prompts[i % args.sys_prompt_num] for i in range(args.session_num)]
+    turns = [turn for turn in range(args.turn_num) for _ in range(args.session_num)]
+    sessions = list(range(args.session_num)) * args.turn_num
+    # 同一轮次内的会话乱序到达，保证同一个会话的后一轮在前一轮之后
+    order = sorted(range(len(sessions)), key=lambda i: (turns[i], random.random()))
+    trace = []
+    for i in order:
+        session_id = sessions[i]
+        user_ids = rng.integers(0, args.vocab_size, args.user_len)
+        prompt_ids = np.concatenate([histories[session_id], user_ids])
+        output_ids = rng.integers(0, args.vocab_size, args.output_len)
+        histories[session_id] = np.concatenate([prompt_ids, output_ids])
+        trace.append((prompt_ids, output_ids))
+    return trace
+
+
+def load_trace(path):
+    trace = []
+    with open(path, "r") as f:
+        for line in f:
+            item = json.loads(line)
+            trace.append((np.array(item["prompt_ids"], dtype=np.int64), np.array(item["output_ids"], dtype=np.int64)))
+    return trace
+
+
+class SimDpCache:
+    def __init__(self, capacity_tokens, block_size):
+        self.capacity_blocks = capacity_tokens // block_size
+        self.block_size = block_size
+        self.blocks = OrderedDict()
+
+    def match_and_insert(self, prompt_hashes, all_hashes):
+        hit_blocks = 0
+        for block_hash in prompt_hashes:
+            if block_hash not in self.blocks:
+                break
+            hit_blocks += 1
+        for block_hash in all_hashes:
+            self.blocks[block_hash] = None
+            self.blocks.move_to_end(block_hash)
+        while len(self.blocks) > self.capacity_blocks:
+            self.blocks.popitem(last=False)
+        return hit_blocks * self.block_size
+
+
+def replay(args, trace, policy):
+    random.seed(args.seed)
+    index = PrefixAffinityIndex(dp_size=args.dp, block_size=args.block_size, load_weight=args.load_weight)
+    caches = [SimDpCache(args.cache_tokens, args.block_size) for _ in range(args.dp)]
+    works = [0.0] * args.dp
+    placed_tokens = [0] * args.dp
+    round_robin_dp_id = 0
+    prompt_tokens = 0
+    hit_tokens = 0
+    for prompt_ids, output_ids in trace:
+        works = [max(0.0, work - args.drain_tokens) for work in works]
+        default_dp_index = round_robin_dp_id
+        round_robin_dp_id = (round_robin_dp_id + 1) % args.dp
+        if policy == "prefix_affinity":
+            dp_loads = [work / args.cache_tokens for work in works]
+            dp_index, _ = index.select_dp(prompt_ids, dp_loads, default_dp_index)
+        else:
+            dp_index = default_dp_index
+
+        prompt_hashes = index.get_block_hashes(prompt_ids)
+        all_hashes = index.get_block_hashes(np.concatenate([prompt_ids, output_ids]))
+        hit_len = min(caches[dp_index].match_and_insert(prompt_hashes, all_hashes), len(prompt_ids))
+        prompt_tokens += len(prompt_ids)
+        hit_tokens += hit_len
+        works[dp_index] += len(prompt_ids) - hit_len + len(output_ids)
+        placed_tokens[dp_index] += len(prompt_ids) - hit_len + len(output_ids)
+
+    mean_tokens = sum(placed_tokens) / args.dp
+    return {
+        "hit_ratio": hit_tokens / prompt_tokens,
+        "prefill_tokens": prompt_tokens - hit_tokens,
+        "imbalance": max(placed_tokens) / mean_tokens,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--trace", type=str, default=None)
+    parser.add_argument("--dp", type=int, default=8)
+    parser.add_argument("--block_size", type=int, default=64)
+    parser.add_argument("--cache_tokens", type=int, default=200000, help="每个 dp 上 radix cache 可以保存的 token 数量")
+    parser.add_argument("--drain_tokens", type=float, default=100, help="每个请求到达的间隔内每个 dp 完成的计算量")
+    parser.add_argument("--load_weight", type=float, default=1.0)
+    parser.add_argument("--session_num", type=int, default=512)
+    parser.add_argument("--turn_num", type=int, default=4)
+    parser.add_argument("--sys_prompt_num", type=int, default=16)
+    parser.add_argument("--sys_len", type=int, default=1024)
+    parser.add_argument("--user_len", type=int, default=256)
+    parser.add_argument("--output_len", type=int, default=256)
+    parser.add_argument("--vocab_size", type=int, default=32000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    trace = load_trace(args.trace) if args.trace is not None else gen_synthetic_trace(args)
+    print(f"replay {len(trace)} reqs on {args.dp} dp ranks")
+    print(f"{'policy':>16} {'hit ratio':>10} {'prefill tokens':>15} {'max/mean load':>14}")
+    for policy in ["round_robin", "prefix_affinity"]:
+        ans = replay(args, trace, policy)
+        print(f"{policy:>16} {ans['hit_ratio']:>10.3f} {ans['prefill_tokens']:>15d} {ans['imbalance']:>14.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+visual server 向 llm 推理进程传递图片 embedding 的耗时压测，模拟一个包含 --num_images 张图片的请求。
+对比三种方式：
+    legacy: 原来的 torch.save 序列化后写入每张图片单独创建的 shm，读取时拷贝出来再 torch.load，用完后 unlink；
+    raw_shm: 原始 tensor 格式写入每张图片单独的 shm (没有开启 arena 或者 arena 空间不足时的方式)；
+    arena: 原始 tensor 格式写入 embed cache 管理的预先分配好的 arena 中，读取时 torch.frombuffer 直接映射。
+producer 为 visual server 侧写入所有图片的耗时，consumer 为推理进程侧得到所有图片 embedding 的 cpu tensor 的耗时，
+release 为请求结束后回收资源的耗时。
+
+例子：
+    python benchmark_embed_handoff.py --num_images 20 --image_tokens 1024 --hidden_size 3584 --repeat 10
+"""
+import os
+
+os.environ.setdefault("LIGHTLLM_LOG_LEVEL", "warning")
+os.environ.setdefault("LIGHTLLM_UNIQUE_SERVICE_NAME_ID", f"embed_bench_{os.getpid()}")
+
+import time
+import argparse
+import numpy as np
+import torch
+from lightllm.server.embed_cache.embed_arena import (
+    ArenaAllocator,
+    EmbedArena,
+    get_embed_arena_name,
+    get_raw_tensor_nbytes,
+)
+from lightllm.server.embed_cache.utils import (
+    bytes2tensor,
+    create_embed_shm,
+    create_shm,
+    free_shm,
+    get_shm_name_embed,
+    read_embed,
+    read_shm,
+    tensor2bytes,
+)
+
+
+def run_legacy(embeds, uids):
+    start = time.perf_counter()
+    for uid, embed in zip(uids, embeds):
+        create_shm(get_shm_name_embed(uid), tensor2bytes(embed))
+    mid = time.perf_counter()
+    outs = [bytes2tensor(read_shm(get_shm_name_embed(uid))) for uid in uids]
+    end = time.perf_counter()
+    for uid in uids:
+        free_shm(get_shm_name_embed(uid))
+    return mid - start, end - mid, time.perf_counter() - end, outs
+
+
+def run_raw_shm(embeds, uids):
+    start = time.perf_counter()
+    for uid, embed in zip(uids, embeds):
+        create_embed_shm(get_shm_name_embed(uid), embed)
+    mid = time.perf_counter()
+    outs = [read_embed({"uuid": uid, "embed_slot": None}) for uid in uids]
+    end = time.perf_counter()
+    for uid in uids:
+        free_shm(get_shm_name_embed(uid))
+    return mid - start, end - mid, time.perf_counter() - end, outs
+
+
+def run_arena(embeds, arena: EmbedArena, allocator: ArenaAllocator):
+    start = time.perf_counter()
+    slots = []
+    for slot, embed in enumerate(embeds):
+        # 与 embed cache 的 alloc_embed 相同，分配空间后写入 slot 表
+        nbytes = get_raw_tensor_nbytes(embed)
+        offset = allocator.alloc(nbytes)
+        arena.set_slot(slot, offset, nbytes)
+        arena.write(slot, embed)
+        slots.append(slot)
+    mid = time.perf_counter()
+    outs = [arena.read(slot) for slot in slots]
+    end = time.perf_counter()
+    for slot in slots:
+        offset, nbytes = arena.get_slot(slot)
+        allocator.free(offset, nbytes)
+        arena.set_slot(slot, 0, 0)
+    return mid - start, end - mid, time.perf_counter() - end, outs
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_images", type=int, default=20)
+    parser.add_argument("--image_tokens", type=int, default=1024)
+    parser.add_argument("--hidden_size", type=int, default=3584)
+    parser.add_argument("--dtype", type=str, default="bfloat16", choices=["float16", "bfloat16", "float32"])
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    dtype = getattr(torch, args.dtype)
+    embeds = [torch.randn(args.image_tokens, args.hidden_size).to(dtype) for _ in range(args.num_images)]
+    total_mb = sum(embed.numel() * embed.element_size() for embed in embeds) / 1024**2
+    print(f"{args.num_images} images, {total_mb:.1f} MB embeddings per request")
+
+    arena = EmbedArena(get_embed_arena_name())
+    arena_bytes = sum(get_raw_tensor_nbytes(embed) + 64 for embed in embeds)
+    arena.create(args.num_images, arena_bytes)
+    allocator = ArenaAllocator(arena_bytes)
+
+    print(f"{'mode':>8} {'producer':>10} {'consumer':>10} {'release':>10} {'total':>10}")
+    try:
+        for mode in ["legacy", "raw_shm", "arena"]:
+            costs = []
+            for step in range(args.repeat):
+                uids = [f"{os.getpid()}_{mode}_{step}_{i}" for i in range(args.num_images)]
+                if mode == "legacy":
+                    *cost, outs = run_legacy(embeds, uids)
+                elif mode == "raw_shm":
+                    *cost, outs = run_raw_shm(embeds, uids)
+                else:
+                    *cost, outs = run_arena(embeds, arena, allocator)
+                assert all(torch.equal(out, embed) for out, embed in zip(outs, embeds))
+                del outs
+                costs.append(cost)
+            producer, consumer, release = np.median(np.array(costs), axis=0) * 1000
+            total = producer + consumer + release
+            print(f"{mode:>8} {producer:>8.2f}ms {consumer:>8.2f}ms {release:>8.2f}ms {total:>8.2f}ms")
+    finally:
+        del arena.slots
+        arena.shm.close()
+        arena.shm.unlink()
+
+
+if __name__ == "__main__":
+    main()
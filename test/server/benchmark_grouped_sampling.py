@@ -0,0 +1,79 @@
+"""
+对比全词表排序的采样实现与按照采样策略分组的采样实现的单步耗时，可以在 cpu 上运行。
+mix 为 greedy / top_k / top_p / 无限制 四种请求各占四分之一的混合 batch。
+
+例子：
+    python benchmark_grouped_sampling.py --batch_size 256 --vocab_size 152064 --device cpu
+"""
+import time
+import argparse
+import torch
+from lightllm.common.grouped_sampling import build_sample_groups, grouped_sample, _top_p_top_k
+
+
+def sort_sample(probs, top_ps, top_ks):
+    probs_sort, probs_idx = _top_p_top_k(probs, top_ps, top_ks)
+    sampled_index = torch.multinomial(probs_sort, num_samples=1, replacement=True)
+    return torch.gather(probs_idx, dim=1, index=sampled_index), torch.gather(probs_sort, dim=1, index=sampled_index)
+
+
+def get_params(mode, batch_size, vocab_size):
+    # 与 InferSamplingParams 一致，不限制 top_k 时 top_k 为 vocab_size
+    mode_to_param = {
+        "greedy": (1.0, 1),
+        "top_k": (1.0, 20),
+        "top_p": (0.9, vocab_size),
+        "full": (1.0, vocab_size),
+    }
+    if mode == "mix":
+        params = [list(mode_to_param.values())[i % 4] for i in range(batch_size)]
+    else:
+        params = [mode_to_param[mode]] * batch_size
+    return [e[0] for e in params], [e[1] for e in params]
+
+
+def bench(func, iters, device):
+    func()
+    if device == "cuda":
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(iters):
+        func()
+    if device == "cuda":
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) / iters * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch_size", type=int, default=256)
+    parser.add_argument("--vocab_size", type=int, default=152064)
+    parser.add_argument("--device", type=str, default="cpu")
+    parser.add_argument("--iters", type=int, default=5)
+    # 模型输出的 logits 分布一般比较尖锐，scale 越小分布越平坦，top_p 请求越容易回退到全量排序
+    parser.add_argument("--logit_scale", type=float, default=10.0)
+    parser.add_argument("--modes", type=str, default="greedy,top_k,top_p,full,mix")
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    logits = torch.randn((args.batch_size, args.vocab_size), device=args.device) * args.logit_scale
+    probs = torch.softmax(logits, dim=-1)
+    print(f"{'mode':>8} {'sort ms/step':>13} {'grouped ms/step':>16} {'speedup':>8}")
+    for mode in args.modes.split(","):
+        top_ps_list, top_ks_list = get_params(mode, args.batch_size, args.vocab_size)
+        top_ps = torch.tensor(top_ps_list, dtype=torch.float, device=args.device)
+        top_ks = torch.tensor(top_ks_list, dtype=torch.int32, device=args.device)
+
+        sort_ms = bench(lambda: sort_sample(probs.clone(), top_ps, top_ks), args.iters, args.device)
+
+        def grouped():
+            # 分组在每一步都需要重新构建，计入耗时
+            groups = build_sample_groups(top_ps_list, top_ks_list, args.vocab_size, device=args.device)
+            return grouped_sample(probs.clone(), top_ps, top_ks, groups)
+
+        grouped_ms = bench(grouped, args.iters, args.device)
+        print(f"{mode:>8} {sort_ms:>13.2f} {grouped_ms:>16.2f} {sort_ms / grouped_ms:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
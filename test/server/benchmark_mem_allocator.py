@@ -0,0 +1,119 @@
+"""
+kv cache token 分配器的 cpu 微基准测试，比较 stack 与 free_list 两种分配器在不同 batch size 下
+MemoryManager.alloc / free 的耗时，以及分配出的 token 的连续程度。
+
+负载模拟 decode 过程：每个 step 为 batch 中的每个请求分配一个 token，请求随机的结束并释放其全部 token，
+结束的请求由新的请求 (先进行一次 prefill 分配) 替换，因此 token 的释放顺序不是后进先出的。
+
+例子：
+    python benchmark_mem_allocator.py --size 500000 --steps 2000
+"""
+import argparse
+import random
+import time
+import numpy as np
+import torch
+from lightllm.common.mem_manager import MemoryManager
+from lightllm.server.router.dynamic_prompt.shared_arr import SharedInt
+
+
+def create_mem_manager(size, allocator_name):
+    # 只构造分配 token 相关的状态，不申请 kv buffer
+    mem_manager = MemoryManager.__new__(MemoryManager)
+    mem_manager.size = size
+    mem_manager.mem_state = torch.arange(0, size, dtype=torch.int32)
+    mem_manager.mark_start = 0
+    mem_manager.mark_end = size
+    mem_manager.can_use_mem_size = size
+    mem_manager.shared_can_use_token_num = SharedInt(f"benchmark_mem_allocator_{allocator_name}_can_use")
+    mem_manager.shared_largest_free_run = SharedInt(f"benchmark_mem_allocator_{allocator_name}_largest_free_run")
+    mem_manager.shared_free_run_num = SharedInt(f"benchmark_mem_allocator_{allocator_name}_free_run_num")
+    mem_manager._init_token_allocator(allocator_name)
+    return mem_manager
+
+
+def count_runs(index: torch.Tensor):
+    if len(index) == 0:
+        return 0
+    sorted_index = np.sort(index.numpy())
+    return int(np.count_nonzero(np.diff(sorted_index) != 1)) + 1
+
+
+def run_benchmark(allocator_name, args, batch_size):
+    rng = random.Random(args.seed)
+    mem_manager = create_mem_manager(args.size, allocator_name)
+    reqs = []
+    alloc_cost, alloc_num, free_cost, free_num = 0.0, 0, 0.0, 0
+    alloc_runs, alloc_tokens = 0, 0
+
+    def alloc(need_size):
+        nonlocal alloc_cost, alloc_num, alloc_runs, alloc_tokens
+        start = time.perf_counter()
+        ans = mem_manager.alloc(need_size).clone()
+        alloc_cost += time.perf_counter() - start
+        alloc_num += 1
+        alloc_runs += count_runs(ans)
+        alloc_tokens += need_size
+        return ans
+
+    def free(index):
+        nonlocal free_cost, free_num
+        start = time.perf_counter()
+        mem_manager.free(index)
+        free_cost += time.perf_counter() - start
+        free_num += 1
+
+    for _ in range(args.steps):
+        # 结束的请求释放其全部 token，并补充新的请求
+        alive_reqs = []
+        for req_tokens, left_len in reqs:
+            if left_len == 0:
+                free(torch.cat(req_tokens))
+            else:
+                alive_reqs.append((req_tokens, left_len))
+        reqs = alive_reqs
+        while len(reqs) < batch_size:
+            input_len = rng.randint(1, args.max_input_len)
+            if mem_manager.can_use_mem_size < input_len + batch_size:
+                break
+            reqs.append(([alloc(input_len)], rng.randint(1, args.max_output_len)))
+        if mem_manager.can_use_mem_size < len(reqs):
+            break
+
+        # decode 一步，一次为整个 batch 分配 token
+        decode_index = alloc(len(reqs))
+        for i, (req_tokens, left_len) in enumerate(reqs):
+            req_tokens.append(decode_index[i : i + 1])
+            reqs[i] = (req_tokens, left_len - 1)
+
+    for req_tokens, _ in reqs:
+        free(torch.cat(req_tokens))
+    return {
+        "alloc_us": alloc_cost / max(1, alloc_num) * 1e6,
+        "free_us": free_cost / max(1, free_num) * 1e6,
+        "tokens_per_run": alloc_tokens / max(1, alloc_runs),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=500000)
+    parser.add_argument("--steps", type=int, default=2000)
+    parser.add_argument("--batch_sizes", type=str, default="1,4,16,64,256,1024")
+    parser.add_argument("--max_input_len", type=int, default=512)
+    parser.add_argument("--max_output_len", type=int, default=256)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'batch':>6} {'allocator':>10} {'alloc us':>10} {'free us':>10} {'tokens/run':>11}")
+    for batch_size in [int(e) for e in args.batch_sizes.split(",")]:
+        for allocator_name in ["stack", "free_list"]:
+            result = run_benchmark(allocator_name, args, batch_size)
+            print(
+                f"{batch_size:>6} {allocator_name:>10} {result['alloc_us']:>10.2f} "
+                f"{result['free_us']:>10.2f} {result['tokens_per_run']:>11.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
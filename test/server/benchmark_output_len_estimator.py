@@ -0,0 +1,81 @@
+"""
+使用离线调度模拟器回放请求 trace，对比不同的输出长度估计器 (--output_len_estimator) 下调度器的暂停次数、
+重新计算的 token 数量以及 decode 阶段的平均 batch 大小。估计器只在 router_token_ratio > 0 的激进调度模式下起作用。
+没有指定 --trace 时生成一个短输出和长输出混合的合成 trace，--with_hint 会为合成请求带上区分长短的 output_len_hint。
+trace 为 jsonl 格式，每一行形如 {"arrival_time": 0.1, "input_len": 512, "output_len": 128}，
+可选的字段有 max_new_tokens 和 output_len_hint。
+
+例子：
+    python benchmark_output_len_estimator.py --num_reqs 2000 --qps 40
+    python benchmark_output_len_estimator.py --trace trace.jsonl --max_total_token_num 100000
+"""
+import os
+
+os.environ.setdefault("LIGHTLLM_LOG_LEVEL", "warning")
+
+import time
+import argparse
+from lightllm.server.router.scheduler_simulator import (
+    SchedulerSimulator,
+    build_sim_start_args,
+    gen_bimodal_trace,
+    init_sim_env,
+    load_trace,
+)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--trace", type=str, default=None)
+    parser.add_argument("--num_reqs", type=int, default=2000)
+    parser.add_argument("--qps", type=float, default=40)
+    parser.add_argument("--short_ratio", type=float, default=0.8)
+    parser.add_argument("--max_new_tokens", type=int, default=2048)
+    parser.add_argument("--with_hint", action="store_true")
+    parser.add_argument("--max_total_token_num", type=int, default=100000)
+    parser.add_argument("--running_max_req_size", type=int, default=512)
+    parser.add_argument("--router_token_ratio", type=float, default=0.9)
+    parser.add_argument("--router_max_new_token_len", type=int, default=1024)
+    parser.add_argument("--quantile", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.trace is not None:
+        specs = load_trace(args.trace)
+    else:
+        specs = gen_bimodal_trace(args.num_reqs, args.qps, args.short_ratio, args.max_new_tokens, args.seed)
+        if not args.with_hint:
+            for spec in specs:
+                spec.output_len_hint = -1
+
+    print(f"replay {len(specs)} reqs, max_total_token_num {args.max_total_token_num}")
+    print(
+        f"{'estimator':>10} {'paused reqs':>12} {'recompute':>10} {'mean bs':>8} {'max bs':>7} "
+        f"{'tokens/s':>9} {'sim time':>9} {'cost':>7}"
+    )
+    for estimator in ["fixed", "histogram"]:
+        start_args = build_sim_start_args(
+            max_total_token_num=args.max_total_token_num,
+            running_max_req_size=args.running_max_req_size,
+            max_req_total_len=1024 + args.max_new_tokens,
+            batch_max_tokens=8192,
+            router_token_ratio=args.router_token_ratio,
+            router_max_new_token_len=args.router_max_new_token_len,
+            output_len_estimator=estimator,
+            output_len_estimator_quantile=args.quantile,
+        )
+        init_sim_env(start_args)
+        simulator = SchedulerSimulator(start_args, specs)
+        start = time.time()
+        stats = simulator.run()
+        cost = time.time() - start
+        simulator.close()
+        print(
+            f"{estimator:>10} {stats['paused_req_num']:>12d} {stats['recompute_tokens']:>10d} "
+            f"{stats['mean_decode_batch_size']:>8.1f} {stats['max_batch_size']:>7d} "
+            f"{stats['output_token_throughput']:>9.1f} {stats['sim_time']:>9.1f} {cost:>6.1f}s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+pd 节点与 pd master 之间 websocket 消息序列化的吞吐压测，对比原来的 pickle 方式与 pd_io_frame 的二进制帧格式。
+分别统计节点侧编码 token packs 和 master 侧解码的每秒 token 数，以及每个 token 平均占用的字节数。
+--batch_sizes 为一个 websocket 消息中合并的 token 数，对应节点转发时合并窗口内收集到的 token 数量，
+--prompt_ids_ratio 为带有 prompt_ids 的 token (p 节点输出的首个 token) 所占的比例。
+同时统计 master 下发请求 (REQ) 的编解码耗时。
+
+例子：
+    python benchmark_pd_frame.py --batch_sizes 1,16,256 --num_tokens 200000
+    python benchmark_pd_frame.py --prompt_ids_ratio 0.05 --prompt_len 4096
+"""
+import os
+
+os.environ.setdefault("LIGHTLLM_LOG_LEVEL", "warning")
+
+import time
+import pickle
+import random
+import argparse
+from lightllm.server.core.objs import FinishStatus, SamplingParams
+from lightllm.server.pd_io_struct import ObjType
+from lightllm.server.pd_io_frame import decode_pd_frame, encode_req, encode_token_packs
+
+
+def gen_handle_list(batch_size, args, rng: random.Random):
+    handle_list = []
+    for i in range(batch_size):
+        metadata = {
+            "id": rng.randrange(150000),
+            "logprob": -rng.random(),
+            "cumlogprob": -rng.random(),
+            "special": False,
+            "count_output_tokens": rng.randrange(1, 1024),
+            "prompt_tokens": args.prompt_len,
+        }
+        if rng.random() < args.prompt_ids_ratio:
+            metadata["prompt_ids"] = [rng.randrange(150000) for _ in range(args.prompt_len)]
+        status = FinishStatus.FINISHED_STOP if rng.random() < 0.01 else FinishStatus.NO_FINISH
+        handle_list.append((rng.randrange(1 << 40) * 8, " tok" + str(i % 10), metadata, FinishStatus(status)))
+    return handle_list
+
+
+def bench_func(func, datas, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for data in datas:
+            func(data)
+    return time.perf_counter() - start
+
+
+def pickle_encode(handle_list):
+    return pickle.dumps((ObjType.TOKEN_PACKS, handle_list))
+
+
+def bench_token_packs(batch_size, args):
+    rng = random.Random(args.seed)
+    batch_num = max(1, min(args.num_tokens // batch_size, 1024))
+    repeat = max(1, args.num_tokens // (batch_num * batch_size))
+    batches = [gen_handle_list(batch_size, args, rng) for _ in range(batch_num)]
+    token_num = batch_num * batch_size * repeat
+    ans = {}
+    for name, encode, decode in [
+        ("pickle", pickle_encode, pickle.loads),
+        ("binary", encode_token_packs, decode_pd_frame),
+    ]:
+        frames = [encode(batch) for batch in batches]
+        assert decode(frames[0])[1][0][2] == batches[0][0][2]
+        encode_cost = bench_func(encode, batches, repeat)
+        decode_cost = bench_func(decode, frames, repeat)
+        ans[name] = (
+            token_num / encode_cost,
+            token_num / decode_cost,
+            sum(len(frame) for frame in frames) / (batch_num * batch_size),
+        )
+    return ans
+
+
+def bench_req(args):
+    sampling_params = SamplingParams()
+    sampling_params.max_new_tokens = 1024
+    sampling_params.move_kv_to_decode_node.initialize(None)
+    prompt = [random.randrange(150000) for _ in range(args.prompt_len)]
+    ans = {}
+    for name, encode, decode in [
+        ("pickle", lambda req: pickle.dumps((ObjType.REQ, req)), pickle.loads),
+        ("binary", lambda req: encode_req(*req), decode_pd_frame),
+    ]:
+        req = (prompt, sampling_params, None)
+        frame = encode(req)
+        num = 2000
+        encode_cost = bench_func(encode, [req], num)
+        decode_cost = bench_func(decode, [frame], num)
+        ans[name] = (encode_cost / num, decode_cost / num, len(frame))
+    return ans
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch_sizes", type=str, default="1,16,256")
+    parser.add_argument("--num_tokens", type=int, default=200000)
+    parser.add_argument("--prompt_ids_ratio", type=float, default=0.01)
+    parser.add_argument("--prompt_len", type=int, default=1024)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'format':>7} {'batch':>6} {'encode tokens/s':>16} {'decode tokens/s':>16} {'bytes/token':>12}")
+    for batch_size in [int(batch_size) for batch_size in args.batch_sizes.split(",")]:
+        for name, (encode_tps, decode_tps, token_bytes) in bench_token_packs(batch_size, args).items():
+            print(f"{name:>7} {batch_size:>6} {encode_tps:>16.0f} {decode_tps:>16.0f} {token_bytes:>12.1f}")
+
+    print(f"\n{'format':>7} {'req encode':>12} {'req decode':>12} {'req bytes':>10}")
+    for name, (encode_cost, decode_cost, req_bytes) in bench_req(args).items():
+        print(f"{name:>7} {encode_cost * 1e6:>10.1f}us {decode_cost * 1e6:>10.1f}us {req_bytes:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+"""
+在 cpu 上模拟 pd 分离部署，对比 pd_master 的节点选择策略 (--pd_selector) 下的首字延迟。
+模拟的 prefill 节点按照先来先服务逐个处理请求，耗时与没有命中节点 prompt cache 的 token 数成正比，
+节点的 prompt cache 按照块 LRU 淘汰；decode 节点的 kv 容量有限，容量不足时请求需要排队等待。
+节点每隔 --status_interval_ms 向选择器上报一次负载，与实际部署中通过 /pd_register 上报的方式一致。
+请求由 --num_prefixes 个共享前缀 (按照 zipf 分布选择) 加上随机的后缀组成，模拟系统提示词或者多轮对话。
+
+例子：
+    python benchmark_pd_selector.py --num_reqs 4000 --qps 12 --num_prefill 4 --num_decode 4
+    python benchmark_pd_selector.py --qps 20 --num_prefixes 64 --prefix_len 8192 --prefill_cache_tokens 100000
+"""
+import os
+
+os.environ.setdefault("LIGHTLLM_LOG_LEVEL", "warning")
+
+import heapq
+import random
+import argparse
+import itertools
+import numpy as np
+from collections import deque
+from lightllm.server.pd_io_struct import PD_Client_Obj
+from lightllm.server.httpserver_for_pd_master.pd_selector import (
+    PREFIX_BLOCK_TOKENS,
+    LoadAwarePDSelector,
+    PrefixSketch,
+    RandomPDSelector,
+    get_prompt_block_hashes,
+)
+
+
+class SimPrefillNode:
+    def __init__(self, node: PD_Client_Obj, cache_tokens: int):
+        self.node = node
+        self.cache = PrefixSketch(cache_tokens // PREFIX_BLOCK_TOKENS)
+        self.queue = deque()
+        self.busy = False
+
+    def pending_prompt_tokens(self):
+        return sum(len(req["prompt"]) for req in self.queue)
+
+
+class SimDecodeNode:
+    def __init__(self, node: PD_Client_Obj, capacity: int):
+        self.node = node
+        self.capacity = capacity
+        self.used = 0
+        self.queue = deque()
+
+
+def gen_trace(args):
+    rng = random.Random(args.seed)
+    prefixes = [[rng.randrange(1 << 30) for _ in range(args.prefix_len)] for _ in range(args.num_prefixes)]
+    weights = [1.0 / (i + 1) ** args.zipf for i in range(args.num_prefixes)]
+    reqs = []
+    arrival_time = 0.0
+    for req_id in range(args.num_reqs):
+        arrival_time += rng.expovariate(args.qps)
+        prefix = rng.choices(prefixes, weights)[0]
+        suffix = [rng.randrange(1 << 30) for _ in range(rng.randint(args.suffix_len // 2, args.suffix_len * 3 // 2))]
+        reqs.append(
+            {
+                "req_id": req_id,
+                "arrival_time": arrival_time,
+                "prompt": prefix + suffix,
+                "output_len": rng.randint(args.output_len // 2, args.output_len * 3 // 2),
+            }
+        )
+    return reqs
+
+
+def simulate(selector, reqs, args):
+    start_args = {"max_total_token_num": args.prefill_cache_tokens}
+    p_nodes = [
+        SimPrefillNode(PD_Client_Obj(i, f"p{i}", "prefill", start_args), args.prefill_cache_tokens)
+        for i in range(args.num_prefill)
+    ]
+    d_start_args = {"max_total_token_num": args.decode_capacity}
+    d_nodes = [
+        SimDecodeNode(PD_Client_Obj(i, f"d{i}", "decode", d_start_args), args.decode_capacity)
+        for i in range(args.num_decode)
+    ]
+    url_to_p = {p.node.client_ip_port: p for p in p_nodes}
+    url_to_d = {d.node.client_ip_port: d for d in d_nodes}
+
+    events = []
+    seq = itertools.count()
+
+    def push(time, kind, obj):
+        heapq.heappush(events, (time, next(seq), kind, obj))
+
+    for req in reqs:
+        push(req["arrival_time"], "arrival", req)
+    push(0.0, "status", None)
+
+    def start_prefill(p: SimPrefillNode, now):
+        if p.busy or len(p.queue) == 0:
+            return
+        req = p.queue.popleft()
+        block_hashes = get_prompt_block_hashes(req["prompt"])
+        cached = min(len(req["prompt"]) - 1, p.cache.match_len(block_hashes) * PREFIX_BLOCK_TOKENS)
+        req["cached_tokens"] = cached
+        p.cache.insert(block_hashes)
+        p.busy = True
+        cost = args.prefill_base_ms / 1000 + (len(req["prompt"]) - cached) / args.prefill_tokens_per_s
+        push(now + cost, "prefill_done", req)
+
+    def try_start_decode(d: SimDecodeNode, now):
+        while len(d.queue) != 0:
+            req = d.queue[0]
+            need = len(req["prompt"]) + req["output_len"]
+            if d.used + need > d.capacity and d.used != 0:
+                return
+            d.queue.popleft()
+            d.used += need
+            req["decode_start_time"] = now
+            push(now + req["output_len"] * args.decode_token_ms / 1000, "decode_done", req)
+
+    finished_num = 0
+    while finished_num < len(reqs):
+        now, _, kind, obj = heapq.heappop(events)
+        if kind == "arrival":
+            req = obj
+            p_node, d_node = selector.select(req["req_id"], req["prompt"], req["output_len"], *_nodes(p_nodes, d_nodes))
+            req["p"], req["d"] = url_to_p[p_node.client_ip_port], url_to_d[d_node.client_ip_port]
+            req["p"].queue.append(req)
+            start_prefill(req["p"], now)
+        elif kind == "prefill_done":
+            req = obj
+            req["ttft"] = now - req["arrival_time"]
+            selector.on_prefill_finished(req["req_id"])
+            req["p"].busy = False
+            start_prefill(req["p"], now)
+            req["d"].queue.append(req)
+            req["decode_ready_time"] = now
+            try_start_decode(req["d"], now)
+        elif kind == "decode_done":
+            req = obj
+            req["d"].used -= len(req["prompt"]) + req["output_len"]
+            selector.on_req_finished(req["req_id"])
+            finished_num += 1
+            try_start_decode(req["d"], now)
+        elif kind == "status":
+            for p in p_nodes:
+                load = 0.0
+                selector.update_node_status(
+                    p.node.client_ip_port,
+                    {
+                        "running_req_num": len(p.queue) + int(p.busy),
+                        "pending_prompt_tokens": p.pending_prompt_tokens(),
+                        "current_load": [load],
+                        "dynamic_max_load": [load],
+                    },
+                )
+            for d in d_nodes:
+                # 排队等待的请求同样计入负载
+                load = (d.used + sum(len(r["prompt"]) + r["output_len"] for r in d.queue)) / d.capacity
+                selector.update_node_status(
+                    d.node.client_ip_port,
+                    {
+                        "running_req_num": len(d.queue),
+                        "pending_prompt_tokens": 0,
+                        "current_load": [load],
+                        "dynamic_max_load": [load],
+                    },
+                )
+            push(now + args.status_interval_ms / 1000, "status", None)
+
+    ttfts = np.array([req["ttft"] for req in reqs])
+    decode_waits = np.array([req["decode_start_time"] - req["decode_ready_time"] for req in reqs])
+    cache_ratio = sum(req["cached_tokens"] for req in reqs) / sum(len(req["prompt"]) for req in reqs)
+    return {
+        "ttft_p50": np.percentile(ttfts, 50),
+        "ttft_p90": np.percentile(ttfts, 90),
+        "ttft_p99": np.percentile(ttfts, 99),
+        "decode_wait_p99": np.percentile(decode_waits, 99),
+        "cache_ratio": cache_ratio,
+    }
+
+
+def _nodes(p_nodes, d_nodes):
+    return [p.node for p in p_nodes], [d.node for d in d_nodes]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_reqs", type=int, default=4000)
+    parser.add_argument("--qps", type=float, default=12)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--num_prefill", type=int, default=4)
+    parser.add_argument("--num_decode", type=int, default=4)
+    parser.add_argument("--num_prefixes", type=int, default=32)
+    parser.add_argument("--zipf", type=float, default=1.0)
+    parser.add_argument("--prefix_len", type=int, default=4096)
+    parser.add_argument("--suffix_len", type=int, default=512)
+    parser.add_argument("--output_len", type=int, default=256)
+    parser.add_argument("--prefill_tokens_per_s", type=float, default=20000)
+    parser.add_argument("--prefill_base_ms", type=float, default=20)
+    parser.add_argument("--prefill_cache_tokens", type=int, default=100000)
+    parser.add_argument("--decode_capacity", type=int, default=200000)
+    parser.add_argument("--decode_token_ms", type=float, default=30)
+    parser.add_argument("--status_interval_ms", type=float, default=200)
+    args = parser.parse_args()
+
+    reqs = gen_trace(args)
+    print(f"replay {len(reqs)} reqs, last arrival at {reqs[-1]['arrival_time']:.1f}s")
+    print(
+        f"{'selector':>10} {'ttft p50':>9} {'ttft p90':>9} {'ttft p99':>9} {'decode wait p99':>16} {'cache ratio':>12}"
+    )
+    for name, selector in [("random", RandomPDSelector()), ("load_aware", LoadAwarePDSelector())]:
+        random.seed(args.seed)
+        ans = simulate(selector, [dict(req) for req in reqs], args)
+        print(
+            f"{name:>10} {ans['ttft_p50']:>9.3f} {ans['ttft_p90']:>9.3f} {ans['ttft_p99']:>9.3f} "
+            f"{ans['decode_wait_p99']:>16.3f} {ans['cache_ratio']:>12.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
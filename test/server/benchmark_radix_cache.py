@@ -0,0 +1,131 @@
+"""
+prompt cache 数据结构的 cpu 微基准测试，回放一个请求 trace，模拟推理进程中
+InferReq.init_all (match_prefix) 和 free_a_req_mem (insert + dec_node_ref_counter)
+对 prompt cache 的调用，比较不同 prompt cache 实现的耗时。
+
+trace 文件为 jsonl 格式，每行一个请求: {"input_ids": [...], "output_ids": [...]}
+
+例子：
+    python benchmark_radix_cache.py --save_trace trace.jsonl
+    python benchmark_radix_cache.py --trace trace.jsonl --capacity 400000
+"""
+import argparse
+import json
+import random
+import time
+import numpy as np
+import torch
+from lightllm.server.router.dynamic_prompt.radix_cache import RadixCache
+from lightllm.server.router.dynamic_prompt.array_radix_cache import ArrayRadixCache
+from lightllm.server.router.dynamic_prompt.block_prefix_cache import BlockPrefixCache
+
+CACHE_CLASSES = {
+    "radix": RadixCache,
+    "array_radix": ArrayRadixCache,
+    "block": BlockPrefixCache,
+}
+
+
+def gen_multi_turn_trace(num_sessions, num_turns, system_prompt_len, turn_input_len, output_len, vocab_size, seed):
+    rng = random.Random(seed)
+    system_prompt = [rng.randrange(vocab_size) for _ in range(system_prompt_len)]
+    sessions = [list(system_prompt) for _ in range(num_sessions)]
+    trace = []
+    for _ in range(num_turns):
+        for history in sessions:
+            history.extend(rng.randrange(vocab_size) for _ in range(turn_input_len))
+            output_ids = [rng.randrange(vocab_size) for _ in range(output_len)]
+            trace.append({"input_ids": list(history), "output_ids": output_ids})
+            history.extend(output_ids)
+    rng.shuffle(trace)
+    return trace
+
+
+def load_trace(path):
+    with open(path, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def replay(cache_name, trace, capacity):
+    cache = CACHE_CLASSES[cache_name](f"bench_{cache_name}", capacity, 0)
+    next_mem_index = 0
+    hit_tokens = 0
+    match_cost = 0.0
+    insert_cost = 0.0
+    evict_cost = 0.0
+    for item in trace:
+        input_ids = torch.tensor(item["input_ids"], dtype=torch.int64)
+        all_ids = torch.tensor(item["input_ids"] + item["output_ids"], dtype=torch.int64)
+
+        start = time.perf_counter()
+        share_node, kv_len, _ = cache.match_prefix(input_ids[0 : len(input_ids) - 1], update_refs=True)
+        match_cost += time.perf_counter() - start
+        hit_tokens += kv_len
+
+        need_token_num = len(all_ids) - kv_len
+        unrefed_token_num = cache.get_tree_total_tokens_num() - cache.get_refed_tokens_num()
+        if cache.get_tree_total_tokens_num() + need_token_num > capacity and unrefed_token_num > 0:
+            start = time.perf_counter()
+            cache.evict(min(need_token_num, unrefed_token_num), lambda x: None)
+            evict_cost += time.perf_counter() - start
+
+        value = torch.arange(next_mem_index, next_mem_index + len(all_ids), dtype=torch.int64)
+        next_mem_index += len(all_ids)
+        start = time.perf_counter()
+        cache.insert(all_ids, value)
+        cache.dec_node_ref_counter(share_node)
+        insert_cost += time.perf_counter() - start
+
+    return {
+        "match_ms_per_req": match_cost * 1000 / len(trace),
+        "insert_ms_per_req": insert_cost * 1000 / len(trace),
+        "evict_ms_total": evict_cost * 1000,
+        "hit_tokens": hit_tokens,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--trace", type=str, default=None, help="jsonl request trace to replay")
+    parser.add_argument("--save_trace", type=str, default=None, help="save the generated trace to this path")
+    parser.add_argument("--capacity", type=int, default=1000000, help="max tokens held by the prompt cache")
+    parser.add_argument("--num_sessions", type=int, default=64)
+    parser.add_argument("--num_turns", type=int, default=6)
+    parser.add_argument("--system_prompt_len", type=int, default=4096)
+    parser.add_argument("--turn_input_len", type=int, default=512)
+    parser.add_argument("--output_len", type=int, default=256)
+    parser.add_argument("--vocab_size", type=int, default=150000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--caches", nargs="+", default=list(CACHE_CLASSES.keys()))
+    args = parser.parse_args()
+
+    if args.trace is not None:
+        trace = load_trace(args.trace)
+    else:
+        trace = gen_multi_turn_trace(
+            args.num_sessions,
+            args.num_turns,
+            args.system_prompt_len,
+            args.turn_input_len,
+            args.output_len,
+            args.vocab_size,
+            args.seed,
+        )
+        if args.save_trace is not None:
+            with open(args.save_trace, "w") as f:
+                for item in trace:
+                    f.write(json.dumps(item) + "\n")
+
+    avg_len = np.mean([len(e["input_ids"]) for e in trace])
+    print(f"replay {len(trace)} reqs, avg input len {avg_len:.1f}, capacity {args.capacity}")
+    for cache_name in args.caches:
+        result = replay(cache_name, trace, args.capacity)
+        print(
+            f"{cache_name:>12}: match {result['match_ms_per_req']:.3f} ms/req, "
+            f"insert {result['insert_ms_per_req']:.3f} ms/req, "
+            f"evict total {result['evict_ms_total']:.1f} ms, hit tokens {result['hit_tokens']}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+对比每个请求单独创建共享内存段与使用预先分配的 arena 槽位时，请求初始化和各个进程 link 缓冲区的耗时。
+link_num 模拟 detokenization 与各个 tp 推理进程对同一个请求的 link 次数。
+
+例子：
+    python benchmark_req_shm_arena.py --req_num 2000 --input_len 1024 --output_len 1024 --link_num 9
+"""
+import os
+import json
+import time
+import argparse
+import numpy as np
+
+
+def run(args, use_arena):
+    from lightllm.server.core.objs.req import Req
+    from lightllm.server.core.objs.req_shm_arena import get_req_shm_arena
+    from lightllm.utils.envs_utils import get_env_start_args
+
+    if use_arena:
+        os.environ["LIGHTLLM_START_ARGS"] = json.dumps(
+            {"running_max_req_size": args.max_req_num, "max_req_total_len": args.input_len + args.output_len}
+        )
+    else:
+        os.environ.pop("LIGHTLLM_START_ARGS", None)
+    get_env_start_args.cache_clear()
+    get_req_shm_arena.cache_clear()
+
+    prompt_ids = list(range(args.input_len))
+    reqs = []
+    for i in range(args.max_req_num):
+        req = Req()
+        req.index_in_shm_mem = i
+        reqs.append(req)
+
+    init_cost = 0.0
+    link_cost = 0.0
+    for i in range(args.req_num):
+        req = reqs[i % args.max_req_num]
+        start = time.perf_counter()
+        req.init(i * 8, prompt_ids, {"max_new_tokens": args.output_len}, None)
+        init_cost += time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in range(args.link_num):
+            req.link_prompt_ids_shm_array()
+            req.link_logprobs_shm_array()
+            req.shm_prompt_ids.arr[args.input_len] = 1
+        link_cost += time.perf_counter() - start
+
+    if not use_arena:
+        for req in reqs:
+            req.link_prompt_ids_shm_array()
+            req.link_logprobs_shm_array()
+            req.shm_prompt_ids.close_shm()
+            req.shm_logprobs.close_shm()
+    else:
+        get_req_shm_arena("prompts").shm_array.close_shm()
+        get_req_shm_arena("logprobs").shm_array.close_shm()
+    return init_cost / args.req_num * 1e6, link_cost / args.req_num * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--req_num", type=int, default=2000)
+    parser.add_argument("--max_req_num", type=int, default=256)
+    parser.add_argument("--input_len", type=int, default=1024)
+    parser.add_argument("--output_len", type=int, default=1024)
+    parser.add_argument("--link_num", type=int, default=9)
+    args = parser.parse_args()
+    os.environ["LIGHTLLM_UNIQUE_SERVICE_NAME_ID"] = f"bench_{os.getpid()}"
+
+    print(f"{'mode':>12} {'init us/req':>12} {'link us/req':>12}")
+    for use_arena in [False, True]:
+        init_us, link_us = run(args, use_arena)
+        print(f"{'arena' if use_arena else 'single shm':>12} {init_us:>12.2f} {link_us:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""
+router 与推理进程之间 rpc 的 host 端开销压测。使用只在 cpu 上运行的 stub 后端，每个 rank 一个进程，
+stub 的 prefill/decode 只 sleep --step_ms 模拟 gpu 上的计算，统计每次调用的耗时减去 step_ms 后的额外开销，
+以及压测期间所有 rank 进程消耗的 cpu 时间 (每秒墙钟时间对应的 cpu 核数)。
+--protocols 可以选择对比的同步方式：
+    shm_seq: 当前使用的命令序号 + 先忙等后 sleep 的同步方式，prefill/decode 使用二进制编码；
+    legacy: 原来的 multiprocessing.Event + 两次 rank 间忙等 barrier + pickle 的方式，作为对比基线。
+
+例子：
+    python benchmark_rpc_overhead.py --tps 1,2,4,8 --num_steps 500 --step_ms 10 --prefill_req_num 64
+"""
+import os
+
+os.environ.setdefault("LIGHTLLM_LOG_LEVEL", "warning")
+os.environ.setdefault("LIGHTLLM_UNIQUE_SERVICE_NAME_ID", f"rpc_bench_{os.getpid()}")
+
+import time
+import pickle
+import asyncio
+import argparse
+import multiprocessing
+import numpy as np
+import psutil
+from lightllm.server.core.objs.rpc_shm import RpcShmParams, ShmSyncStatusArray
+from lightllm.server.router.dynamic_prompt.shared_arr import SharedArray
+from lightllm.utils.envs_utils import get_unique_server_name
+
+
+class StubBackend:
+    def __init__(self, step_time):
+        self.step_time = step_time
+
+    def prefill(self, reqs):
+        time.sleep(self.step_time)
+
+    def decode(self):
+        time.sleep(self.step_time)
+
+    def pause_reqs(self, req_ids):
+        return
+
+
+class LegacySyncStatus:
+    """
+    原来的同步方式，各个 rank 执行完成后在两个 barrier 上忙等所有 rank。
+    """
+
+    def __init__(self, world_size):
+        self.shared_arr = SharedArray(f"{get_unique_server_name()}_legacy_rpc_state", (2, world_size), np.int64)
+        self.arr0 = self.shared_arr.arr[0]
+        self.arr1 = self.shared_arr.arr[1]
+
+    def barrier(self, arr, rank):
+        arr[rank] += 1
+        while len(np.unique(arr)) != 1:
+            pass
+
+
+def _rank_loop(protocol, rank, world_size, step_time, events, ready_event):
+    backend = StubBackend(step_time)
+    params = RpcShmParams()
+    params.create_or_link_shm()
+    if protocol == "shm_seq":
+        status = ShmSyncStatusArray(world_size)
+        status.create_or_link_shm()
+        ready_event.set()
+        last_cmd_seq = 0
+        while True:
+            cmd_seq = status.wait_cmd(last_cmd_seq)
+            func_name, args = params.read_func_params()
+            if func_name == "exit":
+                status.mark_done(rank, cmd_seq)
+                return
+            getattr(backend, func_name)(*args)
+            status.mark_done(rank, cmd_seq)
+            last_cmd_seq = cmd_seq
+    else:
+        rpc_event, rpc_finished_event = events
+        status = LegacySyncStatus(world_size)
+        ready_event.set()
+        while True:
+            rpc_event.wait()
+            bytes_len = params.shm.buf.cast("i")[0]
+            func_name, args = pickle.loads(params.shm.buf[4 : 4 + bytes_len])
+            if func_name != "exit":
+                getattr(backend, func_name)(*args)
+            status.barrier(status.arr0, rank)
+            rpc_event.clear()
+            status.barrier(status.arr1, rank)
+            if rank == 0:
+                rpc_finished_event.set()
+            if func_name == "exit":
+                return
+
+
+class BenchClient:
+    def __init__(self, protocol, world_size, events):
+        self.protocol = protocol
+        self.params = RpcShmParams()
+        self.params.create_or_link_shm()
+        self.status = ShmSyncStatusArray(world_size)
+        self.status.create_or_link_shm()
+        self.events = events
+
+    async def call(self, func_name, args):
+        if self.protocol == "shm_seq":
+            self.params.write_func_params(func_name, args)
+            cmd_seq = self.status.send_cmd()
+            await self.status.async_wait_all_done(cmd_seq)
+        else:
+            rpc_event, rpc_finished_event = self.events
+            objs_bytes = pickle.dumps((func_name, args))
+            self.params.shm.buf.cast("i")[0] = len(objs_bytes)
+            self.params.shm.buf[4 : 4 + len(objs_bytes)] = objs_bytes
+            rpc_event.set()
+            await asyncio.to_thread(rpc_finished_event.wait)
+            rpc_finished_event.clear()
+
+
+def get_cpu_time(procs):
+    total = 0.0
+    for proc in procs:
+        cpu_times = proc.cpu_times()
+        total += cpu_times.user + cpu_times.system
+    return total
+
+
+async def run_client(client, num_steps, step_time, prefill_reqs, rank_procs):
+    ans = {}
+    for func_name, args in [("decode", ()), ("prefill", (prefill_reqs,)), ("pause_reqs", ([1, 2, 3, 4],))]:
+        expect_time = 0.0 if func_name == "pause_reqs" else step_time
+        overheads = []
+        cpu_start, wall_start = get_cpu_time(rank_procs), time.time()
+        for _ in range(num_steps):
+            start = time.perf_counter()
+            await client.call(func_name, args)
+            overheads.append(time.perf_counter() - start - expect_time)
+        cpu_cost = (get_cpu_time(rank_procs) - cpu_start) / (time.time() - wall_start)
+        ans[func_name] = (np.percentile(overheads, 50), np.percentile(overheads, 99), cpu_cost)
+    await client.call("exit", ())
+    return ans
+
+
+def bench(protocol, tp, args):
+    step_time = args.step_ms / 1000
+    events = (multiprocessing.Event(), multiprocessing.Event())
+    client = BenchClient(protocol, tp, events)
+    legacy_status = LegacySyncStatus(tp)
+    legacy_status.shared_arr.arr.fill(0)
+    ready_events = [multiprocessing.Event() for _ in range(tp)]
+    procs = [
+        multiprocessing.Process(target=_rank_loop, args=(protocol, rank, tp, step_time, events, ready_events[rank]))
+        for rank in range(tp)
+    ]
+    for proc in procs:
+        proc.start()
+    for ready_event in ready_events:
+        ready_event.wait()
+    # 每个 rank 在链接时都会清零 ShmSyncStatusArray，所有 rank 都启动后再开始
+    prefill_reqs = [(i, i, None, -1) for i in range(args.prefill_req_num)]
+    rank_procs = [psutil.Process(proc.pid) for proc in procs]
+    ans = asyncio.run(run_client(client, args.num_steps, step_time, prefill_reqs, rank_procs))
+    for proc in procs:
+        proc.join()
+    for shm in [client.params.shm, client.status.shm, legacy_status.shared_arr.shm]:
+        shm.unlink()
+    return ans
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tps", type=str, default="1,2,4,8")
+    parser.add_argument("--protocols", type=str, default="legacy,shm_seq")
+    parser.add_argument("--num_steps", type=int, default=500)
+    parser.add_argument("--step_ms", type=float, default=10)
+    parser.add_argument("--prefill_req_num", type=int, default=64)
+    args = parser.parse_args()
+
+    print(f"host cpu num {os.cpu_count()}, stub step {args.step_ms} ms")
+    print(f"{'protocol':>9} {'tp':>3} {'func':>11} {'overhead p50':>13} {'overhead p99':>13} {'rank cpu cores':>15}")
+    for tp in [int(tp) for tp in args.tps.split(",")]:
+        for protocol in args.protocols.split(","):
+            ans = bench(protocol, tp, args)
+            for func_name, (p50, p99, cpu_cost) in ans.items():
+                print(
+                    f"{protocol:>9} {tp:>3} {func_name:>11} {p50 * 1e6:>11.1f}us {p99 * 1e6:>11.1f}us "
+                    f"{cpu_cost:>15.2f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+使用离线调度模拟器在 cpu 上评估调度参数，输出吞吐、TTFT/ITL/端到端延迟的分位数和暂停事件的统计。
+--trace 为 jsonl 格式的请求 trace，每一行形如 {"arrival_time": 0.1, "input_len": 512, "output_len": 128}，
+也接受 timestamp、prompt_len、prompt_tokens、completion_tokens 等常见字段名，没有指定时生成一个合成 trace。
+--sweep 可以对一个启动参数设置多个取值进行对比，如 --sweep router_token_ratio=0.0,0.5,0.9。
+单步推理的耗时使用线性的 cost model 估计，需要按照实际部署的 profile 结果设置 --base_time 等参数。
+--high_priority_ratio 将合成 trace 中对应比例的请求设置为高优先级 (priority 0)，其余为 priority 1，
+配合 --enable_priority_schedule 对比各个优先级的 TTFT。
+
+例子：
+    python benchmark_scheduler_sim.py --num_reqs 2000 --qps 20 --sweep router_token_ratio=0.0,0.5,0.9
+    python benchmark_scheduler_sim.py --trace trace.jsonl --max_total_token_num 200000 \\
+        --sweep chunked_prefill_size=2048,4096,8192 --dump_pause_events pause_events.jsonl
+    python benchmark_scheduler_sim.py --qps 12 --max_total_token_num 60000 --high_priority_ratio 0.3 \\
+        --enable_priority_schedule --sweep priority_preempt_wait_ms=-1,500,100
+"""
+import os
+
+os.environ.setdefault("LIGHTLLM_LOG_LEVEL", "warning")
+
+import json
+import time
+import random
+import argparse
+from lightllm.server.router.scheduler_simulator import (
+    SchedulerSimulator,
+    StepCostModel,
+    build_sim_start_args,
+    gen_bimodal_trace,
+    init_sim_env,
+    load_trace,
+)
+
+_SIM_ARG_NAMES = [
+    "max_total_token_num",
+    "running_max_req_size",
+    "max_req_total_len",
+    "batch_max_tokens",
+    "router_token_ratio",
+    "router_max_new_token_len",
+    "router_max_wait_tokens",
+    "chunked_prefill_size",
+    "disable_chunked_prefill",
+    "disable_aggressive_schedule",
+    "output_len_estimator",
+    "enable_priority_schedule",
+    "priority_preempt_wait_ms",
+    "dp",
+]
+
+
+def parse_sweep(sweep: str):
+    if sweep is None:
+        return None, [None]
+    name, values = sweep.split("=", 1)
+    assert name in _SIM_ARG_NAMES, f"can not sweep {name}, only support {_SIM_ARG_NAMES}"
+    parsed_values = []
+    for value in values.split(","):
+        try:
+            parsed_values.append(json.loads(value))
+        except json.JSONDecodeError:
+            parsed_values.append(value)
+    return name, parsed_values
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--trace", type=str, default=None)
+    parser.add_argument("--num_reqs", type=int, default=2000)
+    parser.add_argument("--qps", type=float, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max_total_token_num", type=int, default=200000)
+    parser.add_argument("--running_max_req_size", type=int, default=1000)
+    parser.add_argument("--max_req_total_len", type=int, default=16384)
+    parser.add_argument("--batch_max_tokens", type=int, default=None)
+    parser.add_argument("--router_token_ratio", type=float, default=0.0)
+    parser.add_argument("--router_max_new_token_len", type=int, default=1024)
+    parser.add_argument("--router_max_wait_tokens", type=int, default=6)
+    parser.add_argument("--chunked_prefill_size", type=int, default=8192)
+    parser.add_argument("--disable_chunked_prefill", action="store_true")
+    parser.add_argument("--disable_aggressive_schedule", action="store_true")
+    parser.add_argument("--output_len_estimator", type=str, default="fixed", choices=["fixed", "histogram"])
+    parser.add_argument("--enable_priority_schedule", action="store_true")
+    parser.add_argument("--priority_preempt_wait_ms", type=int, default=500)
+    parser.add_argument("--high_priority_ratio", type=float, default=0.0)
+    parser.add_argument("--dp", type=int, default=1)
+    parser.add_argument("--base_time", type=float, default=StepCostModel.base_time)
+    parser.add_argument("--prefill_token_time", type=float, default=StepCostModel.prefill_token_time)
+    parser.add_argument("--decode_req_time", type=float, default=StepCostModel.decode_req_time)
+    parser.add_argument("--kv_token_time", type=float, default=StepCostModel.kv_token_time)
+    parser.add_argument("--sweep", type=str, default=None, help="name=v1,v2,... 对比一个启动参数的多个取值")
+    parser.add_argument("--dump_pause_events", type=str, default=None, help="将暂停事件写入 jsonl 文件")
+    args = parser.parse_args()
+
+    if args.trace is not None:
+        specs = load_trace(args.trace)
+    else:
+        specs = gen_bimodal_trace(args.num_reqs, args.qps, seed=args.seed)
+        if args.high_priority_ratio > 0:
+            rng = random.Random(args.seed)
+            for spec in specs:
+                spec.priority = 0 if rng.random() < args.high_priority_ratio else 1
+    cost_model = StepCostModel(
+        base_time=args.base_time,
+        prefill_token_time=args.prefill_token_time,
+        decode_req_time=args.decode_req_time,
+        kv_token_time=args.kv_token_time,
+    )
+    sweep_name, sweep_values = parse_sweep(args.sweep)
+
+    print(f"replay {len(specs)} reqs, last arrival at {specs[-1].arrival_time:.1f}s")
+    print(
+        f"{'config':>24} {'req/s':>7} {'tok/s':>8} {'ttft p50':>9} {'ttft p99':>9} {'itl p50':>8} {'itl p99':>8} "
+        f"{'paused':>7} {'recompute':>10} {'mean bs':>8} {'unfinished':>10} {'cost':>6}"
+    )
+    pause_event_file = open(args.dump_pause_events, "w") if args.dump_pause_events is not None else None
+    for sweep_value in sweep_values:
+        sim_kwargs = {name: getattr(args, name) for name in _SIM_ARG_NAMES}
+        config = "default"
+        if sweep_name is not None:
+            sim_kwargs[sweep_name] = sweep_value
+            config = f"{sweep_name}={sweep_value}"
+        start_args = build_sim_start_args(**sim_kwargs)
+        init_sim_env(start_args)
+        simulator = SchedulerSimulator(start_args, specs, cost_model)
+        start = time.time()
+        ans = simulator.run()
+        cost = time.time() - start
+        if pause_event_file is not None:
+            for event in simulator.get_pause_events():
+                pause_event_file.write(json.dumps({"config": config, **event}) + "\n")
+        simulator.close()
+        print(
+            f"{config:>24} {ans['req_throughput']:>7.2f} {ans['output_token_throughput']:>8.1f} "
+            f"{ans['ttft_p50']:>9.3f} {ans['ttft_p99']:>9.3f} {ans['itl_p50'] * 1000:>6.1f}ms "
+            f"{ans['itl_p99'] * 1000:>6.1f}ms {ans['paused_req_num']:>7d} {ans['recompute_tokens']:>10d} "
+            f"{ans['mean_decode_batch_size']:>8.1f} {ans['unfinished_req_num']:>10d} {cost:>5.1f}s"
+        )
+        if len(ans["ttft_by_priority"]) > 1:
+            for priority, ttft in ans["ttft_by_priority"].items():
+                print(f"{'priority ' + str(priority):>24} ttft p50 {ttft['ttft_p50']:.3f} p99 {ttft['ttft_p99']:.3f}")
+    if pause_event_file is not None:
+        pause_event_file.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+token 下发路径的压测脚本。对一个已经启动的服务，分别以不同的并发流数量请求 /generate_stream，
+统计服务端各个进程在压测期间消耗的 cpu 时间，计算每个输出 token 的 cpu 开销。
+httpserver 进程只处理有新 token 的请求时，每个 token 的 httpserver cpu 开销不应随并发流数量增长。
+
+例子：
+    python benchmark_token_delivery.py --url http://127.0.0.1:8000 --server_pid 12345 \
+        --concurrencies 10,100,500,1000,2000 --output_len 256
+"""
+import argparse
+import asyncio
+import json
+import time
+import aiohttp
+import psutil
+
+
+def get_server_processes(server_pid):
+    # 返回 {进程类别: [进程]}，gunicorn 启动的 httpserver 进程命令行中包含 api_http
+    root = psutil.Process(server_pid)
+    processes = {"httpserver": [], "others": [root]}
+    for proc in root.children(recursive=True):
+        try:
+            kind = "httpserver" if "api_http" in " ".join(proc.cmdline()) else "others"
+        except psutil.Error:
+            continue
+        processes[kind].append(proc)
+    return processes
+
+
+def get_cpu_time(processes):
+    total = 0.0
+    for proc in processes:
+        try:
+            cpu_times = proc.cpu_times()
+            total += cpu_times.user + cpu_times.system
+        except psutil.Error:
+            pass
+    return total
+
+
+async def stream_one(session, args, index):
+    payload = {
+        "inputs": f"{index} " + "hello " * args.input_len,
+        "parameters": {"max_new_tokens": args.output_len, "ignore_eos": True},
+    }
+    token_num = 0
+    async with session.post(f"{args.url}/generate_stream", json=payload) as response:
+        async for line in response.content:
+            line = line.strip()
+            if line.startswith(b"data:"):
+                json.loads(line[5:])
+                token_num += 1
+    return token_num
+
+
+async def run_concurrency(args, concurrency):
+    timeout = aiohttp.ClientTimeout(total=None)
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+        results = await asyncio.gather(*[stream_one(session, args, i) for i in range(concurrency)])
+    return sum(results)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", type=str, default="http://127.0.0.1:8000")
+    parser.add_argument("--server_pid", type=int, required=True, help="the pid of the api server main process")
+    parser.add_argument("--concurrencies", type=str, default="10,100,500,1000,2000")
+    parser.add_argument("--input_len", type=int, default=32)
+    parser.add_argument("--output_len", type=int, default=256)
+    args = parser.parse_args()
+
+    processes = get_server_processes(args.server_pid)
+    print(f"httpserver pids: {[proc.pid for proc in processes['httpserver']]}")
+    print(f"{'streams':>8} {'tokens':>9} {'tokens/s':>10} {'http cpu us/token':>18} {'all cpu us/token':>17}")
+    for concurrency in [int(e) for e in args.concurrencies.split(",")]:
+        http_cpu_start = get_cpu_time(processes["httpserver"])
+        other_cpu_start = get_cpu_time(processes["others"])
+        start_time = time.time()
+        token_num = asyncio.run(run_concurrency(args, concurrency))
+        cost_time = time.time() - start_time
+        http_cpu = get_cpu_time(processes["httpserver"]) - http_cpu_start
+        other_cpu = get_cpu_time(processes["others"]) - other_cpu_start
+        token_num = max(1, token_num)
+        print(
+            f"{concurrency:>8} {token_num:>9} {token_num / cost_time:>10.1f} "
+            f"{http_cpu / token_num * 1e6:>18.2f} {(http_cpu + other_cpu) / token_num * 1e6:>17.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
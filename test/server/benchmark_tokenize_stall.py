@@ -0,0 +1,101 @@
+"""
+测试长 prompt 的 tokenize 对已有流式请求的 token 间延迟 (inter token latency) 的影响。
+先启动 stream_num 个持续输出的流式请求，稳定后每隔 long_interval 秒发送一个 long_prompt_chars 字符的长 prompt 请求，
+统计流式请求在有无长 prompt 到达时的 token 间延迟的 p50 / p99 / max。
+分别以 --tokenize_workers 0 和 --tokenize_workers 2 启动服务进行对比。
+
+例子：
+    python benchmark_tokenize_stall.py --url http://127.0.0.1:8000 --stream_num 64 \
+        --long_prompt_chars 100000 --long_num 20 --long_interval 0.5
+"""
+import argparse
+import asyncio
+import time
+import numpy as np
+import aiohttp
+
+
+async def stream_one(session, args, index, itls, stop_event):
+    payload = {
+        "inputs": f"{index} " + "hello " * args.input_len,
+        "parameters": {"max_new_tokens": args.output_len, "ignore_eos": True},
+    }
+    while not stop_event.is_set():
+        last_time = None
+        async with session.post(f"{args.url}/generate_stream", json=payload) as response:
+            async for line in response.content:
+                if not line.strip().startswith(b"data:"):
+                    continue
+                cur_time = time.perf_counter()
+                if last_time is not None:
+                    itls.append((cur_time, cur_time - last_time))
+                last_time = cur_time
+                if stop_event.is_set():
+                    break
+
+
+async def send_long_prompts(session, args, long_windows):
+    text = ("The quick brown fox jumps over the lazy dog. " * (args.long_prompt_chars // 45 + 1))[
+        : args.long_prompt_chars
+    ]
+    payload = {"inputs": text, "parameters": {"max_new_tokens": 1}}
+    for _ in range(args.long_num):
+        start = time.perf_counter()
+        async with session.post(f"{args.url}/generate", json=payload) as response:
+            await response.read()
+        long_windows.append((start, time.perf_counter()))
+        await asyncio.sleep(args.long_interval)
+
+
+def report(name, values):
+    if len(values) == 0:
+        print(f"{name:>18} no data")
+        return
+    values = np.array(values) * 1000
+    print(
+        f"{name:>18} count {len(values):>7} p50 {np.percentile(values, 50):>8.2f} ms "
+        f"p99 {np.percentile(values, 99):>8.2f} ms max {values.max():>8.2f} ms"
+    )
+
+
+async def run(args):
+    timeout = aiohttp.ClientTimeout(total=None)
+    connector = aiohttp.TCPConnector(limit=0)
+    itls = []
+    long_windows = []
+    stop_event = asyncio.Event()
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+        streams = [asyncio.create_task(stream_one(session, args, i, itls, stop_event)) for i in range(args.stream_num)]
+        await asyncio.sleep(args.warmup)
+        base_start = time.perf_counter()
+        await asyncio.sleep(args.warmup)
+        base_end = time.perf_counter()
+        await send_long_prompts(session, args, long_windows)
+        stop_event.set()
+        await asyncio.gather(*streams, return_exceptions=True)
+
+    def in_long_window(t):
+        return any(start <= t <= end for start, end in long_windows)
+
+    report("baseline", [itl for t, itl in itls if base_start <= t <= base_end])
+    report("with long prompts", [itl for t, itl in itls if in_long_window(t)])
+    long_costs = [end - start for start, end in long_windows]
+    report("long prompt e2e", long_costs)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", type=str, default="http://127.0.0.1:8000")
+    parser.add_argument("--stream_num", type=int, default=64)
+    parser.add_argument("--input_len", type=int, default=32)
+    parser.add_argument("--output_len", type=int, default=1024)
+    parser.add_argument("--long_prompt_chars", type=int, default=100000)
+    parser.add_argument("--long_num", type=int, default=20)
+    parser.add_argument("--long_interval", type=float, default=0.5)
+    parser.add_argument("--warmup", type=float, default=5.0)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
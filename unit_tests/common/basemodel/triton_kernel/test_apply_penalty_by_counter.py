@@ -0,0 +1,49 @@
+import torch
+import pytest
+from lightllm.common.basemodel.triton_kernel.apply_penalty import apply_penalty
+from lightllm.common.basemodel.triton_kernel.apply_penalty_by_counter import apply_penalty_by_counter
+
+
+@pytest.mark.parametrize("batch_size, vocab_size", [(1, 1000), (16, 32000), (64, 152064)])
+def test_apply_penalty_by_counter(batch_size, vocab_size):
+    max_req_num = 128
+    b_req_idx = torch.randperm(max_req_num, device="cuda")[0:batch_size].to(torch.int32)
+    counter = torch.zeros((max_req_num + 1, vocab_size), dtype=torch.int32, device="cuda")
+    presence = torch.rand((batch_size,), device="cuda")
+    frequency = torch.rand((batch_size,), device="cuda")
+    repetition = torch.rand((batch_size,), device="cuda") + 1.0
+    # 部分请求没有开启 penalty
+    presence[0::3] = 0.0
+    frequency[0::3] = 0.0
+    repetition[0::3] = 1.0
+
+    p_token_ids, p_token_counts, p_seq_len = [], [], [0]
+    for i in range(batch_size):
+        token_ids = torch.randperm(vocab_size)[0:300]
+        token_counts = torch.randint(1, 5, (300,))
+        counter[b_req_idx[i].item(), token_ids.cuda()] = token_counts.to(torch.int32).cuda()
+        if i % 3 == 0:
+            p_seq_len.append(0)
+            continue
+        p_token_ids.append(token_ids)
+        p_token_counts.append(token_counts)
+        p_seq_len.append(300)
+
+    logits = torch.randn((batch_size, vocab_size), device="cuda")
+    ref_logits = logits.clone()
+    apply_penalty(
+        ref_logits,
+        presence,
+        frequency,
+        repetition,
+        torch.cat(p_token_ids).to(torch.int32).cuda(),
+        torch.cat(p_token_counts).to(torch.int32).cuda(),
+        torch.cumsum(torch.tensor(p_seq_len), dim=0).to(torch.int32).cuda(),
+        300,
+    )
+    apply_penalty_by_counter(logits, b_req_idx, presence, frequency, repetition, counter)
+    assert torch.allclose(logits, ref_logits, atol=1e-5, rtol=0)
+
+
+if __name__ == "__main__":
+    pytest.main()
@@ -0,0 +1,82 @@
+import torch
+import pytest
+from lightllm.common.grouped_sampling import (
+    GREEDY,
+    TOP_K,
+    TOP_P,
+    FULL,
+    SORT,
+    TOP_P_CANDIDATE_NUM,
+    build_sample_groups,
+    grouped_sample,
+    _top_p_top_k,
+)
+
+VOCAB_SIZE = 4096
+
+
+def _sort_reference_support(probs, top_ps, top_ks):
+    # 原来的全量排序实现中，每个请求可以被采样到的 token 集合
+    probs_sort, probs_idx = _top_p_top_k(probs.clone(), top_ps, top_ks)
+    return [set(probs_idx[i][probs_sort[i] > 0].tolist()) for i in range(probs.shape[0])]
+
+
+def test_build_sample_groups():
+    top_ps = [1.0, 1.0, 0.9, 1.0, 1.0, 0.5, 0.8]
+    top_ks = [1, 20, VOCAB_SIZE, VOCAB_SIZE, TOP_P_CANDIDATE_NUM + 1, -1, 50]
+    groups = build_sample_groups(top_ps, top_ks, VOCAB_SIZE, device="cpu")
+    strategy_to_index = {group.strategy: group.index.tolist() for group in groups}
+    assert strategy_to_index == {GREEDY: [0], TOP_K: [1, 6], TOP_P: [2, 5], FULL: [3], SORT: [4]}
+    assert [group.max_top_k for group in groups if group.strategy == TOP_K] == [50]
+
+
+def test_greedy_same_as_sort():
+    torch.manual_seed(0)
+    probs = torch.softmax(torch.randn((16, VOCAB_SIZE)), dim=-1)
+    top_ps = torch.ones((16,))
+    top_ks = torch.ones((16,), dtype=torch.int32)
+    groups = build_sample_groups(top_ps.tolist(), top_ks.tolist(), VOCAB_SIZE, device="cpu")
+    ids, next_probs = grouped_sample(probs, top_ps, top_ks, groups)
+
+    probs_sort, probs_idx = _top_p_top_k(probs.clone(), top_ps, top_ks)
+    assert torch.equal(ids, probs_idx[:, 0])
+    assert torch.equal(next_probs, probs_sort[:, 0])
+
+
+@pytest.mark.parametrize(
+    "top_p, top_k",
+    [(1.0, 20), (0.7, 20), (0.9, VOCAB_SIZE), (0.999999, VOCAB_SIZE), (1.0, 2000), (0.5, 2000)],
+)
+def test_sampled_tokens_in_reference_support(top_p, top_k):
+    torch.manual_seed(1)
+    batch_size = 8
+    # 部分请求的概率分布比较平坦，使 TOP_P 分组的候选覆盖不了 top_p，走回退的路径
+    logits = torch.randn((batch_size, VOCAB_SIZE)) * torch.linspace(0.1, 8.0, batch_size).view(-1, 1)
+    probs = torch.softmax(logits, dim=-1)
+    top_ps = torch.full((batch_size,), top_p)
+    top_ks = torch.full((batch_size,), top_k, dtype=torch.int32)
+    groups = build_sample_groups(top_ps.tolist(), top_ks.tolist(), VOCAB_SIZE, device="cpu")
+    supports = _sort_reference_support(probs, top_ps, top_ks)
+    for _ in range(20):
+        ids, next_probs = grouped_sample(probs, top_ps, top_ks, groups)
+        for i in range(batch_size):
+            assert ids[i].item() in supports[i]
+            assert next_probs[i].item() == probs[i, ids[i]].item()
+
+
+def test_mixed_batch_scatter_back():
+    torch.manual_seed(2)
+    batch_size = 32
+    probs = torch.softmax(torch.randn((batch_size, VOCAB_SIZE)) * 4, dim=-1)
+    top_ps = torch.tensor([[1.0, 0.8, 1.0, 0.9][i % 4] for i in range(batch_size)])
+    top_ks = torch.tensor([[1, 10, VOCAB_SIZE, VOCAB_SIZE][i % 4] for i in range(batch_size)], dtype=torch.int32)
+    groups = build_sample_groups(top_ps.tolist(), top_ks.tolist(), VOCAB_SIZE, device="cpu")
+    assert len(groups) == 4
+    supports = _sort_reference_support(probs, top_ps, top_ks)
+    ids, next_probs = grouped_sample(probs, top_ps, top_ks, groups)
+    assert ids.dtype == torch.int64
+    for i in range(batch_size):
+        assert ids[i].item() in supports[i]
+        assert next_probs[i].item() == probs[i, ids[i]].item()
+    greedy_index = groups[0].index
+    assert torch.equal(ids[greedy_index], probs[greedy_index].argmax(dim=-1))
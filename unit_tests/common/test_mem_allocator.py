@@ -0,0 +1,89 @@
+import random
+import pytest
+import numpy as np
+import torch
+from lightllm.common.mem_allocator import FreeListTokenAllocator
+
+
+def _check_runs(allocator: FreeListTokenAllocator, free_set: set):
+    runs = sorted(allocator.run_by_start.items())
+    assert sum(length for _, length in runs) == len(free_set) == allocator.can_use_size
+    covered = set()
+    for i, (start, length) in enumerate(runs):
+        covered.update(range(start, start + length))
+        # 相邻的空闲段一定会被合并
+        if i > 0:
+            assert runs[i - 1][0] + runs[i - 1][1] < start
+    assert covered == free_set
+    assert allocator.run_by_end == {start + length: start for start, length in runs}
+    for level, bucket in enumerate(allocator.buckets):
+        assert all(allocator.run_by_start[start].bit_length() - 1 == level for start in bucket)
+    assert sum(len(bucket) for bucket in allocator.buckets) == len(runs)
+    assert np.flatnonzero(allocator.is_free).tolist() == sorted(free_set)
+
+
+def test_alloc_contiguous_and_merge():
+    allocator = FreeListTokenAllocator(100)
+    a = allocator.alloc(10)
+    b = allocator.alloc(20)
+    c = allocator.alloc(30)
+    assert a.dtype == torch.int32 and a.tolist() == list(range(0, 10))
+    assert b.tolist() == list(range(10, 30))
+    assert c.tolist() == list(range(30, 60))
+
+    # 非后进先出的释放
+    allocator.free(a)
+    allocator.free(c[0:10].tolist())
+    assert allocator.get_free_run_num() == 3
+    assert allocator.get_largest_free_run() == 40
+
+    # 优先使用能容纳需求的较小的空闲段
+    d = allocator.alloc(8)
+    assert d.tolist() == list(range(0, 8))
+    # 没有足够大的连续空闲段时，从大到小拼凑
+    e = allocator.alloc(45)
+    assert e.tolist() == list(range(60, 100)) + list(range(30, 35))
+
+    allocator.free(torch.cat([b, d, e, c[10:]]))
+    assert allocator.get_free_run_num() == 1 and allocator.get_largest_free_run() == 100
+
+
+def test_double_free():
+    allocator = FreeListTokenAllocator(16)
+    a = allocator.alloc(4)
+    allocator.free(a)
+    with pytest.raises(AssertionError):
+        allocator.free(a[1:2])
+
+
+def test_random_alloc_free():
+    rng = random.Random(0)
+    size = 512
+    allocator = FreeListTokenAllocator(size)
+    free_set = set(range(size))
+    holds = []
+    for _ in range(2000):
+        if holds and (rng.random() < 0.5 or allocator.can_use_size == 0):
+            index = holds.pop(rng.randrange(len(holds)))
+            # 随机释放其中的一部分 token
+            keep = rng.randrange(len(index) + 1)
+            perm = np.random.RandomState(rng.randrange(1 << 30)).permutation(len(index))
+            allocator.free(index[perm[keep:]])
+            free_set.update(index[perm[keep:]].tolist())
+            if keep > 0:
+                holds.append(index[perm[:keep]])
+        else:
+            need = rng.randint(1, min(64, allocator.can_use_size))
+            index = allocator.alloc(need)
+            assert len(index) == need and len(set(index.tolist())) == need
+            assert set(index.tolist()) <= free_set
+            free_set.difference_update(index.tolist())
+            holds.append(index)
+        _check_runs(allocator, free_set)
+
+    allocator.free_all()
+    assert allocator.get_largest_free_run() == size
+
+
+if __name__ == "__main__":
+    pytest.main()
@@ -0,0 +1,67 @@
+import torch
+import numpy as np
+import pytest
+from lightllm.common.req_manager import ReqSamplingParamsManager
+from lightllm.server.core.objs import SamplingParams
+
+VOCAB_SIZE = 32
+
+
+def _sampling_params(**kwargs):
+    sampling_params = SamplingParams()
+    sampling_params.init(tokenizer=None, **kwargs)
+    return sampling_params
+
+
+def test_init_params():
+    manager = ReqSamplingParamsManager(4, VOCAB_SIZE, device="cpu")
+    param = _sampling_params(
+        do_sample=True, temperature=0.5, top_p=0.8, top_k=10, min_new_tokens=3, presence_penalty=0.1
+    )
+    manager.init_req_sampling_params(2, param, np.array([1, 2, 3]))
+    ans = manager.get_sampling_params(torch.tensor([2, 0], dtype=torch.int32))
+    presence, frequency, repetition, decay_start, decay_factor, temperature, top_p, top_k, min_new_tokens = ans
+    assert presence.tolist() == pytest.approx([0.1, 0.0])
+    assert temperature.tolist() == [0.5, 0.0]
+    assert top_p.tolist() == pytest.approx([0.8, 0.0])
+    assert top_k.dtype == torch.int32 and top_k.tolist() == [10, 0]
+    assert min_new_tokens.tolist() == [3, 0]
+    assert repetition.tolist() == [1.0, 0.0]
+
+
+def test_counter_preallocated():
+    # 计数表在创建时就申请好，保证在 kv cache 确定大小之前占用显存
+    manager = ReqSamplingParamsManager(4, VOCAB_SIZE, device="cpu")
+    assert manager.req_to_out_token_id_counter.shape == (5, VOCAB_SIZE)
+    manager.init_req_sampling_params(0, _sampling_params(), np.array([1, 2]))
+    assert not manager.has_penalty([0])
+    manager.update_out_token_id_counter([0], [5])
+    assert manager.req_to_out_token_id_counter.sum().item() == 0
+
+    manager.init_req_sampling_params(1, _sampling_params(frequency_penalty=0.5), np.array([1, 2]))
+    assert manager.has_penalty([0, 1])
+    assert not manager.has_penalty([0])
+
+
+def test_incremental_counter():
+    manager = ReqSamplingParamsManager(4, VOCAB_SIZE, device="cpu")
+    manager.init_req_sampling_params(
+        1, _sampling_params(repetition_penalty=1.2, input_penalty=True), np.array([3, 3, 4])
+    )
+    manager.init_req_sampling_params(2, _sampling_params(presence_penalty=0.3), np.array([3, 4]))
+    manager.init_req_sampling_params(3, _sampling_params(), np.array([3, 4]))
+    counter = manager.req_to_out_token_id_counter
+    assert counter[1, 3].item() == 2 and counter[1, 4].item() == 1
+    # 没有开启 input_penalty 的请求不统计 prompt 中的 token
+    assert counter[2].sum().item() == 0
+
+    for token_ids in [[7, 7, 7], [7, 8, 9]]:
+        manager.update_out_token_id_counter([1, 2, 3], token_ids)
+    assert counter[1, 7].item() == 2 and counter[1, 3].item() == 2
+    assert counter[2, 7].item() == 1 and counter[2, 8].item() == 1
+    # 没有开启 penalty 的请求不会更新计数
+    assert counter[3].sum().item() == 0
+
+    # 槽位被新的请求复用时计数被清零
+    manager.init_req_sampling_params(1, _sampling_params(frequency_penalty=0.1), np.array([3]))
+    assert counter[1].sum().item() == 0
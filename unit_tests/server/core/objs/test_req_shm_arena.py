@@ -0,0 +1,64 @@
+import json
+import pytest
+import numpy as np
+from lightllm.server.core.objs.req import Req
+from lightllm.server.core.objs.req_shm_arena import ReqShmArena, get_req_shm_arena
+from lightllm.utils.envs_utils import get_env_start_args
+
+
+@pytest.fixture
+def arena():
+    arena = ReqShmArena("test_req_shm_arena", 4, 16, np.int64)
+    yield arena
+    arena.shm_array.close_shm()
+
+
+def test_slot_shared_between_processes(arena):
+    slot = arena.get_slot(2, 8)
+    slot.arr[:] = np.arange(8)
+    # 模拟另一个进程 link 同一个 arena
+    linked = ReqShmArena("test_req_shm_arena", 4, 16, np.int64)
+    assert linked.get_slot(2, 8).arr.tolist() == list(range(8))
+    assert linked.get_slot(1, 8).arr.tolist() == [0] * 8
+
+
+def test_can_hold(arena):
+    assert arena.can_hold(0, 16)
+    assert not arena.can_hold(0, 17)
+    assert not arena.can_hold(4, 1)
+
+
+@pytest.fixture
+def start_args_env(monkeypatch):
+    monkeypatch.setenv("LIGHTLLM_START_ARGS", json.dumps({"running_max_req_size": 4, "max_req_total_len": 64}))
+    get_env_start_args.cache_clear()
+    get_req_shm_arena.cache_clear()
+    yield
+    for kind in ["prompts", "logprobs"]:
+        get_req_shm_arena(kind).shm_array.close_shm()
+    get_env_start_args.cache_clear()
+    get_req_shm_arena.cache_clear()
+
+
+def test_req_use_arena_slot(start_args_env):
+    req = Req()
+    req.index_in_shm_mem = 1
+    req.init(8, [1, 2, 3], {"max_new_tokens": 4}, None)
+    arena = get_req_shm_arena("prompts")
+    assert arena.shm_array.arr[1, 0:3].tolist() == [1, 2, 3]
+
+    req.link_prompt_ids_shm_array()
+    req.link_logprobs_shm_array()
+    assert req.get_prompt_ids() == [1, 2, 3]
+    assert len(req.shm_logprobs.arr) == req.alloc_shm_numpy_len
+
+
+def test_req_fallback_to_single_shm(start_args_env):
+    req = Req()
+    req.index_in_shm_mem = 2
+    # 超过 arena 槽位长度的请求使用单独的共享内存段
+    req.init(16, list(range(100)), {"max_new_tokens": 4}, None)
+    assert req.get_prompt_ids() == list(range(100))
+    assert get_req_shm_arena("prompts").shm_array.arr[2, 0:100].tolist() != list(range(100))
+    req.shm_prompt_ids.close_shm()
+    req.shm_logprobs.close_shm()
@@ -0,0 +1,106 @@
+import os
+import time
+import asyncio
+import threading
+import pytest
+from lightllm.server.core.objs.rpc_shm import (
+    RpcShmParams,
+    ShmSyncStatusArray,
+    decode_func_params,
+    encode_func_params,
+)
+
+
+@pytest.fixture
+def server_name(monkeypatch):
+    monkeypatch.setenv("LIGHTLLM_UNIQUE_SERVICE_NAME_ID", f"rpc_shm_test_{os.getpid()}")
+
+
+def test_binary_encoding():
+    reqs = [(1 << 40, 3, None, -1), (7, 0, None, 2)]
+    data = encode_func_params("prefill", (reqs,))
+    # 每个请求只占用 4 个 int64
+    assert len(data) == 6 + 2 * 4 * 8
+    assert decode_func_params(memoryview(data)) == ("prefill", (reqs,))
+
+    assert decode_func_params(encode_func_params("decode", ())) == ("decode", ())
+    assert decode_func_params(encode_func_params("pause_reqs", ([5, 9],))) == ("pause_reqs", ([5, 9],))
+    assert decode_func_params(encode_func_params("prefill", ([],))) == ("prefill", ([],))
+
+
+def test_multimodal_params_encoding():
+    pytest.importorskip("requests")
+    from lightllm.server.multimodal_params import MultimodalParams
+
+    # 没有图片的多模态参数仍然使用二进制编码
+    data = encode_func_params("prefill", ([(7, 0, MultimodalParams(), 2)],))
+    assert len(data) == 6 + 4 * 8
+    _, (reqs,) = decode_func_params(data)
+    assert isinstance(reqs[0][2], MultimodalParams) and len(reqs[0][2].images) == 0
+
+    mm_params = MultimodalParams(images=[{"type": "url", "data": "http://a/b.png"}])
+    func_name, (reqs,) = decode_func_params(encode_func_params("prefill", ([(1, 2, mm_params, 0)],)))
+    assert func_name == "prefill" and len(reqs[0][2].images) == 1
+
+
+def test_pickle_fallback():
+    kvargs = {"args": None, "world_size": 2}
+    assert decode_func_params(encode_func_params("init_model", (kvargs,))) == ("init_model", (kvargs,))
+
+
+def test_params_shm(server_name):
+    params = RpcShmParams()
+    params.create_or_link_shm()
+    try:
+        params.write_func_params("pause_reqs", ([1, 2, 3],))
+        assert params.read_func_params() == ("pause_reqs", ([1, 2, 3],))
+        params.write_func_params("save_prompt_cache_snapshot", ("/tmp/a", 100))
+        assert params.read_func_params() == ("save_prompt_cache_snapshot", ("/tmp/a", 100))
+    finally:
+        params.shm.close()
+        params.shm.unlink()
+
+
+def test_sync_status(server_name):
+    world_size = 3
+    client = ShmSyncStatusArray(world_size)
+    client.create_or_link_shm()
+    executed = [[] for _ in range(world_size)]
+
+    def rank_loop(rank):
+        status = ShmSyncStatusArray(world_size)
+        status.create_or_link_shm()
+        last_cmd_seq = 0
+        while last_cmd_seq < 20:
+            cmd_seq = status.wait_cmd(last_cmd_seq)
+            if rank == 0:
+                # 慢的 rank 会让调用进入 sleep 等待的阶段
+                time.sleep(0.002 * (cmd_seq % 2))
+            executed[rank].append(cmd_seq)
+            status.mark_done(rank, cmd_seq)
+            last_cmd_seq = cmd_seq
+
+    threads = [threading.Thread(target=rank_loop, args=(rank,)) for rank in range(world_size)]
+    for thread in threads:
+        thread.start()
+    # 所有 rank 都链接到共享内存后才能下发命令
+    time.sleep(0.1)
+
+    async def run_cmds():
+        for _ in range(10):
+            cmd_seq = client.send_cmd()
+            await client.async_wait_all_done(cmd_seq)
+            assert all(executed[rank][-1] == cmd_seq for rank in range(world_size))
+
+    try:
+        asyncio.run(run_cmds())
+        for _ in range(10):
+            cmd_seq = client.send_cmd()
+            client.wait_all_done(cmd_seq)
+            assert client.all_done(cmd_seq)
+    finally:
+        for thread in threads:
+            thread.join(timeout=5)
+        client.shm.close()
+        client.shm.unlink()
+    assert all(executed[rank] == list(range(1, 21)) for rank in range(world_size))
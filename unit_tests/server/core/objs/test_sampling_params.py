@@ -14,6 +14,7 @@ from lightllm.server.core.objs.sampling_params import (
     ALLOWED_TOKEN_IDS_MAX_LENGTH,
     JSON_SCHEMA_MAX_LENGTH,
     GRAMMAR_CONSTRAINT_MAX_LENGTH,
+    PRIORITY_CLASS_NUM,
 )
 
 grammar_str = r"""root ::= (expr "=" term)+
@@ -173,6 +174,16 @@ def test_sampling_params_initialization():
     assert params.stop_sequences.size == 2
 
 
+def test_sampling_params_priority():
+    params = SamplingParams()
+    params.init(None)
+    assert params.priority == 0
+    params.init(None, priority=3)
+    assert params.to_dict()["priority"] == 3
+    with pytest.raises(ValueError):
+        params.init(None, priority=PRIORITY_CLASS_NUM)
+
+
 # Mock tokenizer for testing
 class MockTokenizer:
     def encode(self, text, add_special_tokens=False):
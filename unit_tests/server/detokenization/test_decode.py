@@ -0,0 +1,108 @@
+import random
+import pytest
+from types import SimpleNamespace
+from tokenizers import Tokenizer, models, trainers, pre_tokenizers, decoders
+from transformers import PreTrainedTokenizerFast
+from lightllm.server.detokenization.decode import decode_token
+from lightllm.server.detokenization.decode_req import DecodeReq
+
+CORPUS = [
+    "hello world, this is a simple test of the incremental detokenizer.",
+    "你好世界，这是一个增量解码的测试。",
+    "emoji 😀 and 🚀 need several bytes, 混合 mixed text 123",
+]
+
+
+def _build_tokenizer(kind):
+    tok = Tokenizer(models.BPE())
+    if kind == "byte_level":
+        tok.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+        tok.decoder = decoders.ByteLevel()
+        alphabet = pre_tokenizers.ByteLevel.alphabet()
+    else:
+        # 与 sentencepiece 类似，解码时会去掉首个 token 的前导空格
+        tok.pre_tokenizer = pre_tokenizers.Metaspace()
+        tok.decoder = decoders.Metaspace()
+        alphabet = []
+    trainer = trainers.BpeTrainer(vocab_size=400, special_tokens=["<s>", "</s>"], initial_alphabet=alphabet)
+    tok.train_from_iterator(CORPUS * 10, trainer)
+    tokenizer = PreTrainedTokenizerFast(tokenizer_object=tok, bos_token="<s>", eos_token="</s>")
+    tokenizer.add_tokens(["<tool>"])
+    return tokenizer
+
+
+def _create_decode_req(skip_special_tokens, add_spaces_between_special_tokens):
+    sample_params = SimpleNamespace(
+        skip_special_tokens=skip_special_tokens,
+        print_eos_token=False,
+        add_spaces_between_special_tokens=add_spaces_between_special_tokens,
+    )
+    decode_req = DecodeReq.__new__(DecodeReq)
+    decode_req.req = SimpleNamespace(sample_params=sample_params)
+    decode_req.output_ids = []
+    decode_req.start_new_segment()
+    decode_req.sub_text_num = 0
+    return decode_req
+
+
+def _reference_decode(tokenizer, token_ids, sample_params, eos_id):
+    # 每个 token 都对完整的输出重新解码的实现，作为增量解码结果的参考
+    output_str, sub_texts, current_sub_text = "", [], []
+    sep = " " if sample_params.add_spaces_between_special_tokens else ""
+    for token_id in token_ids:
+        token = tokenizer.convert_ids_to_tokens(token_id)
+        if token_id in eos_id and not sample_params.print_eos_token:
+            continue
+        if sample_params.skip_special_tokens and token_id in tokenizer.all_special_ids and token_id not in eos_id:
+            continue
+        if token in tokenizer.added_tokens_encoder:
+            if current_sub_text:
+                sub_texts.append(tokenizer.convert_tokens_to_string(current_sub_text))
+                current_sub_text = []
+            sub_texts.append(token)
+            out_text = sep.join(sub_texts)
+        else:
+            current_sub_text.append(token)
+            out_text = sep.join(sub_texts + [tokenizer.convert_tokens_to_string(current_sub_text)])
+        if not out_text.endswith("\ufffd"):
+            output_str = out_text
+    return output_str
+
+
+@pytest.mark.parametrize("kind", ["byte_level", "metaspace"])
+@pytest.mark.parametrize("skip_special_tokens", [True, False])
+@pytest.mark.parametrize("add_spaces_between_special_tokens", [True, False])
+def test_incremental_decode_matches_full_decode(kind, skip_special_tokens, add_spaces_between_special_tokens):
+    tokenizer = _build_tokenizer(kind)
+    eos_id = [tokenizer.eos_token_id]
+    rng = random.Random(0)
+    special_ids = [tokenizer.bos_token_id, tokenizer.convert_tokens_to_ids("<tool>")]
+    for _ in range(20):
+        token_ids = []
+        for _ in range(rng.randint(1, 6)):
+            token_ids.extend(tokenizer.encode(rng.choice(CORPUS)[rng.randint(0, 10) :], add_special_tokens=False))
+            token_ids.extend(rng.choice(special_ids) for _ in range(rng.randint(0, 2)))
+        token_ids.append(tokenizer.eos_token_id)
+
+        decode_req = _create_decode_req(skip_special_tokens, add_spaces_between_special_tokens)
+        deltas = [decode_token(tokenizer, decode_req, token_id, eos_id) for token_id in token_ids]
+        assert all("\ufffd" not in delta for delta in deltas)
+        expected = _reference_decode(tokenizer, token_ids, decode_req.req.sample_params, eos_id)
+        assert "".join(deltas) == expected
+        # 窗口不会随着输出的变长而增长
+        assert len(decode_req.output_tokens) - decode_req.prefix_offset <= 8
+
+
+def test_partial_utf8():
+    tokenizer = _build_tokenizer("byte_level")
+    token_ids = tokenizer.encode("😀", add_special_tokens=False)
+    assert len(token_ids) > 1
+    decode_req = _create_decode_req(True, True)
+    deltas = [decode_token(tokenizer, decode_req, token_id, []) for token_id in token_ids]
+    # 不完整的字符不会被输出，补全之后一次输出
+    assert deltas[:-1] == [""] * (len(token_ids) - 1)
+    assert deltas[-1] == "😀"
+
+
+if __name__ == "__main__":
+    pytest.main()
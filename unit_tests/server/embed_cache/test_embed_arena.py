@@ -0,0 +1,107 @@
+import os
+import sys
+import pytest
+import torch
+from types import SimpleNamespace
+from lightllm.server.embed_cache.embed_arena import (
+    ArenaAllocator,
+    EmbedArena,
+    get_raw_tensor_nbytes,
+    read_raw_tensor,
+    write_raw_tensor,
+)
+
+
+@pytest.fixture
+def server_name(monkeypatch):
+    monkeypatch.setenv("LIGHTLLM_UNIQUE_SERVICE_NAME_ID", f"embed_arena_test_{os.getpid()}")
+    from lightllm.server.embed_cache import embed_arena
+
+    # 每个测试重新链接 arena
+    monkeypatch.setattr(embed_arena, "_arena_checked", False)
+    monkeypatch.setattr(embed_arena, "_linked_arena", None)
+
+
+def test_raw_tensor():
+    for dtype in [torch.float16, torch.bfloat16, torch.float32]:
+        tensor = torch.randn(5, 7).to(dtype)
+        buf = bytearray(get_raw_tensor_nbytes(tensor))
+        write_raw_tensor(memoryview(buf), tensor)
+        out = read_raw_tensor(memoryview(buf))
+        assert out.dtype == dtype and torch.equal(out, tensor)
+        # 读取的 tensor 直接映射在 buf 上
+        out[0, 0] = 1
+        assert read_raw_tensor(memoryview(buf))[0, 0] == 1
+    with pytest.raises(ValueError):
+        read_raw_tensor(memoryview(bytearray(64)))
+
+
+def test_arena_allocator():
+    allocator = ArenaAllocator(1024)
+    a = allocator.alloc(100)
+    b = allocator.alloc(64)
+    c = allocator.alloc(256)
+    assert (a, b, c) == (0, 128, 192)
+    assert allocator.alloc(1024) is None
+    allocator.free(b, 64)
+    assert allocator.alloc(64) == b
+    allocator.free(a, 100)
+    allocator.free(b, 64)
+    allocator.free(c, 256)
+    # 释放的相邻空闲块被合并
+    assert allocator.free_blocks == [(0, 1024)] and allocator.used_bytes == 0
+
+
+def test_arena_and_cache(server_name, monkeypatch):
+    from lightllm.server.embed_cache.embed_arena import get_embed_arena, get_embed_arena_name
+    from lightllm.server.embed_cache.utils import create_embed_shm, free_shm, get_shm_name_embed, read_embed
+
+    monkeypatch.setitem(
+        sys.modules,
+        "lightllm.server.tokenizer",
+        SimpleNamespace(get_tokenizer=lambda *args, **kwargs: SimpleNamespace(vocab_size=1000)),
+    )
+    from lightllm.server.embed_cache.impl.naive_memory_cache import InMemoryCache
+
+    args = SimpleNamespace(
+        cache_capacity=4,
+        cache_reserved_ratio=0.0,
+        cache_embed_arena_gb=4096 / 1024**3,
+        model_dir=None,
+        tokenizer_mode="fast",
+        trust_remote_code=False,
+    )
+    cache = InMemoryCache(args)
+    arena = get_embed_arena()
+    try:
+        record = cache.alloc("md5_0", 16)
+        embed = torch.randn(16, 32, dtype=torch.float16)
+        embed_slot = cache.alloc_embed(record["id"], get_raw_tensor_nbytes(embed))
+        assert embed_slot == record["embed_slot"]
+        assert arena.write(embed_slot, embed)
+        cache.set_item_embed(record["id"])
+        assert torch.equal(read_embed({"uuid": record["id"], "embed_slot": embed_slot}), embed)
+
+        # arena 空间不足时使用单独的 shm
+        big_record = cache.alloc("md5_1", 1024)
+        big_embed = torch.randn(1024, 32, dtype=torch.float16)
+        assert cache.alloc_embed(big_record["id"], get_raw_tensor_nbytes(big_embed)) == -1
+        create_embed_shm(get_shm_name_embed(big_record["id"]), big_embed)
+        cache.set_item_embed(big_record["id"])
+        img = {"uuid": big_record["id"], "embed_slot": big_record["embed_slot"]}
+        assert torch.equal(read_embed(img), big_embed)
+
+        # 记录被清理后 slot 和 arena 的空间被回收
+        cache.release(record["id"])
+        cache.release(big_record["id"])
+        cache.capacity = 2
+        cache.alloc("md5_2", 16)
+        assert cache.arena_allocator.used_bytes == 0
+        assert arena.get_slot(embed_slot) == (0, 0)
+        assert len(cache.free_slots) == 3
+    finally:
+        del arena.slots
+        arena.shm.close()
+        del cache.arena.slots
+        cache.arena.shm.close()
+        cache.arena.shm.unlink()
@@ -0,0 +1,113 @@
+import asyncio
+import threading
+import pytest
+from lightllm.server.httpserver.tokenize_pool import TokenizePool
+
+
+class ToyTokenizer:
+    def __init__(self):
+        self.encode_threads = set()
+
+    def encode(self, prompt, multimodal_params=None, add_special_tokens=True):
+        self.encode_threads.add(threading.current_thread().name)
+        if prompt == "bad":
+            raise ValueError("bad prompt")
+        ids = [ord(c) for c in prompt]
+        return [0] + ids if add_special_tokens else ids
+
+    def apply_chat_template(self, conversation, tokenize=False, add_generation_prompt=True):
+        return "".join(m["content"] for m in conversation) + ("<gen>" if add_generation_prompt else "")
+
+
+@pytest.mark.parametrize("worker_num", [0, 2])
+def test_encode_results(worker_num):
+    tokenizer = ToyTokenizer()
+    pool = TokenizePool(tokenizer, worker_num=worker_num, max_batch_size=4, small_prompt_len=8)
+
+    async def run():
+        prompts = ["ab", "c", "long prompt over limit", "d", "ef", "g", "h"]
+        flags = [True, False, True, True, False, True, True]
+        return await asyncio.gather(*[pool.encode(p, add_special_tokens=f) for p, f in zip(prompts, flags)]), [
+            tokenizer.encode(p, add_special_tokens=f) for p, f in zip(prompts, flags)
+        ]
+
+    results, expected = asyncio.run(run())
+    assert results == expected
+    pool.shutdown()
+
+
+def test_encode_batched_in_worker():
+    tokenizer = ToyTokenizer()
+    pool = TokenizePool(tokenizer, worker_num=2)
+    calls = []
+    origin_submit = pool.text_executor.submit
+    pool.text_executor.submit = lambda fn, prompts, flag: calls.append(len(prompts)) or origin_submit(fn, prompts, flag)
+
+    async def run():
+        return await asyncio.gather(*[pool.encode(str(i)) for i in range(10)])
+
+    results = asyncio.run(run())
+    assert results == [[0, ord(str(i))] for i in range(10)]
+    # 同一轮事件循环中到达的短 prompt 被合并为一个任务
+    assert calls == [10]
+    pool.shutdown()
+
+
+def test_call_and_chat_template_run_off_loop():
+    tokenizer = ToyTokenizer()
+    pool = TokenizePool(tokenizer, worker_num=1)
+
+    async def run():
+        text = await pool.apply_chat_template(conversation=[{"content": "hi"}], tokenize=False)
+        ids = await pool.call("encode", "x", None, add_special_tokens=False)
+        return text, ids
+
+    assert asyncio.run(run()) == ("hi<gen>", [ord("x")])
+    pool.shutdown()
+
+
+def test_encode_exception():
+    tokenizer = ToyTokenizer()
+    pool = TokenizePool(tokenizer, worker_num=1)
+
+    async def run():
+        return await asyncio.gather(pool.encode("bad"), pool.encode("ok"), return_exceptions=True)
+
+    results = asyncio.run(run())
+    # 合并到同一个任务中的其他请求不受影响
+    assert isinstance(results[0], ValueError)
+    assert results[1] == [0, ord("o"), ord("k")]
+    with pytest.raises(ValueError):
+        asyncio.run(pool.encode("bad"))
+    pool.shutdown()
+
+
+class UncopyableTokenizer(ToyTokenizer):
+    def __deepcopy__(self, memo):
+        raise TypeError("can not copy")
+
+
+def test_each_thread_has_own_tokenizer():
+    tokenizer = ToyTokenizer()
+    pool = TokenizePool(tokenizer, worker_num=2)
+    thread_tokenizers = set()
+
+    def get_tokenizer_id():
+        from lightllm.server.httpserver import tokenize_pool
+
+        thread_tokenizers.add(id(tokenize_pool._get_worker_tokenizer()))
+        return
+
+    futures = [pool.thread_executor.submit(get_tokenizer_id) for _ in range(8)]
+    for future in futures:
+        future.result()
+    assert id(tokenizer) not in thread_tokenizers
+    pool.shutdown()
+
+
+def test_uncopyable_tokenizer_without_model_dir():
+    # 不能拷贝又不能重新加载的 tokenizer 不允许在多个线程中共享，启动时直接报错
+    with pytest.raises(RuntimeError):
+        TokenizePool(UncopyableTokenizer(), worker_num=2)
+    pool = TokenizePool(UncopyableTokenizer(), worker_num=0)
+    assert asyncio.run(pool.encode("a")) == [0, ord("a")]
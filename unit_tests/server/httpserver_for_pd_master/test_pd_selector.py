@@ -0,0 +1,98 @@
+import pytest
+from lightllm.server.pd_io_struct import PD_Client_Obj
+from lightllm.server.httpserver_for_pd_master.pd_selector import (
+    PREFIX_BLOCK_TOKENS,
+    LoadAwarePDSelector,
+    PrefixSketch,
+    get_prompt_block_hashes,
+)
+
+
+def _node(mode, index, max_total_token_num=6400):
+    return PD_Client_Obj(
+        node_id=index,
+        client_ip_port=f"127.0.0.1:{8000 + index}",
+        mode=mode,
+        start_args={"max_total_token_num": max_total_token_num},
+    )
+
+
+def _status(pending_prompt_tokens=0, load=0.0):
+    return {
+        "running_req_num": 0,
+        "pending_prompt_tokens": pending_prompt_tokens,
+        "current_load": [load],
+        "dynamic_max_load": [load],
+    }
+
+
+def test_prefix_block_hashes():
+    prompt = list(range(3 * PREFIX_BLOCK_TOKENS + 5))
+    hashes = get_prompt_block_hashes(prompt)
+    assert len(hashes) == 3
+    assert get_prompt_block_hashes(prompt[: 2 * PREFIX_BLOCK_TOKENS]) == hashes[:2]
+    # 前缀不同时后面的块即使内容相同哈希值也不同
+    assert get_prompt_block_hashes([-1] + prompt[1:])[1:] != hashes[1:]
+    assert len(get_prompt_block_hashes("a" * (PREFIX_BLOCK_TOKENS * 4 * 2))) == 2
+
+    sketch = PrefixSketch(capacity_blocks=3)
+    sketch.insert(hashes)
+    assert sketch.match_len(hashes) == 3
+    sketch.insert(get_prompt_block_hashes([-1] + prompt[1:]))
+    assert sketch.match_len(hashes) == 0
+
+
+def test_select_by_prefix_and_load():
+    selector = LoadAwarePDSelector()
+    p_nodes = [_node("prefill", i) for i in range(2)]
+    d_nodes = [_node("decode", i + 2) for i in range(2)]
+    shared_prefix = list(range(10 * PREFIX_BLOCK_TOKENS))
+
+    p_node, _ = selector.select(0, shared_prefix + [1], 16, p_nodes, d_nodes)
+    selector.on_req_finished(0)
+    # 命中前缀的节点只需要计算少量的 token
+    for req_id in range(1, 5):
+        assert selector.select(req_id, shared_prefix + [req_id], 16, p_nodes, d_nodes)[0] is p_node
+        selector.on_req_finished(req_id)
+
+    # 排队的 token 过多时选择另一个节点
+    other_p_node = p_nodes[1] if p_node is p_nodes[0] else p_nodes[0]
+    selector.update_node_status(p_node.client_ip_port, _status(pending_prompt_tokens=20 * PREFIX_BLOCK_TOKENS))
+    assert selector.select(5, shared_prefix + [5], 16, p_nodes, d_nodes)[0] is other_p_node
+
+
+def test_local_pending_tokens():
+    selector = LoadAwarePDSelector()
+    p_nodes = [_node("prefill", i) for i in range(2)]
+    d_nodes = [_node("decode", 2)]
+    p_a, _ = selector.select(0, list(range(1000)), 16, p_nodes, d_nodes)
+    # 第一个请求还没有完成 prefill，第二个请求选择另一个节点
+    p_b, _ = selector.select(1, list(range(1000, 2000)), 16, p_nodes, d_nodes)
+    assert p_a is not p_b
+    # 节点上报的排队 token 都是本 master 分发的，不会被重复计算
+    selector.update_node_status(p_a.client_ip_port, _status(pending_prompt_tokens=1000))
+    assert selector.other_pending_tokens[p_a.client_ip_port] == 0
+    selector.on_prefill_finished(0)
+    assert selector.select(2, list(range(2000, 2100)), 16, p_nodes, d_nodes)[0] is p_a
+    for req_id in range(3):
+        selector.on_req_finished(req_id)
+    assert selector.pending_prefill_tokens == {p_a.client_ip_port: 0, p_b.client_ip_port: 0}
+    assert len(selector.req_records) == 0
+
+
+def test_select_decode_by_kv_headroom():
+    selector = LoadAwarePDSelector()
+    p_nodes = [_node("prefill", 0)]
+    d_nodes = [_node("decode", i + 1, max_total_token_num=10000) for i in range(2)]
+    selector.update_node_status(d_nodes[0].client_ip_port, _status(load=0.5))
+    selector.update_node_status(d_nodes[1].client_ip_port, _status(load=0.2))
+    # 上报之后新分发的请求也计入负载
+    assert selector.select(0, [1] * 100, 1900, p_nodes, d_nodes)[1] is d_nodes[1]
+    assert selector.select(1, [1] * 100, 1900, p_nodes, d_nodes)[1] is d_nodes[1]
+    assert selector.get_decode_score(d_nodes[1], now=selector.node_status[d_nodes[1].client_ip_port].update_time) == (
+        pytest.approx(0.6)
+    )
+    assert selector.select(2, [1] * 100, 1900, p_nodes, d_nodes)[1] is d_nodes[0]
+
+    selector.remove_node(d_nodes[0].client_ip_port)
+    assert d_nodes[0].client_ip_port not in selector.node_status
@@ -0,0 +1,83 @@
+import os
+import pytest
+from types import SimpleNamespace
+from lightllm.server.pd_io_struct import get_pd_master_addrs
+from lightllm.utils.envs_utils import set_unique_server_name
+from lightllm.server.req_id_generator import MAX_BEST_OF, ReqIDGenerator, get_id_shard
+from lightllm.server.httpserver_for_pd_master.pd_store import FilePDMasterStore, MemoryPDMasterStore, PDMasterStore
+
+
+@pytest.fixture(params=["memory", "file"])
+def stores(request, tmp_path):
+    # 两个副本使用的 store
+    if request.param == "memory":
+        store = MemoryPDMasterStore()
+        return store, store
+    return FilePDMasterStore(str(tmp_path)), FilePDMasterStore(str(tmp_path))
+
+
+def test_shared_node_status(stores):
+    store0, store1 = stores
+    status = {"client_ip_port": "127.0.0.1:8000", "running_req_num": 3, "current_load": [0.5]}
+    stored = store0.put_node_status("127.0.0.1:8000", status)
+    assert "update_time" not in status
+    assert store1.get_node_status() == {"127.0.0.1:8000": stored}
+    store1.put_node_status("127.0.0.1:8000", dict(status, running_req_num=4))
+    assert store0.get_node_status()["127.0.0.1:8000"]["running_req_num"] == 4
+
+
+def test_pd_master_addrs():
+    args = SimpleNamespace(pd_master_ip="10.0.0.1", pd_master_port=1212, pd_master_replicas=None)
+    assert get_pd_master_addrs(args) == [("10.0.0.1", 1212)]
+    args.pd_master_replicas = "10.0.0.1:1212, 10.0.0.2:1213"
+    assert get_pd_master_addrs(args) == [("10.0.0.1", 1212), ("10.0.0.2", 1213)]
+
+
+def test_req_id_partition(monkeypatch):
+    monkeypatch.setenv("LIGHTLLM_UNIQUE_SERVICE_NAME_ID", f"pd_store_test_{os.getpid()}")
+    id_gen = ReqIDGenerator(shard_id=2, shard_num=3)
+    try:
+        group_ids = [int(id_gen.generate_id()) for _ in range(10)]
+    finally:
+        id_gen.current_id.shm.close()
+        id_gen.current_id.shm.unlink()
+    assert len(set(group_ids)) == 10
+    for group_id in group_ids:
+        assert group_id % MAX_BEST_OF == 0
+        # 同一个 group 中的所有子请求都属于同一个副本
+        assert all(get_id_shard(group_id + i, 3) == 2 for i in range(MAX_BEST_OF))
+
+
+def test_store_is_abstract():
+    with pytest.raises(TypeError):
+        PDMasterStore()
+
+
+def test_req_id_replicas_on_same_host(monkeypatch):
+    # 同一台机器上使用相同 nccl_port 的两个副本不能共享同一个 id 计数器
+    monkeypatch.setenv("LIGHTLLM_UNIQUE_SERVICE_NAME_ID", f"pd_store_test_replicas_{os.getpid()}")
+    id_gens = [ReqIDGenerator(shard_id=i, shard_num=2) for i in range(2)]
+    try:
+        group_ids = [[int(id_gen.generate_id()) for _ in range(5)] for id_gen in id_gens]
+    finally:
+        for id_gen in id_gens:
+            id_gen.current_id.shm.close()
+            id_gen.current_id.shm.unlink()
+    for shard_id in range(2):
+        assert all(get_id_shard(group_id, 2) == shard_id for group_id in group_ids[shard_id])
+    assert len(set(group_ids[0]) | set(group_ids[1])) == 10
+
+
+def test_unique_server_name_of_replicas(monkeypatch):
+    args = SimpleNamespace(nccl_port=28765, node_rank=0, run_mode="pd_master", pd_master_replicas=None)
+    monkeypatch.delenv("LIGHTLLM_UNIQUE_SERVICE_NAME_ID", raising=False)
+    set_unique_server_name(args)
+    assert os.environ["LIGHTLLM_UNIQUE_SERVICE_NAME_ID"] == "28765_0"
+    args.pd_master_replicas = "127.0.0.1:1212,127.0.0.1:1213"
+    args.pd_master_replica_id = 1
+    set_unique_server_name(args)
+    assert os.environ["LIGHTLLM_UNIQUE_SERVICE_NAME_ID"] == "28765_0_pd_master_1"
+    # 连接多个副本的 p d 节点不受影响
+    args.run_mode = "prefill"
+    set_unique_server_name(args)
+    assert os.environ["LIGHTLLM_UNIQUE_SERVICE_NAME_ID"] == "28765_0"
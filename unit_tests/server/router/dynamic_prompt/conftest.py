@@ -0,0 +1,34 @@
+import pytest
+import torch
+from lightllm.common.mem_manager import MemoryManager
+from lightllm.server.router.dynamic_prompt.shared_arr import SharedInt
+
+
+class CpuMemoryManager(MemoryManager):
+    """
+    kv_buffer 放在 cpu 上的 MemoryManager，只用于在没有 gpu 的环境中测试。
+    """
+
+    def __init__(self, size, name, layer_num=2, head_num=1, head_dim=4, dtype=torch.float32, token_allocator="stack"):
+        self.size = size
+        self.head_num = head_num
+        self.head_dim = head_dim
+        self.layer_num = layer_num
+        self.dtype = dtype
+        self.always_copy = False
+        self.mem_state = torch.arange(0, size, dtype=torch.int32)
+        self.mark_start = 0
+        self.mark_end = size
+        self.can_use_mem_size = size
+        self.shared_can_use_token_num = SharedInt(name)
+        self.shared_can_use_token_num.set_value(size)
+        self.shared_largest_free_run = SharedInt(f"{name}_largest_free_run")
+        self.shared_free_run_num = SharedInt(f"{name}_free_run_num")
+        self._init_token_allocator(token_allocator)
+        self.kv_buffer = torch.zeros((layer_num, size + 1, 2 * head_num, head_dim), dtype=dtype)
+        self.HOLD_TOKEN_MEMINDEX = size
+
+
+@pytest.fixture
+def cpu_mem_manager_class():
+    return CpuMemoryManager
@@ -0,0 +1,119 @@
+import pytest
+import random
+import torch
+import numpy as np
+from lightllm.server.router.dynamic_prompt.radix_cache import RadixCache
+from lightllm.server.router.dynamic_prompt.array_radix_cache import ArrayRadixCache, array_match
+
+
+def test_array_match():
+    a = np.arange(1000, dtype=np.int32)
+    b = a.copy()
+    assert array_match(a, b) == 1000
+    b[700] = -1
+    assert array_match(a, b) == 700
+    assert array_match(a[:10], b) == 10
+    assert array_match(a, b[:0]) == 0
+
+
+def test_case1():
+    tree = ArrayRadixCache("array_unique_name", 100, 0)
+    ans = tree.insert(torch.tensor([0, 1, 2, 3, 4, 5, 6, 7, 8, 9], dtype=torch.int64, device="cpu"))
+    assert ans == 0
+    ans = tree.insert(torch.tensor([0, 1, 2, 3, 4, 7, 8, 9], dtype=torch.int64, device="cpu"))
+    assert ans == 5
+    ans = tree.insert(torch.tensor([0, 1, 2, 3, 4, 7, 8, 9], dtype=torch.int64, device="cpu"))
+    assert ans == 8
+    tree.print_self()
+
+    assert tree.get_refed_tokens_num() == 0
+    assert tree.get_tree_total_tokens_num() == 13
+
+    tree.evict(9, lambda x: x)
+    assert tree.get_refed_tokens_num() == 0 and tree.get_tree_total_tokens_num() == 0
+
+
+def test_case2():
+    tree = ArrayRadixCache("array_unique_name", 100, 1)
+    tree.insert(torch.tensor([0, 1, 2, 3, 4, 5, 6, 7, 8, 9], dtype=torch.int64, device="cpu"))
+    tree.insert(torch.tensor([0, 1, 2, 3, 4, 7, 8, 9], dtype=torch.int64, device="cpu"))
+
+    tree_node, size, values = tree.match_prefix(
+        torch.tensor([0, 1, 2, 3, 4], dtype=torch.int64, device="cpu"), update_refs=False
+    )
+    assert tree_node.node_prefix_total_len == 5 and size == 5 and len(values) == 5
+    tree_node, size, values = tree.match_prefix(
+        torch.tensor([0, 1, 2, 3, 4, 9], dtype=torch.int64, device="cpu"), update_refs=False
+    )
+    assert tree_node.node_prefix_total_len == 5 and size == 5 and len(values) == 5
+    tree_node, size, values = tree.match_prefix(
+        torch.tensor([0, 1, 2, 3, 4, 7, 8], dtype=torch.int64, device="cpu"), update_refs=False
+    )
+    assert tree_node.node_prefix_total_len == 7 and size == 7 and len(values) == 7
+    tree_node, size, values = tree.match_prefix(
+        torch.tensor([0, 1, 2, 3, 4, 7, 9], dtype=torch.int64, device="cpu"), update_refs=False
+    )
+    assert tree_node.node_prefix_total_len == 6 and size == 6 and len(values) == 6
+    assert values.tolist() == [0, 1, 2, 3, 4, 7]
+
+
+def test_case3():
+    tree = ArrayRadixCache("array_unique_name", 100, 2)
+    tree.insert(torch.tensor([0, 1, 2, 3, 4, 5, 6, 7, 8, 9], dtype=torch.int64, device="cpu"))
+    tree.insert(torch.tensor([0, 1, 2, 3, 4, 7, 8, 9], dtype=torch.int64, device="cpu"))
+
+    tree_node, size, values = tree.match_prefix(
+        torch.tensor([0, 1, 2, 3, 4], dtype=torch.int64, device="cpu"), update_refs=True
+    )
+    assert tree_node.node_prefix_total_len == 5 and size == 5 and len(values) == 5
+    assert tree.get_refed_tokens_num() == 5 and tree.get_tree_total_tokens_num() == 13
+
+    tree_node, size, values = tree.match_prefix(
+        torch.tensor([0, 1, 2, 3, 4, 7, 9], dtype=torch.int64, device="cpu"), update_refs=True
+    )
+    assert tree_node.node_prefix_total_len == 6 and size == 6 and len(values) == 6
+    assert tree.get_refed_tokens_num() == 6 and tree.get_tree_total_tokens_num() == 13
+
+    tree.evict(2, lambda x: x)
+    assert tree.get_refed_tokens_num() == 6 and tree.get_tree_total_tokens_num() == 8
+
+    tree.dec_node_ref_counter(tree_node)
+    tree.clear_tree_nodes()
+    assert tree.get_refed_tokens_num() == 0 and tree.get_tree_total_tokens_num() == 0
+
+
+def test_same_behavior_with_radix_cache():
+    random.seed(0)
+    tree = RadixCache("array_cmp_radix", 100, 0)
+    array_tree = ArrayRadixCache("array_cmp_array", 100, 0, arena_chunk_size=64)
+    prompts = [[random.randint(0, 8) for _ in range(random.randint(1, 40))] for _ in range(300)]
+    mem_index = 0
+    for prompt in prompts:
+        key = torch.tensor(prompt, dtype=torch.int64)
+        ans = tree.match_prefix(key, update_refs=True)
+        array_ans = array_tree.match_prefix(key, update_refs=True)
+        assert ans[1] == array_ans[1]
+        if ans[0] is not None:
+            assert torch.equal(ans[2], array_ans[2])
+
+        value = torch.arange(mem_index, mem_index + len(prompt), dtype=torch.int64)
+        mem_index += len(prompt)
+        assert tree.insert(key, value) == array_tree.insert(key, value)
+        tree.dec_node_ref_counter(ans[0])
+        array_tree.dec_node_ref_counter(array_ans[0])
+
+        assert tree.get_refed_tokens_num() == array_tree.get_refed_tokens_num()
+        assert tree.get_tree_total_tokens_num() == array_tree.get_tree_total_tokens_num()
+
+        if tree.get_tree_total_tokens_num() > 200:
+            evicted, array_evicted = [], []
+            tree.evict(100, lambda x: evicted.append(x))
+            array_tree.evict(100, lambda x: array_evicted.append(x))
+            assert sorted(torch.cat(evicted).tolist()) == sorted(torch.cat(array_evicted).tolist())
+            assert tree.get_tree_total_tokens_num() == array_tree.get_tree_total_tokens_num()
+
+    assert array_tree.arena.get_live_token_num() == array_tree.get_tree_total_tokens_num()
+
+
+if __name__ == "__main__":
+    pytest.main()
@@ -0,0 +1,113 @@
+import pytest
+import random
+import torch
+from lightllm.server.router.dynamic_prompt.block_prefix_cache import BlockPrefixCache
+
+
+def test_case1():
+    tree = BlockPrefixCache("block_unique_name", 100, 0, block_size=4)
+    ans = tree.insert(torch.tensor([0, 1, 2, 3, 4, 5, 6, 7, 8, 9], dtype=torch.int64, device="cpu"))
+    assert ans == 0
+    # 前 4 个 token 组成的 block 已经存在
+    ans = tree.insert(torch.tensor([0, 1, 2, 3, 4, 7, 8, 9], dtype=torch.int64, device="cpu"))
+    assert ans == 4
+    ans = tree.insert(torch.tensor([0, 1, 2, 3, 4, 7, 8, 9], dtype=torch.int64, device="cpu"))
+    assert ans == 8
+    # 尾部不满一个 block 的部分完全相同
+    ans = tree.insert(torch.tensor([0, 1, 2, 3, 4, 5, 6, 7, 8, 9], dtype=torch.int64, device="cpu"))
+    assert ans == 10
+    tree.print_self()
+
+    assert tree.get_refed_tokens_num() == 0
+    assert tree.get_tree_total_tokens_num() == 14
+    assert tree.get_node_num() == 4
+
+    tree.evict(14, lambda x: x)
+    assert tree.get_refed_tokens_num() == 0 and tree.get_tree_total_tokens_num() == 0
+    assert tree.get_node_num() == 0
+
+
+def test_case2():
+    tree = BlockPrefixCache("block_unique_name", 100, 1, block_size=4)
+    tree.insert(torch.tensor([0, 1, 2, 3, 4, 5, 6, 7, 8, 9], dtype=torch.int64, device="cpu"))
+
+    tree_node, size, values = tree.match_prefix(
+        torch.tensor([0, 1, 2, 3, 4, 5, 6], dtype=torch.int64, device="cpu"), update_refs=False
+    )
+    assert tree_node.node_prefix_total_len == 4 and size == 4 and values.tolist() == [0, 1, 2, 3]
+    tree_node, size, values = tree.match_prefix(
+        torch.tensor([0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10], dtype=torch.int64, device="cpu"), update_refs=False
+    )
+    assert tree_node.node_prefix_total_len == 10 and size == 10 and len(values) == 10
+    tree_node, size, values = tree.match_prefix(
+        torch.tensor([1, 2, 3, 4], dtype=torch.int64, device="cpu"), update_refs=False
+    )
+    assert tree_node is None and size == 0 and values is None
+
+
+def test_case3():
+    tree = BlockPrefixCache("block_unique_name", 100, 2, block_size=4)
+    tree.insert(torch.tensor([0, 1, 2, 3, 4, 5, 6, 7, 8, 9], dtype=torch.int64, device="cpu"))
+    tree.insert(
+        torch.tensor([0, 1, 2, 3, 7, 8, 9, 10, 11], dtype=torch.int64, device="cpu"),
+        torch.arange(10, 19, dtype=torch.int64, device="cpu"),
+    )
+    assert tree.get_tree_total_tokens_num() == 15
+
+    tree_node, size, values = tree.match_prefix(
+        torch.tensor([0, 1, 2, 3, 4, 5, 6, 7, 8], dtype=torch.int64, device="cpu"), update_refs=True
+    )
+    assert size == 8
+    assert tree.get_refed_tokens_num() == 8
+
+    # 只有 [7, 8, 9, 10] [11] [8, 9] 可以被淘汰
+    with pytest.raises(AssertionError):
+        tree.evict(8, lambda x: x)
+    evicted = []
+    tree.evict(7, lambda x: evicted.append(x))
+    assert sorted(torch.cat(evicted).tolist()) == [8, 9, 14, 15, 16, 17, 18]
+    assert tree.get_refed_tokens_num() == 8 and tree.get_tree_total_tokens_num() == 8
+
+    tree.dec_node_ref_counter(tree_node)
+    assert tree.get_refed_tokens_num() == 0
+    tree.evict(8, lambda x: x)
+    assert tree.get_tree_total_tokens_num() == 0
+
+
+def test_random_ops():
+    random.seed(0)
+    tree = BlockPrefixCache("block_random", 100, 0, block_size=3)
+    mem_index = 0
+    owned = set()
+    for _ in range(500):
+        prompt = [random.randint(0, 3) for _ in range(random.randint(1, 20))]
+        key = torch.tensor(prompt, dtype=torch.int64)
+        node, kv_len, values = tree.match_prefix(key, update_refs=True)
+        if node is not None:
+            assert node.node_prefix_total_len == kv_len
+            assert set(values.tolist()) <= owned
+
+        # 与推理进程相同，命中部分复用 cache 中的 mem index
+        new_len = len(prompt) - kv_len
+        value = torch.arange(mem_index, mem_index + new_len, dtype=torch.int64)
+        if node is not None:
+            value = torch.cat([values, value])
+        mem_index += new_len
+        prefix_len = tree.insert(key, value)
+        assert prefix_len >= kv_len
+        assert owned.isdisjoint(value[prefix_len:].tolist())
+        owned.update(value[prefix_len:].tolist())
+        tree.dec_node_ref_counter(node)
+
+        assert tree.get_tree_total_tokens_num() == len(owned)
+        assert tree.get_refed_tokens_num() == 0
+        if tree.get_tree_total_tokens_num() > 60:
+            tree.evict(30, lambda x: owned.difference_update(x.tolist()))
+            assert tree.get_tree_total_tokens_num() == len(owned)
+
+    tree.evict(tree.get_tree_total_tokens_num(), lambda x: owned.difference_update(x.tolist()))
+    assert len(owned) == 0 and tree.get_node_num() == 0
+
+
+if __name__ == "__main__":
+    pytest.main()
@@ -0,0 +1,154 @@
+import pytest
+import torch
+import numpy as np
+from lightllm.common.mem_manager import MemoryManager
+from lightllm.server.router.dynamic_prompt.shared_arr import SharedInt
+from lightllm.server.router.dynamic_prompt.radix_cache import RadixCache
+from lightllm.server.router.dynamic_prompt.array_radix_cache import ArrayRadixCache
+from lightllm.server.router.dynamic_prompt.block_prefix_cache import BlockPrefixCache
+from lightllm.server.router.dynamic_prompt.host_kv_cache import HostKvCache, HostKvCacheStats
+
+LAYER_NUM, HEAD_NUM, HEAD_DIM = 2, 1, 4
+
+
+class CpuMemoryManager(MemoryManager):
+    """
+    kv_buffer 放在 cpu 上的 MemoryManager，只用于在没有 gpu 的环境中测试。
+    """
+
+    def __init__(self, size, name, token_allocator="stack"):
+        self.size = size
+        self.head_num = HEAD_NUM
+        self.head_dim = HEAD_DIM
+        self.layer_num = LAYER_NUM
+        self.dtype = torch.float32
+        self.mem_state = torch.arange(0, size, dtype=torch.int32)
+        self.mark_start = 0
+        self.mark_end = size
+        self.can_use_mem_size = size
+        self.shared_can_use_token_num = SharedInt(name)
+        self.shared_can_use_token_num.set_value(size)
+        self.shared_largest_free_run = SharedInt(f"{name}_largest_free_run")
+        self.shared_free_run_num = SharedInt(f"{name}_free_run_num")
+        self._init_token_allocator(token_allocator)
+        self.kv_buffer = torch.zeros((LAYER_NUM, size + 1, 2 * HEAD_NUM, HEAD_DIM), dtype=torch.float32)
+        self.HOLD_TOKEN_MEMINDEX = size
+
+
+def _fill_kv(mem_manager, tokens, mem_index, start_pos=0):
+    # 每个 token 的 kv 只和 token 在序列中的位置与 id 有关，便于校验恢复出的 kv 是否正确
+    for pos, (token, index) in enumerate(zip(tokens, mem_index.tolist()), start_pos):
+        mem_manager.kv_buffer[:, index] = float(token * 1000 + pos)
+
+
+def _check_kv(mem_manager, tokens, mem_index):
+    for pos, (token, index) in enumerate(zip(tokens, mem_index.tolist())):
+        assert torch.all(mem_manager.kv_buffer[:, index] == float(token * 1000 + pos))
+
+
+def _prefill(tree, mem_manager, tokens):
+    key = torch.tensor(tokens, dtype=torch.int64)
+    tree.restore_from_host_kv_cache(key)
+    node, kv_len, value = tree.match_prefix(key, update_refs=True)
+    tree.free_radix_cache_to_get_enough_token(len(tokens) - kv_len)
+    new_index = mem_manager.alloc(len(tokens) - kv_len).clone().to(torch.int64)
+    _fill_kv(mem_manager, tokens[kv_len:], new_index, start_pos=kv_len)
+    all_index = new_index if value is None else torch.cat([value, new_index])
+    prefix_len = tree.insert(key, all_index)
+    mem_manager.free(all_index[kv_len:prefix_len])
+    tree.dec_node_ref_counter(node)
+    return kv_len
+
+
+@pytest.mark.parametrize("token_allocator", ["stack", "free_list"])
+@pytest.mark.parametrize("cache_class", [RadixCache, ArrayRadixCache, BlockPrefixCache])
+def test_offload_and_restore(cache_class, token_allocator):
+    name = f"host_kv_{cache_class.__name__}_{token_allocator}"
+    mem_manager = CpuMemoryManager(64, f"{name}_can_use", token_allocator=token_allocator)
+    tree = cache_class(name, 64, 0, mem_manager=mem_manager)
+    tree.host_kv_cache = HostKvCache(1 << 20)
+
+    seq_a = list(range(1, 41))
+    seq_b = list(range(100, 140))
+    assert _prefill(tree, mem_manager, seq_a) == 0
+    # seq_b 需要淘汰 seq_a 的部分 kv，被淘汰的 kv 卸载到 host 上
+    assert _prefill(tree, mem_manager, seq_b) == 0
+    assert tree.host_kv_cache.used_bytes > 0
+    assert tree.get_tree_total_tokens_num() + mem_manager.can_use_mem_size == 64
+
+    # 再次请求 seq_a 加上新的 token，应该能从 gpu + host 中完整的命中 seq_a
+    seq_c = seq_a + [7, 8, 9]
+    key = torch.tensor(seq_c, dtype=torch.int64)
+    tree.restore_from_host_kv_cache(key)
+    node, kv_len, value = tree.match_prefix(key, update_refs=False)
+    assert kv_len == len(seq_a)
+    _check_kv(mem_manager, seq_a, value)
+    assert tree.get_tree_total_tokens_num() + mem_manager.can_use_mem_size == 64
+
+    stats = tree.host_kv_cache.get_stats()
+    assert stats["hit_rate"] > 0 and stats["load_bytes"] > 0 and stats["offload_bytes"] > 0
+
+
+def test_partial_restore_and_lru():
+    mem_manager = CpuMemoryManager(64, "host_kv_partial_can_use")
+    tree = RadixCache("host_kv_partial", 64, 0, mem_manager=mem_manager)
+    token_bytes = LAYER_NUM * 2 * HEAD_NUM * HEAD_DIM * 4
+    tree.host_kv_cache = HostKvCache(40 * token_bytes)
+
+    seq_a = list(range(1, 41))
+    _prefill(tree, mem_manager, seq_a)
+    tree.free_radix_cache_to_get_enough_token(64)
+    assert tree.get_tree_total_tokens_num() == 0
+    assert tree.host_kv_cache.used_bytes == 40 * token_bytes
+
+    # 只使用 host 上一个 entry 的前半部分
+    key = torch.tensor(seq_a[0:20] + [999], dtype=torch.int64)
+    assert tree.restore_from_host_kv_cache(key) == 20
+    _, kv_len, value = tree.match_prefix(key, update_refs=False)
+    assert kv_len == 20
+    _check_kv(mem_manager, seq_a[0:20], value)
+
+    # 超出容量时按照 LRU 淘汰 host 上的 entry
+    tree.clear_tree_nodes()
+    mem_manager.free_all()
+    seq_b = list(range(200, 230))
+    _prefill(tree, mem_manager, seq_b)
+    tree.free_radix_cache_to_get_enough_token(64)
+    assert tree.host_kv_cache.used_bytes <= 40 * token_bytes
+    assert tree.restore_from_host_kv_cache(torch.tensor(seq_a, dtype=torch.int64)) == 0
+    assert tree.restore_from_host_kv_cache(torch.tensor(seq_b, dtype=torch.int64)) == len(seq_b)
+
+
+def test_host_match_chain():
+    cache = HostKvCache(1 << 20, pin_memory=False)
+    mem_manager = CpuMemoryManager(16, "host_kv_chain_can_use")
+    tokens = np.arange(10, 20, dtype=np.int32)
+    mem_index = torch.arange(0, 10, dtype=torch.int64)
+    _fill_kv(mem_manager, tokens.tolist(), mem_index)
+    # 两个前后相连的节点
+    cache.offload([(torch.tensor(tokens[0:4]), mem_index[0:4]), (torch.tensor(tokens), mem_index[4:10])], mem_manager)
+    matched = cache.match(tokens, 0)
+    assert [use_len for _, use_len in matched] == [4, 6]
+    assert cache.match(tokens, 4)[0][1] == 6
+    assert cache.match(np.array([1, 2, 3], dtype=np.int32), 0) == []
+
+
+if __name__ == "__main__":
+    pytest.main()
+
+
+def test_stats_across_ranks():
+    name = "host_kv_cache_stats_test"
+    rank0 = HostKvCacheStats(name, rank_num=2, rank=0)
+    rank1 = HostKvCacheStats(name, rank_num=2, rank=1)
+    reader = HostKvCacheStats(name, rank_num=2)
+    reader.arr.fill(0)
+    rank0.add("lookup_num", 2)
+    rank0.add("hit_num", 1)
+    rank1.add("lookup_num", 2)
+    rank1.add("hit_num", 2)
+    rank0.set("used_bytes", 100)
+    rank1.set("used_bytes", 50)
+    assert reader.get("used_bytes") == 150
+    assert abs(reader.get_hit_rate() - 0.75) < 1e-9
+    assert reader.get_token_hit_rate() == 0
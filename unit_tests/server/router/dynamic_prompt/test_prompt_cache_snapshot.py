@@ -0,0 +1,121 @@
+import pytest
+import torch
+from lightllm.server.router.dynamic_prompt.radix_cache import RadixCache
+from lightllm.server.router.dynamic_prompt.array_radix_cache import ArrayRadixCache
+from lightllm.server.router.dynamic_prompt.block_prefix_cache import BlockPrefixCache
+from lightllm.server.router.dynamic_prompt.prompt_cache_snapshot import (
+    PromptCacheSnapshotLoader,
+    save_prompt_cache_snapshot,
+    select_hot_nodes,
+)
+
+
+def _create_tree(cache_class, name, mem_manager):
+    extra_kwargs = {"block_size": 4} if cache_class is BlockPrefixCache else {}
+    return cache_class(name, mem_manager.size, 0, mem_manager=mem_manager, **extra_kwargs)
+
+
+def _insert_with_kv(tree, mem_manager, tokens):
+    key = torch.tensor(tokens, dtype=torch.int64)
+    node, kv_len, value = tree.match_prefix(key, update_refs=True)
+    new_index = mem_manager.alloc(len(tokens) - kv_len).clone().to(torch.int64)
+    for pos, index in enumerate(new_index.tolist(), kv_len):
+        for layer in range(mem_manager.layer_num):
+            mem_manager.kv_buffer[layer, index] = tokens[pos] + pos / 128 + layer
+    all_index = new_index if value is None else torch.cat([value, new_index])
+    prefix_len = tree.insert(key, all_index)
+    mem_manager.free(all_index[kv_len:prefix_len])
+    tree.dec_node_ref_counter(node)
+
+
+def _check_kv(tree, mem_manager, tokens):
+    _, kv_len, value = tree.match_prefix(torch.tensor(tokens, dtype=torch.int64), update_refs=False)
+    assert kv_len == len(tokens)
+    for pos, index in enumerate(value.tolist()):
+        for layer in range(mem_manager.layer_num):
+            expected = torch.tensor(tokens[pos] + pos / 128 + layer, dtype=mem_manager.dtype)
+            assert torch.all(mem_manager.kv_buffer[layer, index] == expected)
+
+
+@pytest.mark.parametrize("cache_class", [RadixCache, ArrayRadixCache, BlockPrefixCache])
+def test_save_and_load(cache_class, cpu_mem_manager_class, tmp_path):
+    name = f"snapshot_{cache_class.__name__}"
+    mem_manager = cpu_mem_manager_class(128, f"{name}_src_can_use", layer_num=3, dtype=torch.bfloat16)
+    tree = _create_tree(cache_class, f"{name}_src", mem_manager)
+    system_prompt = list(range(1, 21))
+    cold = [50, 51, 52, 53, 54, 55]
+    hot1 = system_prompt + [30, 31, 32]
+    hot2 = system_prompt + [40, 41]
+    for tokens in [cold, hot1, hot2]:
+        _insert_with_kv(tree, mem_manager, tokens)
+
+    # cold 最早访问，在 token 数量限制下不会被保存
+    selected = select_hot_nodes(tree, 25)
+    assert sum(node.node_value_len for node, _ in selected) == 25
+    assert all(parent_pos < i for i, (_, parent_pos) in enumerate(selected))
+
+    file_path = str(tmp_path / "prompt_cache_rank_0.snapshot")
+    assert save_prompt_cache_snapshot(tree, file_path, 25, chunk_token_num=7) == 25
+
+    new_mem_manager = cpu_mem_manager_class(128, f"{name}_dst_can_use", layer_num=3, dtype=torch.bfloat16)
+    new_tree = _create_tree(cache_class, f"{name}_dst", new_mem_manager)
+    # 加载期间服务已经插入了部分重叠的前缀
+    _insert_with_kv(new_tree, new_mem_manager, system_prompt[0:8])
+    loader = PromptCacheSnapshotLoader(file_path, new_tree)
+    assert loader.start()
+    assert loader.finish(commit=True) == 17
+
+    _check_kv(new_tree, new_mem_manager, hot1)
+    _check_kv(new_tree, new_mem_manager, hot2)
+    _, kv_len, _ = new_tree.match_prefix(torch.tensor(cold, dtype=torch.int64), update_refs=False)
+    assert kv_len == 0
+    assert new_tree.get_tree_total_tokens_num() + new_mem_manager.can_use_mem_size == 128
+
+
+def test_block_misaligned_load(cpu_mem_manager_class, tmp_path):
+    mem_manager = cpu_mem_manager_class(128, "snapshot_misaligned_src_can_use")
+    tree = _create_tree(BlockPrefixCache, "snapshot_misaligned_src", mem_manager)
+    system_prompt = list(range(1, 21))
+    for tokens in [system_prompt + [30, 31, 32], system_prompt + [40, 41]]:
+        _insert_with_kv(tree, mem_manager, tokens)
+    file_path = str(tmp_path / "prompt_cache_rank_0.snapshot")
+    save_prompt_cache_snapshot(tree, file_path, 100)
+
+    new_mem_manager = cpu_mem_manager_class(128, "snapshot_misaligned_dst_can_use")
+    new_tree = _create_tree(BlockPrefixCache, "snapshot_misaligned_dst", new_mem_manager)
+    # 不满一个 block 的节点使后续插入的 block 切分位置发生偏移，同一个 mem index 不能被树持有两次
+    _insert_with_kv(new_tree, new_mem_manager, system_prompt[0:10])
+    loader = PromptCacheSnapshotLoader(file_path, new_tree)
+    assert loader.start()
+    assert loader.finish(commit=True) > 0
+    assert new_tree.get_tree_total_tokens_num() + new_mem_manager.can_use_mem_size == 128
+    _check_kv(new_tree, new_mem_manager, system_prompt + [40, 41])
+    evicted = []
+    new_tree.evict(new_tree.get_tree_total_tokens_num(), lambda x: evicted.extend(x.tolist()))
+    assert len(evicted) == len(set(evicted))
+
+
+def test_abort_and_format_check(cpu_mem_manager_class, tmp_path):
+    mem_manager = cpu_mem_manager_class(64, "snapshot_abort_src_can_use")
+    tree = RadixCache("snapshot_abort_src", 64, 0, mem_manager=mem_manager)
+    _insert_with_kv(tree, mem_manager, list(range(10)))
+    file_path = str(tmp_path / "prompt_cache_rank_0.snapshot")
+    save_prompt_cache_snapshot(tree, file_path, 100)
+
+    new_mem_manager = cpu_mem_manager_class(64, "snapshot_abort_dst_can_use")
+    new_tree = RadixCache("snapshot_abort_dst", 64, 0, mem_manager=new_mem_manager)
+    loader = PromptCacheSnapshotLoader(file_path, new_tree)
+    assert loader.start()
+    assert new_mem_manager.can_use_mem_size == 54
+    assert loader.finish(commit=False) == 0
+    assert new_mem_manager.can_use_mem_size == 64 and new_tree.get_tree_total_tokens_num() == 0
+
+    # kv 格式不一致的快照不会被加载
+    other_mem_manager = cpu_mem_manager_class(64, "snapshot_abort_other_can_use", layer_num=4)
+    other_tree = RadixCache("snapshot_abort_other", 64, 0, mem_manager=other_mem_manager)
+    assert not PromptCacheSnapshotLoader(file_path, other_tree).start()
+    assert not PromptCacheSnapshotLoader(str(tmp_path / "not_exist"), other_tree).start()
+
+
+if __name__ == "__main__":
+    pytest.main()
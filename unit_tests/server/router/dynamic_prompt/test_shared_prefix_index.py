@@ -0,0 +1,74 @@
+import pytest
+import torch
+import numpy as np
+from lightllm.server.router.dynamic_prompt.radix_cache import RadixCache
+from lightllm.server.router.dynamic_prompt.array_radix_cache import ArrayRadixCache
+from lightllm.server.router.dynamic_prompt.block_prefix_cache import BlockPrefixCache
+from lightllm.server.router.dynamic_prompt.shared_prefix_index import SharedPrefixIndex, get_prefix_block_hashes
+
+
+def test_block_hashes():
+    hashes = get_prefix_block_hashes(list(range(10)), block_size=4)
+    assert len(hashes) == 2 and (hashes != 0).all()
+    assert (get_prefix_block_hashes(torch.arange(8), block_size=4) == hashes).all()
+    # 链式 hash 包含了之前所有块的内容
+    other = get_prefix_block_hashes([100, 1, 2, 3, 4, 5, 6, 7], block_size=4)
+    assert other[0] != hashes[0] and other[1] != hashes[1]
+    # 从已知的块 hash 继续计算的结果与从头计算一致
+    assert (get_prefix_block_hashes(list(range(10)), 4, start_block=1, prev_hash=hashes[0]) == hashes[1:]).all()
+    assert len(get_prefix_block_hashes(list(range(10)), 4, start_block=2, prev_hash=hashes[1])) == 0
+
+
+def test_insert_resume_from_published_prefix():
+    name = "prefix_index_test_resume"
+    index = SharedPrefixIndex(name, 100, 0, block_size=4)
+    index.init_writer(100)
+    key = np.arange(20)
+    full_hashes = get_prefix_block_hashes(key, block_size=4)
+    index.insert(key[0:8], np.arange(8), 0)
+    # 扩展插入时只计算新的块，结果与整个 key 从头计算一致
+    index.insert(key, np.arange(20), 8)
+    assert (index.mem_index_to_hash[[3, 7, 11, 15, 19]] == full_hashes).all()
+    assert (index.table.arr[full_hashes & index.slot_mask] == full_hashes).all()
+
+    # 前缀的 mem index 上没有记录 hash 时 (与已有节点重复的 token) 退回到从头计算
+    other = SharedPrefixIndex(name + "_dup", 100, 0, block_size=4)
+    other.init_writer(100)
+    other.insert(key, np.arange(20) + 50, 12)
+    assert (other.mem_index_to_hash[[65, 69]] == full_hashes[3:]).all()
+    assert (other.table.arr[full_hashes & other.slot_mask] == full_hashes).all()
+
+
+@pytest.mark.parametrize(
+    "cache_class, kwargs", [(RadixCache, {}), (ArrayRadixCache, {}), (BlockPrefixCache, {"block_size": 4})]
+)
+def test_publish_insert_and_evict(cache_class, kwargs):
+    name = f"prefix_index_test_{cache_class.__name__}"
+    tree = cache_class(name, 100, 0, **kwargs)
+    tree.prefix_index = SharedPrefixIndex(name, 100, 0, block_size=4)
+    tree.prefix_index.init_writer(100)
+    # router 端只读的查询
+    reader = SharedPrefixIndex(name, 100, 0, block_size=4)
+
+    prompt_a = list(range(12))
+    prompt_b = list(range(8)) + [20, 21, 22, 23]
+    tree.insert(torch.tensor(prompt_a, dtype=torch.int64))
+    tree.insert(torch.tensor(prompt_b, dtype=torch.int64), torch.tensor(list(range(8)) + [30, 31, 32, 33]))
+
+    def match_len(prompt):
+        return reader.match_len(get_prefix_block_hashes(prompt, block_size=4))
+
+    assert match_len(prompt_a + [50]) == 12
+    assert match_len(prompt_b) == 12
+    assert match_len(list(range(8)) + [40, 41, 42, 43]) == 8
+    assert match_len([1] * 12) == 0
+
+    # 淘汰一个叶子节点后，其中一个 prompt 只有公共的前缀可以命中
+    tree.evict(4, lambda x: x)
+    assert sorted([match_len(prompt_a), match_len(prompt_b)]) == [8, 12]
+    tree.evict(tree.get_tree_total_tokens_num(), lambda x: x)
+    assert match_len(prompt_a) == 0 and match_len(prompt_b) == 0
+
+
+if __name__ == "__main__":
+    pytest.main()
@@ -0,0 +1,135 @@
+import torch
+from lightllm.common.mem_manager import MemoryManager
+from lightllm.server.router.dynamic_prompt.shared_arr import SharedInt
+from lightllm.server.router.model_infer.kv_swap_pool import KvSwapPool, KvSwapStats
+
+LAYER_NUM, HEAD_NUM, HEAD_DIM = 2, 1, 4
+
+
+class CpuMemoryManager(MemoryManager):
+    """
+    kv_buffer 放在 cpu 上、使用 free_list 分配器的 MemoryManager，只用于在没有 gpu 的环境中测试。
+    """
+
+    def __init__(self, size, name):
+        self.size = size
+        self.head_num = HEAD_NUM
+        self.head_dim = HEAD_DIM
+        self.layer_num = LAYER_NUM
+        self.dtype = torch.float32
+        self.mem_state = torch.arange(0, size, dtype=torch.int32)
+        self.mark_start = 0
+        self.mark_end = size
+        self.can_use_mem_size = size
+        self.shared_can_use_token_num = SharedInt(name)
+        self.shared_can_use_token_num.set_value(size)
+        self.shared_largest_free_run = SharedInt(f"{name}_largest_free_run")
+        self.shared_free_run_num = SharedInt(f"{name}_free_run_num")
+        self._init_token_allocator("free_list")
+        self.kv_buffer = torch.zeros((LAYER_NUM, size + 1, 2 * HEAD_NUM, HEAD_DIM), dtype=torch.float32)
+        self.HOLD_TOKEN_MEMINDEX = size
+
+
+def _build_pool(name, pool_token_num, min_swap_len=4):
+    mem_manager = CpuMemoryManager(64, name)
+    # 每个 token 的 kv 大小为 layer_num * 2 * head_num * head_dim * 4 字节
+    token_bytes = LAYER_NUM * 2 * HEAD_NUM * HEAD_DIM * 4
+    pool = KvSwapPool(pool_token_num * token_bytes, min_swap_len, mem_manager, pin_memory=False)
+    assert pool.size == pool_token_num
+    return mem_manager, pool
+
+
+def _fill_kv(mem_manager, mem_index, base):
+    for pos, index in enumerate(mem_index.tolist()):
+        mem_manager.kv_buffer[:, index] = float(base + pos)
+
+
+def _check_kv(mem_manager, mem_index, base):
+    for pos, index in enumerate(mem_index.tolist()):
+        assert torch.all(mem_manager.kv_buffer[:, index] == float(base + pos))
+
+
+def test_swap_out_and_in():
+    mem_manager, pool = _build_pool("kv_swap_roundtrip", 32)
+    index_a = mem_manager.alloc(10).clone()
+    index_b = mem_manager.alloc(12).clone()
+    _fill_kv(mem_manager, index_a, 1000)
+    _fill_kv(mem_manager, index_b, 2000)
+    assert pool.swap_out(1, index_a, mem_manager)
+    assert pool.swap_out(2, index_b, mem_manager)
+    assert pool.has_swapped(1) and pool.has_swapped(2)
+    mem_manager.free(index_a)
+    mem_manager.free(index_b)
+    mem_manager.kv_buffer.fill_(-1)
+
+    # 交换池中的 slot 被释放后重新分配，请求的 slot 可能不连续
+    pool.swap_in(1, mem_manager.alloc(10).clone(), mem_manager)
+    index_c = mem_manager.alloc(15).clone()
+    _fill_kv(mem_manager, index_c, 3000)
+    assert pool.swap_out(3, index_c, mem_manager)
+    assert len(pool._to_runs(pool.swapped_slots[3])) > 1
+
+    new_index_b = mem_manager.alloc(12).clone()
+    pool.swap_in(2, new_index_b, mem_manager)
+    _check_kv(mem_manager, new_index_b, 2000)
+    new_index_c = mem_manager.alloc(15).clone()
+    pool.swap_in(3, new_index_c, mem_manager)
+    _check_kv(mem_manager, new_index_c, 3000)
+    assert pool.slot_allocator.can_use_size == 32 and len(pool.swapped_slots) == 0
+
+    assert pool.stats.get("swap_out_num") == 3 and pool.stats.get("swap_in_num") == 3
+    assert pool.stats.get("swap_out_bytes") == pool.stats.get("swap_in_bytes") == 37 * pool.token_bytes
+    assert pool.stats.get_mean_latency("in") >= 0
+
+
+def test_swap_in_from_offset():
+    mem_manager, pool = _build_pool("kv_swap_offset", 16)
+    index = mem_manager.alloc(10).clone()
+    _fill_kv(mem_manager, index, 1000)
+    assert pool.swap_out(1, index, mem_manager)
+    mem_manager.free(index)
+    mem_manager.kv_buffer.fill_(-1)
+
+    # 前 6 个 token 仍然保留在 prompt cache 中，只加载剩余的部分，并释放全部 slot
+    new_index = mem_manager.alloc(4).clone()
+    pool.swap_in(1, new_index, mem_manager, start=6)
+    _check_kv(mem_manager, new_index, 1006)
+    assert pool.slot_allocator.can_use_size == 16
+    assert pool.stats.get("swap_in_bytes") == 4 * pool.token_bytes
+
+    # 全部命中 prompt cache 时不需要加载
+    assert pool.swap_out(2, mem_manager.alloc(8).clone(), mem_manager)
+    pool.swap_in(2, mem_manager.alloc(0), mem_manager, start=8)
+    assert pool.slot_allocator.can_use_size == 16 and not pool.has_swapped(2)
+
+
+def test_fallback_to_recompute():
+    mem_manager, pool = _build_pool("kv_swap_recompute", 16, min_swap_len=8)
+    # 过短的请求直接重新计算
+    assert not pool.swap_out(1, mem_manager.alloc(4).clone(), mem_manager)
+    assert pool.swap_out(2, mem_manager.alloc(10).clone(), mem_manager)
+    # 交换池空间不足
+    assert not pool.swap_out(3, mem_manager.alloc(10).clone(), mem_manager)
+    assert not pool.has_swapped(1) and not pool.has_swapped(3)
+    assert pool.stats.get("recompute_num") == 2 and pool.stats.get("pool_full_num") == 1
+
+    # 请求在暂停期间结束，丢弃其 kv 后空间可以复用
+    pool.drop(2)
+    pool.drop(2)
+    assert pool.slot_allocator.can_use_size == 16
+    assert pool.swap_out(3, mem_manager.alloc(10).clone(), mem_manager)
+
+
+def test_stats_across_ranks():
+    name = "kv_swap_stats_test"
+    rank0 = KvSwapStats(name, rank_num=2, rank=0)
+    rank1 = KvSwapStats(name, rank_num=2, rank=1)
+    reader = KvSwapStats(name, rank_num=2)
+    reader.arr.fill(0)
+    rank0.add("swap_out_num", 1)
+    rank0.add("swap_out_time_us", 3000)
+    rank1.add("swap_out_num", 1)
+    rank1.add("swap_out_time_us", 1000)
+    assert reader.get("swap_out_num") == 2
+    assert abs(reader.get_mean_latency("out") - 0.002) < 1e-9
+    assert reader.get_mean_latency("in") == 0
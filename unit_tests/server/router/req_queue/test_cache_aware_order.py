@@ -0,0 +1,123 @@
+import numpy as np
+import pytest
+from types import SimpleNamespace
+from lightllm.server.router.req_queue import base_queue
+from lightllm.server.router.req_queue.base_queue import BaseQueue
+from lightllm.server.router.req_queue.cache_aware_order import CacheAwareWaitingOrder
+
+
+class FakeShmArray:
+    def __init__(self, arr):
+        self.arr = arr
+
+
+class FakeReq:
+    def __init__(self, request_id, prompt_ids, is_paused=False, priority=0):
+        self.request_id = request_id
+        self.sample_params = SimpleNamespace(priority=priority, suggested_dp_index=-1)
+        self.input_len = len(prompt_ids)
+        self.is_paused = is_paused
+        self.is_aborted = False
+        self._prompt_ids = np.array(prompt_ids, dtype=np.int64)
+
+    def link_prompt_ids_shm_array(self):
+        self.shm_prompt_ids = FakeShmArray(self._prompt_ids)
+
+
+def _fake_match_len(hit_lens):
+    # 以第一个块的 hash 查找预先设定的命中长度
+    def get_match_len(block_hashes):
+        return hit_lens.get(int(block_hashes[0]), 0) if len(block_hashes) else 0
+
+    return get_match_len
+
+
+def _make_reqs():
+    sys_prompt = list(range(128))
+    reqs = [
+        FakeReq(0, list(range(1000, 1200))),
+        FakeReq(1, sys_prompt + list(range(2000, 2064))),
+        FakeReq(2, sys_prompt + list(range(3000, 3010))),
+    ]
+    return reqs
+
+
+def test_order_longest_prefix_first():
+    order = CacheAwareWaitingOrder(max_skip_times=2)
+    reqs = _make_reqs()
+    sys_hash = int(order._get_block_hashes(reqs[1])[0])
+    get_match_len = _fake_match_len({sys_hash: 128})
+    ordered = order.order(reqs, get_match_len)
+    # 命中长度相同时剩余 prefill 少的优先，未命中的请求排在最后
+    assert [req.request_id for req in ordered] == [2, 1, 0]
+
+    # 暂停的请求总是排在最前面
+    reqs[0].is_paused = True
+    assert [req.request_id for req in order.order(reqs, get_match_len)] == [0, 2, 1]
+
+
+def test_starvation_bound():
+    order = CacheAwareWaitingOrder(max_skip_times=2)
+    reqs = _make_reqs()
+    sys_hash = int(order._get_block_hashes(reqs[1])[0])
+    get_match_len = _fake_match_len({sys_hash: 128})
+    waiting_reqs = reqs
+    for i in range(2):
+        ordered = order.order(waiting_reqs, get_match_len)
+        assert ordered[-1].request_id == 0
+        new_req = FakeReq(10 + i, list(range(128)) + [5000 + i])
+        # 只调度了排在最前面的请求，请求 0 被后到达的请求超越
+        waiting_reqs = order.remove_scheduled(waiting_reqs, ordered[0:1], []) + [new_req]
+    assert order.skip_times[0] == 2
+    ordered = order.order(waiting_reqs, get_match_len)
+    assert ordered[0].request_id == 0
+    waiting_reqs = order.remove_scheduled(waiting_reqs, ordered[0:1], [])
+    assert 0 not in order.skip_times and 0 not in order.block_hashes
+    assert [req.request_id for req in waiting_reqs] == [1, 11]
+
+
+def test_order_within_priority_level():
+    order = CacheAwareWaitingOrder(max_skip_times=2, enable_priority_schedule=True)
+    sys_prompt = list(range(128))
+    reqs = [
+        FakeReq(0, list(range(1000, 1200)), priority=0),
+        FakeReq(1, list(range(1200, 1300)), priority=0),
+        FakeReq(2, sys_prompt + list(range(2000, 2064)), priority=1),
+        FakeReq(3, sys_prompt + list(range(3000, 3010)), priority=0),
+        FakeReq(4, list(range(4000, 4010)), priority=1, is_paused=True),
+    ]
+    sys_hash = int(order._get_block_hashes(reqs[2])[0])
+    ordered = order.order(reqs, _fake_match_len({sys_hash: 128}))
+    # 命中 prompt cache 的低优先级请求不能排到高优先级请求的前面，暂停的请求排在所属优先级的最前面
+    assert [req.request_id for req in ordered] == [3, 1, 0, 4, 2]
+
+
+def test_base_queue_cache_aware_with_priority(monkeypatch):
+    monkeypatch.setattr(base_queue, "get_fixed_kv_len", lambda: 0)
+    args = SimpleNamespace(
+        max_total_token_num=10000,
+        batch_max_tokens=2048,
+        running_max_req_size=16,
+        router_token_ratio=0.0,
+        router_max_new_token_len=1024,
+        waiting_queue_policy="cache_aware",
+        use_dynamic_prompt_cache=True,
+        waiting_queue_max_skip=2,
+        enable_priority_schedule=True,
+    )
+    reqs = _make_reqs()
+    reqs[0].sample_params.priority = 0
+    reqs[1].sample_params.priority = 1
+    reqs[2].sample_params.priority = 1
+    sys_hash = int(CacheAwareWaitingOrder(2)._get_block_hashes(reqs[1])[0])
+    get_match_len = _fake_match_len({sys_hash: 128})
+    radix_cache_client = SimpleNamespace(
+        get_prefix_match_len=lambda dp_index, block_hashes: get_match_len(block_hashes)
+    )
+    queue = BaseQueue(args, SimpleNamespace(radix_cache_client=radix_cache_client), 0, 1)
+    queue.extend(reqs)
+    assert [req.request_id for req in queue.get_waiting_queue()] == [0, 2, 1]
+
+
+if __name__ == "__main__":
+    pytest.main()
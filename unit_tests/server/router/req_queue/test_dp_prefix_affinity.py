@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+from lightllm.server.router.req_queue.dp_prefix_affinity import PrefixAffinityIndex
+
+
+def test_match_longest_prefix():
+    index = PrefixAffinityIndex(dp_size=4, block_size=4)
+    prompt = np.arange(20)
+    index.insert(index.get_block_hashes(prompt[0:8]), 1)
+    index.insert(index.get_block_hashes(prompt[0:16]), 2)
+    # 不满一个块的尾部不参与匹配
+    assert index.match(index.get_block_hashes(prompt)) == [0, 8, 16, 0]
+    # 前缀不同时，后续相同的块也不能命中
+    other = prompt.copy()
+    other[0] = 100
+    assert index.match(index.get_block_hashes(other)) == [0, 0, 0, 0]
+
+
+def test_select_dp_prefers_prefix_then_load():
+    index = PrefixAffinityIndex(dp_size=2, block_size=4)
+    prompt = np.arange(16)
+    assert index.select_dp(prompt, [0.0, 0.0], default_dp_index=1) == (1, 0)
+    # 相同的前缀会被分配到同一个 dp 上
+    assert index.select_dp(prompt, [0.0, 0.2], default_dp_index=0) == (1, 16)
+    # 负载过高时放弃前缀命中
+    assert index.select_dp(prompt, [0.0, 1.5], default_dp_index=1) == (0, 0)
+    # 两个 dp 都缓存了该前缀时选择负载低的
+    assert index.select_dp(prompt, [0.3, 0.1], default_dp_index=0) == (1, 16)
+
+
+def test_lru_evict():
+    index = PrefixAffinityIndex(dp_size=2, block_size=2, max_block_num=4)
+    prompt_a = np.arange(4)
+    prompt_b = np.arange(100, 106)
+    index.insert(index.get_block_hashes(prompt_a), 0)
+    index.insert(index.get_block_hashes(prompt_b), 1)
+    assert len(index.block_to_dp_mask) == 4
+    # prompt_a 的第一个块最早被淘汰，整个前缀都无法命中
+    assert index.match(index.get_block_hashes(prompt_a)) == [0, 0]
+    assert index.match(index.get_block_hashes(prompt_b)) == [0, 6]
+
+
+if __name__ == "__main__":
+    pytest.main()
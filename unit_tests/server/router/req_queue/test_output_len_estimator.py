@@ -0,0 +1,80 @@
+import pytest
+from types import SimpleNamespace
+from lightllm.server.router.req_queue.output_len_estimator import (
+    FixedOutputLenEstimator,
+    HistogramOutputLenEstimator,
+)
+
+
+def _fake_req(input_len, output_len, output_len_hint=-1):
+    return SimpleNamespace(
+        input_len=input_len,
+        shm_cur_output_len=output_len,
+        sample_params=SimpleNamespace(output_len_hint=output_len_hint),
+    )
+
+
+def test_fixed():
+    estimator = FixedOutputLenEstimator(1024)
+    assert estimator.estimate(_fake_req(100, 0)) == 1024
+    estimator.observe(_fake_req(100, 10))
+    assert estimator.estimate(_fake_req(100, 0)) == 1024
+
+
+def test_fallback_when_not_enough_samples():
+    estimator = HistogramOutputLenEstimator(fallback_len=1024, max_output_len=4096, min_sample_num=32)
+    for _ in range(31):
+        estimator.observe(_fake_req(100, 10))
+    assert estimator.estimate(_fake_req(100, 0)) == 1024
+    estimator.observe(_fake_req(100, 10))
+    assert 10 < estimator.estimate(_fake_req(100, 0)) <= 16
+
+
+def test_conditional_quantile():
+    estimator = HistogramOutputLenEstimator(fallback_len=1024, max_output_len=4096, quantile=0.9)
+    for _ in range(100):
+        estimator.observe(_fake_req(100, 10))
+        estimator.observe(_fake_req(100, 500))
+    # 一半的请求很长，0.9 分位数落在长请求上
+    assert 500 < estimator.estimate(_fake_req(100, 0)) <= 600
+    # 已经输出的长度超过了短请求后，只剩下长请求
+    assert 500 < estimator.estimate(_fake_req(100, 100)) <= 600
+    # 超过了所有统计过的请求
+    assert estimator.estimate(_fake_req(100, 2000)) == 2001
+
+    low_estimator = HistogramOutputLenEstimator(fallback_len=1024, max_output_len=4096, quantile=0.4)
+    for _ in range(100):
+        low_estimator.observe(_fake_req(100, 10))
+        low_estimator.observe(_fake_req(100, 500))
+    assert 10 < low_estimator.estimate(_fake_req(100, 0)) <= 16
+
+
+@pytest.mark.parametrize("use_hint", [True, False])
+def test_group_by_hint_and_prompt_len(use_hint):
+    estimator = HistogramOutputLenEstimator(fallback_len=1024, max_output_len=4096, quantile=0.9)
+    for _ in range(64):
+        if use_hint:
+            estimator.observe(_fake_req(100, 20, output_len_hint=0))
+            estimator.observe(_fake_req(100, 2000, output_len_hint=1))
+        else:
+            estimator.observe(_fake_req(100, 20))
+            estimator.observe(_fake_req(3000, 2000))
+
+    if use_hint:
+        short_req, long_req = _fake_req(100, 0, output_len_hint=0), _fake_req(100, 0, output_len_hint=1)
+    else:
+        short_req, long_req = _fake_req(110, 0), _fake_req(2900, 0)
+    assert estimator.estimate(short_req) <= 32
+    assert estimator.estimate(long_req) > 2000
+    # 没有见过的 prompt 长度分桶退化为按照 hint 的全体统计
+    assert estimator.estimate(_fake_req(20000, 0)) > 2000
+
+
+def test_decay():
+    estimator = HistogramOutputLenEstimator(fallback_len=1024, max_output_len=4096, max_sample_num=64)
+    for _ in range(64):
+        estimator.observe(_fake_req(100, 2000))
+    for _ in range(512):
+        estimator.observe(_fake_req(100, 20))
+    # 旧的长请求样本被遗忘
+    assert estimator.estimate(_fake_req(100, 0)) <= 32
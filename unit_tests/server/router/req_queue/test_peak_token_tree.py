@@ -0,0 +1,41 @@
+import random
+import numpy as np
+import pytest
+from lightllm.server.router.req_queue.peak_token_tree import PeakTokenTree
+
+
+def _peak_by_sort(items):
+    # 与调度器中原有的计算方式相同
+    items = sorted(items, key=lambda x: -x[1])
+    left_out_len_array = np.array([e[1] for e in items])
+    has_run_len_array = np.array([e[0] for e in items])
+    size_array = np.arange(1, len(items) + 1, 1)
+    return int((left_out_len_array * size_array + np.cumsum(has_run_len_array)).max())
+
+
+def test_simple():
+    tree = PeakTokenTree([])
+    assert tree.get_peak() == 0
+    tree.add(10, 5)
+    assert tree.get_peak() == 15
+    tree.add(100, 1)
+    assert tree.get_peak() == 112
+    tree.add(0, 20)
+    assert tree.get_peak() == _peak_by_sort([(10, 5), (100, 1), (0, 20)])
+
+
+@pytest.mark.parametrize("seed", list(range(20)))
+def test_same_as_sort(seed):
+    random.seed(seed)
+    items = [(random.randint(0, 1000), random.randint(0, 200)) for _ in range(random.randint(0, 100))]
+    new_items = [(random.randint(0, 1000), random.randint(0, 300)) for _ in range(50)]
+    # 一部分新请求的 left_out_len 不在预先放入的 key 中，需要重建
+    tree = PeakTokenTree(items, [e[1] for e in new_items[0:30]])
+    for item in new_items:
+        items.append(item)
+        tree.add(*item)
+        assert tree.get_peak() == _peak_by_sort(items)
+
+
+if __name__ == "__main__":
+    pytest.main()
@@ -0,0 +1,41 @@
+from types import SimpleNamespace
+from lightllm.server.router.pause_strategy import Fcfs, PriorityRecoverable
+
+
+def _fake_req(request_id, priority, kv_len, prompt_cache_len=0, group_req_id=None):
+    return SimpleNamespace(
+        request_id=request_id,
+        group_req_id=request_id if group_req_id is None else group_req_id,
+        shm_cur_kv_len=kv_len,
+        prompt_cache_len=prompt_cache_len,
+        sample_params=SimpleNamespace(priority=priority),
+    )
+
+
+def _ids(reqs):
+    return [req.request_id for req in reqs]
+
+
+def test_fcfs():
+    reqs = [_fake_req(i, 0, 10) for i in range(3)]
+    assert _ids(Fcfs().ordering_reqs(reqs)) == [2, 1, 0]
+
+
+def test_priority_first():
+    reqs = [_fake_req(0, 1, 100), _fake_req(1, 0, 10), _fake_req(2, 2, 1000), _fake_req(3, 1, 50)]
+    # 优先级最低的先被暂停，同一优先级中恢复代价小的先被暂停
+    assert _ids(PriorityRecoverable(use_prompt_cache=False).ordering_reqs(reqs)) == [2, 3, 0, 1]
+
+
+def test_recompute_len_with_prompt_cache():
+    reqs = [_fake_req(0, 0, 1000, prompt_cache_len=950), _fake_req(1, 0, 200), _fake_req(2, 0, 200)]
+    # 不开启 prompt cache 时所有的 kv 都需要重新计算，代价相同时最晚加入的先被暂停
+    assert _ids(PriorityRecoverable(use_prompt_cache=False).ordering_reqs(reqs)) == [2, 1, 0]
+    # 命中的 prompt cache 前缀会保留下来，请求 0 只需要重新计算 50 个 token
+    assert _ids(PriorityRecoverable(use_prompt_cache=True).ordering_reqs(reqs)) == [0, 2, 1]
+
+
+def test_group_contiguous():
+    reqs = [_fake_req(0, 1, 10, group_req_id=8), _fake_req(1, 1, 500), _fake_req(2, 1, 10, group_req_id=8)]
+    ordered = PriorityRecoverable(use_prompt_cache=False).ordering_reqs(reqs)
+    assert _ids(ordered) == [0, 2, 1]
@@ -0,0 +1,109 @@
+import os
+import pytest
+from lightllm.utils.envs_utils import get_env_start_args
+from lightllm.server.router.scheduler_simulator import (
+    SchedulerSimulator,
+    SimReqSpec,
+    build_sim_start_args,
+    dump_trace,
+    gen_bimodal_trace,
+    init_sim_env,
+    load_trace,
+)
+
+
+@pytest.fixture
+def sim_env(monkeypatch):
+    # init_sim_env 会修改进程的环境变量，测试结束后恢复
+    monkeypatch.setenv("LIGHTLLM_UNIQUE_SERVICE_NAME_ID", f"sim_test_{os.getpid()}")
+    monkeypatch.setenv("LIGHTLLM_START_ARGS", "{}")
+    yield
+    get_env_start_args.cache_clear()
+
+
+def _run(specs, **kwargs):
+    args = build_sim_start_args(**kwargs)
+    init_sim_env(args)
+    simulator = SchedulerSimulator(args, specs)
+    try:
+        return simulator.run(), simulator.get_pause_events()
+    finally:
+        simulator.close()
+
+
+def test_trace_io(tmp_path):
+    specs = gen_bimodal_trace(10, qps=5, seed=1)
+    path = str(tmp_path / "trace.jsonl")
+    dump_trace(specs, path)
+    assert load_trace(path) == specs
+
+    with open(path, "w") as f:
+        f.write('{"timestamp": 1.0, "prompt_len": 10, "output_len": 5, "other": 1}\n')
+    assert load_trace(path) == [SimReqSpec(input_len=10, output_len=5, arrival_time=1.0)]
+
+
+@pytest.mark.parametrize("disable_chunked_prefill", [True, False])
+def test_all_reqs_finished(sim_env, disable_chunked_prefill):
+    specs = [SimReqSpec(input_len=100, output_len=10, arrival_time=i * 0.01) for i in range(20)]
+    ans, pause_events = _run(
+        specs,
+        max_total_token_num=10000,
+        max_req_total_len=2048,
+        chunked_prefill_size=64,
+        disable_chunked_prefill=disable_chunked_prefill,
+    )
+    assert ans["finished_req_num"] == 20 and ans["unfinished_req_num"] == 0
+    assert ans["output_token_num"] == 200
+    assert len(pause_events) == 0 and ans["oom_num"] == 0
+    assert 0 < ans["ttft_p50"] <= ans["ttft_p99"]
+    assert 0 < ans["itl_p50"] <= ans["itl_p99"]
+
+
+def test_pause_when_underestimated(sim_env):
+    # 激进调度下按照 router_max_new_token_len 估计的输出长度远小于实际长度，需要暂停请求
+    specs = [SimReqSpec(input_len=100, output_len=900, arrival_time=0.0) for _ in range(20)]
+    ans, pause_events = _run(
+        specs,
+        max_total_token_num=4000,
+        max_req_total_len=2048,
+        router_token_ratio=0.9,
+        router_max_new_token_len=16,
+    )
+    assert ans["finished_req_num"] == 20
+    assert len(pause_events) > 0 and ans["recompute_tokens"] > 0
+    assert ans["max_used_token_ratio"] <= 1.0 and ans["oom_num"] == 0
+
+
+def test_priority_waiting_queue(sim_env):
+    specs = [SimReqSpec(input_len=10, output_len=10, priority=priority) for priority in [1, 0, 2, 0, 1]]
+    args = build_sim_start_args(max_total_token_num=10000, max_req_total_len=2048, enable_priority_schedule=True)
+    init_sim_env(args)
+    simulator = SchedulerSimulator(args, specs)
+    try:
+        reqs = [simulator._create_req(index, spec) for index, spec in enumerate(specs)]
+        for req in reqs:
+            simulator.req_queue.extend([req])
+        # 按照优先级分级，同一级别内保持先来先服务
+        assert simulator.req_queue.waiting_req_list == [reqs[1], reqs[3], reqs[0], reqs[4], reqs[2]]
+        simulator.req_queue.waiting_req_list = simulator.req_queue.waiting_req_list[3:]
+        reqs[3].is_paused = True
+        simulator.req_queue.back_to_wait_list([reqs[3]])
+        # 被暂停的请求排在自己优先级的最前面
+        assert simulator.req_queue.waiting_req_list == [reqs[3], reqs[4], reqs[2]]
+    finally:
+        simulator.close()
+
+
+def test_priority_preempt(sim_env):
+    # 低优先级的长请求占满显存后，到达的高优先级请求通过抢占尽快开始运行
+    specs = [SimReqSpec(input_len=500, output_len=1000, arrival_time=0.0, priority=1) for _ in range(6)]
+    specs += [SimReqSpec(input_len=500, output_len=10, arrival_time=1.0, priority=0) for _ in range(2)]
+    kwargs = dict(max_total_token_num=9000, max_req_total_len=1500, enable_priority_schedule=True)
+    ans, _ = _run(specs, priority_preempt_wait_ms=-1, **kwargs)
+    assert ans["finished_req_num"] == 8 and ans["paused_req_num"] == 0
+    assert ans["ttft_by_priority"][0]["ttft_p99"] > 1.0
+
+    ans, pause_events = _run(specs, priority_preempt_wait_ms=100, **kwargs)
+    assert ans["finished_req_num"] == 8 and ans["oom_num"] == 0
+    assert ans["paused_req_num"] > 0 and all(event["is_preempt"] for event in pause_events)
+    assert ans["ttft_by_priority"][0]["ttft_p99"] < 0.5
@@ -0,0 +1,86 @@
+import pickle
+import pytest
+from lightllm.server.core.objs import FinishStatus, SamplingParams
+from lightllm.server.pd_io_struct import ObjType
+from lightllm.server.pd_io_frame import (
+    decode_pd_frame,
+    encode_abort,
+    encode_node_status,
+    encode_req,
+    encode_token_packs,
+)
+
+
+def _metadata(token_id, **kwargs):
+    metadata = {
+        "id": token_id,
+        "logprob": -0.25,
+        "cumlogprob": -1.5,
+        "special": False,
+        "count_output_tokens": 3,
+        "prompt_tokens": 100,
+    }
+    metadata.update(kwargs)
+    return metadata
+
+
+def test_token_packs():
+    handle_list = [
+        (1 << 40, "你好", _metadata(7, prompt_ids=[1, 2, 3]), FinishStatus()),
+        (5, "", _metadata(8, special=True), FinishStatus(FinishStatus.FINISHED_STOP)),
+        (
+            6,
+            " world",
+            _metadata(9, score=0.5, prompt_logprobs=[{"1": -0.1}]),
+            FinishStatus(FinishStatus.FINISHED_LENGTH),
+        ),
+    ]
+    data = encode_token_packs(handle_list)
+    obj_type, decoded = decode_pd_frame(data)
+    assert obj_type == ObjType.TOKEN_PACKS
+    assert len(decoded) == len(handle_list)
+    for (sub_req_id, text, metadata, finish_status), (d_sub_req_id, d_text, d_metadata, d_finish_status) in zip(
+        handle_list, decoded
+    ):
+        assert (d_sub_req_id, d_text, d_metadata) == (sub_req_id, text, metadata)
+        assert d_finish_status.status == finish_status.status
+    # 只有定长字段的 token 比 pickle 的结果更小
+    simple_list = [(i, "ab", _metadata(i), FinishStatus()) for i in range(64)]
+    assert len(encode_token_packs(simple_list)) < len(pickle.dumps((ObjType.TOKEN_PACKS, simple_list)))
+
+
+def test_req_and_abort():
+    sampling_params = SamplingParams()
+    sampling_params.max_new_tokens = 17
+    sampling_params.group_request_id = 1024
+    sampling_params.move_kv_to_decode_node.initialize(None)
+    for prompt in ["hello 世界", [1, 2, 3, 1 << 20]]:
+        obj_type, (d_prompt, d_sampling_params, d_multimodal_params) = decode_pd_frame(
+            encode_req(prompt, sampling_params, None)
+        )
+        assert obj_type == ObjType.REQ
+        assert d_prompt == prompt and d_multimodal_params is None
+        assert bytes(d_sampling_params) == bytes(sampling_params)
+        assert d_sampling_params.max_new_tokens == 17 and d_sampling_params.group_request_id == 1024
+
+    assert decode_pd_frame(encode_abort(1 << 40)) == (ObjType.ABORT, 1 << 40)
+
+
+def test_multimodal_params():
+    pytest.importorskip("requests")
+    from lightllm.server.multimodal_params import MultimodalParams
+
+    _, (_, _, multimodal_params) = decode_pd_frame(encode_req("a", SamplingParams(), MultimodalParams()))
+    assert isinstance(multimodal_params, MultimodalParams) and len(multimodal_params.images) == 0
+    images = [{"type": "url", "data": "http://a/b.png"}]
+    _, (_, _, multimodal_params) = decode_pd_frame(encode_req("a", SamplingParams(), MultimodalParams(images)))
+    assert len(multimodal_params.images) == 1
+
+
+def test_node_status_and_legacy_pickle():
+    node_status = {"client_ip_port": "127.0.0.1:8000", "running_req_num": 2, "current_load": [0.5]}
+    assert decode_pd_frame(encode_node_status(node_status)) == (ObjType.NODE_STATUS, node_status)
+    # 兼容旧版本节点发送的 pickle 消息
+    assert decode_pd_frame(pickle.dumps((ObjType.ABORT, 3))) == (ObjType.ABORT, 3)
+    with pytest.raises(ValueError):
+        decode_pd_frame(bytes([0x4C, 99, 1]))
@@ -0,0 +1,85 @@
+import asyncio
+import hashlib
+import threading
+import pytest
+from io import BytesIO
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from PIL import Image
+from lightllm.utils import image_utils
+from lightllm.utils.image_utils import ImageCache, LoadedImage, fetch_and_load_image, load_image
+
+
+def _png_bytes(width, height):
+    buffer = BytesIO()
+    Image.new("RGB", (width, height), color=(255, 0, 0)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def image_server():
+    png = _png_bytes(32, 16)
+    requested_paths = []
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            requested_paths.append(self.path)
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(png)))
+            self.end_headers()
+            self.wfile.write(png)
+
+        def log_message(self, format, *args):
+            return
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}", png, requested_paths
+    server.shutdown()
+    server.server_close()
+
+
+def test_image_cache(monkeypatch):
+    cache = ImageCache(capacity_bytes=10, ttl=100)
+    cache.put("a", LoadedImage(b"1234", 1, 1, "a"))
+    cache.put("b", LoadedImage(b"1234", 1, 1, "b"))
+    assert cache.get("a").md5 == "a"
+    # 超过容量时淘汰最久没有使用的图片
+    cache.put("c", LoadedImage(b"1234", 1, 1, "c"))
+    assert cache.get("b") is None and cache.used_bytes == 8
+    cache.put("d", LoadedImage(b"x" * 11, 1, 1, "d"))
+    assert cache.get("d") is None
+
+    now = image_utils.time.time()
+    monkeypatch.setattr(image_utils.time, "time", lambda: now + 101)
+    assert cache.get("a") is None and cache.used_bytes == 4
+
+
+def test_load_image():
+    png = _png_bytes(7, 5)
+    image = asyncio.run(load_image(png))
+    assert (image.width, image.height, image.md5) == (7, 5, hashlib.md5(png).hexdigest())
+    with pytest.raises(Exception):
+        asyncio.run(load_image(b"not an image"))
+
+
+def test_fetch_and_load_image(image_server, monkeypatch):
+    base_url, png, requested_paths = image_server
+    monkeypatch.setattr(image_utils, "_image_cache", ImageCache(1024 * 1024, ttl=100))
+
+    async def fetch_all():
+        first = await fetch_and_load_image(f"{base_url}/a.png", None, timeout=5)
+        # 相同 url 的图片直接使用缓存的结果
+        second = await fetch_and_load_image(f"{base_url}/a.png", None, timeout=5)
+        others = await asyncio.gather(*[fetch_and_load_image(f"{base_url}/{i}.png", None, timeout=5) for i in range(4)])
+        assert image_utils._get_http_client(None) is image_utils._get_http_client(None)
+        await image_utils._get_http_client(None).aclose()
+        return first, second, others
+
+    first, second, others = asyncio.run(fetch_all())
+    assert first is second
+    assert (first.width, first.height, first.data) == (32, 16, png)
+    assert all(image.md5 == first.md5 for image in others)
+    assert sorted(requested_paths) == sorted(["/a.png"] + [f"/{i}.png" for i in range(4)])